@@ -4,10 +4,12 @@ API客户端模块
 负责处理HTTP请求和响应
 """
 
+import os
 import json
 import time
+import socket
 import requests
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Callable
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -154,6 +156,10 @@ class APIClient:
             if method.upper() == 'POST' and final_json:
                 final_headers['Content-Type'] = 'application/json'
             
+            if use_proxy:
+                # 🚦 云代理按客户端轮流分配领星配额，用主机名和进程号区分各个进程
+                final_headers['X-Proxy-Client'] = f"{socket.gethostname()}:{os.getpid()}"
+            
             if headers:
                 final_headers.update(headers)
             
@@ -223,8 +229,9 @@ class APIClient:
                             self._rate_limit_retry_count = 1
                         
                         if self._rate_limit_retry_count <= 5:  # 增加到最多重试5次
-                            # 更积极的延迟策略：3^retry_count 秒，最少5秒
-                            delay = max(5, 3 ** self._rate_limit_retry_count)
+                            # 云代理给出Retry-After时按其等待，否则更积极的延迟策略：3^retry_count 秒，最少5秒
+                            retry_after = response.headers.get('Retry-After', '')
+                            delay = int(retry_after) if retry_after.isdigit() else max(5, 3 ** self._rate_limit_retry_count)
                             api_logger.logger.info(f"频率限制第{self._rate_limit_retry_count}次重试，等待{delay}秒")
                             time.sleep(delay)
                             return self._make_request(method, endpoint, params, json_data, headers)
@@ -369,14 +376,26 @@ class APIClient:
         else:
             raise APIException("获取MSKU详细信息失败", response.get('code'), response)
     
+    def _notify_page(self, on_page: Optional[Callable[[int, int, List[Dict[str, Any]]], None]],
+                     page_num: int, total_pages: int, data: List[Dict[str, Any]]):
+        """通知调用方一页数据已到达（回调异常不影响数据获取）"""
+        if on_page is None:
+            return
+        try:
+            on_page(page_num, total_pages, data)
+        except Exception as e:
+            api_logger.log_error(e, f"处理第{page_num + 1}页数据回调失败")
+    
     def get_all_restock_data(self, base_params: Dict[str, Any], 
-                            max_pages: int = None) -> List[Dict[str, Any]]:
+                            max_pages: int = None,
+                            on_page: Callable[[int, int, List[Dict[str, Any]]], None] = None) -> List[Dict[str, Any]]:
         """
         获取所有补货数据（自动分页）
         
         Args:
             base_params: 基础查询参数
             max_pages: 最大页数限制
+            on_page: 每页到达时的回调 (页码(从0开始), 总页数, 本页数据)
             
         Returns:
             List[Dict[str, Any]]: 所有补货数据
@@ -416,6 +435,11 @@ class APIClient:
                     f"第{page_count}页: 获取{len(data)}条数据，累计{len(all_data)}条，总计{total}条"
                 )
                 
+                total_pages = max(page_count, (total + length - 1) // length)
+                if max_pages:
+                    total_pages = min(total_pages, max_pages)
+                self._notify_page(on_page, page_count - 1, total_pages, data)
+                
                 # 检查是否还有更多数据
                 if len(all_data) >= total or len(data) < length:
                     api_logger.logger.info("已获取所有数据")
@@ -436,7 +460,8 @@ class APIClient:
     
     def get_all_restock_data_concurrent(self, base_params: Dict[str, Any],
                                       max_pages: int = None,
-                                      max_workers: int = 3) -> List[Dict[str, Any]]:
+                                      max_workers: int = 3,
+                                      on_page: Callable[[int, int, List[Dict[str, Any]]], None] = None) -> List[Dict[str, Any]]:
         """
         并发获取所有补货数据（提高获取速度）
         
@@ -444,6 +469,7 @@ class APIClient:
             base_params: 基础查询参数
             max_pages: 最大页数限制
             max_workers: 最大并发线程数
+            on_page: 每页到达时的回调 (页码(从0开始), 总页数, 本页数据)，在调用线程中按到达顺序执行
             
         Returns:
             List[Dict[str, Any]]: 所有补货数据
@@ -460,12 +486,14 @@ class APIClient:
             
             if not first_data or total <= length:
                 api_logger.logger.info(f"数据获取完成，共{len(first_data)}条")
+                self._notify_page(on_page, 0, 1, first_data)
                 return first_data
             
             # 计算需要获取的页数
             total_pages = (total + length - 1) // length
             if max_pages:
                 total_pages = min(total_pages, max_pages)
+            self._notify_page(on_page, 0, total_pages, first_data)
             
             api_logger.logger.info(f"开始并发获取数据，总计{total}条，分{total_pages}页，每页{length}条")
             
@@ -501,6 +529,7 @@ class APIClient:
                     page_num, data = future.result()
                     page_results[page_num] = data
                     api_logger.logger.info(f"第{page_num + 1}页: 获取{len(data)}条数据")
+                    self._notify_page(on_page, page_num, total_pages, data)
                 
                 # 按页码顺序合并数据
                 for page_num in sorted(page_results.keys()):
@@ -511,7 +540,7 @@ class APIClient:
             
         except Exception as e:
             api_logger.log_error(e, "并发获取数据失败，回退到串行模式")
-            return self.get_all_restock_data(base_params, max_pages)
+            return self.get_all_restock_data(base_params, max_pages, on_page)
     
     def test_connection(self) -> Dict[str, Any]:
         """
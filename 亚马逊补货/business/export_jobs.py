@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+"""
+后台导出任务模块
+将Excel/JSON文件生成从数据获取和分析流程中解耦，
+由有界的独立进程池执行渲染，任务状态落盘以便机器人和命令行查询；
+已结束的任务按保留天数和数量清理
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable
+from dataclasses import dataclass, asdict
+from concurrent.futures import ProcessPoolExecutor
+
+from config.config import ExportConfig
+from utils.logger import api_logger
+
+# 任务状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+
+JOB_STATUS_DISPLAY = {
+    JOB_QUEUED: '排队中',
+    JOB_RUNNING: '导出中',
+    JOB_COMPLETED: '已完成',
+    JOB_FAILED: '失败'
+}
+
+@dataclass
+class ExportJob:
+    """导出任务数据类"""
+    job_id: str
+    export_format: str
+    item_count: int
+    status: str = JOB_QUEUED
+    progress: int = 0
+    message: str = ""
+    output_path: str = ""
+    error: str = ""
+    created_at: float = 0.0
+    started_at: float = 0.0
+    finished_at: float = 0.0
+
+    @property
+    def duration(self) -> Optional[float]:
+        """渲染耗时（秒），未开始返回None"""
+        if not self.started_at:
+            return None
+        end = self.finished_at or time.time()
+        return round(end - self.started_at, 2)
+
+    @property
+    def is_finished(self) -> bool:
+        """任务是否已结束（成功或失败）"""
+        return self.status in (JOB_COMPLETED, JOB_FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典格式"""
+        data = asdict(self)
+        data['duration'] = self.duration
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ExportJob':
+        """从字典创建ExportJob对象"""
+        fields = cls.__dataclass_fields__.keys()
+        return cls(**{key: value for key, value in data.items() if key in fields})
+
+    def format_status(self) -> str:
+        """格式化为可读的状态文本（机器人和命令行共用）"""
+        created = datetime.fromtimestamp(self.created_at).strftime('%Y-%m-%d %H:%M:%S') if self.created_at else '-'
+        lines = [
+            f"任务ID: {self.job_id}",
+            f"状态: {JOB_STATUS_DISPLAY.get(self.status, self.status)}",
+            f"进度: {self.progress}%",
+            f"商品数量: {self.item_count}",
+            f"导出格式: {self.export_format}",
+            f"提交时间: {created}",
+        ]
+        if self.duration is not None:
+            lines.append(f"耗时: {self.duration}秒")
+        if self.message:
+            lines.append(f"说明: {self.message}")
+        if self.output_path:
+            lines.append(f"文件: {self.output_path}")
+        if self.error:
+            lines.append(f"错误: {self.error}")
+        return '\n'.join(lines)
+
+class ExportJobStore:
+    """导出任务状态存储（每个任务一个JSON文件，原子替换写入）"""
+
+    def __init__(self, job_dir: str = None):
+        """
+        初始化任务存储
+
+        Args:
+            job_dir: 任务状态文件目录
+        """
+        self.job_dir = job_dir or ExportConfig.JOB_DIR
+        os.makedirs(self.job_dir, exist_ok=True)
+
+    def _job_file(self, job_id: str) -> str:
+        return os.path.join(self.job_dir, f"{job_id}.json")
+
+    def save(self, job: ExportJob):
+        """
+        保存任务状态
+
+        Args:
+            job: 导出任务
+        """
+        filepath = self._job_file(job.job_id)
+        tmp_path = f"{filepath}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(asdict(job), f, ensure_ascii=False)
+        os.replace(tmp_path, filepath)
+
+    def update(self, job_id: str, **changes) -> Optional[ExportJob]:
+        """
+        更新任务的部分字段
+
+        Args:
+            job_id: 任务ID
+            **changes: 要更新的字段
+
+        Returns:
+            Optional[ExportJob]: 更新后的任务，不存在则返回None
+        """
+        job = self.load(job_id)
+        if not job:
+            return None
+        for key, value in changes.items():
+            setattr(job, key, value)
+        self.save(job)
+        return job
+
+    def load(self, job_id: str) -> Optional[ExportJob]:
+        """
+        加载任务状态
+
+        Args:
+            job_id: 任务ID
+
+        Returns:
+            Optional[ExportJob]: 导出任务，不存在则返回None
+        """
+        filepath = self._job_file(job_id)
+        if not os.path.exists(filepath):
+            return None
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                return ExportJob.from_dict(json.load(f))
+        except (OSError, ValueError) as e:
+            api_logger.log_error(e, f"读取导出任务状态失败: {job_id}")
+            return None
+
+    def list_jobs(self, limit: int = 10) -> List[ExportJob]:
+        """
+        列出最近的任务（按提交时间倒序）
+
+        Args:
+            limit: 最大返回数量
+
+        Returns:
+            List[ExportJob]: 任务列表
+        """
+        jobs = []
+        for name in os.listdir(self.job_dir):
+            if name.endswith('.json'):
+                job = self.load(name[:-len('.json')])
+                if job:
+                    jobs.append(job)
+        jobs.sort(key=lambda job: job.created_at, reverse=True)
+        return jobs[:limit] if limit else jobs
+
+    def prune(self, max_age: float, max_jobs: int) -> int:
+        """
+        清理已结束的旧任务：删除超过保留时间或超出保留数量的任务状态文件及其导出文件
+        （增量导出的滚动工作簿被后续任务继续使用，不删除）
+
+        Args:
+            max_age: 保留时间（秒）
+            max_jobs: 最多保留的已结束任务数
+
+        Returns:
+            int: 清理的任务数
+        """
+        now = time.time()
+        finished = [job for job in self.list_jobs(limit=0) if job.is_finished]
+        expired = [job for index, job in enumerate(finished)
+                   if index >= max_jobs or now - (job.finished_at or job.created_at) > max_age]
+        for job in expired:
+            paths = [self._job_file(job.job_id)]
+            if job.output_path and job.export_format != 'incremental':
+                paths.append(job.output_path)
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    api_logger.log_warning(f"清理导出任务文件失败: {path} ({e})")
+        return len(expired)
+
+def _run_export_job(job_dir: str, job_id: str, restock_items: list,
+                    export_format: str, filename: Optional[str]) -> str:
+    """
+    在导出进程中执行渲染（模块级函数，便于进程池序列化）
+
+    Args:
+        job_dir: 任务状态文件目录
+        job_id: 任务ID
+        restock_items: 补货项目列表
+        export_format: 导出格式（'both'/'standard'/'detail'/'incremental'/'json'）
+        filename: 文件名
+
+    Returns:
+        str: 导出的文件路径
+    """
+    from business.restock_analyzer import RestockAnalyzer
+
+    store = ExportJobStore(job_dir)
+    store.update(job_id, status=JOB_RUNNING, progress=10,
+                 message='正在生成文件', started_at=time.time())
+
+    def report(progress: int, message: str):
+        """渲染过程中按步骤写回进度"""
+        store.update(job_id, progress=progress, message=message)
+
+    try:
+        analyzer = RestockAnalyzer()
+        if export_format == 'both':
+            filepath = analyzer.export_to_excel_both(restock_items, filename, on_progress=report)
+        elif export_format == 'detail':
+            filepath = analyzer.export_to_excel_detail(restock_items, filename, on_progress=report)
+        elif export_format == 'incremental':
+            from business.incremental_export import IncrementalExcelExporter
+            filepath = IncrementalExcelExporter().export(restock_items, on_progress=report).filepath
+        elif export_format == 'json':
+            filepath = analyzer.save_to_json(restock_items, filename)
+        else:
+            filepath = analyzer.export_to_excel(restock_items, filename, on_progress=report)
+
+        store.update(job_id, status=JOB_COMPLETED, progress=100, message='导出完成',
+                     output_path=os.path.abspath(filepath), finished_at=time.time())
+        return filepath
+    except Exception as e:
+        store.update(job_id, status=JOB_FAILED, message='导出失败',
+                     error=str(e), finished_at=time.time())
+        raise
+
+class ExportJobError(Exception):
+    """导出任务异常类"""
+
+class ExportJobManager:
+    """
+    后台导出任务管理器
+
+    提交任务后立即返回任务ID，渲染在有界进程池中进行，
+    排队和运行中的任务总数超过上限时拒绝提交；
+    任务结束时通过进程池的完成回调通知调用方并清理旧任务，不需要额外的等待线程
+    """
+
+    def __init__(self, max_workers: int = None, max_pending: int = None,
+                 job_dir: str = None, retention_days: float = None, max_finished: int = None):
+        """
+        初始化导出任务管理器
+
+        Args:
+            max_workers: 导出进程数
+            max_pending: 排队和运行中任务数上限
+            job_dir: 任务状态文件目录
+            retention_days: 已结束任务的保留天数
+            max_finished: 最多保留的已结束任务数
+        """
+        self.max_workers = max(1, max_workers or ExportConfig.MAX_WORKERS)
+        self.max_pending = max(1, max_pending or ExportConfig.MAX_PENDING_JOBS)
+        self.retention = (retention_days or ExportConfig.JOB_RETENTION_DAYS) * 86400
+        self.max_finished = max(1, max_finished or ExportConfig.MAX_FINISHED_JOBS)
+        self.store = ExportJobStore(job_dir)
+        self._executor = None
+        self._pending = 0
+        self._futures = {}  # {job_id: Future}，仅包含排队和运行中的任务
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """延迟创建进程池（只有真正提交导出时才启动进程）"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def submit(self, restock_items: list, export_format: str = 'both',
+               filename: str = None) -> str:
+        """
+        提交导出任务
+
+        Args:
+            restock_items: 补货项目列表
+            export_format: 导出格式（'both'/'standard'/'detail'/'incremental'/'json'）
+            filename: 文件名
+
+        Returns:
+            str: 任务ID
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise ExportJobError(f"导出队列已满（{self.max_pending}个任务），请稍后再试")
+            self._pending += 1
+
+        job_id = f"{datetime.now().strftime('%m%d%H%M%S')}{uuid.uuid4().hex[:4]}"
+        job = ExportJob(job_id=job_id, export_format=export_format,
+                        item_count=len(restock_items), message='等待导出进程',
+                        created_at=time.time())
+
+        try:
+            self.store.save(job)
+            with self._lock:
+                future = self._get_executor().submit(
+                    _run_export_job, self.store.job_dir, job_id,
+                    list(restock_items), export_format, filename)
+        except Exception as e:
+            with self._lock:
+                self._pending -= 1
+            self.store.update(job_id, status=JOB_FAILED, error=str(e), finished_at=time.time())
+            api_logger.log_error(e, f"提交导出任务失败: {job_id}")
+            raise ExportJobError(f"提交导出任务失败: {e}")
+
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f, job_id=job_id: self._on_job_done(job_id, f))
+        api_logger.logger.info(f"导出任务已提交: {job_id} ({len(restock_items)}条, 格式: {export_format})")
+        return job_id
+
+    def _on_job_done(self, job_id: str, future):
+        """任务结束回调：释放名额，记录进程崩溃等未落盘的失败，并清理旧任务"""
+        with self._lock:
+            self._pending -= 1
+            self._futures.pop(job_id, None)
+
+        error = future.exception()
+        if error is None:
+            api_logger.logger.info(f"导出任务完成: {job_id}")
+        else:
+            api_logger.log_error(error, f"导出任务失败: {job_id}")
+            job = self.store.load(job_id)
+            if job and not job.is_finished:
+                self.store.update(job_id, status=JOB_FAILED, error=str(error), finished_at=time.time())
+
+        try:
+            self.store.prune(self.retention, self.max_finished)
+        except OSError as e:
+            api_logger.log_warning(f"清理导出任务失败: {e}")
+
+    def add_done_callback(self, job_id: str, callback: Callable[[Optional[ExportJob]], None]):
+        """
+        任务结束时调用callback（参数为结束时的任务状态）；任务已结束或不在本进程时立即调用
+
+        回调在进程池的结果处理线程中执行，应尽快返回
+
+        Args:
+            job_id: 任务ID
+            callback: 回调函数
+        """
+        def notify(_future=None):
+            try:
+                callback(self.store.load(job_id))
+            except Exception as e:
+                api_logger.log_error(e, f"导出任务完成回调失败: {job_id}")
+
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is None:
+            notify()
+        else:
+            # 在 _on_job_done 之后执行，崩溃导致的失败此时已经落盘
+            future.add_done_callback(notify)
+
+    def get_job(self, job_id: str) -> Optional[ExportJob]:
+        """
+        查询任务状态
+
+        Args:
+            job_id: 任务ID
+
+        Returns:
+            Optional[ExportJob]: 导出任务
+        """
+        return self.store.load(job_id)
+
+    def list_jobs(self, limit: int = 10) -> List[ExportJob]:
+        """列出最近的任务"""
+        return self.store.list_jobs(limit)
+
+    def wait(self, job_id: str, timeout: float = None, poll_interval: float = 0.5) -> Optional[ExportJob]:
+        """
+        等待任务结束
+
+        Args:
+            job_id: 任务ID
+            timeout: 最长等待时间（秒），None表示一直等待
+            poll_interval: 状态检查间隔（秒）
+
+        Returns:
+            Optional[ExportJob]: 结束时的任务状态（超时则为当前状态）
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            job = self.store.load(job_id)
+            if job is None or job.is_finished:
+                return job
+            if deadline is not None and time.time() >= deadline:
+                return job
+            time.sleep(poll_interval)
+
+    def shutdown(self, wait: bool = True):
+        """关闭进程池"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
+
+_export_job_manager = None
+_manager_lock = threading.Lock()
+
+def get_export_job_manager() -> ExportJobManager:
+    """
+    获取进程内共享的导出任务管理器
+
+    Returns:
+        ExportJobManager: 导出任务管理器
+    """
+    global _export_job_manager
+    with _manager_lock:
+        if _export_job_manager is None:
+            _export_job_manager = ExportJobManager()
+        return _export_job_manager
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""
+增量Excel导出模块
+维护一个滚动更新的"当前"工作簿和按 (sid, asin, msku) 建立的行索引，
+每次导出只改写新增、变更和删除的行，并追加变更记录工作表
+"""
+
+import os
+import json
+import time
+import hashlib
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple, Callable
+from dataclasses import dataclass
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Alignment, Font
+
+from business.restock_analyzer import RestockAnalyzer, RestockItem
+from config.config import ExportConfig
+from utils.logger import api_logger
+
+# 数据工作表名称
+DATA_SHEET_NAME = '补货数据'
+
+# 变更记录工作表名称前缀
+CHANGE_SHEET_PREFIX = '变更_'
+
+# 不参与差异比较的列（每次同步都会变化，单独变化不视为行变更）
+VOLATILE_COLUMNS = {'sync_time'}
+
+def row_key(item: RestockItem) -> str:
+    """
+    生成行键 (sid, asin, msku)
+
+    Args:
+        item: 补货项目
+
+    Returns:
+        str: 行键
+    """
+    return f"{item.sid}|{item.asin}|{item.primary_msku}"
+
+def build_row_snapshot(restock_items: List[RestockItem],
+                       columns: List[str] = None) -> Dict[str, Tuple[List[Any], str]]:
+    """
+    构建行快照：行键 -> (按列顺序的行数据, 行内容摘要)
+
+    增量Excel导出和飞书表格同步共用，摘要忽略易变列
+
+    Args:
+        restock_items: 补货项目列表
+        columns: 列顺序（默认为标准格式列）
+
+    Returns:
+        Dict[str, Tuple[List[Any], str]]: 行快照
+    """
+    columns = columns or RestockAnalyzer.STANDARD_COLUMN_ORDER
+    diff_columns = [idx for idx, col in enumerate(columns) if col not in VOLATILE_COLUMNS]
+
+    snapshot = {}
+    for item in restock_items:
+        data = item.to_dict()
+        values = [data.get(col) for col in columns]
+        payload = json.dumps([values[idx] for idx in diff_columns], ensure_ascii=False, default=str)
+        snapshot[row_key(item)] = (values, hashlib.md5(payload.encode('utf-8')).hexdigest()[:16])
+
+    duplicates = len(restock_items) - len(snapshot)
+    if duplicates:
+        api_logger.logger.warning(f"发现{duplicates}条重复行键，保留最后一条")
+    return snapshot
+
+@dataclass
+class IncrementalExportResult:
+    """增量导出结果数据类"""
+    filepath: str
+    mode: str  # 'full': 整表重写, 'incremental': 增量更新, 'unchanged': 无变化
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+    total_rows: int = 0
+    change_ratio: float = 0.0
+    duration: float = 0.0
+
+    @property
+    def changed(self) -> int:
+        """变更行总数"""
+        return self.inserted + self.updated + self.deleted
+
+class WorkbookLock:
+    """基于锁文件的跨进程工作簿锁（导出进程池中可能有多个增量导出任务）"""
+
+    def __init__(self, workbook_path: str, timeout: float = 120, stale_after: float = 600):
+        """
+        初始化工作簿锁
+
+        Args:
+            workbook_path: 工作簿路径
+            timeout: 获取锁的最长等待时间（秒）
+            stale_after: 锁文件超过该时长视为残留并清除（秒）
+        """
+        self.lock_path = f"{workbook_path}.lock"
+        self.timeout = timeout
+        self.stale_after = stale_after
+
+    def __enter__(self):
+        lock_dir = os.path.dirname(self.lock_path)
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode('ascii'))
+                os.close(fd)
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.lock_path) > self.stale_after:
+                        api_logger.logger.warning(f"清除残留的工作簿锁: {self.lock_path}")
+                        os.remove(self.lock_path)
+                        continue
+                except OSError:
+                    continue
+                if time.time() >= deadline:
+                    raise TimeoutError(f"等待工作簿锁超时: {self.lock_path}")
+                time.sleep(0.2)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            os.remove(self.lock_path)
+        except OSError:
+            pass
+
+class IncrementalExcelExporter:
+    """
+    增量Excel导出器
+
+    数据行按行键定位：变更行原地改写，新增行优先填补删除留下的空行，
+    多余的空行用末尾行回填，因此每一行的改动代价都是O(1)，且不会整体移动其他行。
+    变更占比超过阈值（或索引与工作簿不一致）时回退为整表重写。
+    """
+
+    def __init__(self, workbook_path: str = None, index_file: str = None,
+                 full_rewrite_ratio: float = None, max_change_sheets: int = None):
+        """
+        初始化增量导出器
+
+        Args:
+            workbook_path: 当前工作簿路径
+            index_file: 行索引文件路径
+            full_rewrite_ratio: 回退整表重写的变更占比阈值
+            max_change_sheets: 保留的变更记录工作表数量
+        """
+        self.workbook_path = workbook_path or ExportConfig.INCREMENTAL_WORKBOOK
+        self.index_file = index_file or ExportConfig.INCREMENTAL_INDEX_FILE
+        self.full_rewrite_ratio = (full_rewrite_ratio if full_rewrite_ratio is not None
+                                   else ExportConfig.INCREMENTAL_FULL_REWRITE_RATIO)
+        self.max_change_sheets = max_change_sheets or ExportConfig.INCREMENTAL_MAX_CHANGE_SHEETS
+
+        self.columns = list(RestockAnalyzer.STANDARD_COLUMN_ORDER)
+        self.headers = [RestockAnalyzer.STANDARD_COLUMN_MAPPING.get(col, col) for col in self.columns]
+        self._wrap_column = self.columns.index('msku_fnsku') + 1
+
+    @staticmethod
+    def row_key(item: RestockItem) -> str:
+        """生成行键 (sid, asin, msku)"""
+        return row_key(item)
+
+    def _load_index(self) -> Optional[Dict[str, Any]]:
+        """加载行索引，工作簿或索引失效时返回None"""
+        if not os.path.exists(self.index_file) or not os.path.exists(self.workbook_path):
+            return None
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError) as e:
+            api_logger.log_error(e, "加载增量导出索引失败")
+            return None
+
+        if index.get('columns') != self.columns:
+            api_logger.logger.info("增量导出列定义已变化，需要整表重写")
+            return None
+        if index.get('workbook_mtime') != os.path.getmtime(self.workbook_path):
+            api_logger.logger.info("当前工作簿已在索引之外被修改，需要整表重写")
+            return None
+        return index
+
+    def _save_index(self, rows: Dict[str, List[Any]]):
+        """保存行索引（行键 -> [行号, 摘要]）"""
+        index_dir = os.path.dirname(self.index_file)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+        index = {
+            'columns': self.columns,
+            'workbook': os.path.abspath(self.workbook_path),
+            'workbook_mtime': os.path.getmtime(self.workbook_path),
+            'updated_at': datetime.now().isoformat(),
+            'rows': rows
+        }
+        tmp_path = f"{self.index_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_file)
+
+    def _save_workbook(self, workbook: Workbook):
+        """先写临时文件再原子替换，避免读者看到写了一半的工作簿"""
+        output_dir = os.path.dirname(self.workbook_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        tmp_path = f"{self.workbook_path}.tmp.xlsx"
+        workbook.save(tmp_path)
+        try:
+            os.replace(tmp_path, self.workbook_path)
+        except PermissionError:
+            os.remove(tmp_path)
+            raise PermissionError(f"工作簿被占用，无法更新: {self.workbook_path}（请关闭后重试）")
+
+    def _write_row(self, worksheet, row: int, values: List[Any]):
+        """写入一行数据"""
+        for col, value in enumerate(values, 1):
+            worksheet.cell(row=row, column=col, value=value)
+        worksheet.cell(row=row, column=self._wrap_column).alignment = Alignment(wrap_text=True, vertical='top')
+
+    def _append_change_sheet(self, workbook: Workbook, changes: List[List[Any]]):
+        """追加变更记录工作表，并只保留最近的若干个"""
+        sheet_name = f"{CHANGE_SHEET_PREFIX}{datetime.now().strftime('%m%d_%H%M%S')}"
+        worksheet = workbook.create_sheet(sheet_name)
+        worksheet.append(['变更类型', '店铺ID', 'ASIN', 'MSKU', '变更字段'])
+        for cell in worksheet[1]:
+            cell.font = Font(bold=True)
+        for change in changes:
+            worksheet.append(change)
+        for col_letter, width in zip('ABCDE', (10, 12, 14, 24, 50)):
+            worksheet.column_dimensions[col_letter].width = width
+
+        change_sheets = [name for name in workbook.sheetnames if name.startswith(CHANGE_SHEET_PREFIX)]
+        for name in change_sheets[:-self.max_change_sheets]:
+            del workbook[name]
+
+    @staticmethod
+    def _split_key(key: str) -> List[str]:
+        return key.split('|', 2)
+
+    def _full_rewrite(self, snapshot: Dict[str, Tuple[List[Any], str]],
+                      changes: List[List[Any]]) -> Dict[str, List[Any]]:
+        """整表重写当前工作簿，返回新的行索引"""
+        workbook = Workbook()
+        worksheet = workbook.active
+        worksheet.title = DATA_SHEET_NAME
+        worksheet.append(self.headers)
+        for cell in worksheet[1]:
+            cell.font = Font(bold=True)
+
+        rows = {}
+        for row, (key, (values, digest)) in enumerate(snapshot.items(), 2):
+            self._write_row(worksheet, row, values)
+            rows[key] = [row, digest]
+
+        # 列宽按表头和前200行估算，避免扫描整表
+        for col, header in enumerate(self.headers, 1):
+            sample = [len(str(values[col - 1] or '')) for values, _ in list(snapshot.values())[:200]]
+            width = min(max([len(header) * 2] + sample) + 2, 50)
+            worksheet.column_dimensions[worksheet.cell(row=1, column=col).column_letter].width = width
+        worksheet.column_dimensions[worksheet.cell(row=1, column=self._wrap_column).column_letter].width = 25
+        worksheet.freeze_panes = 'A2'
+
+        if changes:
+            self._append_change_sheet(workbook, changes)
+
+        self._save_workbook(workbook)
+        return rows
+
+    def _apply_delta(self, index_rows: Dict[str, List[Any]],
+                     snapshot: Dict[str, Tuple[List[Any], str]],
+                     inserted: List[str], updated: List[str],
+                     deleted: List[str]) -> Tuple[Dict[str, List[Any]], List[List[Any]]]:
+        """在现有工作簿上应用差异，返回新的行索引和变更记录"""
+        workbook = load_workbook(self.workbook_path)
+        worksheet = workbook[DATA_SHEET_NAME]
+        rows = {key: list(entry) for key, entry in index_rows.items()}
+        row_to_key = {entry[0]: key for key, entry in rows.items()}
+        last_row = len(rows) + 1
+        changes = []
+
+        # 1. 变更行原地改写，记录变化的字段
+        for key in updated:
+            row = rows[key][0]
+            values, digest = snapshot[key]
+            changed_fields = []
+            for col, value in enumerate(values, 1):
+                if self.columns[col - 1] in VOLATILE_COLUMNS:
+                    continue
+                old_value = worksheet.cell(row=row, column=col).value
+                if (old_value if old_value is not None else '') != (value if value is not None else ''):
+                    changed_fields.append(self.headers[col - 1])
+            self._write_row(worksheet, row, values)
+            rows[key][1] = digest
+            changes.append(['更新'] + self._split_key(key) + ['、'.join(changed_fields)])
+
+        # 2. 删除行留下空位
+        holes = []
+        for key in deleted:
+            row = rows.pop(key)[0]
+            row_to_key.pop(row, None)
+            holes.append(row)
+            changes.append(['删除'] + self._split_key(key) + [''])
+
+        # 3. 新增行优先填补空位，其余追加到末尾
+        holes.sort(reverse=True)
+        for key in inserted:
+            values, digest = snapshot[key]
+            if holes:
+                row = holes.pop()
+            else:
+                last_row += 1
+                row = last_row
+            self._write_row(worksheet, row, values)
+            rows[key] = [row, digest]
+            row_to_key[row] = key
+            changes.append(['新增'] + self._split_key(key) + [''])
+
+        # 4. 剩余空位用末尾行回填，保持数据区连续（从大到小处理），最后截掉尾部空行
+        tail_rows = last_row
+        for hole in sorted(holes, reverse=True):
+            if hole != last_row:
+                moved_key = row_to_key.pop(last_row)
+                self._write_row(worksheet, hole, snapshot[moved_key][0])
+                rows[moved_key][0] = hole
+                row_to_key[hole] = moved_key
+            last_row -= 1
+        if tail_rows > last_row:
+            worksheet.delete_rows(last_row + 1, tail_rows - last_row)
+
+        self._append_change_sheet(workbook, changes)
+        self._save_workbook(workbook)
+        return rows, changes
+
+    def export(self, restock_items: List[RestockItem],
+               on_progress: Callable[[int, str], None] = None) -> IncrementalExportResult:
+        """
+        增量导出补货数据到当前工作簿
+
+        Args:
+            restock_items: 补货项目列表
+            on_progress: 进度回调，参数为百分比和当前步骤说明
+
+        Returns:
+            IncrementalExportResult: 导出结果
+        """
+        start_time = time.time()
+        snapshot = build_row_snapshot(restock_items, self.columns)
+
+        with WorkbookLock(self.workbook_path):
+            index = self._load_index()
+            index_rows = index['rows'] if index else {}
+
+            inserted = [key for key in snapshot if key not in index_rows]
+            deleted = [key for key in index_rows if key not in snapshot]
+            updated = [key for key in snapshot
+                       if key in index_rows and index_rows[key][1] != snapshot[key][1]]
+            changed = len(inserted) + len(updated) + len(deleted)
+            change_ratio = changed / len(index_rows) if index_rows else 1.0
+
+            result = IncrementalExportResult(
+                filepath=self.workbook_path, mode='incremental',
+                inserted=len(inserted), updated=len(updated), deleted=len(deleted),
+                total_rows=len(snapshot), change_ratio=round(change_ratio, 4)
+            )
+
+            if on_progress:
+                on_progress(40, f"正在写入变更（新增{len(inserted)}、更新{len(updated)}、删除{len(deleted)}）")
+            if index and changed == 0:
+                result.mode = 'unchanged'
+            elif not index or change_ratio > self.full_rewrite_ratio:
+                result.mode = 'full'
+                changes = []
+                if index:
+                    changes = ([['新增'] + self._split_key(key) + [''] for key in inserted] +
+                               [['更新'] + self._split_key(key) + ['整表重写'] for key in updated] +
+                               [['删除'] + self._split_key(key) + [''] for key in deleted])
+                rows = self._full_rewrite(snapshot, changes)
+                self._save_index(rows)
+            else:
+                rows, _ = self._apply_delta(index_rows, snapshot, inserted, updated, deleted)
+                self._save_index(rows)
+
+        result.duration = round(time.time() - start_time, 2)
+        api_logger.logger.info(
+            f"增量导出完成({result.mode}): 新增{result.inserted}、更新{result.updated}、"
+            f"删除{result.deleted}，共{result.total_rows}行，耗时{result.duration}秒 -> {self.workbook_path}"
+        )
+        return result
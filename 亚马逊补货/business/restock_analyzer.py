@@ -8,13 +8,15 @@ import json
 import time
 import pandas as pd
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple, Callable
 from dataclasses import dataclass
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from api.client import APIClient
 from utils.logger import api_logger
-from config.config import APIConfig
+from utils.single_flight import SingleFlight
+from utils.ttl_cache import TTLCache
+from config.config import APIConfig, SnapshotConfig
 
 @dataclass
 class RestockItem:
@@ -357,6 +359,48 @@ class RestockItem:
 class RestockAnalyzer:
     """补货分析器"""
     
+    # 标准格式工作表的列顺序
+    STANDARD_COLUMN_ORDER = [
+        'asin', 'sid', 'data_type', 'msku_fnsku',
+        'out_stock_flag', 'out_stock_date', 'available_sale_days',
+        'fba_available', 'fba_shipping', 'local_available', 'oversea_available',
+        'sales_avg_7', 'sales_avg_30', 'sales_total_7', 'sales_total_30',
+        'suggested_purchase', 'suggested_local_to_fba', 'suggested_oversea_to_fba',
+        'listing_opentime', 'sync_time', 'star', 'remark'
+    ]
+    
+    # 标准格式工作表的中文列名
+    STANDARD_COLUMN_MAPPING = {
+        'asin': 'ASIN',
+        'sid': '店铺ID',
+        'data_type': '数据类型',
+        'msku_fnsku': 'MSKU/FNSKU',
+        'out_stock_flag': '断货标记',
+        'out_stock_date': '断货日期',
+        'available_sale_days': '可售天数',
+        'fba_available': 'FBA可售',
+        'fba_shipping': 'FBA在途',
+        'local_available': '本地仓可用',
+        'oversea_available': '海外仓可用',
+        'sales_avg_7': '7天日均销量',
+        'sales_avg_30': '30天日均销量',
+        'sales_total_7': '7天总销量',
+        'sales_total_30': '30天总销量',
+        'suggested_purchase': '建议采购量',
+        'suggested_local_to_fba': '建议本地发FBA',
+        'suggested_oversea_to_fba': '建议海外仓发FBA',
+        'listing_opentime': 'Listing创建时间',
+        'sync_time': '数据更新时间',
+        'star': '关注状态',
+        'remark': '备注'
+    }
+    
+    # 进程内共享的补货数据请求合并器（相同参数的并发拉取只执行一次）
+    _restock_flight = SingleFlight()
+    
+    # 进程内共享的MSKU详细信息缓存（键为 "sid_msku"，LRU+TTL有界），供机器人单品查询展示增强字段
+    _msku_detail_cache = TTLCache(SnapshotConfig.MSKU_DETAIL_CACHE_SIZE, SnapshotConfig.MSKU_DETAIL_CACHE_TTL)
+    
     def __init__(self, api_client: APIClient = None):
         """
         初始化补货分析器
@@ -404,7 +448,8 @@ class RestockAnalyzer:
                         msku_list: List[str] = None,
                         mode: int = 0,
                         max_pages: int = None,
-                        max_workers: int = 3) -> List[RestockItem]:
+                        max_workers: int = 3,
+                        on_page: Callable[[List[RestockItem], int, int], None] = None) -> List[RestockItem]:
         """
         获取补货数据
         
@@ -416,6 +461,8 @@ class RestockAnalyzer:
             mode: 补货建议模式（0: 普通模式, 1: 海外仓中转模式）
             max_pages: 最大页数
             max_workers: 并发线程数
+            on_page: 每页解析完成时的回调 (本页补货项目, 已完成页数, 总页数)；
+                     合并到其他调用的请求不会收到回调
             
         Returns:
             List[RestockItem]: 补货项目列表
@@ -425,6 +472,31 @@ class RestockAnalyzer:
             sellers = self.get_sellers()
             seller_ids = [str(seller['sid']) for seller in sellers]
         
+        # 规范化参数作为合并键：参数相同的并发调用共享同一次拉取
+        key = (
+            tuple(sorted({str(sid) for sid in seller_ids})),
+            data_type,
+            mode,
+            tuple(sorted(asin_list)) if asin_list else (),
+            tuple(sorted(msku_list)) if msku_list else (),
+            max_pages
+        )
+        restock_items, shared = self._restock_flight.do(
+            key, lambda: self._fetch_restock_data(seller_ids, data_type, asin_list, msku_list,
+                                                  mode, max_pages, max_workers, on_page))
+        if shared:
+            api_logger.logger.info(f"合并相同参数的补货数据请求，共享{len(restock_items)}条结果")
+        
+        # 返回新列表，调用方对列表的增删不影响其他共享者
+        return list(restock_items)
+    
+    def _fetch_restock_data(self, seller_ids: List[str], data_type: int,
+                            asin_list: Optional[List[str]], msku_list: Optional[List[str]],
+                            mode: int, max_pages: Optional[int], max_workers: int,
+                            on_page: Callable[[List[RestockItem], int, int], None] = None) -> List[RestockItem]:
+        """
+        调用接口拉取并解析补货数据（由请求合并器调度，每页到达后立即解析）
+        """
         # 构建查询参数
         params = {
             'sid_list': seller_ids,
@@ -440,16 +512,44 @@ class RestockAnalyzer:
         if msku_list:
             params['msku_list'] = msku_list
         
+        # 按页解析：页码 -> (原始条数, 补货项目)
+        parsed_pages = {}
+        
+        def handle_page(page_num: int, total_pages: int, page_data: List[Dict[str, Any]]):
+            page_items = self._parse_restock_items(page_data)
+            parsed_pages[page_num] = (len(page_data), page_items)
+            if on_page:
+                on_page(page_items, len(parsed_pages), total_pages)
+        
         try:
             # 获取原始数据（使用并发模式提高速度）
             # 限制并发线程数在合理范围内
             max_workers = max(1, min(max_workers, 5))
-            raw_data = self.api_client.get_all_restock_data_concurrent(params, max_pages, max_workers)
+            raw_data = self.api_client.get_all_restock_data_concurrent(params, max_pages, max_workers,
+                                                                       on_page=handle_page)
         except Exception as e:
             print(f"并发获取失败，回退到串行模式: {e}")
-            raw_data = self.api_client.get_all_restock_data(params, max_pages)
+            raw_data = self.api_client.get_all_restock_data(params, max_pages, on_page=handle_page)
+        
+        # 各页已在到达时解析，按页码顺序合并；页数据与返回结果不一致时重新解析
+        if sum(count for count, _ in parsed_pages.values()) == len(raw_data):
+            restock_items = [item for page_num in sorted(parsed_pages) for item in parsed_pages[page_num][1]]
+        else:
+            restock_items = self._parse_restock_items(raw_data)
         
-        # 转换为RestockItem对象
+        api_logger.logger.info(f"成功解析{len(restock_items)}条补货数据")
+        return restock_items
+    
+    def _parse_restock_items(self, raw_data: List[Dict[str, Any]]) -> List[RestockItem]:
+        """
+        将接口数据转换为RestockItem对象（解析失败的条目跳过）
+        
+        Args:
+            raw_data: 接口返回的补货数据
+            
+        Returns:
+            List[RestockItem]: 补货项目列表
+        """
         restock_items = []
         for item_data in raw_data:
             try:
@@ -458,10 +558,28 @@ class RestockAnalyzer:
             except Exception as e:
                 api_logger.log_error(e, f"解析补货数据失败: {item_data.get('basic_info', {}).get('hash_id', 'unknown')}")
                 continue
-        
-        api_logger.logger.info(f"成功解析{len(restock_items)}条补货数据")
         return restock_items
     
+    @classmethod
+    def get_fetch_stats(cls) -> Dict[str, int]:
+        """
+        获取补货数据请求合并统计
+        
+        Returns:
+            Dict: 调用次数、实际拉取次数、合并等待次数等
+        """
+        return cls._restock_flight.get_stats()
+    
+    @classmethod
+    def get_msku_detail_cache_stats(cls) -> Dict[str, Any]:
+        """
+        获取MSKU详细信息缓存统计
+        
+        Returns:
+            Dict: 条目数、上限、命中/未命中、过期和淘汰次数
+        """
+        return cls._msku_detail_cache.get_stats()
+    
     def analyze_urgent_restock(self, restock_items: List[RestockItem], 
                               days_threshold: int = 7) -> List[RestockItem]:
         """
@@ -580,13 +698,15 @@ class RestockAnalyzer:
         return report
     
     def export_to_excel(self, restock_items: List[RestockItem], 
-                       filename: str = None) -> str:
+                       filename: str = None,
+                       on_progress: Callable[[int, str], None] = None) -> str:
         """
         导出数据到Excel文件
         
         Args:
             restock_items: 补货项目列表
             filename: 文件名
+            on_progress: 进度回调，参数为百分比和当前步骤说明
             
         Returns:
             str: 导出的文件路径
@@ -609,50 +729,24 @@ class RestockAnalyzer:
             df = pd.DataFrame(data_list)
             
             # 重新排列列顺序
-            column_order = [
-                'asin', 'sid', 'data_type', 'msku_fnsku',
-                'out_stock_flag', 'out_stock_date', 'available_sale_days',
-                'fba_available', 'fba_shipping', 'local_available', 'oversea_available',
-                'sales_avg_7', 'sales_avg_30', 'sales_total_7', 'sales_total_30',
-                'suggested_purchase', 'suggested_local_to_fba', 'suggested_oversea_to_fba',
-                'listing_opentime', 'sync_time', 'star', 'remark'
-            ]
+            column_order = self.STANDARD_COLUMN_ORDER
             
             # 只保留存在的列
             available_columns = [col for col in column_order if col in df.columns]
             df = df[available_columns]
             
             # 添加中文列名
-            column_mapping = {
-                'asin': 'ASIN',
-                'sid': '店铺ID',
-                'data_type': '数据类型',
-                'msku_fnsku': 'MSKU/FNSKU',
-                'out_stock_flag': '断货标记',
-                'out_stock_date': '断货日期',
-                'available_sale_days': '可售天数',
-                'fba_available': 'FBA可售',
-                'fba_shipping': 'FBA在途',
-                'local_available': '本地仓可用',
-                'oversea_available': '海外仓可用',
-                'sales_avg_7': '7天日均销量',
-                'sales_avg_30': '30天日均销量',
-                'sales_total_7': '7天总销量',
-                'sales_total_30': '30天总销量',
-                'suggested_purchase': '建议采购量',
-                'suggested_local_to_fba': '建议本地发FBA',
-                'suggested_oversea_to_fba': '建议海外仓发FBA',
-                'listing_opentime': 'Listing创建时间',
-                'sync_time': '数据更新时间',
-                'star': '关注状态',
-                'remark': '备注'
-            }
+            column_mapping = self.STANDARD_COLUMN_MAPPING
             
             df.rename(columns=column_mapping, inplace=True)
+            if on_progress:
+                on_progress(30, '正在写入工作表')
             
             # 导出到Excel
             with pd.ExcelWriter(filepath, engine='openpyxl') as writer:
                 df.to_excel(writer, sheet_name='补货数据', index=False)
+                if on_progress:
+                    on_progress(70, '正在调整格式并保存')
                 
                 # 获取工作表
                 worksheet = writer.sheets['补货数据']
@@ -736,7 +830,8 @@ class RestockAnalyzer:
             raise
     
     def export_to_excel_both(self, restock_items: List[RestockItem],
-                           filename: str = None) -> str:
+                           filename: str = None,
+                           on_progress: Callable[[int, str], None] = None) -> str:
         """
         导出数据到Excel文件，包含两个工作表：
         1. 标准格式（MSKU/FNSKU合并显示）
@@ -745,6 +840,7 @@ class RestockAnalyzer:
         Args:
             restock_items: 补货项目列表
             filename: 文件名
+            on_progress: 进度回调，参数为百分比和当前步骤说明
             
         Returns:
             str: 导出的文件路径
@@ -770,48 +866,20 @@ class RestockAnalyzer:
                 df_standard = pd.DataFrame(data_list)
                 
                 # 重新排列列顺序
-                column_order_standard = [
-                    'asin', 'sid', 'data_type', 'msku_fnsku',
-                    'out_stock_flag', 'out_stock_date', 'available_sale_days',
-                    'fba_available', 'fba_shipping', 'local_available', 'oversea_available',
-                    'sales_avg_7', 'sales_avg_30', 'sales_total_7', 'sales_total_30',
-                    'suggested_purchase', 'suggested_local_to_fba', 'suggested_oversea_to_fba',
-                    'listing_opentime', 'sync_time', 'star', 'remark'
-                ]
+                column_order_standard = self.STANDARD_COLUMN_ORDER
                 
                 # 只保留存在的列
                 available_columns_standard = [col for col in column_order_standard if col in df_standard.columns]
                 df_standard = df_standard[available_columns_standard]
                 
                 # 添加中文列名
-                column_mapping_standard = {
-                    'asin': 'ASIN',
-                    'sid': '店铺ID',
-                    'data_type': '数据类型',
-                    'msku_fnsku': 'MSKU/FNSKU',
-                    'out_stock_flag': '断货标记',
-                    'out_stock_date': '断货日期',
-                    'available_sale_days': '可售天数',
-                    'fba_available': 'FBA可售',
-                    'fba_shipping': 'FBA在途',
-                    'local_available': '本地仓可用',
-                    'oversea_available': '海外仓可用',
-                    'sales_avg_7': '7天日均销量',
-                    'sales_avg_30': '30天日均销量',
-                    'sales_total_7': '7天总销量',
-                    'sales_total_30': '30天总销量',
-                    'suggested_purchase': '建议采购量',
-                    'suggested_local_to_fba': '建议本地发FBA',
-                    'suggested_oversea_to_fba': '建议海外仓发FBA',
-                    'listing_opentime': 'Listing创建时间',
-                    'sync_time': '数据更新时间',
-                    'star': '关注状态',
-                    'remark': '备注'
-                }
+                column_mapping_standard = self.STANDARD_COLUMN_MAPPING
                 
                 df_standard.rename(columns=column_mapping_standard, inplace=True)
                 
                 # 导出到Excel的第一个工作表
+                if on_progress:
+                    on_progress(20, '正在写入标准格式工作表')
                 df_standard.to_excel(writer, sheet_name='标准格式', index=False)
                 
                 # 获取工作表
@@ -852,6 +920,8 @@ class RestockAnalyzer:
                     worksheet_standard.column_dimensions[col_letter].width = 25
                 
                 # 2. 明细拆分格式工作表
+                if on_progress:
+                    on_progress(50, '正在生成明细拆分格式工作表')
                 # 将所有数据转换为明细字典列表
                 all_detail_data = []
                 for item in restock_items:
@@ -945,6 +1015,8 @@ class RestockAnalyzer:
                 
                 # 导出到Excel的第二个工作表
                 df_detail.to_excel(writer, sheet_name='明细拆分格式', index=False)
+                if on_progress:
+                    on_progress(85, '正在调整格式并保存')
                 
                 # 获取工作表
                 worksheet_detail = writer.sheets['明细拆分格式']
@@ -970,7 +1042,8 @@ class RestockAnalyzer:
             raise
     
     def export_to_excel_detail(self, restock_items: List[RestockItem], 
-                              filename: str = None) -> str:
+                              filename: str = None,
+                              on_progress: Callable[[int, str], None] = None) -> str:
         """
         导出数据到Excel文件（按明细拆分）
         每个MSKU/FNSKU组合单独成行
@@ -978,6 +1051,7 @@ class RestockAnalyzer:
         Args:
             restock_items: 补货项目列表
             filename: 文件名
+            on_progress: 进度回调，参数为百分比和当前步骤说明
             
         Returns:
             str: 保存的文件路径
@@ -1085,10 +1159,14 @@ class RestockAnalyzer:
             }
             
             df = df.rename(columns=column_mapping)
+            if on_progress:
+                on_progress(40, '正在写入工作表')
             
             # 导出到Excel
             with pd.ExcelWriter(filepath, engine='openpyxl') as writer:
                 df.to_excel(writer, sheet_name='补货数据明细', index=False)
+                if on_progress:
+                    on_progress(80, '正在调整格式并保存')
                 
                 # 获取工作表
                 worksheet = writer.sheets['补货数据明细']
@@ -1156,6 +1234,7 @@ class RestockAnalyzer:
             
             if response.get('code') == 0 and response.get('data'):
                 api_logger.logger.info(f"成功获取MSKU详细信息: {msku}")
+                self._msku_detail_cache.put(f"{sid}_{msku}", response['data'])
                 return response['data']
             else:
                 error_msg = response.get('message', '未知错误')
@@ -1166,6 +1245,20 @@ class RestockAnalyzer:
             api_logger.log_error(e, f"获取MSKU详细信息异常: sid={sid}, msku={msku}")
             return {}
     
+    @classmethod
+    def get_cached_msku_detail(cls, sid: str, msku: str) -> Optional[Dict[str, Any]]:
+        """
+        获取已缓存的MSKU详细信息（不调用接口）
+        
+        Args:
+            sid: 店铺ID
+            msku: MSKU编码
+            
+        Returns:
+            Optional[Dict[str, Any]]: MSKU详细信息，未缓存或已过期返回None
+        """
+        return cls._msku_detail_cache.get(f"{sid}_{msku}")
+    
     def get_msku_details_batch(self, msku_list: List[dict], max_workers: int = 1) -> List[dict]:
         """
         批量获取MSKU详细信息
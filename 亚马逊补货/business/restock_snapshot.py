@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+"""
+补货数据快照模块
+由后台定时任务拉取全量补货数据并保存在内存中，
+机器人命令直接基于最近一次完整快照应答，不再每条消息实时调用接口
+"""
+
+import time
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable
+
+from business.restock_analyzer import RestockAnalyzer, RestockItem
+from config.config import SnapshotConfig
+from utils.logger import api_logger
+
+class BaseSnapshot:
+    """快照公共部分：创建时间、拉取耗时和条数"""
+
+    created_at: float = 0.0
+    duration: float = 0.0
+    version: str = ''
+
+    @property
+    def item_count(self) -> int:
+        """快照条数"""
+        return len(self.items)
+
+    @property
+    def age(self) -> float:
+        """快照年龄（秒）"""
+        return time.time() - self.created_at
+
+    def format_age(self) -> str:
+        """格式化快照时间和年龄，如 "2024-01-01 14:05:12（3分钟前）" """
+        created = datetime.fromtimestamp(self.created_at).strftime('%Y-%m-%d %H:%M:%S')
+        age = int(self.age)
+        if age < 60:
+            ago = f"{age}秒前"
+        elif age < 3600:
+            ago = f"{age // 60}分钟前"
+        else:
+            ago = f"{age // 3600}小时{age % 3600 // 60}分钟前"
+        return f"{created}（{ago}）"
+
+class RestockSnapshot(BaseSnapshot):
+    """补货数据快照（创建后只读，可在多个线程间共享）"""
+
+    def __init__(self, items: List[RestockItem], analyzer: RestockAnalyzer,
+                 created_at: float = None, duration: float = 0.0):
+        """
+        初始化快照，并预先计算全量汇总、紧急补货列表和单品/店铺索引
+
+        Args:
+            items: 全量补货项目列表
+            analyzer: 补货分析器
+            created_at: 数据拉取完成时间
+            duration: 拉取耗时（秒）
+        """
+        self.items = items
+        self.created_at = created_at or time.time()
+        self.version = str(int(self.created_at * 1000))
+        self.duration = duration
+        self._analyzer = analyzer
+        self.summary = analyzer.generate_summary_report(items)
+        self.urgent_items = analyzer.analyze_urgent_restock(items)
+
+        # 单品索引：ASIN/MSKU/FNSKU（不区分大小写）-> 补货项目
+        self._by_code: Dict[str, List[RestockItem]] = {}
+        # 店铺索引：店铺ID -> 补货项目 / 紧急补货项目（保持紧急程度顺序）
+        self._by_sid: Dict[str, List[RestockItem]] = {}
+        self._urgent_by_sid: Dict[str, List[RestockItem]] = {}
+
+        for item in items:
+            codes = {item.asin, *(item.msku_list or []), *(item.fnsku_list or [])}
+            for code in codes:
+                if code:
+                    self._by_code.setdefault(self._normalize_code(code), []).append(item)
+            self._by_sid.setdefault(str(item.sid), []).append(item)
+        for item in self.urgent_items:
+            self._urgent_by_sid.setdefault(str(item.sid), []).append(item)
+
+    @staticmethod
+    def _normalize_code(code: str) -> str:
+        """规范化商品编码（去空白、转大写）"""
+        return str(code).strip().upper()
+
+    def filter_by_sellers(self, seller_ids: Optional[List[str]]) -> List[RestockItem]:
+        """
+        按店铺筛选补货项目
+
+        Args:
+            seller_ids: 店铺ID列表，为空返回全部
+
+        Returns:
+            List[RestockItem]: 补货项目列表
+        """
+        if not seller_ids:
+            return self.items
+        result = []
+        for sid in dict.fromkeys(str(sid) for sid in seller_ids):
+            result.extend(self._by_sid.get(sid, []))
+        return result
+
+    def summarize_sellers(self, seller_ids: Optional[List[str]]) -> Dict[str, Any]:
+        """
+        按店铺生成汇总报告
+
+        Args:
+            seller_ids: 店铺ID列表，为空返回全量汇总
+
+        Returns:
+            Dict[str, Any]: 汇总报告（与 generate_summary_report 格式相同）
+        """
+        if not seller_ids:
+            return self.summary
+        return self._analyzer.generate_summary_report(self.filter_by_sellers(seller_ids))
+
+    def urgent_for_sellers(self, seller_ids: Optional[List[str]], limit: int = None) -> List[RestockItem]:
+        """
+        按店铺获取紧急补货项目（保持紧急程度顺序）
+
+        Args:
+            seller_ids: 店铺ID列表，为空返回全部
+            limit: 最多返回的条数，None表示不限制
+
+        Returns:
+            List[RestockItem]: 紧急补货项目列表
+        """
+        if not seller_ids:
+            return self.urgent_items[:limit]
+        wanted = list(dict.fromkeys(str(sid) for sid in seller_ids))
+        if len(wanted) == 1:
+            return self._urgent_by_sid.get(wanted[0], [])[:limit]
+        wanted = set(wanted)
+        return [item for item in self.urgent_items if str(item.sid) in wanted][:limit]
+
+    def lookup(self, code: str) -> List[RestockItem]:
+        """
+        按ASIN/MSKU/FNSKU查找补货项目
+
+        Args:
+            code: 商品编码（不区分大小写）
+
+        Returns:
+            List[RestockItem]: 匹配的补货项目（同一ASIN可能对应多个店铺）
+        """
+        return self._by_code.get(self._normalize_code(code), [])
+
+    def has_seller(self, seller_id: str) -> bool:
+        """快照中是否包含该店铺的数据"""
+        return str(seller_id) in self._by_sid
+
+class RefreshProgress:
+    """一次快照刷新的进度，按到达的页面增量统计部分结果"""
+
+    def __init__(self, analyzer: RestockAnalyzer):
+        """
+        初始化刷新进度
+
+        Args:
+            analyzer: 补货分析器（用于判断紧急补货）
+        """
+        self.analyzer = analyzer
+        self.started_at = time.time()
+        self.pages_done = 0
+        self.total_pages = 0
+        self.items = 0
+        self.urgent_items = 0
+        self.out_of_stock_items = 0
+        self.total_suggested_purchase = 0
+
+    def add_page(self, page_items: List[RestockItem], pages_done: int, total_pages: int):
+        """
+        累加一页数据
+
+        Args:
+            page_items: 本页补货项目
+            pages_done: 已完成页数
+            total_pages: 总页数
+        """
+        self.pages_done = pages_done
+        self.total_pages = max(total_pages, pages_done)
+        self.items += len(page_items)
+        self.urgent_items += len(self.analyzer.analyze_urgent_restock(page_items))
+        self.out_of_stock_items += sum(1 for item in page_items if item.out_stock_flag == 1)
+        self.total_suggested_purchase += sum(item.suggested_purchase for item in page_items)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典格式（交给监听方的只读副本）"""
+        return {
+            'pages_done': self.pages_done,
+            'total_pages': self.total_pages,
+            'items': self.items,
+            'urgent_items': self.urgent_items,
+            'out_of_stock_items': self.out_of_stock_items,
+            'total_suggested_purchase': self.total_suggested_purchase,
+            'elapsed': round(time.time() - self.started_at, 1)
+        }
+
+class RefreshRun:
+    """一次快照刷新的结果，等待同一次刷新的调用方共享"""
+
+    __slots__ = ('done', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+class RestockSnapshotStore:
+    """
+    补货数据快照存储
+
+    后台线程按固定间隔刷新全量快照；同一时间只进行一次刷新，
+    刷新期间的其他刷新请求等待同一次结果，刷新失败时保留旧快照
+    """
+
+    def __init__(self, analyzer: RestockAnalyzer = None, refresh_interval: int = None,
+                 data_type: int = None, mode: int = None, max_workers: int = None,
+                 retry_interval: float = None):
+        """
+        初始化快照存储
+
+        Args:
+            analyzer: 补货分析器
+            refresh_interval: 后台刷新间隔（秒）
+            data_type: 查询维度（1: asin, 2: msku）
+            mode: 补货建议模式（0: 普通模式, 1: 海外仓中转模式）
+            max_workers: 拉取数据的并发线程数
+            retry_interval: 尚无快照时拉取失败的首次重试间隔（秒，之后每次翻倍）
+        """
+        self.analyzer = analyzer or RestockAnalyzer()
+        self.refresh_interval = refresh_interval or SnapshotConfig.REFRESH_INTERVAL
+        self.retry_interval = retry_interval or SnapshotConfig.FIRST_LOAD_RETRY_INTERVAL
+        self.data_type = data_type or SnapshotConfig.DATA_TYPE
+        self.mode = mode if mode is not None else SnapshotConfig.MODE
+        self.max_workers = max_workers or SnapshotConfig.MAX_WORKERS
+
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._run = None
+        self._progress = None
+        self._progress_listeners = []
+        self._stop_event = threading.Event()
+        self._scheduler = None
+
+        # 统计信息
+        self.refresh_count = 0
+        self.failure_count = 0
+        self.last_error = ''
+
+    def start(self):
+        """启动后台刷新线程（重复调用无副作用）"""
+        with self._lock:
+            if self._scheduler and self._scheduler.is_alive():
+                return
+            self._stop_event.clear()
+            self._scheduler = threading.Thread(target=self._schedule_loop, name='restock-snapshot', daemon=True)
+            self._scheduler.start()
+        api_logger.log_info(f"补货数据快照刷新已启动，间隔{self.refresh_interval}秒")
+
+    def stop(self):
+        """停止后台刷新线程"""
+        self._stop_event.set()
+
+    def _schedule_loop(self):
+        """
+        后台刷新循环：快照缺失或过期时刷新，然后等到下次到期；
+        尚无快照时失败后按较短的间隔退避重试，不必等满一个刷新间隔
+        """
+        retry_delay = self.retry_interval
+        while not self._stop_event.is_set():
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.age >= self.refresh_interval:
+                try:
+                    snapshot = self.refresh()
+                except Exception:
+                    snapshot = self._snapshot  # 失败已在 _fetch 中记录，继续使用旧快照
+
+            if snapshot is None:
+                wait = min(retry_delay, self.refresh_interval)
+                retry_delay = min(retry_delay * 2, self.refresh_interval)
+            else:
+                wait = self.refresh_interval - snapshot.age
+                retry_delay = self.retry_interval
+            self._stop_event.wait(max(1.0, wait))
+
+    def refresh(self, timeout: float = None,
+                on_progress: Callable[[Dict[str, Any]], None] = None) -> Optional[RestockSnapshot]:
+        """
+        立即刷新快照（已有刷新在进行时等待其结果）
+
+        拉取在后台线程中进行，调用方最多等待 timeout 秒；超时后拉取继续，
+        完成后更新快照
+
+        Args:
+            timeout: 最长等待时间（秒），None表示等到刷新结束
+            on_progress: 每页数据到达时的回调，参数为 RefreshProgress.to_dict()；
+                         加入进行中的刷新时会先收到当前进度
+
+        Returns:
+            Optional[RestockSnapshot]: 最新快照（超时返回当前快照，可能为None）
+
+        Raises:
+            Exception: 等待的这次刷新拉取失败
+        """
+        current = None
+        with self._lock:
+            if self._refreshing:
+                run = self._run
+                if self._progress and self._progress.pages_done:
+                    current = self._progress.to_dict()
+            else:
+                self._refreshing = True
+                self._run = run = RefreshRun()
+                self._progress = RefreshProgress(self.analyzer)
+                self._progress_listeners = []
+                threading.Thread(target=self._fetch, args=(run,), name='restock-snapshot-fetch', daemon=True).start()
+            if on_progress:
+                self._progress_listeners.append(on_progress)
+
+        if current:
+            self._call_listener(on_progress, current)
+        try:
+            finished = run.done.wait(timeout)
+        finally:
+            self._remove_listener(on_progress)
+        if finished and run.error is not None:
+            raise run.error
+        return self._snapshot
+
+    def _fetch(self, run: 'RefreshRun'):
+        """后台拉取全量数据并替换快照，结果记录在run中"""
+        started = time.time()
+        try:
+            items = self.analyzer.get_restock_data(
+                data_type=self.data_type,
+                mode=self.mode,
+                max_pages=None,
+                max_workers=self.max_workers,
+                on_page=self._on_page
+            )
+            snapshot = RestockSnapshot(items, self.analyzer, duration=round(time.time() - started, 2))
+            with self._lock:
+                self._snapshot = snapshot
+                self.refresh_count += 1
+                self.last_error = ''
+            api_logger.log_info(f"补货数据快照已刷新: {len(items)}条，耗时{snapshot.duration}秒")
+        except Exception as e:
+            api_logger.log_error(e, "拉取补货数据快照失败")
+            run.error = e
+            with self._lock:
+                self.failure_count += 1
+                self.last_error = str(e)
+        finally:
+            with self._lock:
+                self._refreshing = False
+                self._progress_listeners = []
+            run.done.set()
+
+    def _on_page(self, page_items: List[RestockItem], pages_done: int, total_pages: int):
+        """刷新时每页到达：更新进度并通知监听方"""
+        with self._lock:
+            progress = self._progress
+            if progress is None:
+                return
+            progress.add_page(page_items, pages_done, total_pages)
+            current = progress.to_dict()
+            listeners = list(self._progress_listeners)
+        for listener in listeners:
+            self._call_listener(listener, current)
+
+    @staticmethod
+    def _call_listener(listener: Callable[[Dict[str, Any]], None], progress: Dict[str, Any]):
+        """调用进度监听方（异常不影响刷新）"""
+        try:
+            listener(progress)
+        except Exception as e:
+            api_logger.log_error(e, "处理快照刷新进度失败")
+
+    def _remove_listener(self, listener: Optional[Callable[[Dict[str, Any]], None]]):
+        """移除进度监听方"""
+        if listener is None:
+            return
+        with self._lock:
+            if listener in self._progress_listeners:
+                self._progress_listeners.remove(listener)
+
+    def get_snapshot(self) -> Optional[RestockSnapshot]:
+        """获取当前快照（尚未加载时返回None）"""
+        return self._snapshot
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取快照统计信息
+
+        Returns:
+            Dict: 快照条数、年龄、刷新次数和最近错误
+        """
+        snapshot = self._snapshot
+        return {
+            'ready': snapshot is not None,
+            'items': snapshot.item_count if snapshot else 0,
+            'age_seconds': round(snapshot.age, 1) if snapshot else None,
+            'last_duration': snapshot.duration if snapshot else None,
+            'refreshing': self._refreshing,
+            'progress': self._progress.to_dict() if self._refreshing and self._progress else None,
+            'refresh_interval': self.refresh_interval,
+            'refresh_count': self.refresh_count,
+            'failure_count': self.failure_count,
+            'last_error': self.last_error
+        }
@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""
+共享快照文件模块
+多进程服务模式下，由单独的刷新进程把补货数据快照按列写成NumPy文件（含预先计算的
+单品/店铺/紧急补货索引），各工作进程以内存映射方式只读访问，不再各自保存一份数据。
+
+目录结构（SnapshotConfig.SHARED_DIR）：
+    v-<版本>/         一个快照版本（每列一个 .npy 文件 + meta.json）
+    current           指向当前版本目录的符号链接（原子替换）
+    status.json       刷新进程状态和进度
+    refresh.request   工作进程请求立即刷新
+"""
+
+import os
+import json
+import time
+import shutil
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable
+
+import numpy as np
+
+from business.restock_analyzer import RestockItem
+from business.restock_snapshot import BaseSnapshot, RestockSnapshot, RestockSnapshotStore
+from config.config import SnapshotConfig
+from utils.logger import api_logger
+
+CURRENT_LINK = 'current'
+STATUS_FILE = 'status.json'
+REQUEST_FILE = 'refresh.request'
+META_FILE = 'meta.json'
+
+# 写入快照文件的RestockItem字段（按存储类型分组）；MSKU/FNSKU列表以换行拼接保存
+STRING_COLUMNS = ('hash_id', 'asin', 'sid', 'msku_list', 'fnsku_list', 'out_stock_date',
+                  'listing_opentime', 'sync_time', 'remark')
+INT_COLUMNS = ('data_type', 'node_type', 'fba_available', 'fba_shipping', 'fba_shipping_plan',
+               'local_available', 'oversea_available', 'oversea_shipping', 'purchase_plan',
+               'sales_total_7', 'sales_total_30', 'out_stock_flag', 'suggested_purchase',
+               'suggested_local_to_fba', 'suggested_oversea_to_fba', 'available_sale_days', 'star')
+FLOAT_COLUMNS = ('sales_avg_7', 'sales_avg_30')
+LIST_COLUMNS = ('msku_list', 'fnsku_list')
+
+def _atomic_write_json(path: str, data: Dict[str, Any]):
+    """原子写入JSON文件"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _read_json(path: str) -> Dict[str, Any]:
+    """读取JSON文件（不存在或损坏返回空字典）"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _string_array(values: List[str]) -> np.ndarray:
+    """按最长值确定宽度的定长字符串数组（不截断）"""
+    width = max([len(value) for value in values] + [1])
+    return np.array(values, dtype=f'U{width}')
+
+def _sorted_index(keys: List[str], rows: List[int]):
+    """按键稳定排序，返回 (有序键数组, 对应行号数组)，同键的行保持原顺序"""
+    key_array = _string_array(keys)
+    row_array = np.array(rows, dtype=np.int32)
+    order = np.argsort(key_array, kind='stable')
+    return key_array[order], row_array[order]
+
+def write_snapshot_files(snapshot: RestockSnapshot, base_dir: str = None, keep_versions: int = 2) -> str:
+    """
+    把快照写成新的版本目录，并原子切换 current 链接
+
+    Args:
+        snapshot: 内存快照
+        base_dir: 共享目录
+        keep_versions: 保留的版本数（旧版本被读取方映射时删除也不影响其读取）
+
+    Returns:
+        str: 新版本目录路径
+    """
+    base_dir = base_dir or SnapshotConfig.SHARED_DIR
+    os.makedirs(base_dir, exist_ok=True)
+    version = f"{int(snapshot.created_at * 1000)}-{os.getpid()}"
+    tmp_dir = os.path.join(base_dir, f".tmp-{version}")
+    version_dir = os.path.join(base_dir, f"v-{version}")
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    items = snapshot.items
+    row_of = {id(item): row for row, item in enumerate(items)}
+
+    for column in STRING_COLUMNS:
+        if column in LIST_COLUMNS:
+            values = ['\n'.join(getattr(item, column) or []) for item in items]
+        else:
+            values = [str(getattr(item, column) or '') for item in items]
+        np.save(os.path.join(tmp_dir, f"{column}.npy"), _string_array(values))
+    for column in INT_COLUMNS:
+        values = [int(getattr(item, column) or 0) for item in items]
+        np.save(os.path.join(tmp_dir, f"{column}.npy"), np.array(values, dtype=np.int64))
+    for column in FLOAT_COLUMNS:
+        values = [float(getattr(item, column) or 0.0) for item in items]
+        np.save(os.path.join(tmp_dir, f"{column}.npy"), np.array(values, dtype=np.float64))
+
+    # 单品索引：规范化编码 -> 行号
+    code_keys, code_rows = [], []
+    for row, item in enumerate(items):
+        for code in {item.asin, *(item.msku_list or []), *(item.fnsku_list or [])}:
+            if code:
+                code_keys.append(RestockSnapshot._normalize_code(code))
+                code_rows.append(row)
+    # 店铺索引和按店铺的紧急补货索引（保持行顺序/紧急程度顺序）
+    urgent_rows = [row_of[id(item)] for item in snapshot.urgent_items]
+    indexes = {
+        'code': _sorted_index(code_keys, code_rows),
+        'sid': _sorted_index([str(item.sid) for item in items], list(range(len(items)))),
+        'urgent_sid': _sorted_index([str(items[row].sid) for row in urgent_rows], urgent_rows),
+    }
+    for name, (keys, rows) in indexes.items():
+        np.save(os.path.join(tmp_dir, f"{name}_keys.npy"), keys)
+        np.save(os.path.join(tmp_dir, f"{name}_rows.npy"), rows)
+    np.save(os.path.join(tmp_dir, 'urgent_rows.npy'), np.array(urgent_rows, dtype=np.int32))
+
+    _atomic_write_json(os.path.join(tmp_dir, META_FILE), {
+        'version': version,
+        'created_at': snapshot.created_at,
+        'duration': snapshot.duration,
+        'item_count': len(items),
+        'summary': snapshot.summary
+    })
+
+    # 目录改名后再原子替换符号链接，读取方只会看到完整的版本
+    os.rename(tmp_dir, version_dir)
+    link_tmp = os.path.join(base_dir, f".{CURRENT_LINK}-{version}")
+    os.symlink(os.path.basename(version_dir), link_tmp)
+    os.replace(link_tmp, os.path.join(base_dir, CURRENT_LINK))
+
+    versions = sorted(name for name in os.listdir(base_dir) if name.startswith('v-'))
+    for name in versions[:-max(1, keep_versions)]:
+        shutil.rmtree(os.path.join(base_dir, name), ignore_errors=True)
+    return version_dir
+
+class MappedRestockSnapshot(BaseSnapshot):
+    """
+    内存映射的只读快照
+
+    各列以 np.load(mmap_mode='r') 打开，多个进程共享操作系统页缓存；
+    只在需要时把行转换为RestockItem
+    """
+
+    def __init__(self, version_dir: str):
+        """
+        打开快照版本目录
+
+        Args:
+            version_dir: 版本目录
+        """
+        self.version_dir = version_dir
+        meta = _read_json(os.path.join(version_dir, META_FILE))
+        if not meta:
+            raise FileNotFoundError(f"快照元数据不存在: {version_dir}")
+        self.version = meta['version']
+        self.created_at = meta['created_at']
+        self.duration = meta['duration']
+        self.summary = meta['summary']
+        self._count = meta['item_count']
+
+        def load(name: str) -> np.ndarray:
+            return np.load(os.path.join(version_dir, f"{name}.npy"), mmap_mode='r')
+
+        self._columns = {column: load(column) for column in STRING_COLUMNS + INT_COLUMNS + FLOAT_COLUMNS}
+        self._indexes = {name: (load(f"{name}_keys"), load(f"{name}_rows"))
+                         for name in ('code', 'sid', 'urgent_sid')}
+        self._urgent_rows = load('urgent_rows')
+
+    @property
+    def item_count(self) -> int:
+        """快照条数"""
+        return self._count
+
+    def _items(self, rows) -> List[RestockItem]:
+        """
+        把若干行转换为RestockItem（按列整体取值，避免逐个元素访问映射数组）
+
+        Args:
+            rows: 行号数组或切片
+
+        Returns:
+            List[RestockItem]: 补货项目列表
+        """
+        names = STRING_COLUMNS + INT_COLUMNS + FLOAT_COLUMNS
+        columns = [self._columns[name][rows].tolist() for name in names]
+        list_positions = [names.index(name) for name in LIST_COLUMNS]
+        items = []
+        for values in zip(*columns):
+            values = list(values)
+            for position in list_positions:
+                values[position] = values[position].split('\n') if values[position] else None
+            items.append(RestockItem(**dict(zip(names, values))))
+        return items
+
+    def _rows(self, index: str, key: str) -> np.ndarray:
+        """在有序索引中二分查找键对应的行号"""
+        keys, rows = self._indexes[index]
+        if not len(keys) or len(key) > keys.dtype.itemsize // 4:
+            return rows[:0]
+        start = np.searchsorted(keys, key, side='left')
+        end = np.searchsorted(keys, key, side='right')
+        return rows[start:end]
+
+    @property
+    def items(self) -> List[RestockItem]:
+        """全部补货项目（每次调用都重新转换，避免在工作进程中常驻一份副本）"""
+        return self._items(slice(0, self._count))
+
+    @property
+    def urgent_items(self) -> List[RestockItem]:
+        """紧急补货项目（按紧急程度排序）"""
+        return self._items(self._urgent_rows[:])
+
+    def filter_by_sellers(self, seller_ids: Optional[List[str]]) -> List[RestockItem]:
+        """按店铺筛选补货项目，为空返回全部"""
+        if not seller_ids:
+            return self.items
+        rows = [self._rows('sid', sid) for sid in dict.fromkeys(str(sid) for sid in seller_ids)]
+        return self._items(np.concatenate(rows))
+
+    def _summarize_rows(self, rows: np.ndarray) -> Dict[str, Any]:
+        """直接在映射列上统计若干行（口径与 generate_summary_report 相同）"""
+        days = self._columns['available_sale_days'][rows]
+        out_of_stock = self._columns['out_stock_flag'][rows] == 1
+        urgent = out_of_stock | ((days > 0) & (days <= 7))
+        valid_days = days[days > 0]
+        return {
+            'total_items': len(rows),
+            'urgent_items': int(urgent.sum()),
+            'out_of_stock_items': int(out_of_stock.sum()),
+            'high_sales_items': int((self._columns['sales_avg_30'][rows] >= 10.0).sum()),
+            'total_suggested_purchase': int(self._columns['suggested_purchase'][rows].sum()),
+            'avg_available_days': round(int(valid_days.sum()) / len(valid_days), 2) if len(valid_days) else 0,
+        }
+
+    def summarize_sellers(self, seller_ids: Optional[List[str]]) -> Dict[str, Any]:
+        """按店铺生成汇总报告（不转换RestockItem），为空返回全量汇总"""
+        if not seller_ids:
+            return self.summary
+        seller_rows = {sid: self._rows('sid', sid) for sid in dict.fromkeys(str(sid) for sid in seller_ids)}
+        report = self._summarize_rows(np.concatenate(list(seller_rows.values())))
+        if report['total_items']:
+            report['seller_stats'] = {}
+            for sid, rows in seller_rows.items():
+                if len(rows):
+                    stats = self._summarize_rows(rows)
+                    report['seller_stats'][sid] = {'total_items': stats['total_items'],
+                                                   'urgent_items': stats['urgent_items'],
+                                                   'suggested_purchase': stats['total_suggested_purchase']}
+        report['report_time'] = datetime.now().isoformat()
+        return report
+
+    def urgent_for_sellers(self, seller_ids: Optional[List[str]], limit: int = None) -> List[RestockItem]:
+        """按店铺获取紧急补货项目（保持紧急程度顺序，只转换前limit行）"""
+        if not seller_ids:
+            return self._items(self._urgent_rows[:limit])
+        wanted = list(dict.fromkeys(str(sid) for sid in seller_ids))
+        if len(wanted) == 1:
+            return self._items(self._rows('urgent_sid', wanted[0])[:limit])
+        urgent_rows = np.asarray(self._urgent_rows)
+        return self._items(urgent_rows[np.isin(self._columns['sid'][urgent_rows], wanted)][:limit])
+
+    def lookup(self, code: str) -> List[RestockItem]:
+        """按ASIN/MSKU/FNSKU查找补货项目（不区分大小写）"""
+        return self._items(self._rows('code', RestockSnapshot._normalize_code(code)))
+
+    def has_seller(self, seller_id: str) -> bool:
+        """快照中是否包含该店铺的数据"""
+        return len(self._rows('sid', str(seller_id))) > 0
+
+class SharedSnapshotStore:
+    """
+    工作进程使用的共享快照存储（只读）
+
+    接口与 RestockSnapshotStore 一致；快照由刷新进程写入，
+    refresh() 只是向刷新进程发出请求并等待新版本出现
+    """
+
+    def __init__(self, base_dir: str = None, poll_interval: float = 0.2):
+        """
+        初始化共享快照存储
+
+        Args:
+            base_dir: 共享目录
+            poll_interval: 等待刷新时检查状态的间隔（秒）
+        """
+        self.base_dir = base_dir or SnapshotConfig.SHARED_DIR
+        self.poll_interval = poll_interval
+        self._snapshot = None
+        self._target = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """快照由刷新进程维护，工作进程无需启动后台线程"""
+
+    def stop(self):
+        """与 RestockSnapshotStore 接口保持一致"""
+
+    def _current_target(self) -> Optional[str]:
+        """当前版本目录名（尚无快照时为None）"""
+        try:
+            return os.readlink(os.path.join(self.base_dir, CURRENT_LINK))
+        except OSError:
+            return None
+
+    def get_snapshot(self) -> Optional[MappedRestockSnapshot]:
+        """获取当前快照（版本切换后自动重新映射）"""
+        target = self._current_target()
+        if target is None:
+            return None
+        with self._lock:
+            if target != self._target:
+                try:
+                    self._snapshot = MappedRestockSnapshot(os.path.join(self.base_dir, target))
+                    self._target = target
+                except (OSError, ValueError, KeyError) as e:
+                    api_logger.log_warning(f"打开共享快照失败，继续使用旧版本: {target} ({e})")
+            return self._snapshot
+
+    def refresh(self, timeout: float = None,
+                on_progress: Callable[[Dict[str, Any]], None] = None) -> Optional[MappedRestockSnapshot]:
+        """
+        请求刷新进程立即刷新，并等待新版本
+
+        Args:
+            timeout: 最长等待时间（秒），默认 SnapshotConfig.FIRST_LOAD_TIMEOUT
+            on_progress: 刷新进度回调（由刷新进程写入的进度转发）
+
+        Returns:
+            Optional[MappedRestockSnapshot]: 最新快照（超时返回当前快照）
+        """
+        os.makedirs(self.base_dir, exist_ok=True)
+        requested_at = time.time()
+        _atomic_write_json(os.path.join(self.base_dir, REQUEST_FILE), {'requested_at': requested_at})
+
+        before = self._current_target()
+        deadline = requested_at + (timeout if timeout is not None else SnapshotConfig.FIRST_LOAD_TIMEOUT)
+        last_pages = 0
+        while time.time() < deadline:
+            if self._current_target() != before:
+                return self.get_snapshot()
+
+            status = _read_json(os.path.join(self.base_dir, STATUS_FILE))
+            if status.get('last_finished_at', 0) >= requested_at and status.get('last_error'):
+                raise RuntimeError(f"刷新进程拉取失败: {status['last_error']}")
+            progress = status.get('progress') if status.get('refreshing') else None
+            if on_progress and progress and progress.get('pages_done', 0) > last_pages:
+                last_pages = progress['pages_done']
+                RestockSnapshotStore._call_listener(on_progress, progress)
+            time.sleep(self.poll_interval)
+        return self.get_snapshot()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取快照统计信息（合并刷新进程写入的状态）
+
+        Returns:
+            Dict: 快照条数、年龄、版本和刷新状态
+        """
+        snapshot = self.get_snapshot()
+        status = _read_json(os.path.join(self.base_dir, STATUS_FILE))
+        return {
+            'ready': snapshot is not None,
+            'shared': True,
+            'version': snapshot.version if snapshot else None,
+            'items': snapshot.item_count if snapshot else 0,
+            'age_seconds': round(snapshot.age, 1) if snapshot else None,
+            'last_duration': snapshot.duration if snapshot else None,
+            'refreshing': status.get('refreshing', False),
+            'progress': status.get('progress') if status.get('refreshing') else None,
+            'refresh_count': status.get('refresh_count', 0),
+            'failure_count': status.get('failure_count', 0),
+            'last_error': status.get('last_error', '')
+        }
+
+class SnapshotFileWriter:
+    """
+    刷新进程：按间隔或工作进程的请求刷新快照，并写入共享目录
+
+    同一时间只有这一个进程调用领星接口；刷新期间收到的请求由本次刷新满足
+    """
+
+    def __init__(self, store: RestockSnapshotStore = None, base_dir: str = None,
+                 poll_interval: float = 1.0, retry_delay: float = 60.0):
+        """
+        初始化刷新进程
+
+        Args:
+            store: 进程内快照存储（负责实际拉取）
+            base_dir: 共享目录
+            poll_interval: 检查刷新请求的间隔（秒）
+            retry_delay: 定时刷新失败后的重试间隔（秒，工作进程的刷新请求不受限制）
+        """
+        self.store = store or RestockSnapshotStore()
+        self.base_dir = base_dir or SnapshotConfig.SHARED_DIR
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self._handled_at = 0.0
+        self._retry_at = 0.0
+        self._stop_event = threading.Event()
+        self._status = {'refreshing': False, 'progress': None, 'refresh_count': 0, 'failure_count': 0,
+                        'last_error': '', 'last_finished_at': 0.0}
+
+    def stop(self):
+        """停止刷新循环"""
+        self._stop_event.set()
+
+    def _write_status(self, **changes):
+        """更新状态文件"""
+        self._status.update(changes)
+        _atomic_write_json(os.path.join(self.base_dir, STATUS_FILE), self._status)
+
+    def _published_snapshot_age(self) -> Optional[float]:
+        """共享目录中当前快照的年龄（没有快照返回None）"""
+        try:
+            target = os.readlink(os.path.join(self.base_dir, CURRENT_LINK))
+        except OSError:
+            return None
+        meta = _read_json(os.path.join(self.base_dir, target, META_FILE))
+        return time.time() - meta['created_at'] if meta else None
+
+    def refresh_once(self) -> bool:
+        """
+        刷新一次并写入共享目录
+
+        Returns:
+            bool: 是否成功
+        """
+        self._write_status(refreshing=True, progress=None)
+        try:
+            snapshot = self.store.refresh(on_progress=lambda progress: self._write_status(progress=progress))
+            write_snapshot_files(snapshot, self.base_dir)
+            self._write_status(refreshing=False, progress=None, last_error='', last_finished_at=time.time(),
+                               refresh_count=self._status['refresh_count'] + 1)
+            return True
+        except Exception as e:
+            api_logger.log_error(e, "刷新共享快照失败")
+            self._write_status(refreshing=False, progress=None, last_error=str(e), last_finished_at=time.time(),
+                               failure_count=self._status['failure_count'] + 1)
+            return False
+
+    def run(self):
+        """刷新循环：快照缺失、过期或有刷新请求时刷新"""
+        os.makedirs(self.base_dir, exist_ok=True)
+        self._write_status()
+        api_logger.log_info(f"共享快照刷新进程已启动: {self.base_dir}，间隔{self.store.refresh_interval}秒")
+        while not self._stop_event.is_set():
+            requested_at = _read_json(os.path.join(self.base_dir, REQUEST_FILE)).get('requested_at', 0)
+            age = self._published_snapshot_age()
+            due = (age is None or age >= self.store.refresh_interval) and time.time() >= self._retry_at
+            if due or requested_at > self._handled_at:
+                if not self.refresh_once():
+                    self._retry_at = time.time() + self.retry_delay
+                # 刷新期间到达的请求由本次结果满足
+                self._handled_at = time.time()
+            self._stop_event.wait(self.poll_interval)
@@ -179,6 +179,144 @@ class StorageConfig:
         for directory in directories:
             os.makedirs(directory, exist_ok=True)
 
+# 导出任务配置
+class ExportConfig:
+    """后台导出任务配置类"""
+    
+    # 导出进程池大小（独立进程渲染Excel）
+    MAX_WORKERS = int(os.getenv('EXPORT_MAX_WORKERS', '2'))
+    
+    # 最多允许排队/运行中的导出任务数
+    MAX_PENDING_JOBS = int(os.getenv('EXPORT_MAX_PENDING_JOBS', '10'))
+    
+    # 导出任务状态文件目录（供机器人和命令行跨进程查询）
+    JOB_DIR = os.path.join(StorageConfig.DATA_DIR, 'export_jobs')
+    
+    # 已结束任务的保留天数和最多保留数量（超出的任务状态文件及其导出文件被清理）
+    JOB_RETENTION_DAYS = float(os.getenv('EXPORT_JOB_RETENTION_DAYS', '7'))
+    MAX_FINISHED_JOBS = int(os.getenv('EXPORT_MAX_FINISHED_JOBS', '100'))
+    
+    # 增量导出：滚动维护的当前工作簿及其行索引
+    INCREMENTAL_WORKBOOK = os.path.join(StorageConfig.OUTPUT_DIR, 'restock_current.xlsx')
+    INCREMENTAL_INDEX_FILE = os.path.join(StorageConfig.DATA_DIR, 'restock_current_index.json')
+    
+    # 变更行占比超过该阈值时回退为整表重写
+    INCREMENTAL_FULL_REWRITE_RATIO = float(os.getenv('EXPORT_FULL_REWRITE_RATIO', '0.3'))
+    
+    # 保留的变更记录工作表数量
+    INCREMENTAL_MAX_CHANGE_SHEETS = int(os.getenv('EXPORT_MAX_CHANGE_SHEETS', '10'))
+
+# 补货数据快照配置
+class SnapshotConfig:
+    """补货数据快照配置类（机器人从内存快照应答）"""
+    
+    # 后台刷新间隔（秒）
+    REFRESH_INTERVAL = int(os.getenv('SNAPSHOT_REFRESH_INTERVAL', '1800'))
+    
+    # 拉取全量数据的并发线程数（范围1-5）
+    MAX_WORKERS = int(os.getenv('SNAPSHOT_MAX_WORKERS', '3'))
+    
+    # 快照的查询维度和补货建议模式
+    DATA_TYPE = int(os.getenv('SNAPSHOT_DATA_TYPE', '1'))
+    MODE = int(os.getenv('SNAPSHOT_MODE', '0'))
+    
+    # 首次加载时命令等待快照的最长时间（秒）
+    FIRST_LOAD_TIMEOUT = int(os.getenv('SNAPSHOT_FIRST_LOAD_TIMEOUT', '300'))
+    
+    # 尚无快照时拉取失败的重试间隔（秒，每次失败翻倍，最长为刷新间隔）
+    FIRST_LOAD_RETRY_INTERVAL = int(os.getenv('SNAPSHOT_FIRST_LOAD_RETRY_INTERVAL', '30'))
+    
+    # 单品查询展示的MSKU详细信息缓存：最多条数和有效期（秒，默认与快照刷新间隔相同）
+    MSKU_DETAIL_CACHE_SIZE = int(os.getenv('MSKU_DETAIL_CACHE_SIZE', '5000'))
+    MSKU_DETAIL_CACHE_TTL = int(os.getenv('MSKU_DETAIL_CACHE_TTL', str(REFRESH_INTERVAL)))
+    
+    # 多进程服务模式：快照共享目录（刷新进程写入，各工作进程以内存映射只读），
+    # 工作进程数（默认按CPU核数，最多4个；多于CPU核数不会提高吞吐量）
+    SHARED_DIR = os.getenv('SNAPSHOT_SHARED_DIR', os.path.join(StorageConfig.DATA_DIR, 'snapshot'))
+    SERVER_WORKERS = int(os.getenv('FEISHU_SERVER_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+# 飞书表格同步配置
+class FeishuSyncConfig:
+    """飞书电子表格/多维表格同步配置类"""
+    
+    # 同步目标：sheet（电子表格）或 bitable（多维表格）
+    TARGET = os.getenv('FEISHU_SYNC_TARGET', 'sheet')
+    
+    # 电子表格配置
+    SHEET_TOKEN = os.getenv('FEISHU_SHEET_TOKEN', '')
+    SHEET_ID = os.getenv('FEISHU_SHEET_ID', '')
+    
+    # 多维表格配置
+    BITABLE_APP_TOKEN = os.getenv('FEISHU_BITABLE_APP_TOKEN', '')
+    BITABLE_TABLE_ID = os.getenv('FEISHU_BITABLE_TABLE_ID', '')
+    
+    # 单次请求的最大行数（电子表格单次写入上限5000行，多维表格批量接口上限500条）
+    SHEET_BATCH_ROWS = int(os.getenv('FEISHU_SHEET_BATCH_ROWS', '5000'))
+    BITABLE_BATCH_RECORDS = int(os.getenv('FEISHU_BITABLE_BATCH_RECORDS', '500'))
+    
+    # 并发批次数和每秒请求数上限
+    CONCURRENCY = int(os.getenv('FEISHU_SYNC_CONCURRENCY', '3'))
+    QPS = float(os.getenv('FEISHU_SYNC_QPS', '5'))
+    
+    # 同步状态文件（行键 -> 行号/记录ID 和行摘要）
+    STATE_DIR = os.path.join(StorageConfig.DATA_DIR, 'feishu_sync')
+
+# 飞书机器人服务配置
+class FeishuBotConfig:
+    """飞书机器人Webhook服务配置类"""
+    
+    # 处理消息事件的工作线程数
+    WORKER_COUNT = int(os.getenv('FEISHU_WORKER_COUNT', '4'))
+    
+    # 等待处理的事件队列上限（超过后直接回复繁忙提示）
+    EVENT_QUEUE_SIZE = int(os.getenv('FEISHU_EVENT_QUEUE_SIZE', '100'))
+    
+    # 繁忙提示：同一群聊两次提示的最小间隔（秒），等待发送的提示上限（超出时不再提示）
+    BUSY_REPLY_WINDOW = float(os.getenv('FEISHU_BUSY_REPLY_WINDOW', '60'))
+    BUSY_REPLY_QUEUE_SIZE = int(os.getenv('FEISHU_BUSY_REPLY_QUEUE_SIZE', '20'))
+    
+    # 事件去重：内存中保留的事件数和有效期（秒），飞书重推通常在数小时内
+    DEDUP_MAX_ENTRIES = int(os.getenv('FEISHU_DEDUP_MAX_ENTRIES', '10000'))
+    DEDUP_TTL = int(os.getenv('FEISHU_DEDUP_TTL', str(6 * 3600)))
+    
+    # 去重记录的SQLite文件（多进程部署时共享，留空则只在内存中去重）
+    DEDUP_DB_PATH = os.getenv('FEISHU_DEDUP_DB', '')
+    
+    # 重型命令（刷新/导出等）准入控制：最大并发数（应小于工作线程数）和等待队列上限
+    HEAVY_MAX_CONCURRENT = int(os.getenv('FEISHU_HEAVY_MAX_CONCURRENT', '2'))
+    HEAVY_MAX_PENDING = int(os.getenv('FEISHU_HEAVY_MAX_PENDING', '20'))
+
+    # 重型命令限流：每个用户/群聊的突发次数和恢复一次额度的间隔（秒）
+    USER_BURST = int(os.getenv('FEISHU_USER_BURST', '3'))
+    USER_REFILL_INTERVAL = float(os.getenv('FEISHU_USER_REFILL_INTERVAL', '30'))
+    CHAT_BURST = int(os.getenv('FEISHU_CHAT_BURST', '6'))
+    CHAT_REFILL_INTERVAL = float(os.getenv('FEISHU_CHAT_REFILL_INTERVAL', '15'))
+
+    # 卡片翻页：每页行数，查询结果缓存的有效期（秒）和最大数量
+    CARD_PAGE_SIZE = int(os.getenv('FEISHU_CARD_PAGE_SIZE', '10'))
+    QUERY_CACHE_TTL = int(os.getenv('FEISHU_QUERY_CACHE_TTL', '1800'))
+    QUERY_CACHE_MAX_ENTRIES = int(os.getenv('FEISHU_QUERY_CACHE_MAX_ENTRIES', '200'))
+    
+    # 渐进式回复：进度卡片两次更新的最小间隔（秒）
+    PROGRESS_UPDATE_INTERVAL = float(os.getenv('FEISHU_PROGRESS_UPDATE_INTERVAL', '1.0'))
+
+    # 出站请求：超时（秒）、连接池大小、等待空闲连接的最长时间（秒）、429/5xx重试次数和退避基数（秒）
+    HTTP_TIMEOUT = float(os.getenv('FEISHU_HTTP_TIMEOUT', '10'))
+    HTTP_POOL_SIZE = int(os.getenv('FEISHU_HTTP_POOL_SIZE', '8'))
+    HTTP_POOL_TIMEOUT = float(os.getenv('FEISHU_HTTP_POOL_TIMEOUT', '5'))
+    HTTP_MAX_RETRIES = int(os.getenv('FEISHU_HTTP_MAX_RETRIES', '3'))
+    HTTP_RETRY_BACKOFF = float(os.getenv('FEISHU_HTTP_RETRY_BACKOFF', '0.5'))
+    
+    # 租户令牌剩余有效期低于该值时在后台提前续期（秒）
+    TOKEN_RENEW_AHEAD = int(os.getenv('FEISHU_TOKEN_RENEW_AHEAD', '600'))
+    
+    # 发送失败消息的待发队列文件、最大条数和保留时间（秒）
+    OUTBOX_FILE = os.path.join(StorageConfig.DATA_DIR, 'feishu_outbox.json')
+    OUTBOX_MAX_SIZE = int(os.getenv('FEISHU_OUTBOX_MAX_SIZE', '500'))
+    OUTBOX_MAX_AGE = int(os.getenv('FEISHU_OUTBOX_MAX_AGE', '86400'))
+    # 待发队列非空时后台补发的间隔（秒），补发仍失败时逐次加倍，最多为8倍
+    OUTBOX_RETRY_INTERVAL = float(os.getenv('FEISHU_OUTBOX_RETRY_INTERVAL', '30'))
+
 # 安全配置
 class SecurityConfig:
     """安全配置类"""
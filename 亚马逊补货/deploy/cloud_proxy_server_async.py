@@ -0,0 +1,1633 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+⚡ 异步云代理服务器
+在同一个asyncio事件循环上提供HTTP接口、WebSocket反向隧道和领星API转发，
+隧道请求与响应通过原生Future关联，取代 cloud_proxy_server_ws.py 的
+Flask线程 + 独立WebSocket线程 + 100ms轮询方案。
+隧道消息格式与 websocket_reverse_client.py 兼容，客户端声明支持时升级为
+多路复用、可压缩的二进制帧协议（frames/1）。
+"""
+
+import os
+import json
+import math
+import time
+import uuid
+import zlib
+import bisect
+import struct
+import hashlib
+import itertools
+import asyncio
+import logging
+import argparse
+import threading
+import traceback
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from aiohttp import web, ClientSession, ClientTimeout, TCPConnector, WSMsgType, ClientError
+from multidict import CIMultiDict
+
+logger = logging.getLogger(__name__)
+
+# 领星API地址
+LINGXING_BASE_URL = "https://openapi.lingxing.com"
+
+# 各代理按单文件上传到云服务器，以下常量与Flask版代理相同，转发辅助函数为aiohttp版本（test/test_proxy_copies.py 检查）
+# 逐跳头部：只对单个连接有效，代理不应转发（RFC 7230 6.1节）
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailer', 'trailers', 'transfer-encoding', 'upgrade'
+}
+
+# 流式转发时每次读取的字节数
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# 上游返回这些状态码时重试（与同步版本的重试策略一致）
+UPSTREAM_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# 这些状态码表示本地客户端无法连到本地服务器，可改派给其他客户端
+RETRYABLE_STATUS = {502, 503, 504}
+
+def strip_hop_by_hop(headers, extra=()) -> CIMultiDict:
+    """
+    去掉逐跳头部（包括Connection头中列出的头部）
+
+    Args:
+        headers: 原始头部
+        extra: 额外需要去掉的头部（小写）
+
+    Returns:
+        CIMultiDict: 过滤后的头部
+    """
+    listed = {token.strip().lower() for token in headers.get('Connection', '').split(',') if token.strip()}
+    dropped = HOP_BY_HOP_HEADERS | listed | set(extra)
+    return CIMultiDict((name, value) for name, value in headers.items() if name.lower() not in dropped)
+
+# ------------------------------------------------------------------
+# 二进制帧隧道协议（frames/1）
+# 帧 = 10字节头部（类型、标志、流ID、元数据长度）+ 载荷（元数据 + 原样的body字节），
+# 载荷较大时整帧压缩。多个请求以流ID区分，在同一连接上交错传输；
+# 发送方按每个流的窗口发送，接收方消费数据后用WINDOW帧归还额度。
+# 客户端（websocket_reverse_client.py）中保留一份相同的实现，两边需同步修改。
+# ------------------------------------------------------------------
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+TUNNEL_PROTOCOL = 'frames/1'
+
+FRAME_HEADER = struct.Struct('!BBII')
+FRAME_REQUEST, FRAME_RESPONSE, FRAME_DATA, FRAME_WINDOW, FRAME_RESET = 1, 2, 3, 4, 5
+FLAG_END_STREAM = 0x01
+FLAG_COMPRESSED = 0x02
+
+FRAME_MAX_BODY = 32 * 1024   # 单帧最大body字节数，大响应拆帧后与其他流交错
+INITIAL_WINDOW = 256 * 1024  # 每个流的初始发送窗口（字节）
+COMPRESS_MIN_SIZE = 512      # 小于该大小的载荷不压缩
+
+def available_codecs() -> List[str]:
+    """本端支持的帧压缩算法，按优先级排序"""
+    return ['zstd', 'zlib'] if zstandard else ['zlib']
+
+def pack_fields(fields) -> bytes:
+    """把字符串列表编码为（2字节长度 + UTF-8字节）序列"""
+    parts = []
+    for field in fields:
+        data = str(field).encode('utf-8')
+        parts.append(struct.pack('!H', len(data)))
+        parts.append(data)
+    return b''.join(parts)
+
+def unpack_fields(data: bytes) -> List[str]:
+    """pack_fields的逆操作"""
+    fields, offset = [], 0
+    while offset < len(data):
+        (length,) = struct.unpack_from('!H', data, offset)
+        offset += 2
+        fields.append(data[offset:offset + length].decode('utf-8'))
+        offset += length
+    return fields
+
+class Frame:
+    """一个解码后的隧道帧"""
+
+    __slots__ = ('type', 'flags', 'stream_id', 'meta', 'body')
+
+    def __init__(self, frame_type: int, flags: int, stream_id: int, meta: bytes, body: bytes):
+        self.type = frame_type
+        self.flags = flags
+        self.stream_id = stream_id
+        self.meta = meta
+        self.body = body
+
+    @property
+    def end(self) -> bool:
+        return bool(self.flags & FLAG_END_STREAM)
+
+class FrameChannel:
+    """
+    一条WebSocket连接上的多路复用帧通道
+    负责帧的编解码、压缩和按流的发送窗口，收到的WINDOW帧在通道内部处理
+    """
+
+    def __init__(self, send, codec: str = 'zlib'):
+        """
+        Args:
+            send: 发送二进制消息的协程函数
+            codec: 压缩算法（zstd或zlib）
+        """
+        self._send = send
+        self.codec = codec
+        if codec == 'zstd':
+            self._compress = zstandard.ZstdCompressor(level=3).compress
+            self._decompress = zstandard.ZstdDecompressor().decompress
+        else:
+            self._compress = zlib.compress
+            self._decompress = zlib.decompress
+        self.windows: Dict[int, int] = {}  # {stream_id: 剩余发送额度}
+        self.cancelled = set()             # 对端已重置的流
+        self.closed = False
+        self._window_changed = asyncio.Condition()
+        self.stats = {
+            'frames_sent': 0,
+            'frames_received': 0,
+            'payload_bytes_sent': 0,
+            'wire_bytes_sent': 0,
+            'wire_bytes_received': 0
+        }
+
+    def encode(self, frame_type: int, stream_id: int, flags: int = 0, meta: bytes = b'', body: bytes = b'') -> bytes:
+        """编码一个帧，载荷达到阈值且压缩有收益时整体压缩"""
+        payload = meta + body
+        self.stats['payload_bytes_sent'] += len(payload)
+        if len(payload) >= COMPRESS_MIN_SIZE:
+            compressed = self._compress(payload)
+            if len(compressed) < len(payload):
+                payload = compressed
+                flags |= FLAG_COMPRESSED
+        return FRAME_HEADER.pack(frame_type, flags, stream_id, len(meta)) + payload
+
+    def decode(self, data: bytes) -> Frame:
+        """解码一个帧"""
+        frame_type, flags, stream_id, meta_length = FRAME_HEADER.unpack_from(data)
+        payload = data[FRAME_HEADER.size:]
+        if flags & FLAG_COMPRESSED:
+            payload = self._decompress(payload)
+        return Frame(frame_type, flags, stream_id, payload[:meta_length], payload[meta_length:])
+
+    async def _write(self, data: bytes):
+        self.stats['frames_sent'] += 1
+        self.stats['wire_bytes_sent'] += len(data)
+        await self._send(data)
+
+    async def _reserve(self, stream_id: int, size: int):
+        """等待流的发送窗口足够发送size字节"""
+        async with self._window_changed:
+            self.windows.setdefault(stream_id, INITIAL_WINDOW)
+            await self._window_changed.wait_for(
+                lambda: self.closed or stream_id in self.cancelled or self.windows[stream_id] >= size
+            )
+            if self.closed or stream_id in self.cancelled:
+                raise ConnectionResetError('隧道流已中断')
+            self.windows[stream_id] -= size
+
+    async def send_stream(self, frame_type: int, stream_id: int, meta: bytes, body: bytes):
+        """
+        发送REQUEST/RESPONSE帧；body超过单帧大小时拆成后续DATA帧，每帧发送前等待窗口
+
+        Raises:
+            ConnectionResetError: 连接已关闭或对端重置了该流
+        """
+        view = memoryview(body)
+        offset = 0
+        try:
+            while True:
+                chunk = bytes(view[offset:offset + FRAME_MAX_BODY])
+                await self._reserve(stream_id, len(chunk))
+                offset += len(chunk)
+                last = offset >= len(body)
+                await self._write(self.encode(frame_type, stream_id, FLAG_END_STREAM if last else 0, meta, chunk))
+                if last:
+                    break
+                frame_type, meta = FRAME_DATA, b''
+        finally:
+            self.windows.pop(stream_id, None)
+            self.cancelled.discard(stream_id)
+
+    async def grant(self, stream_id: int, size: int):
+        """归还对端发送窗口（已消费size字节）"""
+        if size:
+            await self._write(self.encode(FRAME_WINDOW, stream_id, body=struct.pack('!I', size)))
+
+    async def reset(self, stream_id: int):
+        """通知对端放弃该流"""
+        await self._write(self.encode(FRAME_RESET, stream_id))
+
+    async def receive(self, data: bytes) -> Optional[Frame]:
+        """
+        处理收到的二进制消息
+
+        Returns:
+            Optional[Frame]: 需要上层处理的帧，WINDOW帧返回None
+        """
+        self.stats['frames_received'] += 1
+        self.stats['wire_bytes_received'] += len(data)
+        frame = self.decode(data)
+        if frame.type in (FRAME_WINDOW, FRAME_RESET):
+            async with self._window_changed:
+                if frame.type == FRAME_WINDOW:
+                    if frame.stream_id in self.windows:
+                        self.windows[frame.stream_id] += struct.unpack('!I', frame.body)[0]
+                elif frame.stream_id in self.windows:
+                    self.cancelled.add(frame.stream_id)
+                self._window_changed.notify_all()
+            if frame.type == FRAME_WINDOW:
+                return None
+        return frame
+
+    async def close(self):
+        """连接断开，唤醒所有等待窗口的发送方"""
+        async with self._window_changed:
+            self.closed = True
+            self._window_changed.notify_all()
+
+class TunnelClient:
+    """一条WebSocket反向隧道连接"""
+
+    __slots__ = ('client_id', 'ws', 'info', 'requests', 'connected_at', 'last_heartbeat', 'completed',
+                 'channel', 'streams', 'stream_ids')
+
+    def __init__(self, client_id: str, ws: web.WebSocketResponse):
+        self.client_id = client_id
+        self.ws = ws
+        self.info = {}
+        self.requests = set()  # 在途请求ID
+        self.connected_at = time.time()
+        self.last_heartbeat = time.time()
+        self.completed = 0
+        self.channel: Optional[FrameChannel] = None  # 协商为帧协议后才创建
+        self.streams: Dict[int, asyncio.Queue] = {}  # {stream_id: 收到的帧}
+        self.stream_ids = itertools.count(1)
+
+class TunnelStream:
+    """帧协议下的一个隧道请求流，收到RESPONSE帧后交给调用方继续读取body"""
+
+    __slots__ = ('client', 'request_id', 'stream_id', 'queue', 'status', 'headers', 'first')
+
+    def __init__(self, client: TunnelClient, request_id: str):
+        self.client = client
+        self.request_id = request_id
+        self.stream_id = next(client.stream_ids)
+        self.queue = asyncio.Queue()
+        self.status = None
+        self.headers = None
+        self.first = None
+        client.streams[self.stream_id] = self.queue
+        client.requests.add(request_id)
+
+    async def next_frame(self, timeout: float) -> Frame:
+        """等待该流的下一帧，连接断开或对端重置时抛出ConnectionResetError"""
+        frame = await asyncio.wait_for(self.queue.get(), timeout)
+        if frame is None or frame.type == FRAME_RESET:
+            raise ConnectionResetError('隧道流已中断')
+        return frame
+
+    async def cancel(self):
+        """放弃该流并通知客户端"""
+        self.close()
+        try:
+            await self.client.channel.reset(self.stream_id)
+        except (ConnectionResetError, ClientError):
+            pass
+
+    def close(self):
+        self.client.streams.pop(self.stream_id, None)
+        self.client.requests.discard(self.request_id)
+
+# 边缘缓存和配额调度：辅助函数在异步版和线程版代理中逐字相同，EdgeCache/QuotaLane/QuotaGovernor
+# 分别按asyncio和线程实现、接口一致（test/test_proxy_copies.py 检查）
+# 每次请求都会变化的签名参数，不参与缓存键（access_token保留，不同令牌不共享缓存）
+VOLATILE_PARAMS = {'timestamp', 'sign'}
+
+# 领星业务成功码，只有成功的响应才会被缓存
+SUCCESS_CODES = {0, '0', 200, '200'}
+
+def parse_cache_ttls(spec: str) -> Dict[str, float]:
+    """
+    解析缓存TTL配置，格式为"端点=秒数"，逗号分隔；端点以*结尾表示前缀匹配
+    例如: /erp/sc/data/seller/lists=600,/erp/sc/routing/restocking/*=60
+
+    Args:
+        spec: 配置字符串
+
+    Returns:
+        Dict[str, float]: {端点: TTL秒数}
+    """
+    ttls = {}
+    for item in spec.split(','):
+        endpoint, _, seconds = item.strip().partition('=')
+        if endpoint and seconds:
+            ttls['/' + endpoint.strip().lstrip('/')] = float(seconds)
+    return ttls
+
+def cache_key(method: str, endpoint: str, query, body: bytes, accept_encoding: str) -> str:
+    """
+    计算缓存键：方法 + 端点 + 去掉签名参数的查询参数 + 规范化的业务参数
+
+    Args:
+        method: 请求方法
+        endpoint: 端点路径
+        query: 查询参数（支持重复键的 (名称, 值) 序列）
+        body: 原始请求体
+        accept_encoding: 客户端接受的编码（压缩与否的响应不能混用）
+
+    Returns:
+        str: 缓存键
+    """
+    params = sorted((name, value) for name, value in query if name not in VOLATILE_PARAMS)
+    try:
+        canonical_body = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':')).encode() if body else b''
+    except ValueError:
+        canonical_body = body
+    digest = hashlib.sha256()
+    for part in (method.upper(), '/' + endpoint.lstrip('/'), json.dumps(params), accept_encoding or ''):
+        digest.update(part.encode('utf-8') + b'\0')
+    digest.update(canonical_body)
+    return digest.hexdigest()
+
+def business_code(headers, body: bytes) -> Optional[str]:
+    """解析领星响应的业务码（按Content-Encoding先解压），无法解析时返回None"""
+    try:
+        encoding = next((value for name, value in headers if name.lower() == 'content-encoding'), '').lower()
+        if encoding == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            body = zlib.decompress(body)
+        elif encoding not in ('', 'identity'):
+            return None
+        data = json.loads(body)
+    except (ValueError, zlib.error):
+        return None
+    if not isinstance(data, dict) or data.get('code') is None:
+        return None
+    return str(data['code'])
+
+def is_cacheable(status: int, headers, body: bytes) -> bool:
+    """只缓存HTTP 200且领星业务码表示成功的响应（限流、令牌失效等错误不缓存）"""
+    return status == 200 and business_code(headers, body) in SUCCESS_CODES
+
+class CachedResponse:
+    """缓存的上游响应（原始字节，压缩内容不解压）"""
+
+    __slots__ = ('status', 'headers', 'body', 'stored_at', 'expires_at')
+
+    def __init__(self, status: int, headers: list, body: bytes, ttl: float = 0):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.stored_at = time.time()
+        self.expires_at = self.stored_at + ttl
+
+class EdgeCache:
+    """
+    领星幂等查询的边缘缓存（按端点开启）
+    相同查询在TTL内直接返回缓存；同一键的并发请求只向上游发一次，其余等待其结果
+    """
+
+    def __init__(self, ttls: Dict[str, float], max_entries: int = 256, max_body: int = 4 * 1024 * 1024):
+        """
+        Args:
+            ttls: {端点: TTL秒数}，端点以*结尾表示前缀匹配
+            max_entries: 最多缓存的响应数（超出时淘汰最久未用的）
+            max_body: 单个响应的最大缓存字节数
+        """
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.max_body = max_body
+        self._entries = OrderedDict()  # {key: CachedResponse}，按最近使用排序
+        self._inflight: Dict[str, asyncio.Future] = {}  # 正在向上游请求的键
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'stores': 0, 'uncacheable': 0, 'evictions': 0}
+
+    @classmethod
+    def from_env(cls) -> 'EdgeCache':
+        """从环境变量 PROXY_CACHE_TTLS / PROXY_CACHE_MAX_ENTRIES / PROXY_CACHE_MAX_BODY 创建（未配置TTL时不缓存）"""
+        return cls(
+            parse_cache_ttls(os.getenv('PROXY_CACHE_TTLS', '')),
+            max_entries=int(os.getenv('PROXY_CACHE_MAX_ENTRIES', '256')),
+            max_body=int(os.getenv('PROXY_CACHE_MAX_BODY', str(4 * 1024 * 1024)))
+        )
+
+    def ttl_for(self, endpoint: str) -> Optional[float]:
+        """端点的缓存TTL，未开启缓存时返回None"""
+        endpoint = '/' + endpoint.lstrip('/')
+        ttl = self.ttls.get(endpoint)
+        if ttl is None:
+            matches = [pattern for pattern in self.ttls if pattern.endswith('*') and endpoint.startswith(pattern[:-1])]
+            if matches:
+                ttl = self.ttls[max(matches, key=len)]
+        return ttl if ttl and ttl > 0 else None
+
+    async def fetch(self, key: str, ttl: float, loader):
+        """
+        读取缓存，未命中时调用loader向上游请求；同一键同时只有一个loader在执行
+
+        Args:
+            key: 缓存键
+            ttl: 缓存时间（秒）
+            loader: 返回CachedResponse的协程函数
+
+        Returns:
+            tuple: (CachedResponse, 'HIT'/'MISS'/'COALESCED')
+
+        Raises:
+            Exception: loader的异常（等待同一请求的调用方收到同一异常）
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > time.time():
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry, 'HIT'
+
+        flight = self._inflight.get(key)
+        if flight is not None:
+            # 首个请求失败时等待者收到同一异常；首个请求被取消时重新选出一个请求向上游请求
+            self.stats['coalesced'] += 1
+            entry = await asyncio.shield(flight)
+            if entry is None:
+                return await self.fetch(key, ttl, loader)
+            return entry, 'COALESCED'
+
+        self.stats['misses'] += 1
+        flight = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            entry = await loader()
+        except asyncio.CancelledError:
+            flight.set_result(None)
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            flight.exception()  # 没有等待者时不报告未读取的异常
+            raise
+        finally:
+            del self._inflight[key]
+
+        if len(entry.body) > self.max_body or not is_cacheable(entry.status, entry.headers, entry.body):
+            self.stats['uncacheable'] += 1
+        else:
+            entry.expires_at = entry.stored_at + ttl
+            self._entries[key] = entry
+            self.stats['stores'] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+        flight.set_result(entry)
+        return entry, 'MISS'
+
+    def get_stats(self) -> Dict[str, Any]:
+        """缓存统计（命中率按命中+合并计算）"""
+        lookups = self.stats['hits'] + self.stats['misses'] + self.stats['coalesced']
+        return {
+            **self.stats,
+            'enabled': bool(self.ttls),
+            'entries': len(self._entries),
+            'inflight': len(self._inflight),
+            'hit_rate': round((self.stats['hits'] + self.stats['coalesced']) / lookups * 100, 1) if lookups else 0.0,
+            'ttls': self.ttls
+        }
+
+# 领星限流业务码（接口请求太频繁）
+THROTTLE_CODE = '3001008'
+
+# 不超过该大小的上游响应在转发前读取检查业务码（限流响应很小，大响应照常流式转发）
+THROTTLE_PROBE_SIZE = 4096
+
+def parse_quota_rates(spec: str) -> Dict[str, tuple]:
+    """
+    解析配额配置，格式为"端点=每秒请求数[/突发量]"，逗号分隔；端点以*结尾表示前缀匹配
+    例如: /erp/sc/routing/restocking/*=1/2,/erp/sc/data/seller/lists=5
+
+    Args:
+        spec: 配置字符串
+
+    Returns:
+        Dict[str, tuple]: {端点: (每秒请求数, 突发量)}
+    """
+    rates = {}
+    for item in spec.split(','):
+        endpoint, _, value = item.strip().partition('=')
+        if endpoint and value:
+            rate, _, burst = value.partition('/')
+            rates['/' + endpoint.strip().lstrip('/')] = (float(rate), float(burst) if burst else 1.0)
+    return rates
+
+def retry_after_seconds(seconds: float) -> int:
+    """Retry-After头只接受整数秒，向上取整且至少为1"""
+    return max(1, math.ceil(seconds))
+
+class QuotaExceeded(Exception):
+    """排队时间超过上限，客户端应按Retry-After稍后重试"""
+
+    def __init__(self, endpoint: str, retry_after: int):
+        super().__init__(f"{endpoint} 配额已用尽，{retry_after}秒后重试")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+class QuotaLane:
+    """单个端点（或端点前缀）的令牌桶和按客户端轮转的等待队列"""
+
+    def __init__(self, pattern: str, rate: float, capacity: float):
+        self.pattern = pattern
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0        # 上游返回限流后暂停放行到该时间
+        self.queues = OrderedDict()    # {客户端: deque[asyncio.Future]}，按轮转顺序排列
+        self.waiting = 0
+        self.timer: Optional[asyncio.TimerHandle] = None  # 下一个令牌可用时放行排队请求
+        self.stats = {'granted': 0, 'queued': 0, 'rejected': 0, 'throttled': 0,
+                      'wait_total': 0.0, 'wait_max': 0.0}
+
+    def refill(self, now: float):
+        """按流逝时间补充令牌（暂停期间不补充）"""
+        elapsed = now - max(self.updated_at, self.paused_until)
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = max(self.updated_at, now)
+
+    def next_token_in(self, now: float) -> float:
+        """距离下一个令牌可用的秒数"""
+        return max(self.paused_until - now, 0.0) + max(1 - self.tokens, 0.0) / self.rate
+
+    def estimate(self, client: str, now: float) -> float:
+        """
+        估算该客户端新请求的等待时间：按轮转顺序，客户端已有k个请求在排队时，
+        新请求在第k+1轮放行，每个其他客户端最多排在它前面k+1个
+        """
+        rounds = len(self.queues.get(client, ())) + 1
+        ahead = sum(min(len(queue), rounds) for name, queue in self.queues.items() if name != client)
+        ahead += rounds - 1
+        return max(self.paused_until - now, 0.0) + max(ahead + 1 - self.tokens, 0.0) / self.rate
+
+    def enqueue(self, client: str, ticket: asyncio.Future):
+        self.queues.setdefault(client, deque()).append(ticket)
+        self.waiting += 1
+        self.stats['queued'] += 1
+
+    def cancel(self, client: str, ticket: asyncio.Future):
+        queue = self.queues.get(client)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            self.waiting -= 1
+            if not queue:
+                del self.queues[client]
+
+    def grant(self, now: float):
+        """用可用令牌放行排队的请求：每次取轮转顺序中第一个客户端的最早请求，放行后该客户端排到末尾"""
+        self.refill(now)
+        while self.queues and self.tokens >= 1:
+            client, queue = next(iter(self.queues.items()))
+            ticket = queue.popleft()
+            if queue:
+                self.queues.move_to_end(client)
+            else:
+                del self.queues[client]
+            self.waiting -= 1
+            if not ticket.done():  # 已超时取消的请求不占用令牌
+                ticket.set_result(None)
+                self.tokens -= 1
+
+class QuotaGovernor:
+    """
+    领星接口全局配额调度（按端点开启）
+    所有本地进程共用同一个app key，由代理统一按端点限速：各客户端的请求轮流放行，
+    预计排队超过上限时直接返回Retry-After，而不是转发到上游触发限流
+    """
+
+    def __init__(self, rates: Dict[str, tuple], max_wait: float = 10.0, penalty: float = 5.0):
+        """
+        Args:
+            rates: {端点: (每秒请求数, 突发量)}，端点以*结尾表示前缀匹配
+            max_wait: 请求最长排队时间（秒），预计超过时直接拒绝
+            penalty: 上游仍返回限流时该端点暂停放行的时间（秒）
+        """
+        self.lanes = {pattern: QuotaLane(pattern, rate, burst) for pattern, (rate, burst) in rates.items() if rate > 0}
+        self.max_wait = max_wait
+        self.penalty = penalty
+        self._clients = {}  # {客户端: {'granted', 'rejected', 'wait_total'}}
+
+    @classmethod
+    def from_env(cls) -> 'QuotaGovernor':
+        """从环境变量 PROXY_QUOTA_RATES / PROXY_QUOTA_MAX_WAIT / PROXY_QUOTA_PENALTY 创建（未配置时不限速）"""
+        return cls(
+            parse_quota_rates(os.getenv('PROXY_QUOTA_RATES', '')),
+            max_wait=float(os.getenv('PROXY_QUOTA_MAX_WAIT', '10')),
+            penalty=float(os.getenv('PROXY_QUOTA_PENALTY', '5'))
+        )
+
+    def lane_for(self, endpoint: str) -> Optional[QuotaLane]:
+        """端点对应的配额，未限速时返回None"""
+        endpoint = '/' + endpoint.lstrip('/')
+        lane = self.lanes.get(endpoint)
+        if lane is None:
+            matches = [pattern for pattern in self.lanes if pattern.endswith('*') and endpoint.startswith(pattern[:-1])]
+            if matches:
+                lane = self.lanes[max(matches, key=len)]
+        return lane
+
+    async def acquire(self, endpoint: str, client: str) -> float:
+        """
+        获取一次上游调用的配额，必要时排队等待
+
+        Args:
+            endpoint: API端点路径
+            client: 客户端标识（同一客户端的请求按先后顺序放行）
+
+        Returns:
+            float: 排队等待的秒数
+
+        Raises:
+            QuotaExceeded: 预计或实际排队时间超过 max_wait
+        """
+        lane = self.lane_for(endpoint)
+        if lane is None:
+            return 0.0
+
+        start = time.monotonic()
+        lane.refill(start)
+        if not lane.queues and lane.tokens >= 1:
+            lane.tokens -= 1
+            self._record(lane, client, 0.0)
+            return 0.0
+        wait = lane.estimate(client, start)
+        if wait > self.max_wait:
+            self._reject(lane, client)
+            raise QuotaExceeded(endpoint, retry_after_seconds(wait))
+
+        ticket = asyncio.get_running_loop().create_future()
+        lane.enqueue(client, ticket)
+        self._schedule(lane)
+        try:
+            await asyncio.wait_for(ticket, self.max_wait)
+        except asyncio.TimeoutError:
+            lane.cancel(client, ticket)
+            self._reject(lane, client)
+            raise QuotaExceeded(endpoint, retry_after_seconds(lane.estimate(client, time.monotonic()))) from None
+        except asyncio.CancelledError:
+            lane.cancel(client, ticket)
+            raise
+        waited = time.monotonic() - start
+        self._record(lane, client, waited)
+        return waited
+
+    def penalize(self, endpoint: str) -> int:
+        """
+        上游仍返回限流时暂停该端点放行，清空令牌
+
+        Returns:
+            int: 建议客户端等待的秒数
+        """
+        lane = self.lane_for(endpoint)
+        if lane is None:
+            return retry_after_seconds(self.penalty)
+        now = time.monotonic()
+        lane.refill(now)
+        lane.tokens = 0.0
+        lane.paused_until = max(lane.paused_until, now + self.penalty)
+        lane.stats['throttled'] += 1
+        if lane.timer:
+            lane.timer.cancel()
+            lane.timer = None
+        self._schedule(lane)
+        return retry_after_seconds(lane.paused_until - now)
+
+    def _schedule(self, lane: QuotaLane):
+        """在下一个令牌可用时放行排队请求"""
+        if lane.timer is None and lane.queues:
+            delay = lane.next_token_in(time.monotonic())
+            lane.timer = asyncio.get_running_loop().call_later(delay, self._drain, lane)
+
+    def _drain(self, lane: QuotaLane):
+        lane.timer = None
+        lane.grant(time.monotonic())
+        self._schedule(lane)
+
+    def _record(self, lane: QuotaLane, client: str, waited: float):
+        lane.stats['granted'] += 1
+        lane.stats['wait_total'] += waited
+        lane.stats['wait_max'] = max(lane.stats['wait_max'], waited)
+        stats = self._clients.setdefault(client, {'granted': 0, 'rejected': 0, 'wait_total': 0.0})
+        stats['granted'] += 1
+        stats['wait_total'] += waited
+
+    def _reject(self, lane: QuotaLane, client: str):
+        lane.stats['rejected'] += 1
+        self._clients.setdefault(client, {'granted': 0, 'rejected': 0, 'wait_total': 0.0})['rejected'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """配额统计（排队时间单位为毫秒）"""
+        now = time.monotonic()
+        lanes = {}
+        for pattern, lane in self.lanes.items():
+            lane.refill(now)
+            granted = lane.stats['granted']
+            lanes[pattern] = {
+                'rate': lane.rate,
+                'burst': lane.capacity,
+                'tokens': round(lane.tokens, 2),
+                'waiting': lane.waiting,
+                'paused_seconds': round(max(lane.paused_until - now, 0.0), 1),
+                'granted': granted,
+                'queued': lane.stats['queued'],
+                'rejected': lane.stats['rejected'],
+                'throttled': lane.stats['throttled'],
+                'avg_wait_ms': round(lane.stats['wait_total'] / granted * 1000, 1) if granted else 0.0,
+                'max_wait_ms': round(lane.stats['wait_max'] * 1000, 1)
+            }
+        return {
+            'enabled': bool(self.lanes),
+            'max_wait': self.max_wait,
+            'endpoints': lanes,
+            'clients': {
+                client: {
+                    'granted': stats['granted'],
+                    'rejected': stats['rejected'],
+                    'avg_wait_ms': round(stats['wait_total'] / stats['granted'] * 1000, 1) if stats['granted'] else 0.0
+                }
+                for client, stats in self._clients.items()
+            }
+        }
+
+# 指标采集在各代理中保持逐字相同（test/test_proxy_copies.py 检查）
+# 延迟直方图的桶上界（秒），从隧道内的毫秒级往返覆盖到领星慢查询
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# 每个指标最多保留的标签组合数，超出的归入 other（避免客户端ID等标签无限增长）
+METRIC_SERIES_LIMIT = 200
+
+class Metrics:
+    """
+    📈 线程安全的指标收集：计数器、固定分桶的延迟直方图和实时计算的仪表
+    写入按线程分片，每个线程固定写同一个分片，分片锁只在同分片的线程间竞争；读取时汇总所有分片
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, shards: int = 16):
+        self.buckets = tuple(buckets)
+        self._shards = [(threading.Lock(), {}, {}) for _ in range(shards)]  # [(锁, 计数器, 直方图)]
+        self._next_shard = itertools.count()
+        self._local = threading.local()
+        self._series = {}  # {指标名: set(标签组合)}
+        self._series_lock = threading.Lock()
+        self._gauges = {}  # {指标名: (标签名, 回调)}
+
+    def _shard(self):
+        index = getattr(self._local, 'index', None)
+        if index is None:
+            index = self._local.index = next(self._next_shard) % len(self._shards)
+        return self._shards[index]
+
+    def _key(self, name: str, labels: Dict[str, Any]) -> tuple:
+        """指标键 (名称, 标签组合)，标签组合数超过上限时归入 other"""
+        label_items = tuple(sorted((key, str(value)) for key, value in labels.items()))
+        series = self._series.get(name)
+        if series is None or label_items not in series:
+            with self._series_lock:
+                series = self._series.setdefault(name, set())
+                if label_items not in series:
+                    if len(series) >= METRIC_SERIES_LIMIT:
+                        label_items = tuple((key, 'other') for key, _ in label_items)
+                    series.add(label_items)
+        return name, label_items
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """计数器加一（或加指定数量）"""
+        key = self._key(name, labels)
+        lock, counters, _ = self._shard()
+        with lock:
+            counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, **labels):
+        """记录一次耗时（秒）"""
+        key = self._key(name, labels)
+        lock, _, histograms = self._shard()
+        with lock:
+            counts = histograms.get(key)
+            if counts is None:
+                counts = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]  # 各桶 + 溢出桶 + 总和
+            counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            counts[-1] += seconds
+
+    def gauge(self, name: str, callback, label: Optional[str] = None):
+        """
+        登记仪表，读取时调用回调取值
+
+        Args:
+            name: 指标名
+            callback: 返回数值；指定label时返回 {标签值: 数值}
+            label: 标签名
+        """
+        self._gauges[name] = (label, callback)
+
+    def _collect(self) -> tuple:
+        """汇总所有分片，返回 (计数器, 直方图)"""
+        counters, histograms = {}, {}
+        for lock, shard_counters, shard_histograms in self._shards:
+            with lock:
+                for key, value in shard_counters.items():
+                    counters[key] = counters.get(key, 0) + value
+                for key, counts in shard_histograms.items():
+                    total = histograms.setdefault(key, [0] * (len(counts) - 1) + [0.0])
+                    for i, count in enumerate(counts):
+                        total[i] += count
+        return counters, histograms
+
+    def counter_values(self) -> Dict[str, float]:
+        """不带标签的计数器 {名称: 值}"""
+        return {name: value for (name, labels), value in self._collect()[0].items() if not labels}
+
+    def quantile(self, counts: list, q: float) -> float:
+        """按分桶估算分位数（桶内线性插值，落在溢出桶时取最大桶上界）"""
+        total = sum(counts[:-1])
+        if not total:
+            return 0.0
+        rank = q * total
+        cumulative = 0
+        for i, count in enumerate(counts[:-1]):
+            if count and cumulative + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def latency_summary(self, name: str) -> Dict[str, Dict[str, float]]:
+        """
+        直方图摘要（毫秒）
+
+        Returns:
+            dict: {标签值（多个标签以逗号连接）: {count, avg_ms, p50_ms, p95_ms, p99_ms}}
+        """
+        summary = {}
+        for (metric, labels), counts in sorted(self._collect()[1].items()):
+            if metric != name:
+                continue
+            count = sum(counts[:-1])
+            summary[','.join(value for _, value in labels) or 'all'] = {
+                'count': count,
+                'avg_ms': round(counts[-1] / count * 1000, 1) if count else 0.0,
+                'p50_ms': round(self.quantile(counts, 0.50) * 1000, 1),
+                'p95_ms': round(self.quantile(counts, 0.95) * 1000, 1),
+                'p99_ms': round(self.quantile(counts, 0.99) * 1000, 1)
+            }
+        return summary
+
+    def prometheus(self, prefix: str) -> str:
+        """Prometheus文本格式（text/plain; version=0.0.4）"""
+        def escape(value) -> str:
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        def labels_text(labels, extra=()) -> str:
+            items = [f'{key}="{escape(value)}"' for key, value in tuple(labels) + tuple(extra)]
+            return '{' + ','.join(items) + '}' if items else ''
+
+        counters, histograms = self._collect()
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            metric = f"{prefix}_{name}" if name.endswith('_total') else f"{prefix}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for (counter, labels), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f"{metric}{labels_text(labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            metric = f"{prefix}_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for (histogram, labels), counts in sorted(histograms.items()):
+                if histogram != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{metric}_bucket{labels_text(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{metric}_sum{labels_text(labels)} {counts[-1]}")
+                lines.append(f"{metric}_count{labels_text(labels)} {cumulative}")
+        for name, (label, callback) in sorted(self._gauges.items()):
+            metric = f"{prefix}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            value = callback()
+            if label is None:
+                lines.append(f"{metric} {value}")
+            else:
+                for label_value, item in sorted(value.items()):
+                    lines.append(f"{metric}{labels_text([(label, label_value)])} {item}")
+        return '\n'.join(lines) + '\n'
+
+class AsyncCloudProxy:
+    """
+    ⚡ 异步云代理服务器
+    单个事件循环承载全部连接，空闲的等待不占用线程
+    """
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 8080, ws_port: Optional[int] = None,
+                 upstream_base_url: str = LINGXING_BASE_URL, request_timeout: float = 30,
+                 max_upstream_connections: int = 100, edge_cache: Optional[EdgeCache] = None,
+                 quota: Optional[QuotaGovernor] = None):
+        """
+        初始化异步代理服务器
+
+        Args:
+            host: 监听地址
+            port: HTTP和WebSocket监听端口
+            ws_port: 额外监听的WebSocket端口（兼容连接 :8081/ws 的旧客户端，可选）
+            upstream_base_url: 领星API地址
+            request_timeout: 隧道请求和上游请求的超时时间（秒）
+            max_upstream_connections: 到领星API的最大连接数
+            edge_cache: 领星查询边缘缓存（默认按 PROXY_CACHE_TTLS 环境变量开启）
+            quota: 领星接口全局配额（默认按 PROXY_QUOTA_RATES 环境变量开启）
+        """
+        self.host = host
+        self.port = port
+        self.ws_port = ws_port
+        self.upstream_base_url = upstream_base_url.rstrip('/')
+        self.request_timeout = request_timeout
+        self.max_upstream_connections = max_upstream_connections
+
+        self.clients: Dict[str, TunnelClient] = {}
+        self.pending: Dict[str, asyncio.Future] = {}  # {request_id: 等待隧道响应的Future}
+        self.session: Optional[ClientSession] = None
+        self.edge_cache = edge_cache or EdgeCache.from_env()
+        self.quota = quota or QuotaGovernor.from_env()
+
+        # 请求统计：计数器、各路由/领星端点/隧道客户端的延迟直方图和队列深度仪表
+        self.metrics = Metrics()
+        self.start_time = time.time()
+        self.metrics.gauge('pending_tunnel_requests', lambda: len(self.pending))
+        self.metrics.gauge('tunnel_clients', lambda: len(self.clients))
+        self.metrics.gauge('tunnel_inflight', lambda: {
+            client.info.get('client_id') or client_id: len(client.requests) for client_id, client in self.clients.items()
+        }, label='client')
+        self.metrics.gauge('quota_waiting', lambda: {
+            pattern: lane.waiting for pattern, lane in self.quota.lanes.items()
+        }, label='endpoint')
+        self.metrics.gauge('edge_cache_inflight', lambda: self.edge_cache.get_stats()['inflight'])
+
+        self.app = self._create_app()
+        logger.info(f"⚡ 异步云代理服务器初始化完成 - {host}:{port}")
+
+    # /stats 中始终列出的计数器
+    STAT_COUNTERS = ('total_requests', 'success_requests', 'failed_requests', 'feishu_requests', 'ws_connections',
+                     'tunnel_retries', 'late_responses', 'framed_requests', 'quota_rejected')
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """请求统计（由计数器汇总）"""
+        counters = self.metrics.counter_values()
+        return {**{name: counters.get(name, 0) for name in self.STAT_COUNTERS}, 'start_time': self.start_time}
+
+    def _create_app(self) -> web.Application:
+        """创建aiohttp应用并注册路由"""
+        app = web.Application(middlewares=[self._observe_route])
+        app.router.add_get('/health', self.handle_health)
+        app.router.add_get('/stats', self.handle_stats)
+        app.router.add_get('/metrics', self.handle_metrics)
+        app.router.add_get('/test', self.handle_test)
+        app.router.add_route('GET', '/api/proxy/{endpoint:.*}', self.handle_proxy)
+        app.router.add_route('POST', '/api/proxy/{endpoint:.*}', self.handle_proxy)
+        app.router.add_post('/feishu/webhook', self.handle_feishu)
+        app.router.add_post('/feishu/command', self.handle_feishu)
+        app.router.add_get('/ws', self.handle_websocket)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    @web.middleware
+    async def _observe_route(self, request: web.Request, handler):
+        """按路由记录请求耗时（WebSocket连接时长不计入）"""
+        started = time.perf_counter()
+        response = await handler(request)
+        if not isinstance(response, web.WebSocketResponse):
+            resource = request.match_info.route.resource
+            self.metrics.observe('route_latency', time.perf_counter() - started,
+                                 route=resource.canonical if resource else 'unmatched')
+        return response
+
+    async def _on_startup(self, app: web.Application):
+        """创建到领星API的连接池（不自动解压，压缩内容原样转发）"""
+        self.session = ClientSession(
+            connector=TCPConnector(limit=self.max_upstream_connections),
+            timeout=ClientTimeout(total=None, sock_connect=10, sock_read=self.request_timeout),
+            auto_decompress=False
+        )
+
+    async def _on_cleanup(self, app: web.Application):
+        """关闭连接池和所有隧道连接"""
+        for client in list(self.clients.values()):
+            await client.ws.close()
+        if self.session:
+            await self.session.close()
+
+    # ------------------------------------------------------------------
+    # 状态接口
+    # ------------------------------------------------------------------
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        """🔍 健康检查接口"""
+        return web.json_response({
+            'status': 'healthy',
+            'server': f'cloud-server:{self.port}',
+            'service': 'feishu-webhook-async',
+            'active_connections': len(self.clients),
+            'pending_requests': len(self.pending),
+            'message': '代理服务器运行正常',
+            'timestamp': datetime.now().isoformat(),
+            'stats': self.stats
+        })
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        """📊 获取服务器统计信息"""
+        stats = self.stats
+        uptime = time.time() - stats['start_time']
+        now = time.time()
+        return web.json_response({
+            'stats': stats,
+            'uptime_seconds': uptime,
+            'uptime_hours': uptime / 3600,
+            'success_rate': (
+                stats['success_requests'] / max(stats['total_requests'], 1) * 100
+            ),
+            'active_ws_connections': len(self.clients),
+            'pending_requests': len(self.pending),
+            'edge_cache': self.edge_cache.get_stats(),
+            'quota': self.quota.get_stats(),
+            'latency': {
+                'routes': self.metrics.latency_summary('route_latency'),
+                'upstream': self.metrics.latency_summary('upstream_latency'),
+                'tunnel': self.metrics.latency_summary('tunnel_latency')
+            },
+            'clients': {
+                client_id: {
+                    'inflight': len(client.requests),
+                    'completed': client.completed,
+                    'connected_seconds': round(now - client.connected_at, 1),
+                    'heartbeat_age': round(now - client.last_heartbeat, 1),
+                    'local_url': client.info.get('local_url'),
+                    'protocol': f"{TUNNEL_PROTOCOL}+{client.channel.codec}" if client.channel else 'json',
+                    'tunnel': client.channel.stats if client.channel else None
+                }
+                for client_id, client in self.clients.items()
+            }
+        })
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        """📈 Prometheus指标接口"""
+        return web.Response(body=self.metrics.prometheus('lingxing_proxy').encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def handle_test(self, request: web.Request) -> web.Response:
+        """🧪 测试与领星API的连接"""
+        try:
+            async with self.session.get(self.upstream_base_url, timeout=ClientTimeout(total=10)) as response:
+                return web.json_response({
+                    'status': 'success',
+                    'message': '与领星API连接正常',
+                    'response_code': response.status,
+                    'ws_connections': len(self.clients),
+                    'timestamp': datetime.now().isoformat()
+                })
+        except Exception as e:
+            logger.error(f"连接测试失败: {str(e)}")
+            return web.json_response({
+                'status': 'error',
+                'message': f'连接测试失败: {str(e)}',
+                'timestamp': datetime.now().isoformat()
+            }, status=500)
+
+    # ------------------------------------------------------------------
+    # 领星API转发
+    # ------------------------------------------------------------------
+
+    async def _request_upstream(self, method: str, url: str, **kwargs):
+        """
+        发送上游请求，429/5xx和连接错误时退避重试（响应体尚未读取，重试是安全的）
+
+        Returns:
+            aiohttp.ClientResponse: 上游响应（调用方负责release）
+        """
+        attempts = 3
+        for attempt in range(attempts):
+            try:
+                response = await self.session.request(method, url, **kwargs)
+            except (ClientError, asyncio.TimeoutError):
+                if attempt == attempts - 1:
+                    raise
+            else:
+                if response.status not in UPSTREAM_RETRY_STATUS or attempt == attempts - 1:
+                    return response
+                response.release()
+            await asyncio.sleep(0.5 * 2 ** attempt)
+
+    async def handle_proxy(self, request: web.Request) -> web.StreamResponse:
+        """
+        🔄 API代理转发接口
+        上游响应逐块原样转发，压缩内容不解压，内存占用与响应大小无关
+        """
+        start_time = time.time()
+        self.metrics.inc('total_requests')
+        endpoint = request.match_info['endpoint']
+        target_url = f"{self.upstream_base_url}/{endpoint}"
+
+        headers = strip_hop_by_hop(request.headers, extra=('host', 'content-length', 'x-proxy-client'))
+        headers['User-Agent'] = 'LingXing-Cloud-Proxy/1.0'
+        if 'Accept-Encoding' not in headers:
+            headers['Accept-Encoding'] = 'identity'
+        body = await request.read() if request.method == 'POST' else None
+
+        ttl = self.edge_cache.ttl_for(endpoint)
+        if ttl is not None:
+            return await self._handle_cached_proxy(request, endpoint, target_url, headers, body, ttl, start_time)
+
+        logger.info(f"🔄 代理请求: {request.method} {target_url}")
+        try:
+            quota_wait = await self.quota.acquire(endpoint, self._client_key(request))
+            upstream_started = time.perf_counter()
+            upstream = await self._request_upstream(
+                request.method, target_url, params=request.query, headers=headers, data=body
+            )
+            self.metrics.observe('upstream_latency', time.perf_counter() - upstream_started, endpoint='/' + endpoint)
+        except QuotaExceeded as e:
+            return self._quota_exceeded_response(e)
+        except asyncio.TimeoutError:
+            self.metrics.inc('failed_requests')
+            logger.error(f"⏰ 请求超时: {endpoint}")
+            return web.json_response({
+                'error': '请求超时',
+                'endpoint': endpoint,
+                'timestamp': datetime.now().isoformat()
+            }, status=504)
+        except ClientError as e:
+            self.metrics.inc('failed_requests')
+            logger.error(f"🔌 连接错误: {endpoint} - {str(e)}")
+            return web.json_response({
+                'error': '连接领星API失败',
+                'endpoint': endpoint,
+                'timestamp': datetime.now().isoformat()
+            }, status=502)
+
+        try:
+            response_time = time.time() - start_time
+            if upstream.status == 200:
+                self.metrics.inc('success_requests')
+                logger.info(f"✅ 请求成功: {upstream.status} - {response_time:.2f}s")
+            else:
+                self.metrics.inc('failed_requests')
+                logger.warning(f"⚠️ 请求失败: {upstream.status} - {response_time:.2f}s")
+
+            response_headers = strip_hop_by_hop(upstream.headers)
+            response_headers['X-Proxy-Server'] = 'LingXing-Cloud-Proxy-Async'
+            response_headers['X-Response-Time'] = str(response_time)
+            response_headers['X-Quota-Wait'] = str(int(quota_wait * 1000))
+
+            # 限速端点的小响应先读出来检查是否仍被领星限流
+            content_length = upstream.content_length
+            if self.quota.lane_for(endpoint) and content_length is not None and content_length <= THROTTLE_PROBE_SIZE:
+                response_body = await upstream.read()
+                response_headers.extend(self._throttle_headers(endpoint, upstream.status,
+                                                               response_headers.items(), response_body))
+                return web.Response(status=upstream.status, body=response_body, headers=response_headers)
+
+            response = web.StreamResponse(status=upstream.status, headers=response_headers)
+            await response.prepare(request)
+            async for chunk in upstream.content.iter_chunked(STREAM_CHUNK_SIZE):
+                await response.write(chunk)
+            await response.write_eof()
+            return response
+        finally:
+            upstream.release()
+
+    async def _handle_cached_proxy(self, request: web.Request, endpoint: str, target_url: str,
+                                   headers: CIMultiDict, body: Optional[bytes], ttl: float,
+                                   start_time: float) -> web.Response:
+        """
+        开启缓存的端点：相同查询在TTL内返回缓存，并发的相同请求合并为一次上游调用
+        响应体需要完整读取以便共享，其余转发方式与 handle_proxy 相同
+        """
+        key = cache_key(request.method, endpoint, request.query.items(), body or b'', headers['Accept-Encoding'])
+        client = self._client_key(request)
+
+        async def load() -> CachedResponse:
+            # 只有真正访问上游时才占用配额，缓存命中和合并的请求不消耗
+            await self.quota.acquire(endpoint, client)
+            upstream_started = time.perf_counter()
+            upstream = await self._request_upstream(
+                request.method, target_url, params=request.query, headers=headers, data=body
+            )
+            self.metrics.observe('upstream_latency', time.perf_counter() - upstream_started, endpoint='/' + endpoint)
+            try:
+                response_headers = list(strip_hop_by_hop(upstream.headers).items())
+                response_body = await upstream.read()
+            finally:
+                upstream.release()
+            response_headers.extend(self._throttle_headers(endpoint, upstream.status, response_headers, response_body))
+            return CachedResponse(upstream.status, response_headers, response_body)
+
+        try:
+            entry, source = await self.edge_cache.fetch(key, ttl, load)
+        except QuotaExceeded as e:
+            return self._quota_exceeded_response(e)
+        except asyncio.TimeoutError:
+            self.metrics.inc('failed_requests')
+            logger.error(f"⏰ 请求超时: {endpoint}")
+            return web.json_response({
+                'error': '请求超时',
+                'endpoint': endpoint,
+                'timestamp': datetime.now().isoformat()
+            }, status=504)
+        except ClientError as e:
+            self.metrics.inc('failed_requests')
+            logger.error(f"🔌 连接错误: {endpoint} - {str(e)}")
+            return web.json_response({
+                'error': '连接领星API失败',
+                'endpoint': endpoint,
+                'timestamp': datetime.now().isoformat()
+            }, status=502)
+
+        response_time = time.time() - start_time
+        if entry.status == 200:
+            self.metrics.inc('success_requests')
+        else:
+            self.metrics.inc('failed_requests')
+        logger.info(f"✅ 代理请求完成: {entry.status} - {response_time:.2f}s - 缓存{source}")
+
+        response = web.Response(status=entry.status, body=entry.body,
+                                headers=CIMultiDict(entry.headers))
+        response.headers['X-Proxy-Server'] = 'LingXing-Cloud-Proxy-Async'
+        response.headers['X-Proxy-Cache'] = source
+        response.headers['Age'] = str(int(time.time() - entry.stored_at))
+        response.headers['X-Response-Time'] = str(response_time)
+        return response
+
+    @staticmethod
+    def _client_key(request: web.Request) -> str:
+        """配额排队使用的客户端标识：优先X-Proxy-Client头，其次转发链中的原始IP"""
+        forwarded = request.headers.get('X-Forwarded-For', '').split(',')[0].strip()
+        return request.headers.get('X-Proxy-Client') or forwarded or request.remote or 'unknown'
+
+    def _throttle_headers(self, endpoint: str, status: int, headers, body: bytes) -> list:
+        """领星仍返回限流时暂停该端点放行，并通过Retry-After告知客户端需要等待的时间"""
+        if status != 200 or business_code(headers, body) != THROTTLE_CODE:
+            return []
+        retry_after = self.quota.penalize(endpoint)
+        logger.warning(f"🚦 领星返回限流: {endpoint}，暂停放行{retry_after}秒")
+        return [('Retry-After', str(retry_after))]
+
+    def _quota_exceeded_response(self, error: QuotaExceeded) -> web.Response:
+        """排队超时：返回429和Retry-After，不转发到上游"""
+        self.metrics.inc('quota_rejected')
+        logger.warning(f"🚦 配额排队已满: {error.endpoint}，建议{error.retry_after}秒后重试")
+        return web.json_response({
+            'error': '接口配额已用尽，请稍后重试',
+            'endpoint': error.endpoint,
+            'retry_after': error.retry_after,
+            'timestamp': datetime.now().isoformat()
+        }, status=429, headers={'Retry-After': str(error.retry_after)})
+
+    # ------------------------------------------------------------------
+    # 飞书请求隧道转发
+    # ------------------------------------------------------------------
+
+    async def handle_feishu(self, request: web.Request) -> web.StreamResponse:
+        """🤖 飞书webhook/命令接口 - 通过WebSocket隧道转发到本地服务器"""
+        start_time = time.time()
+        self.metrics.inc('feishu_requests')
+
+        try:
+            if not self.clients:
+                logger.warning("⚠️ 没有活跃的WebSocket连接")
+                return web.json_response({
+                    'error': '没有活跃的本地服务器连接',
+                    'timestamp': datetime.now().isoformat()
+                }, status=503)
+
+            request_id = str(uuid.uuid4())
+            body = await request.read()
+
+            logger.info(f"🤖 通过WebSocket转发飞书请求: {request_id}")
+            response = await self._dispatch(request, request_id, body)
+
+            if response is None:
+                return web.json_response({
+                    'error': '请求超时或连接断开',
+                    'timestamp': datetime.now().isoformat()
+                }, status=504)
+
+            if isinstance(response, TunnelStream):
+                return await self._relay_stream(request, response, start_time)
+
+            response_time = time.time() - start_time
+            logger.info(f"✅ 飞书请求完成: {response_time:.2f}s")
+            return web.json_response(
+                response.get('data', {}),
+                status=response.get('status_code', 200),
+                headers={
+                    'X-Feishu-Proxy': 'Cloud-Proxy-Async',
+                    'X-Response-Time': str(response_time)
+                },
+                dumps=lambda data: json.dumps(data, ensure_ascii=False)
+            )
+
+        except Exception as e:
+            error_msg = str(e)
+            logger.error(f"❌ 飞书请求异常: {error_msg}\n{traceback.format_exc()}")
+            return web.json_response({
+                'error': f'飞书代理服务器内部错误: {error_msg}',
+                'endpoint': request.path,
+                'timestamp': datetime.now().isoformat()
+            }, status=500)
+
+    def _pick_client(self, exclude: List[str]) -> Optional[TunnelClient]:
+        """选择在途请求最少的隧道连接"""
+        candidates = [client for client_id, client in self.clients.items() if client_id not in exclude]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda client: len(client.requests))
+
+    async def _dispatch(self, request: web.Request, request_id: str, body: bytes):
+        """
+        把请求发给在途请求最少的隧道连接并等待响应；
+        连接中途断开或回复502/503/504时，在剩余时间内改派给其他连接
+
+        Args:
+            request: 飞书的原始请求
+            request_id: 请求ID
+            body: 原始请求体
+
+        Returns:
+            JSON协议客户端返回响应字典，帧协议客户端返回已收到响应头的TunnelStream，
+            超时或没有可用连接时返回None
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.request_timeout
+        message = None
+        tried = []
+        response = None
+
+        while loop.time() < deadline:
+            client = self._pick_client(tried)
+            if client is None:
+                break
+            if tried:
+                self.metrics.inc('tunnel_retries')
+            tried.append(client.client_id)
+            attempt_started = loop.time()
+
+            try:
+                if client.channel:
+                    response = await self._send_framed(client, request, request_id, body, deadline)
+                    status = response.status
+                else:
+                    if message is None:
+                        message = json.dumps({
+                            'type': 'feishu_request',
+                            'request_id': request_id,
+                            'method': request.method,
+                            'endpoint': request.path,
+                            'headers': dict(request.headers),
+                            'data': json.loads(body) if request.content_type == 'application/json' else {},
+                            'timestamp': datetime.now().isoformat()
+                        }, ensure_ascii=False)
+                    response = await self._send_json(client, request_id, message, deadline)
+                    status = response.get('status_code') if isinstance(response, dict) else None
+            except asyncio.TimeoutError:
+                logger.warning(f"⏰ 请求超时: {request_id}")
+                return None
+            except (ConnectionResetError, ClientError) as e:
+                logger.warning(f"⚠️ 隧道连接 {client.client_id} 断开，尝试改派: {request_id} - {str(e)}")
+                continue
+
+            client.completed += 1
+            # 按客户端自报的ID统计（重连后连接ID会变），未上报时用连接ID
+            self.metrics.observe('tunnel_latency', loop.time() - attempt_started,
+                                 client=client.info.get('client_id') or client.client_id)
+            if status not in RETRYABLE_STATUS:
+                return response
+            logger.warning(f"⚠️ 客户端 {client.client_id} 无法连接本地服务器，尝试改派: {request_id}")
+            if isinstance(response, TunnelStream):
+                await response.cancel()
+                response = {'status_code': status, 'data': {'error': '本地服务器不可用'}}
+
+        return response
+
+    async def _send_json(self, client: TunnelClient, request_id: str, message: str, deadline: float):
+        """JSON协议：发送请求消息，等待响应消息完成对应的Future"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending[request_id] = future
+        client.requests.add(request_id)
+        try:
+            await client.ws.send_str(message)
+            return await asyncio.wait_for(future, deadline - loop.time())
+        finally:
+            self.pending.pop(request_id, None)
+            client.requests.discard(request_id)
+
+    async def _send_framed(self, client: TunnelClient, request: web.Request, request_id: str,
+                           body: bytes, deadline: float) -> TunnelStream:
+        """帧协议：发送REQUEST帧（原始body），等待RESPONSE帧"""
+        loop = asyncio.get_running_loop()
+        stream = TunnelStream(client, request_id)
+        try:
+            headers = strip_hop_by_hop(request.headers, extra=('host', 'content-length'))
+            meta = pack_fields([request.method, request.path, request.query_string,
+                                *itertools.chain.from_iterable(headers.items())])
+            self.metrics.inc('framed_requests')
+            await client.channel.send_stream(FRAME_REQUEST, stream.stream_id, meta, body)
+            frame = await stream.next_frame(deadline - loop.time())
+            fields = unpack_fields(frame.meta)
+            stream.status = int(fields[0])
+            stream.headers = CIMultiDict(zip(fields[1::2], fields[2::2]))
+            stream.first = frame
+            return stream
+        except BaseException:
+            await stream.cancel()
+            raise
+
+    async def _relay_stream(self, request: web.Request, stream: TunnelStream, start_time: float) -> web.StreamResponse:
+        """把帧协议的响应body逐帧写给飞书，写出后再归还窗口，慢速读取方会反压本地客户端"""
+        channel = stream.client.channel
+        try:
+            response = web.StreamResponse(status=stream.status,
+                                          headers=strip_hop_by_hop(stream.headers, extra=('content-length',)))
+            response.headers['X-Feishu-Proxy'] = 'Cloud-Proxy-Async'
+            response.headers['X-Response-Time'] = str(time.time() - start_time)
+            await response.prepare(request)
+            frame = stream.first
+            while True:
+                await response.write(frame.body)
+                if frame.end:
+                    break
+                await channel.grant(stream.stream_id, len(frame.body))
+                frame = await stream.next_frame(self.request_timeout)
+            await response.write_eof()
+            logger.info(f"✅ 飞书请求完成: {time.time() - start_time:.2f}s")
+            return response
+        except BaseException:
+            await stream.cancel()
+            raise
+        finally:
+            stream.close()
+
+    # ------------------------------------------------------------------
+    # WebSocket隧道
+    # ------------------------------------------------------------------
+
+    async def handle_websocket(self, request: web.Request) -> web.WebSocketResponse:
+        """🔌 本地客户端的WebSocket隧道连接"""
+        ws = web.WebSocketResponse(heartbeat=30, max_msg_size=0)
+        await ws.prepare(request)
+
+        client = TunnelClient(f"client_{uuid.uuid4().hex[:8]}", ws)
+        self.clients[client.client_id] = client
+        self.metrics.inc('ws_connections')
+        logger.info(f"🔗 新的WebSocket连接: {client.client_id}")
+
+        try:
+            async for message in ws:
+                try:
+                    if message.type == WSMsgType.BINARY and client.channel:
+                        await self._on_tunnel_frame(client, message.data)
+                    elif message.type == WSMsgType.TEXT:
+                        await self._on_tunnel_message(client, json.loads(message.data))
+                except json.JSONDecodeError:
+                    logger.warning(f"⚠️ 收到无效JSON消息: {message.data[:200]}")
+                except Exception as e:
+                    logger.error(f"❌ 处理WebSocket消息异常: {e}")
+        finally:
+            # 清理连接，在途请求立即失败以便改派
+            self.clients.pop(client.client_id, None)
+            for request_id in list(client.requests):
+                future = self.pending.get(request_id)
+                if future and not future.done():
+                    future.set_exception(ConnectionResetError('隧道连接已断开'))
+            for queue in client.streams.values():
+                queue.put_nowait(None)
+            if client.channel:
+                await client.channel.close()
+            logger.info(f"🧹 清理WebSocket连接: {client.client_id}")
+
+        return ws
+
+    async def _on_tunnel_message(self, client: TunnelClient, data: Dict[str, Any]):
+        """处理隧道消息：注册、响应和心跳（任何消息都刷新心跳时间）"""
+        client.last_heartbeat = time.time()
+        message_type = data.get('type')
+
+        if message_type == 'register':
+            client.info = {'local_url': data.get('local_url'), 'client_id': data.get('client_id')}
+            ack = {
+                'type': 'registration_ack',
+                'client_id': client.client_id,
+                'timestamp': datetime.now().isoformat()
+            }
+            # 客户端声明支持帧协议时升级，否则继续使用JSON消息
+            codec = next((name for name in data.get('compression', []) if name in available_codecs()), None)
+            if data.get('protocol') == TUNNEL_PROTOCOL and codec:
+                client.channel = FrameChannel(client.ws.send_bytes, codec)
+                ack.update(protocol=TUNNEL_PROTOCOL, compression=codec)
+            logger.info(f"📝 客户端注册: {client.client_id} - {data.get('local_url')} "
+                        f"({ack.get('protocol', 'json')})")
+            await client.ws.send_str(json.dumps(ack))
+
+        elif message_type == 'feishu_response':
+            request_id = data.get('request_id')
+            future = self.pending.get(request_id)
+            if future is None or future.done():
+                self.metrics.inc('late_responses')
+                logger.warning(f"⚠️ 请求已超时或未知，丢弃响应: {request_id}")
+            else:
+                future.set_result(data.get('response'))
+                logger.info(f"📨 收到响应: {request_id}")
+
+    async def _on_tunnel_frame(self, client: TunnelClient, data: bytes):
+        """处理帧协议消息：把帧交给对应的流，已结束的流通知客户端放弃"""
+        client.last_heartbeat = time.time()
+        frame = await client.channel.receive(data)
+        if frame is None:
+            return
+        queue = client.streams.get(frame.stream_id)
+        if queue is not None:
+            queue.put_nowait(frame)
+        elif frame.type != FRAME_RESET:
+            if frame.type == FRAME_RESPONSE:
+                self.metrics.inc('late_responses')
+                logger.warning(f"⚠️ 流已结束，丢弃响应: {client.client_id}#{frame.stream_id}")
+            await client.channel.reset(frame.stream_id)
+
+    # ------------------------------------------------------------------
+    # 启动
+    # ------------------------------------------------------------------
+
+    async def start(self) -> web.AppRunner:
+        """在当前事件循环中启动服务（端口为0时使用系统分配的端口）"""
+        runner = web.AppRunner(self.app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+        self.port = runner.addresses[0][1]
+        if self.ws_port:
+            await web.TCPSite(runner, self.host, self.ws_port).start()
+        return runner
+
+    def run(self):
+        """🚀 启动代理服务器"""
+        logger.info(f"🚀 启动异步云代理服务器: http://{self.host}:{self.port}")
+        logger.info(f"🔄 代理接口: http://{self.host}:{self.port}/api/proxy/{{endpoint}}")
+        logger.info(f"🤖 飞书webhook接口: http://{self.host}:{self.port}/feishu/webhook")
+        logger.info(f"🔌 WebSocket接口: ws://{self.host}:{self.port}/ws"
+                    + (f"，ws://{self.host}:{self.ws_port}/ws" if self.ws_port else ""))
+
+        async def serve():
+            runner = await self.start()
+            try:
+                await asyncio.Event().wait()
+            finally:
+                await runner.cleanup()
+
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            logger.info("👋 代理服务器已停止")
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='异步云代理服务器')
+    parser.add_argument('--host', default='0.0.0.0', help='服务器监听地址')
+    parser.add_argument('--port', type=int, default=8080, help='HTTP和WebSocket监听端口')
+    parser.add_argument('--ws-port', type=int, default=None, help='额外的WebSocket监听端口（兼容旧客户端，如8081）')
+    parser.add_argument('--upstream', default=LINGXING_BASE_URL, help='领星API地址')
+    parser.add_argument('--log-file', default='proxy_server.log', help='日志文件')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(args.log_file, encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+
+    AsyncCloudProxy(
+        host=args.host,
+        port=args.port,
+        ws_port=args.ws_port,
+        upstream_base_url=args.upstream
+    ).run()
+
+if __name__ == '__main__':
+    main()
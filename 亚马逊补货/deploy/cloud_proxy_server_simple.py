@@ -9,186 +9,930 @@ import logging
 import time
 import json
 import uuid
-from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, Response
+import bisect
+import random
+import itertools
+from datetime import datetime
+from flask import Flask, request, jsonify, Response, g
 import requests
+import heapq
 import threading
-from collections import defaultdict, deque
+from typing import Any, Dict, List, Optional
+from collections import OrderedDict
 import asyncio
 import traceback
 from websockets.server import serve
 import websockets.exceptions
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/opt/lingxing-proxy/cloud_proxy.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# 长轮询最长挂起时间（秒），客户端请求的等待时间超过此值时按此值处理
+POLL_MAX_WAIT = 30
+
+# 各代理按单文件上传到云服务器，以下转发辅助函数在Flask版代理中保持逐字相同（test/test_proxy_copies.py 检查）
+# 逐跳头部：只对单个连接有效，代理不应转发（RFC 7230 6.1节）
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailer', 'trailers', 'transfer-encoding', 'upgrade'
+}
+
+# 流式转发时每次读取的字节数
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def strip_hop_by_hop(headers, extra=()) -> list:
+    """
+    去掉逐跳头部（包括Connection头中列出的头部）
+
+    Args:
+        headers: 原始头部（支持重复头部的items()）
+        extra: 额外需要去掉的头部（小写）
+
+    Returns:
+        list: (名称, 值) 列表
+    """
+    listed = {token.strip().lower() for token in headers.get('Connection', '').split(',') if token.strip()}
+    dropped = HOP_BY_HOP_HEADERS | listed | set(extra)
+    return [(name, value) for name, value in headers.items() if name.lower() not in dropped]
+
+def upstream_request_headers(headers) -> dict:
+    """
+    构造转发到上游的请求头：去掉逐跳头部、Host、Content-Length（由requests重新计算）和
+    只给代理看的X-Proxy-Client，客户端未声明Accept-Encoding时要求上游不压缩，避免把压缩内容转给不支持的客户端
+
+    Args:
+        headers: 客户端请求头
+
+    Returns:
+        dict: 上游请求头
+    """
+    forwarded = dict(strip_hop_by_hop(headers, extra=('host', 'content-length', 'x-proxy-client')))
+    if not any(name.lower() == 'accept-encoding' for name in forwarded):
+        forwarded['Accept-Encoding'] = 'identity'
+    return forwarded
+
+def stream_upstream_response(upstream: requests.Response, extra_headers: dict = None) -> Response:
+    """
+    把上游响应（需以stream=True发出）逐块原样转发给客户端
+    读取原始字节不解压，Content-Encoding/Content-Length保持与上游一致，内存占用与响应大小无关
+
+    Args:
+        upstream: 上游响应
+        extra_headers: 额外添加的响应头
+
+    Returns:
+        Response: 流式Flask响应
+    """
+    def generate():
+        try:
+            for chunk in upstream.raw.stream(STREAM_CHUNK_SIZE, decode_content=False):
+                yield chunk
+        finally:
+            upstream.close()
+
+    headers = strip_hop_by_hop(upstream.raw.headers)
+    headers.extend((extra_headers or {}).items())
+    return Response(generate(), status=upstream.status_code, headers=headers, direct_passthrough=True)
+
+class PendingRequest:
+    """等待客户端提交响应的请求"""
+
+    __slots__ = ('created_at', 'event', 'response')
+
+    def __init__(self):
+        self.created_at = time.time()
+        self.event = threading.Event()
+        self.response = None
+
+class RequestCorrelator:
+    """
+    请求/响应关联表
+    按请求ID登记等待者，响应到达时直接唤醒等待线程；
+    条目只由等待方移除（拿到响应或超时），迟到和重复的响应直接丢弃
+    """
+
+    def __init__(self):
+        self._pending = {}  # {request_id: PendingRequest}
+        self._lock = threading.Lock()
+        self.stats = {
+            'completed': 0,
+            'timeouts': 0,
+            'late_responses': 0
+        }
+
+    def register(self, request_id: str) -> PendingRequest:
+        """
+        登记等待响应的请求（需在请求发出之前调用，避免响应先于登记到达）
+
+        Args:
+            request_id: 请求ID
+
+        Returns:
+            PendingRequest: 等待者
+        """
+        pending = PendingRequest()
+        with self._lock:
+            self._pending[request_id] = pending
+        return pending
+
+    def complete(self, request_id: str, response: Any) -> bool:
+        """
+        写入响应并唤醒等待者
+
+        Args:
+            request_id: 请求ID
+            response: 响应数据
+
+        Returns:
+            bool: 是否有等待者（False表示请求已超时、未知或重复响应）
+        """
+        with self._lock:
+            pending = self._pending.get(request_id)
+            if pending is None or pending.event.is_set():
+                self.stats['late_responses'] += 1
+                return False
+            pending.response = response
+            pending.event.set()
+            self.stats['completed'] += 1
+        return True
+
+    def wait(self, request_id: str, timeout: float) -> Optional[Any]:
+        """
+        阻塞等待响应，超时后注销请求
+
+        Args:
+            request_id: 请求ID
+            timeout: 超时时间（秒）
+
+        Returns:
+            响应数据，超时或未登记时返回None
+        """
+        with self._lock:
+            pending = self._pending.get(request_id)
+        if pending is None:
+            return None
+
+        pending.event.wait(timeout)
+        with self._lock:
+            # 超时与响应到达可能同时发生，以注销时是否已完成为准
+            self._pending.pop(request_id, None)
+            if pending.event.is_set():
+                return pending.response
+            self.stats['timeouts'] += 1
+        return None
+
+    def cancel(self, request_id: str):
+        """注销请求（转发失败时调用）"""
+        with self._lock:
+            self._pending.pop(request_id, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+# 本地客户端断开或失联时，用于唤醒其在途请求的响应标记
+CLIENT_LOST = {'status_code': 503, 'error': '本地客户端已断开'}
+
+# 这些状态码表示本地客户端无法连到本地服务器，可改派给其他客户端
+RETRYABLE_STATUS = {502, 503, 504}
+
+# 失败的请求按此延迟（秒）计入惩罚值，反复失败的客户端会自然少分配
+FAILURE_PENALTY = 5.0
+
+# 惩罚值在此时间（秒）内线性衰减到0，失败过的客户端之后重新平等参与分配
+PENALTY_DECAY = 30.0
+
+class TunnelClient:
+    """隧道客户端的负载信息"""
+
+    __slots__ = ('client_id', 'requests', 'ewma_latency', 'last_heartbeat', 'completed', 'failures',
+                 'penalty', 'penalized_at')
+
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.requests = set()  # 在途请求ID
+        self.ewma_latency = None
+        self.last_heartbeat = time.time()
+        self.completed = 0
+        self.failures = 0
+        self.penalty = 0.0     # 失败惩罚（秒），随时间线性衰减
+        self.penalized_at = 0.0
+
+    def current_penalty(self, now: float) -> float:
+        """当前的失败惩罚值"""
+        if not self.penalty:
+            return 0.0
+        return self.penalty * max(0.0, 1 - (now - self.penalized_at) / PENALTY_DECAY)
+
+    def score(self, now: float) -> float:
+        """选择客户端时比较的延迟：响应延迟EWMA加上衰减后的失败惩罚"""
+        return (self.ewma_latency or 0.0) + self.current_penalty(now)
+
+class ClientPool:
+    """
+    本地隧道客户端池
+    记录每个客户端的在途请求数和响应延迟EWMA，按"两次随机选择"挑出负载较低的客户端；
+    失败按随时间衰减的惩罚值计入，重新注册时清零；
+    心跳超时的客户端不再分配新请求（排空），移除时返回其在途请求以便改派
+    """
+
+    def __init__(self, heartbeat_timeout: float = 90, ewma_alpha: float = 0.3):
+        """
+        初始化客户端池
+
+        Args:
+            heartbeat_timeout: 超过此时间（秒）无心跳的客户端不再分配请求
+            ewma_alpha: 延迟EWMA的平滑系数
+        """
+        self.heartbeat_timeout = heartbeat_timeout
+        self.ewma_alpha = ewma_alpha
+        self._clients = {}  # {client_id: TunnelClient}
+        self._lock = threading.Lock()
+        self.stats = {
+            'dispatched': 0,
+            'retried': 0,
+            'no_client': 0
+        }
+
+    def add(self, client_id: str):
+        """加入客户端（已存在时刷新心跳并清除失败惩罚）"""
+        with self._lock:
+            client = self._clients.get(client_id)
+            if client is None:
+                self._clients[client_id] = TunnelClient(client_id)
+            else:
+                client.last_heartbeat = time.time()
+                client.penalty = 0.0
+
+    def remove(self, client_id: str) -> List[str]:
+        """
+        移除客户端
+
+        Returns:
+            List[str]: 该客户端的在途请求ID（调用方应使其立即失败以便改派）
+        """
+        with self._lock:
+            client = self._clients.pop(client_id, None)
+            return list(client.requests) if client else []
+
+    def heartbeat(self, client_id: str) -> bool:
+        """刷新客户端心跳，返回客户端是否在池中"""
+        with self._lock:
+            client = self._clients.get(client_id)
+            if client is None:
+                return False
+            client.last_heartbeat = time.time()
+            return True
+
+    def acquire(self, request_id: str, exclude=()) -> Optional[str]:
+        """
+        为请求挑选客户端并计入在途数
+
+        Args:
+            request_id: 请求ID
+            exclude: 不参与选择的客户端（本请求已失败过的）
+
+        Returns:
+            Optional[str]: 客户端ID，没有可用客户端时返回None
+        """
+        with self._lock:
+            now = time.time()
+            candidates = [
+                client for client_id, client in self._clients.items()
+                if client_id not in exclude and now - client.last_heartbeat < self.heartbeat_timeout
+            ]
+            if not candidates:
+                self.stats['no_client'] += 1
+                return None
+
+            # 两次随机选择：随机取两个，选在途请求少的（相同时选延迟加惩罚低的）
+            candidates = random.sample(candidates, min(2, len(candidates)))
+            client = min(candidates, key=lambda c: (len(c.requests), c.score(now)))
+            client.requests.add(request_id)
+            self.stats['dispatched'] += 1
+            if exclude:
+                self.stats['retried'] += 1
+            return client.client_id
+
+    def release(self, client_id: str, request_id: str, latency: float = None, success: bool = True):
+        """
+        请求结束：移出在途请求并更新延迟EWMA
+
+        Args:
+            client_id: 客户端ID
+            request_id: 请求ID
+            latency: 本次响应耗时（秒）
+            success: 是否成功（失败时累加FAILURE_PENALTY惩罚，不计入延迟EWMA）
+        """
+        with self._lock:
+            client = self._clients.get(client_id)
+            if client is None:
+                return
+            client.requests.discard(request_id)
+            if not success:
+                now = time.time()
+                client.failures += 1
+                client.penalty = client.current_penalty(now) + FAILURE_PENALTY
+                client.penalized_at = now
+                return
+            client.completed += 1
+            if latency is not None:
+                if client.ewma_latency is None:
+                    client.ewma_latency = latency
+                else:
+                    client.ewma_latency += self.ewma_alpha * (latency - client.ewma_latency)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._clients)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取客户端池统计"""
+        with self._lock:
+            now = time.time()
+            return {
+                **self.stats,
+                'clients': {
+                    client_id: {
+                        'inflight': len(client.requests),
+                        'ewma_latency_ms': round(client.ewma_latency * 1000, 1) if client.ewma_latency is not None else None,
+                        'penalty_ms': round(client.current_penalty(now) * 1000, 1),
+                        'completed': client.completed,
+                        'failures': client.failures,
+                        'heartbeat_age': round(now - client.last_heartbeat, 1),
+                        'draining': now - client.last_heartbeat >= self.heartbeat_timeout
+                    }
+                    for client_id, client in self._clients.items()
+                }
+            }
+
 # 全局状态管理
+# 客户端超过该时间（秒）没有心跳或轮询即视为失联
+CLIENT_TTL = 300
+
+# 客户端表按客户端ID分段加锁，不同客户端的轮询、提交和心跳互不阻塞
+LOCK_STRIPES = 16
+
+# 每次持锁处理的过期条目数，大量条目同时过期时分批处理，避免长时间占用锁
+EXPIRY_BATCH = 256
+
+# 没有条目即将过期时，清理线程最长的休眠时间（秒）
+CLEANUP_MAX_INTERVAL = 5.0
+
+class ExpiryHeap:
+    """
+    按到期时间排序的最小堆，登记和弹出过期条目都是O(log n)
+    重新登记或注销只更新到期时间表，堆中的旧条目在弹出时跳过（惰性删除）
+    """
+
+    def __init__(self):
+        self._heap = []       # [(到期时间, 键)]
+        self._deadlines = {}  # {键: 当前有效的到期时间}
+        self._lock = threading.Lock()
+
+    def schedule(self, key, expires_at: float):
+        """登记（或顺延）键的到期时间"""
+        with self._lock:
+            self._deadlines[key] = expires_at
+            heapq.heappush(self._heap, (expires_at, key))
+            # 旧条目过多时重建，堆大小始终与有效条目数同一量级
+            if len(self._heap) > 2 * len(self._deadlines) + 64:
+                self._heap = [(deadline, k) for k, deadline in self._deadlines.items()]
+                heapq.heapify(self._heap)
+
+    def discard(self, key):
+        """注销键（堆中的条目留到弹出时跳过）"""
+        with self._lock:
+            self._deadlines.pop(key, None)
+
+    def pop_expired(self, now: float, limit: int = EXPIRY_BATCH) -> list:
+        """
+        弹出已到期的键
+
+        Args:
+            now: 当前时间
+            limit: 最多弹出的数量
+
+        Returns:
+            list: 到期的键（按到期先后）
+        """
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and len(expired) < limit:
+                expires_at, key = heapq.heappop(self._heap)
+                if self._deadlines.get(key) == expires_at:
+                    del self._deadlines[key]
+                    expired.append(key)
+        return expired
+
+    def next_expiry(self) -> Optional[float]:
+        """最早的到期时间，没有条目时返回None"""
+        with self._lock:
+            while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._deadlines)
+
+# 指标采集在各代理中保持逐字相同（test/test_proxy_copies.py 检查）
+# 延迟直方图的桶上界（秒），从隧道内的毫秒级往返覆盖到领星慢查询
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# 每个指标最多保留的标签组合数，超出的归入 other（避免客户端ID等标签无限增长）
+METRIC_SERIES_LIMIT = 200
+
+class Metrics:
+    """
+    📈 线程安全的指标收集：计数器、固定分桶的延迟直方图和实时计算的仪表
+    写入按线程分片，每个线程固定写同一个分片，分片锁只在同分片的线程间竞争；读取时汇总所有分片
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, shards: int = 16):
+        self.buckets = tuple(buckets)
+        self._shards = [(threading.Lock(), {}, {}) for _ in range(shards)]  # [(锁, 计数器, 直方图)]
+        self._next_shard = itertools.count()
+        self._local = threading.local()
+        self._series = {}  # {指标名: set(标签组合)}
+        self._series_lock = threading.Lock()
+        self._gauges = {}  # {指标名: (标签名, 回调)}
+
+    def _shard(self):
+        index = getattr(self._local, 'index', None)
+        if index is None:
+            index = self._local.index = next(self._next_shard) % len(self._shards)
+        return self._shards[index]
+
+    def _key(self, name: str, labels: Dict[str, Any]) -> tuple:
+        """指标键 (名称, 标签组合)，标签组合数超过上限时归入 other"""
+        label_items = tuple(sorted((key, str(value)) for key, value in labels.items()))
+        series = self._series.get(name)
+        if series is None or label_items not in series:
+            with self._series_lock:
+                series = self._series.setdefault(name, set())
+                if label_items not in series:
+                    if len(series) >= METRIC_SERIES_LIMIT:
+                        label_items = tuple((key, 'other') for key, _ in label_items)
+                    series.add(label_items)
+        return name, label_items
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """计数器加一（或加指定数量）"""
+        key = self._key(name, labels)
+        lock, counters, _ = self._shard()
+        with lock:
+            counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, **labels):
+        """记录一次耗时（秒）"""
+        key = self._key(name, labels)
+        lock, _, histograms = self._shard()
+        with lock:
+            counts = histograms.get(key)
+            if counts is None:
+                counts = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]  # 各桶 + 溢出桶 + 总和
+            counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            counts[-1] += seconds
+
+    def gauge(self, name: str, callback, label: Optional[str] = None):
+        """
+        登记仪表，读取时调用回调取值
+
+        Args:
+            name: 指标名
+            callback: 返回数值；指定label时返回 {标签值: 数值}
+            label: 标签名
+        """
+        self._gauges[name] = (label, callback)
+
+    def _collect(self) -> tuple:
+        """汇总所有分片，返回 (计数器, 直方图)"""
+        counters, histograms = {}, {}
+        for lock, shard_counters, shard_histograms in self._shards:
+            with lock:
+                for key, value in shard_counters.items():
+                    counters[key] = counters.get(key, 0) + value
+                for key, counts in shard_histograms.items():
+                    total = histograms.setdefault(key, [0] * (len(counts) - 1) + [0.0])
+                    for i, count in enumerate(counts):
+                        total[i] += count
+        return counters, histograms
+
+    def counter_values(self) -> Dict[str, float]:
+        """不带标签的计数器 {名称: 值}"""
+        return {name: value for (name, labels), value in self._collect()[0].items() if not labels}
+
+    def quantile(self, counts: list, q: float) -> float:
+        """按分桶估算分位数（桶内线性插值，落在溢出桶时取最大桶上界）"""
+        total = sum(counts[:-1])
+        if not total:
+            return 0.0
+        rank = q * total
+        cumulative = 0
+        for i, count in enumerate(counts[:-1]):
+            if count and cumulative + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def latency_summary(self, name: str) -> Dict[str, Dict[str, float]]:
+        """
+        直方图摘要（毫秒）
+
+        Returns:
+            dict: {标签值（多个标签以逗号连接）: {count, avg_ms, p50_ms, p95_ms, p99_ms}}
+        """
+        summary = {}
+        for (metric, labels), counts in sorted(self._collect()[1].items()):
+            if metric != name:
+                continue
+            count = sum(counts[:-1])
+            summary[','.join(value for _, value in labels) or 'all'] = {
+                'count': count,
+                'avg_ms': round(counts[-1] / count * 1000, 1) if count else 0.0,
+                'p50_ms': round(self.quantile(counts, 0.50) * 1000, 1),
+                'p95_ms': round(self.quantile(counts, 0.95) * 1000, 1),
+                'p99_ms': round(self.quantile(counts, 0.99) * 1000, 1)
+            }
+        return summary
+
+    def prometheus(self, prefix: str) -> str:
+        """Prometheus文本格式（text/plain; version=0.0.4）"""
+        def escape(value) -> str:
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        def labels_text(labels, extra=()) -> str:
+            items = [f'{key}="{escape(value)}"' for key, value in tuple(labels) + tuple(extra)]
+            return '{' + ','.join(items) + '}' if items else ''
+
+        counters, histograms = self._collect()
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            metric = f"{prefix}_{name}" if name.endswith('_total') else f"{prefix}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for (counter, labels), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f"{metric}{labels_text(labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            metric = f"{prefix}_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for (histogram, labels), counts in sorted(histograms.items()):
+                if histogram != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{metric}_bucket{labels_text(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{metric}_sum{labels_text(labels)} {counts[-1]}")
+                lines.append(f"{metric}_count{labels_text(labels)} {cumulative}")
+        for name, (label, callback) in sorted(self._gauges.items()):
+            metric = f"{prefix}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            value = callback()
+            if label is None:
+                lines.append(f"{metric} {value}")
+            else:
+                for label_value, item in sorted(value.items()):
+                    lines.append(f"{metric}{labels_text([(label, label_value)])} {item}")
+        return '\n'.join(lines) + '\n'
+
 class ProxyState:
     """代理服务器状态管理"""
     
     def __init__(self):
-        # 客户端管理
+        # 客户端管理（各客户端的条目由其所在分段的锁保护）
         self.clients = {}  # {client_id: {info, last_heartbeat}}
-        self.pending_requests = defaultdict(deque)  # {client_id: [requests]}
-        self.responses = {}  # {request_id: response_data}
+        self.pending_requests = {}  # {client_id: OrderedDict{request_id: request_data}}
+        self.request_conditions = {}  # {client_id: Condition}，有新请求时唤醒长轮询
+        self.responses = RequestCorrelator()  # 等待客户端响应的请求
+        self.client_pool = ClientPool(heartbeat_timeout=60)  # 1分钟内有心跳的客户端才分配请求
         
-        # 统计信息
-        self.stats = {
-            'start_time': time.time(),
-            'total_requests': 0,
-            'successful_requests': 0,
-            'failed_requests': 0,
-            'active_clients': 0,
-            'feishu_requests': 0,
-            'ws_connections': 0
-        }
+        # 过期登记：客户端按最后心跳，排队请求按分配时的截止时间
+        self.client_expiry = ExpiryHeap()   # 键: client_id
+        self.request_expiry = ExpiryHeap()  # 键: (client_id, request_id)
         
-        # 线程锁
-        self.lock = threading.RLock()
+        # 统计信息：计数器、各路由/领星端点/客户端的延迟直方图和队列深度仪表
+        self.metrics = Metrics()
+        self.start_time = time.time()
+        self.metrics.gauge('active_clients', lambda: len(self.clients))
+        self.metrics.gauge('pending_responses', lambda: len(self.responses))
+        self.metrics.gauge('queued_requests', lambda: {
+            client_id: len(queue) for client_id, queue in list(self.pending_requests.items())
+        }, label='client')
+        
+        # 分段锁（按客户端ID）
+        self._stripes = [threading.RLock() for _ in range(LOCK_STRIPES)]
         
         # 启动清理线程
         self.start_cleanup_thread()
     
+    def _lock_for(self, client_id):
+        """客户端所在分段的锁"""
+        return self._stripes[hash(client_id) % LOCK_STRIPES]
+    
+    # /stats 中始终列出的计数器
+    STAT_COUNTERS = ('total_requests', 'successful_requests', 'failed_requests', 'feishu_requests',
+                     'ws_connections', 'long_polls', 'expired_clients', 'expired_requests')
+    
+    @property
+    def stats(self):
+        """请求统计（由计数器汇总）"""
+        counters = self.metrics.counter_values()
+        return {
+            'start_time': self.start_time,
+            **{name: counters.get(name, 0) for name in self.STAT_COUNTERS},
+            'active_clients': len(self.clients)
+        }
+    
     def start_cleanup_thread(self):
-        """启动定期清理线程"""
+        """启动清理线程（休眠到下一个条目到期，最长 CLEANUP_MAX_INTERVAL 秒）"""
         def cleanup():
             while True:
                 try:
                     self.cleanup_expired_data()
-                    time.sleep(60)  # 每分钟清理一次
                 except Exception as e:
                     logger.error(f"❌ 清理线程异常: {str(e)}")
-                    time.sleep(60)
+                time.sleep(self._cleanup_delay())
         
         cleanup_thread = threading.Thread(target=cleanup, daemon=True)
         cleanup_thread.start()
         logger.info("🧹 清理线程已启动")
     
-    def cleanup_expired_data(self):
-        """清理过期数据"""
-        with self.lock:
-            current_time = time.time()
-            
-            # 清理过期客户端
-            expired_clients = []
-            for client_id, client_info in self.clients.items():
-                if current_time - client_info['last_heartbeat'] > 300:  # 5分钟无心跳
-                    expired_clients.append(client_id)
-            
-            for client_id in expired_clients:
-                logger.warning(f"⚠️ 清理过期客户端: {client_id}")
-                del self.clients[client_id]
-                if client_id in self.pending_requests:
-                    del self.pending_requests[client_id]
-            
-            # 清理过期响应
-            expired_responses = []
-            for request_id, response_data in self.responses.items():
-                response_time = datetime.fromisoformat(response_data['timestamp'])
-                if datetime.now() - response_time > timedelta(hours=1):  # 1小时过期
-                    expired_responses.append(request_id)
-            
-            for request_id in expired_responses:
-                del self.responses[request_id]
-            
-            # 更新统计信息
-            self.stats['active_clients'] = len(self.clients)
+    def _cleanup_delay(self):
+        """距离下一个条目到期的秒数"""
+        deadlines = [t for t in (self.client_expiry.next_expiry(), self.request_expiry.next_expiry()) if t is not None]
+        if not deadlines:
+            return CLEANUP_MAX_INTERVAL
+        return min(max(min(deadlines) - time.time(), 0.01), CLEANUP_MAX_INTERVAL)
+    
+    def cleanup_expired_data(self, now=None):
+        """
+        清理到期的客户端和无人领取的请求
+        只处理堆顶已到期的条目，每个条目只持有其客户端所在分段的锁
+        
+        Returns:
+            tuple: (清理的客户端数, 丢弃的请求数)
+        """
+        now = now or time.time()
+        expired_clients = expired_requests = 0
+        
+        while True:
+            batch = self.client_expiry.pop_expired(now)
+            for client_id in batch:
+                with self._lock_for(client_id):
+                    client_info = self.clients.get(client_id)
+                    if client_info is None:
+                        continue
+                    # 期间有心跳或轮询的客户端按最后心跳顺延，心跳本身不需要更新堆
+                    alive_until = client_info['last_heartbeat'] + CLIENT_TTL
+                    if alive_until > now:
+                        self.client_expiry.schedule(client_id, alive_until)
+                        continue
+                    logger.warning(f"⚠️ 清理过期客户端: {client_id}")
+                    self._remove_client(client_id)
+                    expired_clients += 1
+            if len(batch) < EXPIRY_BATCH:
+                break
+        
+        while True:
+            batch = self.request_expiry.pop_expired(now)
+            for client_id, request_id in batch:
+                with self._lock_for(client_id):
+                    queue = self.pending_requests.get(client_id)
+                    if queue is not None and queue.pop(request_id, None) is not None:
+                        # 分配方已超时放弃，客户端不必再处理
+                        logger.warning(f"⚠️ 丢弃过期未领取的请求: {client_id} - {request_id}")
+                        expired_requests += 1
+            if len(batch) < EXPIRY_BATCH:
+                break
+        
+        if expired_clients:
+            self.metrics.inc('expired_clients', expired_clients)
+        if expired_requests:
+            self.metrics.inc('expired_requests', expired_requests)
+        return expired_clients, expired_requests
     
     def register_client(self, client_id, client_info):
         """注册客户端"""
-        with self.lock:
+        now = time.time()
+        with self._lock_for(client_id):
             self.clients[client_id] = {
                 **client_info,
-                'last_heartbeat': time.time(),
-                'registered_at': time.time()
+                'last_heartbeat': now,
+                'registered_at': now
             }
-            logger.info(f"✅ 客户端注册: {client_id}")
+            self.pending_requests.setdefault(client_id, OrderedDict())
+            self.client_pool.add(client_id)
+            self.client_expiry.schedule(client_id, now + CLIENT_TTL)
+        logger.info(f"✅ 客户端注册: {client_id}")
     
     def unregister_client(self, client_id):
         """注销客户端"""
-        with self.lock:
-            if client_id in self.clients:
-                del self.clients[client_id]
-                if client_id in self.pending_requests:
-                    del self.pending_requests[client_id]
-                logger.info(f"✅ 客户端注销: {client_id}")
+        with self._lock_for(client_id):
+            if client_id not in self.clients:
+                return
+            self._remove_client(client_id)
+        logger.info(f"✅ 客户端注销: {client_id}")
+    
+    def _remove_client(self, client_id):
+        """移除客户端及其请求队列，并唤醒挂起的长轮询（调用方需持有该客户端分段的锁）"""
+        del self.clients[client_id]
+        self.client_expiry.discard(client_id)
+        for request_id in self.pending_requests.pop(client_id, {}):
+            self.request_expiry.discard((client_id, request_id))
+        condition = self.request_conditions.pop(client_id, None)
+        if condition:
+            condition.notify_all()
+        # 已分配给该客户端（含尚未取走）的请求立即失败，由等待线程改派
+        for request_id in self.client_pool.remove(client_id):
+            self.responses.complete(request_id, CLIENT_LOST)
+    
+    def _condition(self, client_id):
+        """获取客户端的请求条件变量（调用方需持有该客户端分段的锁）"""
+        condition = self.request_conditions.get(client_id)
+        if condition is None:
+            condition = threading.Condition(self._lock_for(client_id))
+            self.request_conditions[client_id] = condition
+        return condition
+    
+    def _touch(self, client_id):
+        """记录客户端在线（调用方需持有该客户端分段的锁）"""
+        self.clients[client_id]['last_heartbeat'] = time.time()
+        self.client_pool.heartbeat(client_id)
     
     def update_heartbeat(self, client_id, stats=None):
         """更新客户端心跳"""
-        with self.lock:
+        with self._lock_for(client_id):
             if client_id in self.clients:
-                self.clients[client_id]['last_heartbeat'] = time.time()
+                self._touch(client_id)
                 if stats:
                     self.clients[client_id]['stats'] = stats
                 return True
             return False
     
-    def add_request(self, client_id, request_data):
-        """添加待处理请求"""
-        with self.lock:
+    def add_request(self, client_id, request_data, expires_at=None):
+        """
+        添加待处理请求（同时登记响应等待者）
+        
+        Args:
+            client_id: 客户端ID
+            request_data: 请求数据
+            expires_at: 截止时间，到期仍未被领取的请求会被丢弃（默认30秒后）
+        """
+        request_id = request_data['request_id']
+        with self._lock_for(client_id):
             if client_id not in self.clients:
                 return False
             
-            self.pending_requests[client_id].append(request_data)
-            self.stats['total_requests'] += 1
-            logger.info(f"📥 添加请求到队列: {client_id} - {request_data['request_id']}")
-            return True
+            self.responses.register(request_id)
+            self.pending_requests[client_id][request_id] = request_data
+            self.request_expiry.schedule((client_id, request_id), expires_at or time.time() + 30)
+            self._condition(client_id).notify_all()
+        self.metrics.inc('total_requests')
+        logger.info(f"📥 添加请求到队列: {client_id} - {request_id}")
+        return True
     
-    def get_requests(self, client_id):
-        """获取客户端的待处理请求"""
-        with self.lock:
+    def get_requests(self, client_id, wait=0, limit=None):
+        """
+        获取客户端的待处理请求
+        
+        Args:
+            client_id: 客户端ID
+            wait: 队列为空时最长挂起等待的秒数（长轮询），0表示立即返回
+            limit: 最多返回的请求数（客户端工作队列的剩余容量），其余留在队列中
+        """
+        with self._lock_for(client_id):
             if client_id not in self.clients:
                 return []
             
-            requests_list = list(self.pending_requests[client_id])
-            self.pending_requests[client_id].clear()
+            # 轮询本身说明客户端在线，挂起期间也不会被判定为失联
+            self._touch(client_id)
+            
+            if wait > 0 and not self.pending_requests[client_id]:
+                self.metrics.inc('long_polls')
+                self._condition(client_id).wait_for(
+                    lambda: client_id not in self.clients or self.pending_requests[client_id],
+                    timeout=wait
+                )
+                if client_id not in self.clients:
+                    return []
+                self._touch(client_id)
+            
+            pending = self.pending_requests[client_id]
+            count = len(pending) if limit is None else min(limit, len(pending))
+            requests_list = [pending.popitem(last=False)[1] for _ in range(count)]
+            for request_data in requests_list:
+                self.request_expiry.discard((client_id, request_data['request_id']))
             return requests_list
     
     def store_response(self, request_id, response_data):
-        """存储响应数据"""
-        with self.lock:
-            self.responses[request_id] = response_data
-            self.stats['successful_requests'] += 1
-            logger.info(f"✅ 存储响应: {request_id}")
+        """提交响应数据，直接唤醒等待的请求线程"""
+        if not self.responses.complete(request_id, response_data):
+            logger.warning(f"⚠️ 请求已超时或未知，丢弃响应: {request_id}")
+            return False
+        
+        self.metrics.inc('successful_requests')
+        logger.info(f"✅ 存储响应: {request_id}")
+        return True
     
     def get_response(self, request_id, timeout=30):
-        """获取响应数据（带超时）"""
-        start_time = time.time()
-        
-        while time.time() - start_time < timeout:
-            with self.lock:
-                if request_id in self.responses:
-                    response_data = self.responses.pop(request_id)
-                    return response_data
-            
-            time.sleep(0.1)  # 100ms检查间隔
+        """等待响应数据（带超时）"""
+        response_data = self.responses.wait(request_id, timeout)
+        if response_data is not None:
+            return response_data
         
         # 超时处理
-        self.stats['failed_requests'] += 1
+        self.metrics.inc('failed_requests')
         logger.warning(f"⚠️ 响应超时: {request_id}")
         return None
     
-    def get_available_client(self):
-        """获取可用的客户端"""
-        with self.lock:
-            for client_id, client_info in self.clients.items():
-                if time.time() - client_info['last_heartbeat'] < 60:  # 1分钟内有心跳
-                    return client_id
-            return None
+    def client_snapshot(self):
+        """各客户端信息的快照（逐个在其分段锁内复制，不阻塞其他客户端）"""
+        snapshot = {}
+        for client_id in list(self.clients):
+            with self._lock_for(client_id):
+                client_info = self.clients.get(client_id)
+                if client_info is not None:
+                    snapshot[client_id] = dict(client_info)
+        return snapshot
+    
+    def get_available_client(self, request_id, exclude=()):
+        """获取负载最低的可用客户端（并计入其在途请求）"""
+        return self.client_pool.acquire(request_id, exclude=exclude)
+    
+    def dispatch(self, request_data, timeout=30):
+        """
+        把请求分配给负载最低的客户端并等待响应；
+        客户端中途失联或回复502/503/504时，在剩余时间内改派给其他客户端
+        
+        Args:
+            request_data: 请求数据
+            timeout: 总超时时间（秒）
+        
+        Returns:
+            响应数据；超时返回None，没有可用客户端返回CLIENT_LOST
+        """
+        request_id = request_data['request_id']
+        deadline = time.time() + timeout
+        tried = []
+        response_data = CLIENT_LOST
+        
+        while time.time() < deadline:
+            client_id = self.get_available_client(request_id, exclude=tried)
+            if client_id is None:
+                break
+            tried.append(client_id)
+            
+            started = time.time()
+            if not self.add_request(client_id, request_data, expires_at=deadline):
+                self.client_pool.release(client_id, request_id, success=False)
+                continue
+            logger.info(f"📤 飞书请求已转发: {request_id} -> {client_id}")
+            
+            response_data = self.get_response(request_id, timeout=deadline - time.time())
+            failed = response_data is None or response_data is CLIENT_LOST or self._is_retryable(response_data)
+            self.client_pool.release(client_id, request_id,
+                                     latency=None if failed else time.time() - started, success=not failed)
+            if not failed:
+                self.metrics.observe('tunnel_latency', time.time() - started, client=client_id)
+            if response_data is None or not failed:
+                return response_data
+            logger.warning(f"⚠️ 客户端 {client_id} 未能处理请求 {request_id}，尝试改派")
+        
+        return response_data
+    
+    @staticmethod
+    def _is_retryable(response_data):
+        """客户端回复的状态码是否表示本地服务器不可达（状态码可能在顶层或 response 字段中）"""
+        if not isinstance(response_data, dict):
+            return False
+        status_code = response_data.get('status_code')
+        if status_code is None and isinstance(response_data.get('response'), dict):
+            status_code = response_data['response'].get('status_code')
+        return status_code in RETRYABLE_STATUS
 
 # 创建全局状态实例
 proxy_state = ProxyState()
 
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_route(response):
+    """按路由记录请求耗时（长轮询包含挂起时间，流式响应记录到响应头发出为止）"""
+    started = g.get('request_started')
+    if started is not None:
+        proxy_state.metrics.observe('route_latency', time.perf_counter() - started,
+                                    route=request.url_rule.rule if request.url_rule else 'unmatched')
+    return response
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """健康检查接口"""
@@ -267,19 +1011,26 @@ def heartbeat():
 
 @app.route('/poll_requests', methods=['GET'])
 def poll_requests():
-    """轮询请求接口"""
+    """轮询请求接口（带 wait 参数时长轮询：无请求则挂起至有请求或超时；max 限制单次领取数量）"""
     try:
         client_id = request.args.get('client_id')
         
         if not client_id:
             return jsonify({'error': '客户端ID不能为空'}), 400
         
-        requests_list = proxy_state.get_requests(client_id)
+        try:
+            wait = min(max(float(request.args.get('wait', 0)), 0), POLL_MAX_WAIT)
+            limit = max(int(request.args['max']), 1) if 'max' in request.args else None
+        except ValueError:
+            return jsonify({'error': 'wait或max参数无效'}), 400
+        
+        requests_list = proxy_state.get_requests(client_id, wait=wait, limit=limit)
         
         return jsonify({
             'status': 'success',
             'requests': requests_list,
-            'count': len(requests_list)
+            'count': len(requests_list),
+            'wait': wait
         })
         
     except Exception as e:
@@ -296,7 +1047,8 @@ def submit_response():
         if not request_id:
             return jsonify({'error': '请求ID不能为空'}), 400
         
-        proxy_state.store_response(request_id, data)
+        if not proxy_state.store_response(request_id, data):
+            return jsonify({'error': '请求已超时或不存在', 'request_id': request_id}), 410
         
         return jsonify({
             'status': 'success',
@@ -311,16 +1063,7 @@ def submit_response():
 def feishu_webhook():
     """飞书webhook接口"""
     try:
-        proxy_state.stats['feishu_requests'] += 1
-        
-        # 获取可用客户端
-        client_id = proxy_state.get_available_client()
-        if not client_id:
-            logger.error("❌ 没有可用的客户端处理飞书请求")
-            return jsonify({
-                'error': '服务暂时不可用，请稍后重试',
-                'code': 'NO_AVAILABLE_CLIENT'
-            }), 503
+        proxy_state.metrics.inc('feishu_requests')
         
         # 生成请求ID
         request_id = str(uuid.uuid4())
@@ -336,18 +1079,16 @@ def feishu_webhook():
             'timestamp': datetime.now().isoformat()
         }
         
-        # 添加到请求队列
-        if not proxy_state.add_request(client_id, request_data):
+        # 分配给负载最低的客户端并等待响应（失败时自动改派）
+        response_data = proxy_state.dispatch(request_data, timeout=30)
+        
+        if response_data is CLIENT_LOST:
+            logger.error("❌ 没有可用的客户端处理飞书请求")
             return jsonify({
-                'error': '客户端不可用',
-                'code': 'CLIENT_UNAVAILABLE'
+                'error': '服务暂时不可用，请稍后重试',
+                'code': 'NO_AVAILABLE_CLIENT'
             }), 503
         
-        logger.info(f"📤 飞书请求已转发: {request_id} -> {client_id}")
-        
-        # 等待响应
-        response_data = proxy_state.get_response(request_id, timeout=30)
-        
         if response_data:
             # 构建Flask响应
             status_code = response_data.get('status_code', 200)
@@ -388,24 +1129,33 @@ def feishu_webhook():
 def get_stats():
     """获取统计信息"""
     try:
-        uptime = time.time() - proxy_state.stats['start_time']
+        state_stats = proxy_state.stats
+        uptime = time.time() - state_stats['start_time']
         
         stats = {
-            **proxy_state.stats,
+            **state_stats,
             'uptime_seconds': uptime,
             'uptime_hours': uptime / 3600,
+            'pending_responses': len(proxy_state.responses),
+            'queued_requests': len(proxy_state.request_expiry),
+            'correlation': proxy_state.responses.stats,
+            'client_pool': proxy_state.client_pool.get_stats(),
+            'latency': {
+                'routes': proxy_state.metrics.latency_summary('route_latency'),
+                'upstream': proxy_state.metrics.latency_summary('upstream_latency'),
+                'tunnel': proxy_state.metrics.latency_summary('tunnel_latency')
+            },
             'clients': {}
         }
         
         # 添加客户端信息
-        with proxy_state.lock:
-            for client_id, client_info in proxy_state.clients.items():
-                stats['clients'][client_id] = {
-                    'local_server': client_info.get('local_server'),
-                    'last_heartbeat': client_info['last_heartbeat'],
-                    'registered_at': client_info['registered_at'],
-                    'stats': client_info.get('stats', {})
-                }
+        for client_id, client_info in proxy_state.client_snapshot().items():
+            stats['clients'][client_id] = {
+                'local_server': client_info.get('local_server'),
+                'last_heartbeat': client_info['last_heartbeat'],
+                'registered_at': client_info['registered_at'],
+                'stats': client_info.get('stats', {})
+            }
         
         return jsonify(stats)
         
@@ -413,6 +1163,12 @@ def get_stats():
         logger.error(f"❌ 获取统计信息失败: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus指标接口"""
+    return Response(proxy_state.metrics.prometheus('lingxing_proxy'),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # 原有的领星API代理功能保持不变
 @app.route('/api/lingxing/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
 def proxy_to_lingxing(path):
@@ -421,26 +1177,25 @@ def proxy_to_lingxing(path):
         target_url = f"https://openapi.lingxing.com/{path}"
         
         # 获取请求数据
-        headers = dict(request.headers)
+        headers = upstream_request_headers(request.headers)
         data = request.get_data()
         params = dict(request.args)
         
-        # 发送请求到领星API
+        # 发送请求到领星API（流式读取响应）
+        upstream_started = time.perf_counter()
         response = requests.request(
             method=request.method,
             url=target_url,
             headers=headers,
             data=data,
             params=params,
-            timeout=30
+            timeout=30,
+            stream=True
         )
+        proxy_state.metrics.observe('upstream_latency', time.perf_counter() - upstream_started, endpoint='/' + path)
         
-        # 构建响应
-        excluded_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
-        headers = [(name, value) for (name, value) in response.raw.headers.items()
-                  if name.lower() not in excluded_headers]
-        
-        return Response(response.content, response.status_code, headers)
+        # 流式返回响应（原样转发压缩内容）
+        return stream_upstream_response(response)
         
     except Exception as e:
         logger.error(f"❌ 领星API代理失败: {str(e)}")
@@ -743,6 +1498,16 @@ def main():
     
     args = parser.parse_args()
     
+    # 配置日志
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('/opt/lingxing-proxy/cloud_proxy.log', encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+    
     # 创建并启动服务器
     server = CloudProxyServer(
         host=args.host,
@@ -34,6 +34,70 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 各代理按单文件上传到云服务器，以下转发辅助函数在Flask版代理中保持逐字相同（test/test_proxy_copies.py 检查）
+# 逐跳头部：只对单个连接有效，代理不应转发（RFC 7230 6.1节）
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailer', 'trailers', 'transfer-encoding', 'upgrade'
+}
+
+# 流式转发时每次读取的字节数
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def strip_hop_by_hop(headers, extra=()) -> list:
+    """
+    去掉逐跳头部（包括Connection头中列出的头部）
+
+    Args:
+        headers: 原始头部（支持重复头部的items()）
+        extra: 额外需要去掉的头部（小写）
+
+    Returns:
+        list: (名称, 值) 列表
+    """
+    listed = {token.strip().lower() for token in headers.get('Connection', '').split(',') if token.strip()}
+    dropped = HOP_BY_HOP_HEADERS | listed | set(extra)
+    return [(name, value) for name, value in headers.items() if name.lower() not in dropped]
+
+def upstream_request_headers(headers) -> dict:
+    """
+    构造转发到上游的请求头：去掉逐跳头部、Host、Content-Length（由requests重新计算）和
+    只给代理看的X-Proxy-Client，客户端未声明Accept-Encoding时要求上游不压缩，避免把压缩内容转给不支持的客户端
+
+    Args:
+        headers: 客户端请求头
+
+    Returns:
+        dict: 上游请求头
+    """
+    forwarded = dict(strip_hop_by_hop(headers, extra=('host', 'content-length', 'x-proxy-client')))
+    if not any(name.lower() == 'accept-encoding' for name in forwarded):
+        forwarded['Accept-Encoding'] = 'identity'
+    return forwarded
+
+def stream_upstream_response(upstream: requests.Response, extra_headers: dict = None) -> Response:
+    """
+    把上游响应（需以stream=True发出）逐块原样转发给客户端
+    读取原始字节不解压，Content-Encoding/Content-Length保持与上游一致，内存占用与响应大小无关
+
+    Args:
+        upstream: 上游响应
+        extra_headers: 额外添加的响应头
+
+    Returns:
+        Response: 流式Flask响应
+    """
+    def generate():
+        try:
+            for chunk in upstream.raw.stream(STREAM_CHUNK_SIZE, decode_content=False):
+                yield chunk
+        finally:
+            upstream.close()
+
+    headers = strip_hop_by_hop(upstream.raw.headers)
+    headers.extend((extra_headers or {}).items())
+    return Response(generate(), status=upstream.status_code, headers=headers, direct_passthrough=True)
+
 class CloudProxyServerWS:
     """
     🚀 支持WebSocket的云代理服务器类
@@ -200,14 +264,9 @@ class CloudProxyServerWS:
             
             # 获取原始请求信息
             method = request.method
-            headers = dict(request.headers)
+            headers = upstream_request_headers(request.headers)
             params = request.args.to_dict()
             
-            # 移除代理相关的头部
-            headers_to_remove = ['Host', 'Content-Length']
-            for header in headers_to_remove:
-                headers.pop(header, None)
-            
             # 设置User-Agent
             headers['User-Agent'] = 'LingXing-Cloud-Proxy/1.0'
             
@@ -219,7 +278,8 @@ class CloudProxyServerWS:
                     target_url,
                     params=params,
                     headers=headers,
-                    timeout=30
+                    timeout=30,
+                    stream=True
                 )
             elif method == 'POST':
                 if request.is_json:
@@ -228,7 +288,8 @@ class CloudProxyServerWS:
                         json=request.get_json(),
                         params=params,
                         headers=headers,
-                        timeout=30
+                        timeout=30,
+                        stream=True
                     )
                 else:
                     response = self.session.post(
@@ -236,7 +297,8 @@ class CloudProxyServerWS:
                         data=request.get_data(),
                         params=params,
                         headers=headers,
-                        timeout=30
+                        timeout=30,
+                        stream=True
                     )
             else:
                 return jsonify({'error': f'不支持的HTTP方法: {method}'}), 405
@@ -252,19 +314,11 @@ class CloudProxyServerWS:
                 self.stats['failed_requests'] += 1
                 logger.warning(f"⚠️ 请求失败: {response.status_code} - {response_time:.2f}s")
             
-            # 构建响应
-            try:
-                response_data = response.json()
-            except:
-                response_data = response.text
-            
-            # 添加代理信息到响应头
-            flask_response = jsonify(response_data)
-            flask_response.status_code = response.status_code
-            flask_response.headers['X-Proxy-Server'] = 'LingXing-Cloud-Proxy-WS'
-            flask_response.headers['X-Response-Time'] = str(response_time)
-            
-            return flask_response
+            # 流式返回响应（原样转发压缩内容，不在代理中解析或重新编码）
+            return stream_upstream_response(response, {
+                'X-Proxy-Server': 'LingXing-Cloud-Proxy-WS',
+                'X-Response-Time': str(response_time)
+            })
             
         except Exception as e:
             self.stats['failed_requests'] += 1
@@ -8,9 +8,12 @@
 import requests
 import json
 import time
+import queue
+import itertools
 import threading
 import logging
 from datetime import datetime
+from requests.adapters import HTTPAdapter
 import signal
 import sys
 
@@ -21,37 +24,101 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 请求优先级：数值越小越先处理
+PRIORITY_STOP = -1          # 停止工作线程
+PRIORITY_VERIFICATION = 0   # 飞书URL校验，需要在1秒内应答
+PRIORITY_INTERACTIVE = 1    # 卡片回调和命令，用户正在等待
+PRIORITY_EVENT = 2          # 普通事件推送
+
+# 用户正在等待回复的事件类型：收到消息（机器人命令）和卡片回调
+INTERACTIVE_EVENT_TYPES = {'im.message.receive_v1', 'card.action.trigger'}
+
+def request_priority(request_data):
+    """
+    根据请求内容确定处理优先级
+    
+    Args:
+        request_data: 轮询得到的请求数据
+    
+    Returns:
+        int: 优先级，数值越小越先处理
+    """
+    envelope = request_data.get('data') or {}
+    body = envelope.get('json_data') or envelope
+    if body.get('type') == 'url_verification':
+        return PRIORITY_VERIFICATION
+    endpoint = envelope.get('endpoint') or request_data.get('endpoint', '')
+    if endpoint.endswith('/command') or 'action' in body:
+        return PRIORITY_INTERACTIVE
+    # 命令和普通事件都推送到同一个Webhook，按事件类型区分
+    event_type = (body.get('header') or {}).get('event_type')
+    if event_type in INTERACTIVE_EVENT_TYPES:
+        return PRIORITY_INTERACTIVE
+    return PRIORITY_EVENT
+
 class HTTPPollingClient:
     """
     🔄 HTTP轮询客户端
     通过HTTP轮询方式处理飞书请求
     """
     
-    def __init__(self, cloud_server_url='http://175.178.183.96:8080', local_server_url='http://127.0.0.1:8000'):
+    def __init__(self, cloud_server_url='http://175.178.183.96:8080', local_server_url='http://127.0.0.1:8000',
+                 poll_wait=25, max_workers=8, queue_limit=32, stale_after=25, enqueue_timeout=2):
         """
         初始化客户端
         
         Args:
             cloud_server_url: 云服务器地址
             local_server_url: 本地服务器地址
+            poll_wait: 长轮询挂起时间（秒），0表示使用固定间隔的短轮询
+            max_workers: 处理请求的工作线程数（也是到本地服务器的最大连接数）
+            queue_limit: 等待处理的请求上限，队列满时暂停轮询
+            stale_after: 请求在本地排队超过该秒数后丢弃（云服务器已放弃等待）
+            enqueue_timeout: 一批请求入队的最长等待秒数，超时未入队的请求退回云服务器
         """
         self.cloud_server_url = cloud_server_url
         self.local_server_url = local_server_url
         self.client_id = f"http_client_{int(time.time())}"
+        self.poll_wait = poll_wait
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self.stale_after = stale_after
+        self.enqueue_timeout = enqueue_timeout
         
         # 运行状态
         self.running = False
+        # 服务器是否支持长轮询（以响应中是否带回 wait 字段判断）
+        self.long_poll = False
         
-        # HTTP会话
+        # HTTP会话，连接池大小与工作线程数一致，满时等待而不是新建连接
         self.session = requests.Session()
         self.session.timeout = 10
+        adapter = HTTPAdapter(pool_maxsize=max_workers + 2, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
+        # 有界工作队列：(优先级, 序号, 入队时间, 请求数据)
+        self.work_queue = queue.PriorityQueue(maxsize=queue_limit)
+        self.sequence = itertools.count()
+        self.capacity_changed = threading.Condition()
+        self.workers = []
+        self.stats_lock = threading.Lock()
         
         # 统计信息
         self.stats = {
             'requests_processed': 0,
             'start_time': time.time(),
             'last_poll_time': None,
-            'errors': 0
+            'polls': 0,
+            'errors': 0,
+            'max_workers': max_workers,
+            'active_workers': 0,
+            'queue_limit': queue_limit,
+            'queue_depth': 0,
+            'saturated': False,
+            'backpressure_waits': 0,
+            'dropped_stale': 0,
+            'rejected_full': 0
         }
         
         logger.info(f"🔄 HTTP轮询客户端初始化完成")
@@ -91,28 +158,32 @@ class HTTPPollingClient:
     def poll_for_requests(self):
         """
         轮询云服务器获取待处理请求
+        服务器支持长轮询时连接会挂起到有请求到达或 poll_wait 秒后才返回；
+        每次最多领取工作队列剩余容量的请求，其余留在服务器端
         """
         try:
+            capacity = max(self.queue_limit - self.work_queue.qsize(), 1)
             response = self.session.get(
                 f"{self.cloud_server_url}/poll_requests",
-                params={'client_id': self.client_id},
-                timeout=5
+                params={'client_id': self.client_id, 'wait': self.poll_wait, 'max': capacity},
+                timeout=self.poll_wait + 10
             )
             
             self.stats['last_poll_time'] = datetime.now().isoformat()
+            self.stats['polls'] += 1
             
             if response.status_code == 200:
                 data = response.json()
                 requests_list = data.get('requests', [])
+                self.long_poll = self.poll_wait > 0 and bool(data.get('wait'))
                 
                 if requests_list:
                     logger.info(f"📥 收到 {len(requests_list)} 个待处理请求")
                     
+                    # 整批共用一个入队期限，轮询线程不会因队列满而长时间阻塞（心跳照常发送）
+                    deadline = time.time() + self.enqueue_timeout
                     for request_data in requests_list:
-                        threading.Thread(
-                            target=self.handle_feishu_request,
-                            args=(request_data,)
-                        ).start()
+                        self.enqueue_request(request_data, timeout=max(deadline - time.time(), 0))
                 
                 return True
             elif response.status_code == 204:
@@ -130,6 +201,102 @@ class HTTPPollingClient:
             self.stats['errors'] += 1
             return False
     
+    def enqueue_request(self, request_data, timeout=None):
+        """
+        按优先级放入工作队列；队列已满时最多等待timeout秒（不支持 max 参数的旧服务器可能一次返回更多请求），
+        仍然放不下时回复503，由云服务器改派或直接返回失败，而不是在本地排到过期
+        
+        Args:
+            request_data: 飞书请求数据
+            timeout: 最长等待秒数，默认使用 enqueue_timeout
+        
+        Returns:
+            bool: 是否已放入工作队列
+        """
+        if timeout is None:
+            timeout = self.enqueue_timeout
+        try:
+            self.work_queue.put((request_priority(request_data), next(self.sequence), time.time(), request_data),
+                                timeout=timeout)
+            return True
+        except queue.Full:
+            pass
+        
+        with self.stats_lock:
+            self.stats['rejected_full'] += 1
+        request_id = request_data.get('request_id')
+        logger.warning(f"🚫 工作队列已满，退回请求: {request_id}")
+        if request_id:
+            self.send_error_response(request_id, 'client queue full', status_code=503)
+        return False
+    
+    def wait_for_capacity(self, timeout):
+        """
+        工作队列已满时暂停轮询，等待工作线程腾出位置
+        
+        Args:
+            timeout: 最长等待秒数
+        
+        Returns:
+            bool: 是否有空位可以继续轮询
+        """
+        with self.capacity_changed:
+            depth = self.work_queue.qsize()
+            if depth < self.queue_limit:
+                # 回落到一半以下才解除饱和状态，避免在满载边缘反复切换
+                if depth <= self.queue_limit // 2:
+                    self.stats['saturated'] = False
+                return True
+            
+            if not self.stats['saturated']:
+                logger.warning(f"⏸️ 工作队列已满（{self.queue_limit}），暂停轮询")
+            self.stats['saturated'] = True
+            self.stats['backpressure_waits'] += 1
+            available = self.capacity_changed.wait_for(
+                lambda: self.work_queue.qsize() < self.queue_limit or not self.running,
+                timeout=timeout
+            )
+            return available and self.running
+    
+    def start_workers(self):
+        """启动固定数量的工作线程"""
+        for index in range(self.max_workers - len(self.workers)):
+            worker = threading.Thread(target=self.worker_loop, name=f"polling-worker-{index}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+    
+    def stop_workers(self):
+        """通知工作线程退出（队列中尚未处理的请求由云服务器超时后改派）"""
+        for _ in self.workers:
+            try:
+                self.work_queue.put((PRIORITY_STOP, next(self.sequence), 0, None), timeout=1)
+            except queue.Full:
+                break
+        self.workers = []
+    
+    def worker_loop(self):
+        """工作线程：按优先级取出请求处理"""
+        while True:
+            _, _, enqueued_at, request_data = self.work_queue.get()
+            with self.capacity_changed:
+                self.capacity_changed.notify_all()
+            if request_data is None:
+                break
+            
+            if time.time() - enqueued_at > self.stale_after:
+                with self.stats_lock:
+                    self.stats['dropped_stale'] += 1
+                logger.warning(f"⌛ 请求排队超时，已丢弃: {request_data.get('request_id')}")
+                continue
+            
+            with self.stats_lock:
+                self.stats['active_workers'] += 1
+            try:
+                self.handle_feishu_request(request_data)
+            finally:
+                with self.stats_lock:
+                    self.stats['active_workers'] -= 1
+    
     def handle_feishu_request(self, request_data):
         """
         处理飞书请求
@@ -190,7 +357,8 @@ class HTTPPollingClient:
             # 发送响应回云服务器
             self.send_response(request_id, response_info)
             
-            self.stats['requests_processed'] += 1
+            with self.stats_lock:
+                self.stats['requests_processed'] += 1
             logger.info(f"✅ 飞书请求处理完成: {request_id} - {response.status_code}")
             
         except requests.exceptions.ConnectionError:
@@ -260,6 +428,7 @@ class HTTPPollingClient:
         发送心跳到云服务器
         """
         try:
+            self.stats['queue_depth'] = self.work_queue.qsize()
             heartbeat_data = {
                 'client_id': self.client_id,
                 'timestamp': datetime.now().isoformat(),
@@ -287,16 +456,21 @@ class HTTPPollingClient:
         
         # 注册客户端
         self.register_client()
+        self.start_workers()
         
         # 轮询循环
-        poll_interval = 2  # 2秒轮询间隔
+        poll_interval = 2  # 短轮询间隔（服务器不支持长轮询或轮询失败时）
         heartbeat_interval = 30  # 30秒心跳间隔
         last_heartbeat = time.time()
         
         try:
             while self.running:
-                # 轮询请求
-                self.poll_for_requests()
+                # 工作队列满时不再领取请求，请求留在服务器端（心跳照常发送，上报饱和状态）
+                if self.wait_for_capacity(timeout=heartbeat_interval):
+                    # 轮询请求（长轮询时在服务器端挂起等待）
+                    success = self.poll_for_requests()
+                else:
+                    success = True
                 
                 # 发送心跳
                 current_time = time.time()
@@ -304,8 +478,9 @@ class HTTPPollingClient:
                     self.send_heartbeat()
                     last_heartbeat = current_time
                 
-                # 等待下次轮询
-                time.sleep(poll_interval)
+                # 长轮询返回后立即发起下一次，否则等待下次轮询
+                if not (success and self.long_poll):
+                    time.sleep(poll_interval)
                 
         except KeyboardInterrupt:
             logger.info("🛑 收到停止信号")
@@ -320,6 +495,9 @@ class HTTPPollingClient:
         """
         logger.info("🛑 停止HTTP轮询客户端")
         self.running = False
+        with self.capacity_changed:
+            self.capacity_changed.notify_all()
+        self.stop_workers()
         
         # 发送注销消息
         try:
@@ -347,6 +525,7 @@ class HTTPPollingClient:
         uptime = time.time() - self.stats['start_time']
         return {
             **self.stats,
+            'queue_depth': self.work_queue.qsize(),
             'uptime_seconds': uptime,
             'uptime_hours': uptime / 3600
         }
@@ -358,13 +537,19 @@ def main():
     parser = argparse.ArgumentParser(description='🔄 HTTP轮询客户端')
     parser.add_argument('--cloud-server', default='http://175.178.183.96:8080', help='云服务器地址')
     parser.add_argument('--local-server', default='http://127.0.0.1:8000', help='本地服务器地址')
+    parser.add_argument('--poll-wait', type=int, default=25, help='长轮询挂起时间（秒），0为短轮询')
+    parser.add_argument('--max-workers', type=int, default=8, help='处理请求的工作线程数')
+    parser.add_argument('--queue-limit', type=int, default=32, help='等待处理的请求上限，满时暂停轮询')
     
     args = parser.parse_args()
     
     # 创建客户端
     client = HTTPPollingClient(
         cloud_server_url=args.cloud_server,
-        local_server_url=args.local_server
+        local_server_url=args.local_server,
+        poll_wait=args.poll_wait,
+        max_workers=args.max_workers,
+        queue_limit=args.queue_limit
     )
     
     # 设置信号处理
@@ -6,14 +6,22 @@
 解决IP白名单问题的完整解决方案
 """
 
+import os
+import math
+import zlib
+import hashlib
 import logging
 import time
 import json
 import traceback
 import uuid
+import bisect
+import random
+import itertools
+from collections import OrderedDict, deque
 from datetime import datetime
-from typing import Dict, Any, Optional
-from flask import Flask, request, jsonify, Response
+from typing import Dict, Any, List, Optional
+from flask import Flask, request, jsonify, Response, g
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, disconnect
 import requests
@@ -22,17 +30,972 @@ from urllib3.util.retry import Retry
 import argparse
 import threading
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('unified_proxy.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+# 各代理按单文件上传到云服务器，以下转发辅助函数在Flask版代理中保持逐字相同（test/test_proxy_copies.py 检查）
+# 逐跳头部：只对单个连接有效，代理不应转发（RFC 7230 6.1节）
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailer', 'trailers', 'transfer-encoding', 'upgrade'
+}
+
+# 流式转发时每次读取的字节数
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def strip_hop_by_hop(headers, extra=()) -> list:
+    """
+    去掉逐跳头部（包括Connection头中列出的头部）
+
+    Args:
+        headers: 原始头部（支持重复头部的items()）
+        extra: 额外需要去掉的头部（小写）
+
+    Returns:
+        list: (名称, 值) 列表
+    """
+    listed = {token.strip().lower() for token in headers.get('Connection', '').split(',') if token.strip()}
+    dropped = HOP_BY_HOP_HEADERS | listed | set(extra)
+    return [(name, value) for name, value in headers.items() if name.lower() not in dropped]
+
+def upstream_request_headers(headers) -> dict:
+    """
+    构造转发到上游的请求头：去掉逐跳头部、Host、Content-Length（由requests重新计算）和
+    只给代理看的X-Proxy-Client，客户端未声明Accept-Encoding时要求上游不压缩，避免把压缩内容转给不支持的客户端
+
+    Args:
+        headers: 客户端请求头
+
+    Returns:
+        dict: 上游请求头
+    """
+    forwarded = dict(strip_hop_by_hop(headers, extra=('host', 'content-length', 'x-proxy-client')))
+    if not any(name.lower() == 'accept-encoding' for name in forwarded):
+        forwarded['Accept-Encoding'] = 'identity'
+    return forwarded
+
+def stream_upstream_response(upstream: requests.Response, extra_headers: dict = None) -> Response:
+    """
+    把上游响应（需以stream=True发出）逐块原样转发给客户端
+    读取原始字节不解压，Content-Encoding/Content-Length保持与上游一致，内存占用与响应大小无关
+
+    Args:
+        upstream: 上游响应
+        extra_headers: 额外添加的响应头
+
+    Returns:
+        Response: 流式Flask响应
+    """
+    def generate():
+        try:
+            for chunk in upstream.raw.stream(STREAM_CHUNK_SIZE, decode_content=False):
+                yield chunk
+        finally:
+            upstream.close()
+
+    headers = strip_hop_by_hop(upstream.raw.headers)
+    headers.extend((extra_headers or {}).items())
+    return Response(generate(), status=upstream.status_code, headers=headers, direct_passthrough=True)
+
+class PendingRequest:
+    """等待本地服务器响应的请求"""
+
+    __slots__ = ('created_at', 'event', 'response', 'error')
+
+    def __init__(self):
+        self.created_at = time.time()
+        self.event = threading.Event()
+        self.response = None
+        self.error = None
+
+class RequestCorrelator:
+    """
+    请求/响应关联表
+    按请求ID登记等待者，响应到达时直接唤醒等待线程；
+    条目只由等待方移除（拿到响应或超时），迟到和重复的响应直接丢弃
+    """
+
+    def __init__(self):
+        self._pending = {}  # {request_id: PendingRequest}
+        self._lock = threading.Lock()
+        self.stats = {
+            'completed': 0,
+            'timeouts': 0,
+            'late_responses': 0
+        }
+
+    def register(self, request_id: str) -> PendingRequest:
+        """
+        登记等待响应的请求（需在请求发出之前调用，避免响应先于登记到达）
+
+        Args:
+            request_id: 请求ID
+
+        Returns:
+            PendingRequest: 等待者
+        """
+        pending = PendingRequest()
+        with self._lock:
+            self._pending[request_id] = pending
+        return pending
+
+    def complete(self, request_id: str, response: Any) -> bool:
+        """
+        写入响应并唤醒等待者
+
+        Args:
+            request_id: 请求ID
+            response: 响应数据
+
+        Returns:
+            bool: 是否有等待者（False表示请求已超时、未知或重复响应）
+        """
+        with self._lock:
+            pending = self._pending.get(request_id)
+            if pending is None or pending.event.is_set():
+                self.stats['late_responses'] += 1
+                return False
+            pending.response = response
+            pending.event.set()
+            self.stats['completed'] += 1
+        return True
+
+    def wait(self, request_id: str, timeout: float) -> Optional[Any]:
+        """
+        阻塞等待响应，超时后注销请求
+
+        Args:
+            request_id: 请求ID
+            timeout: 超时时间（秒）
+
+        Returns:
+            响应数据，超时或未登记时返回None
+        """
+        with self._lock:
+            pending = self._pending.get(request_id)
+        if pending is None:
+            return None
+
+        pending.event.wait(timeout)
+        with self._lock:
+            # 超时与响应到达可能同时发生，以注销时是否已完成为准
+            self._pending.pop(request_id, None)
+            if pending.event.is_set():
+                return pending.response
+            self.stats['timeouts'] += 1
+        return None
+
+    def cancel(self, request_id: str):
+        """注销请求（转发失败时调用）"""
+        with self._lock:
+            self._pending.pop(request_id, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+# 本地客户端断开或失联时，用于唤醒其在途请求的响应标记
+CLIENT_LOST = {'status_code': 503, 'error': '本地客户端已断开'}
+
+# 这些状态码表示本地客户端无法连到本地服务器，可改派给其他客户端
+RETRYABLE_STATUS = {502, 503, 504}
+
+# 失败的请求按此延迟（秒）计入惩罚值，反复失败的客户端会自然少分配
+FAILURE_PENALTY = 5.0
+
+# 惩罚值在此时间（秒）内线性衰减到0，失败过的客户端之后重新平等参与分配
+PENALTY_DECAY = 30.0
+
+class TunnelClient:
+    """隧道客户端的负载信息"""
+
+    __slots__ = ('client_id', 'requests', 'ewma_latency', 'last_heartbeat', 'completed', 'failures',
+                 'penalty', 'penalized_at')
+
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.requests = set()  # 在途请求ID
+        self.ewma_latency = None
+        self.last_heartbeat = time.time()
+        self.completed = 0
+        self.failures = 0
+        self.penalty = 0.0     # 失败惩罚（秒），随时间线性衰减
+        self.penalized_at = 0.0
+
+    def current_penalty(self, now: float) -> float:
+        """当前的失败惩罚值"""
+        if not self.penalty:
+            return 0.0
+        return self.penalty * max(0.0, 1 - (now - self.penalized_at) / PENALTY_DECAY)
+
+    def score(self, now: float) -> float:
+        """选择客户端时比较的延迟：响应延迟EWMA加上衰减后的失败惩罚"""
+        return (self.ewma_latency or 0.0) + self.current_penalty(now)
+
+class ClientPool:
+    """
+    本地隧道客户端池
+    记录每个客户端的在途请求数和响应延迟EWMA，按"两次随机选择"挑出负载较低的客户端；
+    失败按随时间衰减的惩罚值计入，重新注册时清零；
+    心跳超时的客户端不再分配新请求（排空），移除时返回其在途请求以便改派
+    """
+
+    def __init__(self, heartbeat_timeout: float = 90, ewma_alpha: float = 0.3):
+        """
+        初始化客户端池
+
+        Args:
+            heartbeat_timeout: 超过此时间（秒）无心跳的客户端不再分配请求
+            ewma_alpha: 延迟EWMA的平滑系数
+        """
+        self.heartbeat_timeout = heartbeat_timeout
+        self.ewma_alpha = ewma_alpha
+        self._clients = {}  # {client_id: TunnelClient}
+        self._lock = threading.Lock()
+        self.stats = {
+            'dispatched': 0,
+            'retried': 0,
+            'no_client': 0
+        }
+
+    def add(self, client_id: str):
+        """加入客户端（已存在时刷新心跳并清除失败惩罚）"""
+        with self._lock:
+            client = self._clients.get(client_id)
+            if client is None:
+                self._clients[client_id] = TunnelClient(client_id)
+            else:
+                client.last_heartbeat = time.time()
+                client.penalty = 0.0
+
+    def remove(self, client_id: str) -> List[str]:
+        """
+        移除客户端
+
+        Returns:
+            List[str]: 该客户端的在途请求ID（调用方应使其立即失败以便改派）
+        """
+        with self._lock:
+            client = self._clients.pop(client_id, None)
+            return list(client.requests) if client else []
+
+    def heartbeat(self, client_id: str) -> bool:
+        """刷新客户端心跳，返回客户端是否在池中"""
+        with self._lock:
+            client = self._clients.get(client_id)
+            if client is None:
+                return False
+            client.last_heartbeat = time.time()
+            return True
+
+    def acquire(self, request_id: str, exclude=()) -> Optional[str]:
+        """
+        为请求挑选客户端并计入在途数
+
+        Args:
+            request_id: 请求ID
+            exclude: 不参与选择的客户端（本请求已失败过的）
+
+        Returns:
+            Optional[str]: 客户端ID，没有可用客户端时返回None
+        """
+        with self._lock:
+            now = time.time()
+            candidates = [
+                client for client_id, client in self._clients.items()
+                if client_id not in exclude and now - client.last_heartbeat < self.heartbeat_timeout
+            ]
+            if not candidates:
+                self.stats['no_client'] += 1
+                return None
+
+            # 两次随机选择：随机取两个，选在途请求少的（相同时选延迟加惩罚低的）
+            candidates = random.sample(candidates, min(2, len(candidates)))
+            client = min(candidates, key=lambda c: (len(c.requests), c.score(now)))
+            client.requests.add(request_id)
+            self.stats['dispatched'] += 1
+            if exclude:
+                self.stats['retried'] += 1
+            return client.client_id
+
+    def release(self, client_id: str, request_id: str, latency: float = None, success: bool = True):
+        """
+        请求结束：移出在途请求并更新延迟EWMA
+
+        Args:
+            client_id: 客户端ID
+            request_id: 请求ID
+            latency: 本次响应耗时（秒）
+            success: 是否成功（失败时累加FAILURE_PENALTY惩罚，不计入延迟EWMA）
+        """
+        with self._lock:
+            client = self._clients.get(client_id)
+            if client is None:
+                return
+            client.requests.discard(request_id)
+            if not success:
+                now = time.time()
+                client.failures += 1
+                client.penalty = client.current_penalty(now) + FAILURE_PENALTY
+                client.penalized_at = now
+                return
+            client.completed += 1
+            if latency is not None:
+                if client.ewma_latency is None:
+                    client.ewma_latency = latency
+                else:
+                    client.ewma_latency += self.ewma_alpha * (latency - client.ewma_latency)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._clients)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取客户端池统计"""
+        with self._lock:
+            now = time.time()
+            return {
+                **self.stats,
+                'clients': {
+                    client_id: {
+                        'inflight': len(client.requests),
+                        'ewma_latency_ms': round(client.ewma_latency * 1000, 1) if client.ewma_latency is not None else None,
+                        'penalty_ms': round(client.current_penalty(now) * 1000, 1),
+                        'completed': client.completed,
+                        'failures': client.failures,
+                        'heartbeat_age': round(now - client.last_heartbeat, 1),
+                        'draining': now - client.last_heartbeat >= self.heartbeat_timeout
+                    }
+                    for client_id, client in self._clients.items()
+                }
+            }
+
+# 边缘缓存和配额调度：辅助函数在异步版和线程版代理中逐字相同，EdgeCache/QuotaLane/QuotaGovernor
+# 分别按asyncio和线程实现、接口一致（test/test_proxy_copies.py 检查）
+# 每次请求都会变化的签名参数，不参与缓存键（access_token保留，不同令牌不共享缓存）
+VOLATILE_PARAMS = {'timestamp', 'sign'}
+
+# 领星业务成功码，只有成功的响应才会被缓存
+SUCCESS_CODES = {0, '0', 200, '200'}
+
+def parse_cache_ttls(spec: str) -> Dict[str, float]:
+    """
+    解析缓存TTL配置，格式为"端点=秒数"，逗号分隔；端点以*结尾表示前缀匹配
+    例如: /erp/sc/data/seller/lists=600,/erp/sc/routing/restocking/*=60
+
+    Args:
+        spec: 配置字符串
+
+    Returns:
+        Dict[str, float]: {端点: TTL秒数}
+    """
+    ttls = {}
+    for item in spec.split(','):
+        endpoint, _, seconds = item.strip().partition('=')
+        if endpoint and seconds:
+            ttls['/' + endpoint.strip().lstrip('/')] = float(seconds)
+    return ttls
+
+def cache_key(method: str, endpoint: str, query, body: bytes, accept_encoding: str) -> str:
+    """
+    计算缓存键：方法 + 端点 + 去掉签名参数的查询参数 + 规范化的业务参数
+
+    Args:
+        method: 请求方法
+        endpoint: 端点路径
+        query: 查询参数（支持重复键的 (名称, 值) 序列）
+        body: 原始请求体
+        accept_encoding: 客户端接受的编码（压缩与否的响应不能混用）
+
+    Returns:
+        str: 缓存键
+    """
+    params = sorted((name, value) for name, value in query if name not in VOLATILE_PARAMS)
+    try:
+        canonical_body = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':')).encode() if body else b''
+    except ValueError:
+        canonical_body = body
+    digest = hashlib.sha256()
+    for part in (method.upper(), '/' + endpoint.lstrip('/'), json.dumps(params), accept_encoding or ''):
+        digest.update(part.encode('utf-8') + b'\0')
+    digest.update(canonical_body)
+    return digest.hexdigest()
+
+def business_code(headers, body: bytes) -> Optional[str]:
+    """解析领星响应的业务码（按Content-Encoding先解压），无法解析时返回None"""
+    try:
+        encoding = next((value for name, value in headers if name.lower() == 'content-encoding'), '').lower()
+        if encoding == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            body = zlib.decompress(body)
+        elif encoding not in ('', 'identity'):
+            return None
+        data = json.loads(body)
+    except (ValueError, zlib.error):
+        return None
+    if not isinstance(data, dict) or data.get('code') is None:
+        return None
+    return str(data['code'])
+
+def is_cacheable(status: int, headers, body: bytes) -> bool:
+    """只缓存HTTP 200且领星业务码表示成功的响应（限流、令牌失效等错误不缓存）"""
+    return status == 200 and business_code(headers, body) in SUCCESS_CODES
+
+class CachedResponse:
+    """缓存的上游响应（原始字节，压缩内容不解压）"""
+
+    __slots__ = ('status', 'headers', 'body', 'stored_at', 'expires_at')
+
+    def __init__(self, status: int, headers: list, body: bytes, ttl: float = 0):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.stored_at = time.time()
+        self.expires_at = self.stored_at + ttl
+
+class EdgeCache:
+    """
+    领星幂等查询的边缘缓存（按端点开启）
+    相同查询在TTL内直接返回缓存；同一键的并发请求只向上游发一次，其余等待其结果
+    """
+
+    def __init__(self, ttls: Dict[str, float], max_entries: int = 256, max_body: int = 4 * 1024 * 1024):
+        """
+        Args:
+            ttls: {端点: TTL秒数}，端点以*结尾表示前缀匹配
+            max_entries: 最多缓存的响应数（超出时淘汰最久未用的）
+            max_body: 单个响应的最大缓存字节数
+        """
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.max_body = max_body
+        self._entries = OrderedDict()  # {key: CachedResponse}，按最近使用排序
+        self._inflight = {}            # {key: PendingRequest}，正在向上游请求的键
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'stores': 0, 'uncacheable': 0, 'evictions': 0}
+
+    @classmethod
+    def from_env(cls) -> 'EdgeCache':
+        """从环境变量 PROXY_CACHE_TTLS / PROXY_CACHE_MAX_ENTRIES / PROXY_CACHE_MAX_BODY 创建（未配置TTL时不缓存）"""
+        return cls(
+            parse_cache_ttls(os.getenv('PROXY_CACHE_TTLS', '')),
+            max_entries=int(os.getenv('PROXY_CACHE_MAX_ENTRIES', '256')),
+            max_body=int(os.getenv('PROXY_CACHE_MAX_BODY', str(4 * 1024 * 1024)))
+        )
+
+    def ttl_for(self, endpoint: str) -> Optional[float]:
+        """端点的缓存TTL，未开启缓存时返回None"""
+        endpoint = '/' + endpoint.lstrip('/')
+        ttl = self.ttls.get(endpoint)
+        if ttl is None:
+            matches = [pattern for pattern in self.ttls if pattern.endswith('*') and endpoint.startswith(pattern[:-1])]
+            if matches:
+                ttl = self.ttls[max(matches, key=len)]
+        return ttl if ttl and ttl > 0 else None
+
+    def fetch(self, key: str, ttl: float, loader, timeout: float = 60):
+        """
+        读取缓存，未命中时调用loader向上游请求；同一键同时只有一个loader在执行
+
+        Args:
+            key: 缓存键
+            ttl: 缓存时间（秒）
+            loader: 返回CachedResponse的函数
+            timeout: 等待其他请求结果的最长时间（秒）
+
+        Returns:
+            tuple: (CachedResponse, 'HIT'/'MISS'/'COALESCED')
+
+        Raises:
+            Exception: loader的异常（等待同一请求的调用方收到同一异常）
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry, 'HIT'
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = PendingRequest()
+                self.stats['misses'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            # 首个请求失败时把同一异常交给等待者，上游出错时不再各自重试
+            if not flight.event.wait(timeout):
+                raise TimeoutError(f"等待相同请求的上游响应超时（{timeout}秒）")
+            if flight.error is not None:
+                raise flight.error
+            return flight.response, 'COALESCED'
+
+        try:
+            entry = loader()
+        except Exception as e:
+            flight.error = e
+            raise
+        else:
+            # 先写入缓存再移除在途记录，之后到达的相同请求直接命中缓存
+            flight.response = entry
+            self._store(key, ttl, entry)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.event.set()
+        return entry, 'MISS'
+
+    def _store(self, key: str, ttl: float, entry: CachedResponse):
+        if len(entry.body) > self.max_body or not is_cacheable(entry.status, entry.headers, entry.body):
+            with self._lock:
+                self.stats['uncacheable'] += 1
+            return
+        entry.expires_at = entry.stored_at + ttl
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self.stats['stores'] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """缓存统计（命中率按命中+合并计算）"""
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses'] + self.stats['coalesced']
+            return {
+                **self.stats,
+                'enabled': bool(self.ttls),
+                'entries': len(self._entries),
+                'inflight': len(self._inflight),
+                'hit_rate': round((self.stats['hits'] + self.stats['coalesced']) / lookups * 100, 1) if lookups else 0.0,
+                'ttls': self.ttls
+            }
+
+# 领星限流业务码（接口请求太频繁）
+THROTTLE_CODE = '3001008'
+
+# 不超过该大小的上游响应在转发前读取检查业务码（限流响应很小，大响应照常流式转发）
+THROTTLE_PROBE_SIZE = 4096
+
+def parse_quota_rates(spec: str) -> Dict[str, tuple]:
+    """
+    解析配额配置，格式为"端点=每秒请求数[/突发量]"，逗号分隔；端点以*结尾表示前缀匹配
+    例如: /erp/sc/routing/restocking/*=1/2,/erp/sc/data/seller/lists=5
+
+    Args:
+        spec: 配置字符串
+
+    Returns:
+        Dict[str, tuple]: {端点: (每秒请求数, 突发量)}
+    """
+    rates = {}
+    for item in spec.split(','):
+        endpoint, _, value = item.strip().partition('=')
+        if endpoint and value:
+            rate, _, burst = value.partition('/')
+            rates['/' + endpoint.strip().lstrip('/')] = (float(rate), float(burst) if burst else 1.0)
+    return rates
+
+def retry_after_seconds(seconds: float) -> int:
+    """Retry-After头只接受整数秒，向上取整且至少为1"""
+    return max(1, math.ceil(seconds))
+
+class QuotaExceeded(Exception):
+    """排队时间超过上限，客户端应按Retry-After稍后重试"""
+
+    def __init__(self, endpoint: str, retry_after: int):
+        super().__init__(f"{endpoint} 配额已用尽，{retry_after}秒后重试")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+class QuotaLane:
+    """单个端点（或端点前缀）的令牌桶和按客户端轮转的等待队列，由 QuotaGovernor 加锁访问"""
+
+    def __init__(self, pattern: str, rate: float, capacity: float):
+        self.pattern = pattern
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0        # 上游返回限流后暂停放行到该时间
+        self.queues = OrderedDict()    # {客户端: deque[threading.Event]}，按轮转顺序排列
+        self.waiting = 0
+        self.stats = {'granted': 0, 'queued': 0, 'rejected': 0, 'throttled': 0,
+                      'wait_total': 0.0, 'wait_max': 0.0}
+
+    def refill(self, now: float):
+        """按流逝时间补充令牌（暂停期间不补充）"""
+        elapsed = now - max(self.updated_at, self.paused_until)
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = max(self.updated_at, now)
+
+    def next_token_in(self, now: float) -> float:
+        """距离下一个令牌可用的秒数"""
+        return max(self.paused_until - now, 0.0) + max(1 - self.tokens, 0.0) / self.rate
+
+    def estimate(self, client: str, now: float) -> float:
+        """
+        估算该客户端新请求的等待时间：按轮转顺序，客户端已有k个请求在排队时，
+        新请求在第k+1轮放行，每个其他客户端最多排在它前面k+1个
+        """
+        rounds = len(self.queues.get(client, ())) + 1
+        ahead = sum(min(len(queue), rounds) for name, queue in self.queues.items() if name != client)
+        ahead += rounds - 1
+        return max(self.paused_until - now, 0.0) + max(ahead + 1 - self.tokens, 0.0) / self.rate
+
+    def enqueue(self, client: str, ticket):
+        self.queues.setdefault(client, deque()).append(ticket)
+        self.waiting += 1
+        self.stats['queued'] += 1
+
+    def cancel(self, client: str, ticket):
+        queue = self.queues.get(client)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            self.waiting -= 1
+            if not queue:
+                del self.queues[client]
+
+    def grant(self, now: float) -> list:
+        """
+        用可用令牌放行排队的请求：每次取轮转顺序中第一个客户端的最早请求，放行后该客户端排到末尾
+
+        Returns:
+            list: 被放行的请求
+        """
+        self.refill(now)
+        granted = []
+        while self.queues and self.tokens >= 1:
+            client, queue = next(iter(self.queues.items()))
+            granted.append(queue.popleft())
+            if queue:
+                self.queues.move_to_end(client)
+            else:
+                del self.queues[client]
+            self.tokens -= 1
+            self.waiting -= 1
+        return granted
+
+class QuotaGovernor:
+    """
+    领星接口全局配额调度（按端点开启）
+    所有本地进程共用同一个app key，由代理统一按端点限速：各客户端的请求轮流放行，
+    预计排队超过上限时直接返回Retry-After，而不是转发到上游触发限流
+    """
+
+    def __init__(self, rates: Dict[str, tuple], max_wait: float = 10.0, penalty: float = 5.0):
+        """
+        Args:
+            rates: {端点: (每秒请求数, 突发量)}，端点以*结尾表示前缀匹配
+            max_wait: 请求最长排队时间（秒），预计超过时直接拒绝
+            penalty: 上游仍返回限流时该端点暂停放行的时间（秒）
+        """
+        self.lanes = {pattern: QuotaLane(pattern, rate, burst) for pattern, (rate, burst) in rates.items() if rate > 0}
+        self.max_wait = max_wait
+        self.penalty = penalty
+        self._lock = threading.Lock()
+        self._clients = {}  # {客户端: {'granted', 'rejected', 'wait_total'}}
+
+    @classmethod
+    def from_env(cls) -> 'QuotaGovernor':
+        """从环境变量 PROXY_QUOTA_RATES / PROXY_QUOTA_MAX_WAIT / PROXY_QUOTA_PENALTY 创建（未配置时不限速）"""
+        return cls(
+            parse_quota_rates(os.getenv('PROXY_QUOTA_RATES', '')),
+            max_wait=float(os.getenv('PROXY_QUOTA_MAX_WAIT', '10')),
+            penalty=float(os.getenv('PROXY_QUOTA_PENALTY', '5'))
+        )
+
+    def lane_for(self, endpoint: str) -> Optional[QuotaLane]:
+        """端点对应的配额，未限速时返回None"""
+        endpoint = '/' + endpoint.lstrip('/')
+        lane = self.lanes.get(endpoint)
+        if lane is None:
+            matches = [pattern for pattern in self.lanes if pattern.endswith('*') and endpoint.startswith(pattern[:-1])]
+            if matches:
+                lane = self.lanes[max(matches, key=len)]
+        return lane
+
+    def acquire(self, endpoint: str, client: str) -> float:
+        """
+        获取一次上游调用的配额，必要时排队等待
+
+        Args:
+            endpoint: API端点路径
+            client: 客户端标识（同一客户端的请求按先后顺序放行）
+
+        Returns:
+            float: 排队等待的秒数
+
+        Raises:
+            QuotaExceeded: 预计或实际排队时间超过 max_wait
+        """
+        lane = self.lane_for(endpoint)
+        if lane is None:
+            return 0.0
+
+        start = time.monotonic()
+        with self._lock:
+            lane.refill(start)
+            if not lane.queues and lane.tokens >= 1:
+                lane.tokens -= 1
+                self._record(lane, client, 0.0)
+                return 0.0
+            wait = lane.estimate(client, start)
+            if wait > self.max_wait:
+                self._reject(lane, client)
+                raise QuotaExceeded(endpoint, retry_after_seconds(wait))
+            ticket = threading.Event()
+            lane.enqueue(client, ticket)
+
+        deadline = start + self.max_wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                for granted in lane.grant(now):
+                    granted.set()
+                if ticket.is_set():
+                    self._record(lane, client, now - start)
+                    return now - start
+                if now >= deadline:
+                    lane.cancel(client, ticket)
+                    self._reject(lane, client)
+                    raise QuotaExceeded(endpoint, retry_after_seconds(lane.estimate(client, now)))
+                timeout = min(lane.next_token_in(now), deadline - now)
+            ticket.wait(timeout)
+
+    def penalize(self, endpoint: str) -> int:
+        """
+        上游仍返回限流时暂停该端点放行，清空令牌
+
+        Returns:
+            int: 建议客户端等待的秒数
+        """
+        lane = self.lane_for(endpoint)
+        if lane is None:
+            return retry_after_seconds(self.penalty)
+        with self._lock:
+            now = time.monotonic()
+            lane.refill(now)
+            lane.tokens = 0.0
+            lane.paused_until = max(lane.paused_until, now + self.penalty)
+            lane.stats['throttled'] += 1
+            return retry_after_seconds(lane.paused_until - now)
+
+    def _record(self, lane: QuotaLane, client: str, waited: float):
+        lane.stats['granted'] += 1
+        lane.stats['wait_total'] += waited
+        lane.stats['wait_max'] = max(lane.stats['wait_max'], waited)
+        stats = self._clients.setdefault(client, {'granted': 0, 'rejected': 0, 'wait_total': 0.0})
+        stats['granted'] += 1
+        stats['wait_total'] += waited
+
+    def _reject(self, lane: QuotaLane, client: str):
+        lane.stats['rejected'] += 1
+        self._clients.setdefault(client, {'granted': 0, 'rejected': 0, 'wait_total': 0.0})['rejected'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """配额统计（排队时间单位为毫秒）"""
+        with self._lock:
+            now = time.monotonic()
+            lanes = {}
+            for pattern, lane in self.lanes.items():
+                lane.refill(now)
+                granted = lane.stats['granted']
+                lanes[pattern] = {
+                    'rate': lane.rate,
+                    'burst': lane.capacity,
+                    'tokens': round(lane.tokens, 2),
+                    'waiting': lane.waiting,
+                    'paused_seconds': round(max(lane.paused_until - now, 0.0), 1),
+                    'granted': granted,
+                    'queued': lane.stats['queued'],
+                    'rejected': lane.stats['rejected'],
+                    'throttled': lane.stats['throttled'],
+                    'avg_wait_ms': round(lane.stats['wait_total'] / granted * 1000, 1) if granted else 0.0,
+                    'max_wait_ms': round(lane.stats['wait_max'] * 1000, 1)
+                }
+            return {
+                'enabled': bool(self.lanes),
+                'max_wait': self.max_wait,
+                'endpoints': lanes,
+                'clients': {
+                    client: {
+                        'granted': stats['granted'],
+                        'rejected': stats['rejected'],
+                        'avg_wait_ms': round(stats['wait_total'] / stats['granted'] * 1000, 1) if stats['granted'] else 0.0
+                    }
+                    for client, stats in self._clients.items()
+                }
+            }
+
+# 指标采集在各代理中保持逐字相同（test/test_proxy_copies.py 检查）
+# 延迟直方图的桶上界（秒），从隧道内的毫秒级往返覆盖到领星慢查询
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# 每个指标最多保留的标签组合数，超出的归入 other（避免客户端ID等标签无限增长）
+METRIC_SERIES_LIMIT = 200
+
+class Metrics:
+    """
+    📈 线程安全的指标收集：计数器、固定分桶的延迟直方图和实时计算的仪表
+    写入按线程分片，每个线程固定写同一个分片，分片锁只在同分片的线程间竞争；读取时汇总所有分片
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, shards: int = 16):
+        self.buckets = tuple(buckets)
+        self._shards = [(threading.Lock(), {}, {}) for _ in range(shards)]  # [(锁, 计数器, 直方图)]
+        self._next_shard = itertools.count()
+        self._local = threading.local()
+        self._series = {}  # {指标名: set(标签组合)}
+        self._series_lock = threading.Lock()
+        self._gauges = {}  # {指标名: (标签名, 回调)}
+
+    def _shard(self):
+        index = getattr(self._local, 'index', None)
+        if index is None:
+            index = self._local.index = next(self._next_shard) % len(self._shards)
+        return self._shards[index]
+
+    def _key(self, name: str, labels: Dict[str, Any]) -> tuple:
+        """指标键 (名称, 标签组合)，标签组合数超过上限时归入 other"""
+        label_items = tuple(sorted((key, str(value)) for key, value in labels.items()))
+        series = self._series.get(name)
+        if series is None or label_items not in series:
+            with self._series_lock:
+                series = self._series.setdefault(name, set())
+                if label_items not in series:
+                    if len(series) >= METRIC_SERIES_LIMIT:
+                        label_items = tuple((key, 'other') for key, _ in label_items)
+                    series.add(label_items)
+        return name, label_items
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """计数器加一（或加指定数量）"""
+        key = self._key(name, labels)
+        lock, counters, _ = self._shard()
+        with lock:
+            counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, **labels):
+        """记录一次耗时（秒）"""
+        key = self._key(name, labels)
+        lock, _, histograms = self._shard()
+        with lock:
+            counts = histograms.get(key)
+            if counts is None:
+                counts = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]  # 各桶 + 溢出桶 + 总和
+            counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            counts[-1] += seconds
+
+    def gauge(self, name: str, callback, label: Optional[str] = None):
+        """
+        登记仪表，读取时调用回调取值
+
+        Args:
+            name: 指标名
+            callback: 返回数值；指定label时返回 {标签值: 数值}
+            label: 标签名
+        """
+        self._gauges[name] = (label, callback)
+
+    def _collect(self) -> tuple:
+        """汇总所有分片，返回 (计数器, 直方图)"""
+        counters, histograms = {}, {}
+        for lock, shard_counters, shard_histograms in self._shards:
+            with lock:
+                for key, value in shard_counters.items():
+                    counters[key] = counters.get(key, 0) + value
+                for key, counts in shard_histograms.items():
+                    total = histograms.setdefault(key, [0] * (len(counts) - 1) + [0.0])
+                    for i, count in enumerate(counts):
+                        total[i] += count
+        return counters, histograms
+
+    def counter_values(self) -> Dict[str, float]:
+        """不带标签的计数器 {名称: 值}"""
+        return {name: value for (name, labels), value in self._collect()[0].items() if not labels}
+
+    def quantile(self, counts: list, q: float) -> float:
+        """按分桶估算分位数（桶内线性插值，落在溢出桶时取最大桶上界）"""
+        total = sum(counts[:-1])
+        if not total:
+            return 0.0
+        rank = q * total
+        cumulative = 0
+        for i, count in enumerate(counts[:-1]):
+            if count and cumulative + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def latency_summary(self, name: str) -> Dict[str, Dict[str, float]]:
+        """
+        直方图摘要（毫秒）
+
+        Returns:
+            dict: {标签值（多个标签以逗号连接）: {count, avg_ms, p50_ms, p95_ms, p99_ms}}
+        """
+        summary = {}
+        for (metric, labels), counts in sorted(self._collect()[1].items()):
+            if metric != name:
+                continue
+            count = sum(counts[:-1])
+            summary[','.join(value for _, value in labels) or 'all'] = {
+                'count': count,
+                'avg_ms': round(counts[-1] / count * 1000, 1) if count else 0.0,
+                'p50_ms': round(self.quantile(counts, 0.50) * 1000, 1),
+                'p95_ms': round(self.quantile(counts, 0.95) * 1000, 1),
+                'p99_ms': round(self.quantile(counts, 0.99) * 1000, 1)
+            }
+        return summary
+
+    def prometheus(self, prefix: str) -> str:
+        """Prometheus文本格式（text/plain; version=0.0.4）"""
+        def escape(value) -> str:
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        def labels_text(labels, extra=()) -> str:
+            items = [f'{key}="{escape(value)}"' for key, value in tuple(labels) + tuple(extra)]
+            return '{' + ','.join(items) + '}' if items else ''
+
+        counters, histograms = self._collect()
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            metric = f"{prefix}_{name}" if name.endswith('_total') else f"{prefix}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for (counter, labels), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f"{metric}{labels_text(labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            metric = f"{prefix}_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for (histogram, labels), counts in sorted(histograms.items()):
+                if histogram != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{metric}_bucket{labels_text(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{metric}_sum{labels_text(labels)} {counts[-1]}")
+                lines.append(f"{metric}_count{labels_text(labels)} {cumulative}")
+        for name, (label, callback) in sorted(self._gauges.items()):
+            metric = f"{prefix}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            value = callback()
+            if label is None:
+                lines.append(f"{metric} {value}")
+            else:
+                for label_value, item in sorted(value.items()):
+                    lines.append(f"{metric}{labels_text([(label, label_value)])} {item}")
+        return '\n'.join(lines) + '\n'
+
 class UnifiedCloudProxy:
     """
     🚀 统一云代理服务器
@@ -69,17 +1032,32 @@ class UnifiedCloudProxy:
         
         # WebSocket连接管理
         self.ws_clients = {}  # 存储WebSocket连接
-        self.pending_requests = {}  # 存储待处理的请求
+        self.pending_requests = RequestCorrelator()  # 等待本地响应的请求
+        self.client_pool = ClientPool()  # 可接收飞书请求的本地客户端
         
-        # 请求统计
-        self.stats = {
-            'total_requests': 0,
-            'success_requests': 0,
-            'failed_requests': 0,
-            'feishu_requests': 0,
-            'ws_connections': 0,
-            'start_time': time.time()
-        }
+        # 领星查询边缘缓存（通过 PROXY_CACHE_TTLS 按端点开启）
+        self.edge_cache = EdgeCache.from_env()
+        if self.edge_cache.ttls:
+            logger.info(f"🗄️ 已开启边缘缓存: {self.edge_cache.ttls}")
+        
+        # 领星接口全局配额（通过 PROXY_QUOTA_RATES 按端点开启）
+        self.quota = QuotaGovernor.from_env()
+        if self.quota.lanes:
+            logger.info(f"🚦 已开启配额调度: {list(self.quota.lanes)}")
+        
+        # 请求统计：计数器、各路由/领星端点/隧道客户端的延迟直方图和队列深度仪表
+        self.metrics = Metrics()
+        self.start_time = time.time()
+        self.metrics.gauge('pending_tunnel_requests', lambda: len(self.pending_requests))
+        self.metrics.gauge('tunnel_clients', lambda: len(self.ws_clients))
+        self.metrics.gauge('tunnel_inflight', lambda: {
+            self._client_label(client_id): client['inflight']
+            for client_id, client in self.client_pool.get_stats()['clients'].items()
+        }, label='client')
+        self.metrics.gauge('quota_waiting', lambda: {
+            pattern: lane.waiting for pattern, lane in self.quota.lanes.items()
+        }, label='endpoint')
+        self.metrics.gauge('edge_cache_inflight', lambda: self.edge_cache.get_stats()['inflight'])
         
         # 创建HTTP会话
         self.session = self._create_session()
@@ -90,6 +1068,21 @@ class UnifiedCloudProxy:
         
         logger.info(f"🌐 统一云代理服务器初始化完成 - {host}:{port}")
     
+    # /stats 中始终列出的计数器
+    STAT_COUNTERS = ('total_requests', 'success_requests', 'failed_requests', 'feishu_requests',
+                     'ws_connections', 'quota_rejected')
+    
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """请求统计（由计数器汇总）"""
+        counters = self.metrics.counter_values()
+        return {**{name: counters.get(name, 0) for name in self.STAT_COUNTERS}, 'start_time': self.start_time}
+    
+    def _client_label(self, client_id: str) -> str:
+        """指标中的客户端标签：客户端自报的ID（重连后连接ID会变），未上报时用连接ID"""
+        info = self.ws_clients.get(client_id, {}).get('info') or {}
+        return info.get('client_id') or client_id
+    
     def _create_session(self) -> requests.Session:
         """
         创建HTTP会话，配置重试策略
@@ -116,6 +1109,19 @@ class UnifiedCloudProxy:
     def _register_routes(self):
         """注册所有HTTP路由"""
         
+        @self.app.before_request
+        def start_timer():
+            g.request_started = time.perf_counter()
+        
+        @self.app.after_request
+        def observe_route(response):
+            """按路由记录请求耗时（流式响应记录到响应头发出为止）"""
+            started = g.get('request_started')
+            if started is not None:
+                self.metrics.observe('route_latency', time.perf_counter() - started,
+                                     route=request.url_rule.rule if request.url_rule else 'unmatched')
+            return response
+        
         @self.app.route('/health', methods=['GET'])
         def health_check():
             """🔍 健康检查接口"""
@@ -124,6 +1130,7 @@ class UnifiedCloudProxy:
                 'server': f'unified-proxy:{self.port}',
                 'service': 'lingxing-feishu-proxy',
                 'active_connections': len(self.ws_clients),
+                'pending_requests': len(self.pending_requests),
                 'message': '统一代理服务器运行正常',
                 'timestamp': datetime.now().isoformat(),
                 'stats': self.stats
@@ -132,24 +1139,42 @@ class UnifiedCloudProxy:
         @self.app.route('/stats', methods=['GET'])
         def get_stats():
             """📊 获取服务器统计信息"""
-            uptime = time.time() - self.stats['start_time']
+            stats = self.stats
+            uptime = time.time() - stats['start_time']
             return jsonify({
-                'stats': self.stats,
+                'stats': stats,
                 'uptime_seconds': uptime,
                 'uptime_hours': uptime / 3600,
                 'success_rate': (
-                    self.stats['success_requests'] / max(self.stats['total_requests'], 1) * 100
+                    stats['success_requests'] / max(stats['total_requests'], 1) * 100
                 ),
                 'active_ws_connections': len(self.ws_clients),
+                'pending_requests': len(self.pending_requests),
+                'correlation': self.pending_requests.stats,
+                'client_pool': self.client_pool.get_stats(),
+                'edge_cache': self.edge_cache.get_stats(),
+                'quota': self.quota.get_stats(),
+                'latency': {
+                    'routes': self.metrics.latency_summary('route_latency'),
+                    'upstream': self.metrics.latency_summary('upstream_latency'),
+                    'tunnel': self.metrics.latency_summary('tunnel_latency')
+                },
                 'endpoints': {
                     'health': f'http://{self.host}:{self.port}/health',
                     'stats': f'http://{self.host}:{self.port}/stats',
+                    'metrics': f'http://{self.host}:{self.port}/metrics',
                     'proxy': f'http://{self.host}:{self.port}/api/proxy/{{endpoint}}',
                     'feishu_webhook': f'http://{self.host}:{self.port}/feishu/webhook',
                     'websocket': f'ws://{self.host}:{self.port}/socket.io/'
                 }
             })
         
+        @self.app.route('/metrics', methods=['GET'])
+        def get_metrics():
+            """📈 Prometheus指标接口"""
+            return Response(self.metrics.prometheus('lingxing_proxy'),
+                            content_type='text/plain; version=0.0.4; charset=utf-8')
+        
         @self.app.route('/api/proxy/<path:endpoint>', methods=['GET', 'POST'])
         def proxy_api(endpoint):
             """
@@ -201,7 +1226,7 @@ class UnifiedCloudProxy:
                 'last_ping': time.time(),
                 'type': 'unknown'
             }
-            self.stats['ws_connections'] += 1
+            self.metrics.inc('ws_connections')
             
             logger.info(f"🔗 WebSocket客户端连接: {client_id}")
             
@@ -219,6 +1244,10 @@ class UnifiedCloudProxy:
             if client_id in self.ws_clients:
                 del self.ws_clients[client_id]
             
+            # 断开客户端的在途请求立即失败，由等待线程改派给其他客户端
+            for request_id in self.client_pool.remove(client_id):
+                self.pending_requests.complete(request_id, CLIENT_LOST)
+            
             logger.info(f"🔌 WebSocket客户端断开: {client_id}")
         
         @self.socketio.on('register')
@@ -230,6 +1259,8 @@ class UnifiedCloudProxy:
             if client_id in self.ws_clients:
                 self.ws_clients[client_id]['type'] = client_type
                 self.ws_clients[client_id]['info'] = data
+            if client_type == 'local_server':
+                self.client_pool.add(client_id)
             
             logger.info(f"✅ 客户端 {client_id} 注册为 {client_type}")
             
@@ -240,17 +1271,31 @@ class UnifiedCloudProxy:
                 'timestamp': datetime.now().isoformat()
             })
         
+        @self.socketio.on('heartbeat')
+        @self.socketio.on('ping')
+        def handle_heartbeat(data=None):
+            """客户端心跳：超过心跳超时未上报的客户端不再分配新请求"""
+            client_id = request.sid
+            if client_id in self.ws_clients:
+                self.ws_clients[client_id]['last_ping'] = time.time()
+            self.client_pool.heartbeat(client_id)
+            emit('pong', {'timestamp': datetime.now().isoformat()})
+        
         @self.socketio.on('response')
         def handle_response(data):
             """处理来自本地服务器的响应"""
             client_id = request.sid
             request_id = data.get('request_id')
+            self.client_pool.heartbeat(client_id)
             
-            if request_id and request_id in self.pending_requests:
-                # 将响应数据存储，供HTTP请求使用
-                self.pending_requests[request_id]['response'] = data.get('response', {})
-                self.pending_requests[request_id]['completed'] = True
+            if not request_id:
+                return
+
+            # 直接唤醒等待该响应的HTTP请求线程
+            if self.pending_requests.complete(request_id, data.get('response', {})):
                 logger.info(f"✅ 收到请求 {request_id} 的响应")
+            else:
+                logger.warning(f"⚠️ 请求 {request_id} 已超时，丢弃迟到的响应")
     
     def _handle_proxy_request(self, endpoint: str) -> Response:
         """
@@ -263,60 +1308,173 @@ class UnifiedCloudProxy:
             Response: Flask响应对象
         """
         start_time = time.time()
-        self.stats['total_requests'] += 1
+        self.metrics.inc('total_requests')
+        
+        ttl = self.edge_cache.ttl_for(endpoint)
+        if ttl is not None:
+            return self._handle_cached_proxy_request(endpoint, ttl, start_time)
         
         try:
+            # 🚦 获取全局配额（未限速的端点直接放行）
+            quota_wait = self.quota.acquire(endpoint, self._client_key())
+            
             # 构建目标URL
             target_url = f"{self.lingxing_base_url}/{endpoint}"
             
             # 准备请求数据
+            upstream_started = time.perf_counter()
             if request.method == 'POST':
                 data = request.get_json() if request.is_json else request.form.to_dict()
-                headers = dict(request.headers)
+                headers = upstream_request_headers(request.headers)
                 
-                # 发送POST请求
+                # 发送POST请求（流式读取响应）
                 response = self.session.post(
                     target_url,
                     json=data if request.is_json else None,
                     data=None if request.is_json else data,
                     headers=headers,
-                    timeout=30
+                    timeout=30,
+                    stream=True
                 )
             else:
                 # 发送GET请求
                 params = request.args.to_dict()
-                headers = dict(request.headers)
+                headers = upstream_request_headers(request.headers)
                 
                 response = self.session.get(
                     target_url,
                     params=params,
                     headers=headers,
-                    timeout=30
+                    timeout=30,
+                    stream=True
                 )
             
             # 记录成功
-            self.stats['success_requests'] += 1
+            self.metrics.inc('success_requests')
+            self.metrics.observe('upstream_latency', time.perf_counter() - upstream_started, endpoint='/' + endpoint)
             
-            # 计算响应时间
+            # 计算响应时间（收到上游响应头的时间）
             response_time = time.time() - start_time
             
             logger.info(f"✅ 代理请求成功: {endpoint} - {response.status_code} - {response_time:.2f}s")
             
-            # 返回响应
-            return Response(
-                response.content,
-                status=response.status_code,
-                headers=dict(response.headers)
-            )
+            extra_headers = {'X-Response-Time': str(response_time), 'X-Quota-Wait': str(int(quota_wait * 1000))}
+            
+            # 限速端点的小响应先读出来检查是否仍被领星限流
+            content_length = response.headers.get('Content-Length', '')
+            if self.quota.lane_for(endpoint) and content_length.isdigit() and int(content_length) <= THROTTLE_PROBE_SIZE:
+                try:
+                    headers = strip_hop_by_hop(response.raw.headers)
+                    body = response.raw.read(decode_content=False)
+                finally:
+                    response.close()
+                headers.extend(self._throttle_headers(endpoint, response.status_code, headers, body))
+                headers.extend(extra_headers.items())
+                return Response(body, status=response.status_code, headers=headers, direct_passthrough=True)
+            
+            # 流式返回响应（原样转发压缩内容）
+            return stream_upstream_response(response, extra_headers)
+            
+        except QuotaExceeded as e:
+            return self._quota_exceeded_response(e)
+        except Exception as e:
+            self.metrics.inc('failed_requests')
+            logger.error(f"❌ 代理请求失败: {endpoint} - {str(e)}")
+            return jsonify({
+                'error': f'代理请求失败: {str(e)}',
+                'endpoint': endpoint,
+                'timestamp': datetime.now().isoformat()
+            }), 502
+
+    def _handle_cached_proxy_request(self, endpoint: str, ttl: float, start_time: float) -> Response:
+        """
+        开启缓存的端点：相同查询在TTL内返回缓存，并发的相同请求合并为一次上游调用
+        转发方式与 _handle_proxy_request 相同，但需要完整读取响应体以便共享
+        
+        Args:
+            endpoint: API端点路径
+            ttl: 缓存时间（秒）
+            start_time: 请求开始时间
             
+        Returns:
+            Response: Flask响应对象
+        """
+        target_url = f"{self.lingxing_base_url}/{endpoint}"
+        body = request.get_data()
+        headers = upstream_request_headers(request.headers)
+        accept_encoding = next((value for name, value in headers.items() if name.lower() == 'accept-encoding'), '')
+        key = cache_key(request.method, endpoint, request.args.items(multi=True), body, accept_encoding)
+        client = self._client_key()
+        
+        def load() -> CachedResponse:
+            # 只有真正访问上游时才占用配额，缓存命中和合并的请求不消耗
+            self.quota.acquire(endpoint, client)
+            upstream_started = time.perf_counter()
+            if request.method == 'POST':
+                upstream = self.session.post(target_url, data=body, headers=headers, timeout=30, stream=True)
+            else:
+                upstream = self.session.get(target_url, params=request.args.to_dict(), headers=headers,
+                                            timeout=30, stream=True)
+            self.metrics.observe('upstream_latency', time.perf_counter() - upstream_started, endpoint='/' + endpoint)
+            try:
+                response_headers = strip_hop_by_hop(upstream.raw.headers)
+                response_body = upstream.raw.read(decode_content=False)
+            finally:
+                upstream.close()
+            response_headers.extend(self._throttle_headers(endpoint, upstream.status_code,
+                                                           response_headers, response_body))
+            return CachedResponse(upstream.status_code, response_headers, response_body)
+        
+        try:
+            entry, source = self.edge_cache.fetch(key, ttl, load)
+        except QuotaExceeded as e:
+            return self._quota_exceeded_response(e)
         except Exception as e:
-            self.stats['failed_requests'] += 1
+            self.metrics.inc('failed_requests')
             logger.error(f"❌ 代理请求失败: {endpoint} - {str(e)}")
             return jsonify({
                 'error': f'代理请求失败: {str(e)}',
                 'endpoint': endpoint,
                 'timestamp': datetime.now().isoformat()
             }), 502
+        
+        self.metrics.inc('success_requests')
+        response_time = time.time() - start_time
+        logger.info(f"✅ 代理请求成功: {endpoint} - {entry.status} - {response_time:.2f}s - 缓存{source}")
+        
+        headers = entry.headers + [
+            ('X-Proxy-Cache', source),
+            ('Age', str(int(time.time() - entry.stored_at))),
+            ('X-Response-Time', str(response_time))
+        ]
+        return Response(entry.body, status=entry.status, headers=headers, direct_passthrough=True)
+
+    def _client_key(self) -> str:
+        """配额排队使用的客户端标识：优先X-Proxy-Client头，其次转发链中的原始IP"""
+        forwarded = request.headers.get('X-Forwarded-For', '').split(',')[0].strip()
+        return request.headers.get('X-Proxy-Client') or forwarded or request.remote_addr or 'unknown'
+
+    def _throttle_headers(self, endpoint: str, status: int, headers, body: bytes) -> list:
+        """领星仍返回限流时暂停该端点放行，并通过Retry-After告知客户端需要等待的时间"""
+        if status != 200 or business_code(headers, body) != THROTTLE_CODE:
+            return []
+        retry_after = self.quota.penalize(endpoint)
+        logger.warning(f"🚦 领星返回限流: {endpoint}，暂停放行{retry_after}秒")
+        return [('Retry-After', str(retry_after))]
+
+    def _quota_exceeded_response(self, error: QuotaExceeded) -> Response:
+        """排队超时：返回429和Retry-After，不转发到上游"""
+        self.metrics.inc('quota_rejected')
+        logger.warning(f"🚦 配额排队已满: {error.endpoint}，建议{error.retry_after}秒后重试")
+        response = jsonify({
+            'error': '接口配额已用尽，请稍后重试',
+            'endpoint': error.endpoint,
+            'retry_after': error.retry_after,
+            'timestamp': datetime.now().isoformat()
+        })
+        response.status_code = 429
+        response.headers['Retry-After'] = str(error.retry_after)
+        return response
 
     def _handle_feishu_webhook(self) -> Response:
         """
@@ -325,23 +1483,9 @@ class UnifiedCloudProxy:
         Returns:
             Response: Flask响应对象
         """
-        self.stats['feishu_requests'] += 1
+        self.metrics.inc('feishu_requests')
 
         try:
-            # 检查是否有可用的WebSocket连接
-            local_clients = [
-                client_id for client_id, info in self.ws_clients.items()
-                if info.get('type') == 'local_server'
-            ]
-
-            if not local_clients:
-                logger.error("❌ 没有可用的本地服务器连接")
-                return jsonify({
-                    'error': '本地服务器未连接',
-                    'message': '请确保本地反向代理客户端正在运行',
-                    'timestamp': datetime.now().isoformat()
-                }), 503
-
             # 准备转发数据
             request_data = {
                 'method': request.method,
@@ -355,13 +1499,6 @@ class UnifiedCloudProxy:
             # 生成请求ID
             request_id = str(uuid.uuid4())
 
-            # 存储待处理请求
-            self.pending_requests[request_id] = {
-                'created_at': time.time(),
-                'completed': False,
-                'response': None
-            }
-
             # 构建WebSocket消息
             ws_message = {
                 'type': 'feishu_request',
@@ -370,39 +1507,34 @@ class UnifiedCloudProxy:
                 'timestamp': datetime.now().isoformat()
             }
 
-            # 发送到第一个可用的本地服务器客户端
-            target_client = local_clients[0]
-            self.socketio.emit('feishu_request', ws_message, room=target_client)
-            logger.info(f"📤 已通过WebSocket转发飞书请求到客户端: {target_client}")
-
-            # 等待响应
-            timeout = 30  # 30秒超时
-            start_wait = time.time()
-
-            while time.time() - start_wait < timeout:
-                if self.pending_requests[request_id]['completed']:
-                    response_data = self.pending_requests[request_id]['response']
-                    del self.pending_requests[request_id]
-
-                    # 返回本地服务器的响应
-                    if isinstance(response_data, dict):
-                        status_code = response_data.get('status_code', 200)
-                        headers = response_data.get('headers', {})
-                        data = response_data.get('data', {})
-
-                        return Response(
-                            json.dumps(data, ensure_ascii=False),
-                            status=status_code,
-                            headers=headers,
-                            content_type='application/json; charset=utf-8'
-                        )
-                    else:
-                        return jsonify(response_data)
-
-                time.sleep(0.1)  # 短暂等待
+            # 转发给负载最低的本地客户端并等待响应（30秒超时）
+            response_data = self._dispatch(request_id, ws_message, timeout=30)
+
+            if response_data is CLIENT_LOST:
+                logger.error("❌ 没有可用的本地服务器连接")
+                return jsonify({
+                    'error': '本地服务器未连接',
+                    'message': '请确保本地反向代理客户端正在运行',
+                    'timestamp': datetime.now().isoformat()
+                }), 503
+
+            if response_data is not None:
+                # 返回本地服务器的响应
+                if isinstance(response_data, dict):
+                    status_code = response_data.get('status_code', 200)
+                    headers = response_data.get('headers', {})
+                    data = response_data.get('data', {})
+
+                    return Response(
+                        json.dumps(data, ensure_ascii=False),
+                        status=status_code,
+                        headers=headers,
+                        content_type='application/json; charset=utf-8'
+                    )
+                else:
+                    return jsonify(response_data)
 
             # 超时处理
-            del self.pending_requests[request_id]
             return jsonify({
                 'error': '请求处理超时',
                 'message': '本地服务器响应超时',
@@ -418,6 +1550,58 @@ class UnifiedCloudProxy:
                 'timestamp': datetime.now().isoformat()
             }), 500
 
+    def _dispatch(self, request_id: str, ws_message: Dict[str, Any], timeout: float) -> Optional[Any]:
+        """
+        把请求转发给负载最低的本地客户端并等待响应；
+        客户端中途断开或回复502/503/504时，在剩余时间内改派给其他客户端
+
+        Args:
+            request_id: 请求ID
+            ws_message: WebSocket消息
+            timeout: 总超时时间（秒）
+
+        Returns:
+            响应数据；超时返回None，没有可用客户端返回CLIENT_LOST
+        """
+        deadline = time.time() + timeout
+        tried = []
+        response_data = CLIENT_LOST
+
+        while time.time() < deadline:
+            # 先登记再占用客户端并转发：响应到达、或客户端刚被选中就断开时，
+            # 都能直接唤醒本次等待，不会被当作迟到响应丢弃
+            self.pending_requests.register(request_id)
+            client_id = self.client_pool.acquire(request_id, exclude=tried)
+            if client_id is None:
+                self.pending_requests.cancel(request_id)
+                break
+            tried.append(client_id)
+
+            started = time.time()
+            try:
+                self.socketio.emit('feishu_request', ws_message, room=client_id)
+            except Exception as e:
+                self.pending_requests.cancel(request_id)
+                self.client_pool.release(client_id, request_id, success=False)
+                logger.warning(f"⚠️ 转发到客户端 {client_id} 失败: {str(e)}")
+                continue
+            logger.info(f"📤 已通过WebSocket转发飞书请求到客户端: {client_id}")
+
+            response_data = self.pending_requests.wait(request_id, timeout=deadline - time.time())
+            failed = (
+                response_data is None or response_data is CLIENT_LOST or
+                (isinstance(response_data, dict) and response_data.get('status_code') in RETRYABLE_STATUS)
+            )
+            self.client_pool.release(client_id, request_id,
+                                     latency=None if failed else time.time() - started, success=not failed)
+            if not failed:
+                self.metrics.observe('tunnel_latency', time.time() - started, client=self._client_label(client_id))
+            if response_data is None or not failed:
+                return response_data
+            logger.warning(f"⚠️ 客户端 {client_id} 未能处理请求 {request_id}，尝试改派")
+
+        return response_data
+
     def run(self):
         """
         🚀 启动统一代理服务器
@@ -453,6 +1637,16 @@ def main():
 
     args = parser.parse_args()
 
+    # 配置日志
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('unified_proxy.log', encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+
     # 创建并启动服务器
     server = UnifiedCloudProxy(
         host=args.host,
@@ -464,103 +1658,3 @@ def main():
 
 if __name__ == '__main__':
     main()
-
-    def _handle_feishu_webhook(self) -> Response:
-        """
-        处理飞书webhook请求，通过WebSocket转发到本地服务器
-
-        Returns:
-            Response: Flask响应对象
-        """
-        self.stats['feishu_requests'] += 1
-
-        try:
-            # 检查是否有可用的WebSocket连接
-            local_clients = [
-                client_id for client_id, info in self.ws_clients.items()
-                if info.get('type') == 'local_server'
-            ]
-
-            if not local_clients:
-                logger.error("❌ 没有可用的本地服务器连接")
-                return jsonify({
-                    'error': '本地服务器未连接',
-                    'message': '请确保本地反向代理客户端正在运行',
-                    'timestamp': datetime.now().isoformat()
-                }), 503
-
-            # 准备转发数据
-            request_data = {
-                'method': request.method,
-                'headers': dict(request.headers),
-                'json_data': request.get_json() if request.is_json else None,
-                'form_data': request.form.to_dict() if not request.is_json else None,
-                'args': request.args.to_dict(),
-                'endpoint': '/feishu/webhook'
-            }
-
-            # 生成请求ID
-            request_id = str(uuid.uuid4())
-
-            # 存储待处理请求
-            self.pending_requests[request_id] = {
-                'created_at': time.time(),
-                'completed': False,
-                'response': None
-            }
-
-            # 构建WebSocket消息
-            ws_message = {
-                'type': 'feishu_request',
-                'request_id': request_id,
-                'data': request_data,
-                'timestamp': datetime.now().isoformat()
-            }
-
-            # 发送到第一个可用的本地服务器客户端
-            target_client = local_clients[0]
-            self.socketio.emit('feishu_request', ws_message, room=target_client)
-            logger.info(f"📤 已通过WebSocket转发飞书请求到客户端: {target_client}")
-
-            # 等待响应
-            timeout = 30  # 30秒超时
-            start_wait = time.time()
-
-            while time.time() - start_wait < timeout:
-                if self.pending_requests[request_id]['completed']:
-                    response_data = self.pending_requests[request_id]['response']
-                    del self.pending_requests[request_id]
-
-                    # 返回本地服务器的响应
-                    if isinstance(response_data, dict):
-                        status_code = response_data.get('status_code', 200)
-                        headers = response_data.get('headers', {})
-                        data = response_data.get('data', {})
-
-                        return Response(
-                            json.dumps(data, ensure_ascii=False),
-                            status=status_code,
-                            headers=headers,
-                            content_type='application/json; charset=utf-8'
-                        )
-                    else:
-                        return jsonify(response_data)
-
-                time.sleep(0.1)  # 短暂等待
-
-            # 超时处理
-            del self.pending_requests[request_id]
-            return jsonify({
-                'error': '请求处理超时',
-                'message': '本地服务器响应超时',
-                'request_id': request_id,
-                'timestamp': datetime.now().isoformat()
-            }), 408
-
-        except Exception as e:
-            logger.error(f"❌ 处理飞书请求失败: {str(e)}")
-            logger.error(traceback.format_exc())
-            return jsonify({
-                'error': f'处理飞书请求失败: {str(e)}',
-                'timestamp': datetime.now().isoformat()
-            }), 500
@@ -2,62 +2,274 @@
 # -*- coding: utf-8 -*-
 """
 🔌 原生WebSocket反向代理客户端
-与云代理服务器的原生WebSocket接口兼容
+与云代理服务器的原生WebSocket接口兼容；服务器支持时使用二进制帧协议（frames/1），
+多个请求在同一连接上交错传输，请求/响应body原样传递
 """
 
 import asyncio
 import websockets
 import json
+import zlib
+import struct
 import logging
 import time
-import requests
+import aiohttp
 from datetime import datetime
+from typing import Dict, List, Optional
 import signal
 import sys
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('websocket_reverse_client.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+# 逐跳头部：只对单个连接有效，不转发
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailer', 'trailers', 'transfer-encoding', 'upgrade'
+}
+
+# 转发到本地服务器时由HTTP客户端重新生成的请求头
+SKIPPED_REQUEST_HEADERS = HOP_BY_HOP_HEADERS | {'host', 'content-length'}
+
+# 响应体已被HTTP客户端解压，内容相关头部不随响应回传
+SKIPPED_RESPONSE_HEADERS = HOP_BY_HOP_HEADERS | {'content-encoding', 'content-length'}
+
+# ------------------------------------------------------------------
+# 二进制帧隧道协议（frames/1）
+# 帧 = 10字节头部（类型、标志、流ID、元数据长度）+ 载荷（元数据 + 原样的body字节），
+# 载荷较大时整帧压缩。多个请求以流ID区分，在同一连接上交错传输；
+# 发送方按每个流的窗口发送，接收方消费数据后用WINDOW帧归还额度。
+# 云代理（cloud_proxy_server_async.py）中保留一份相同的实现，两边需同步修改。
+# ------------------------------------------------------------------
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+TUNNEL_PROTOCOL = 'frames/1'
+
+FRAME_HEADER = struct.Struct('!BBII')
+FRAME_REQUEST, FRAME_RESPONSE, FRAME_DATA, FRAME_WINDOW, FRAME_RESET = 1, 2, 3, 4, 5
+FLAG_END_STREAM = 0x01
+FLAG_COMPRESSED = 0x02
+
+FRAME_MAX_BODY = 32 * 1024   # 单帧最大body字节数，大响应拆帧后与其他流交错
+INITIAL_WINDOW = 256 * 1024  # 每个流的初始发送窗口（字节）
+COMPRESS_MIN_SIZE = 512      # 小于该大小的载荷不压缩
+
+def available_codecs() -> List[str]:
+    """本端支持的帧压缩算法，按优先级排序"""
+    return ['zstd', 'zlib'] if zstandard else ['zlib']
+
+def pack_fields(fields) -> bytes:
+    """把字符串列表编码为（2字节长度 + UTF-8字节）序列"""
+    parts = []
+    for field in fields:
+        data = str(field).encode('utf-8')
+        parts.append(struct.pack('!H', len(data)))
+        parts.append(data)
+    return b''.join(parts)
+
+def unpack_fields(data: bytes) -> List[str]:
+    """pack_fields的逆操作"""
+    fields, offset = [], 0
+    while offset < len(data):
+        (length,) = struct.unpack_from('!H', data, offset)
+        offset += 2
+        fields.append(data[offset:offset + length].decode('utf-8'))
+        offset += length
+    return fields
+
+class Frame:
+    """一个解码后的隧道帧"""
+
+    __slots__ = ('type', 'flags', 'stream_id', 'meta', 'body')
+
+    def __init__(self, frame_type: int, flags: int, stream_id: int, meta: bytes, body: bytes):
+        self.type = frame_type
+        self.flags = flags
+        self.stream_id = stream_id
+        self.meta = meta
+        self.body = body
+
+    @property
+    def end(self) -> bool:
+        return bool(self.flags & FLAG_END_STREAM)
+
+class FrameChannel:
+    """
+    一条WebSocket连接上的多路复用帧通道
+    负责帧的编解码、压缩和按流的发送窗口，收到的WINDOW帧在通道内部处理
+    """
+
+    def __init__(self, send, codec: str = 'zlib'):
+        """
+        Args:
+            send: 发送二进制消息的协程函数
+            codec: 压缩算法（zstd或zlib）
+        """
+        self._send = send
+        self.codec = codec
+        if codec == 'zstd':
+            self._compress = zstandard.ZstdCompressor(level=3).compress
+            self._decompress = zstandard.ZstdDecompressor().decompress
+        else:
+            self._compress = zlib.compress
+            self._decompress = zlib.decompress
+        self.windows: Dict[int, int] = {}  # {stream_id: 剩余发送额度}
+        self.cancelled = set()             # 对端已重置的流
+        self.closed = False
+        self._window_changed = asyncio.Condition()
+        self.stats = {
+            'frames_sent': 0,
+            'frames_received': 0,
+            'payload_bytes_sent': 0,
+            'wire_bytes_sent': 0,
+            'wire_bytes_received': 0
+        }
+
+    def encode(self, frame_type: int, stream_id: int, flags: int = 0, meta: bytes = b'', body: bytes = b'') -> bytes:
+        """编码一个帧，载荷达到阈值且压缩有收益时整体压缩"""
+        payload = meta + body
+        self.stats['payload_bytes_sent'] += len(payload)
+        if len(payload) >= COMPRESS_MIN_SIZE:
+            compressed = self._compress(payload)
+            if len(compressed) < len(payload):
+                payload = compressed
+                flags |= FLAG_COMPRESSED
+        return FRAME_HEADER.pack(frame_type, flags, stream_id, len(meta)) + payload
+
+    def decode(self, data: bytes) -> Frame:
+        """解码一个帧"""
+        frame_type, flags, stream_id, meta_length = FRAME_HEADER.unpack_from(data)
+        payload = data[FRAME_HEADER.size:]
+        if flags & FLAG_COMPRESSED:
+            payload = self._decompress(payload)
+        return Frame(frame_type, flags, stream_id, payload[:meta_length], payload[meta_length:])
+
+    async def _write(self, data: bytes):
+        self.stats['frames_sent'] += 1
+        self.stats['wire_bytes_sent'] += len(data)
+        await self._send(data)
+
+    async def _reserve(self, stream_id: int, size: int):
+        """等待流的发送窗口足够发送size字节"""
+        async with self._window_changed:
+            self.windows.setdefault(stream_id, INITIAL_WINDOW)
+            await self._window_changed.wait_for(
+                lambda: self.closed or stream_id in self.cancelled or self.windows[stream_id] >= size
+            )
+            if self.closed or stream_id in self.cancelled:
+                raise ConnectionResetError('隧道流已中断')
+            self.windows[stream_id] -= size
+
+    async def send_stream(self, frame_type: int, stream_id: int, meta: bytes, body: bytes):
+        """
+        发送REQUEST/RESPONSE帧；body超过单帧大小时拆成后续DATA帧，每帧发送前等待窗口
+
+        Raises:
+            ConnectionResetError: 连接已关闭或对端重置了该流
+        """
+        view = memoryview(body)
+        offset = 0
+        try:
+            while True:
+                chunk = bytes(view[offset:offset + FRAME_MAX_BODY])
+                await self._reserve(stream_id, len(chunk))
+                offset += len(chunk)
+                last = offset >= len(body)
+                await self._write(self.encode(frame_type, stream_id, FLAG_END_STREAM if last else 0, meta, chunk))
+                if last:
+                    break
+                frame_type, meta = FRAME_DATA, b''
+        finally:
+            self.windows.pop(stream_id, None)
+            self.cancelled.discard(stream_id)
+
+    async def grant(self, stream_id: int, size: int):
+        """归还对端发送窗口（已消费size字节）"""
+        if size:
+            await self._write(self.encode(FRAME_WINDOW, stream_id, body=struct.pack('!I', size)))
+
+    async def reset(self, stream_id: int):
+        """通知对端放弃该流"""
+        await self._write(self.encode(FRAME_RESET, stream_id))
+
+    async def receive(self, data: bytes) -> Optional[Frame]:
+        """
+        处理收到的二进制消息
+
+        Returns:
+            Optional[Frame]: 需要上层处理的帧，WINDOW帧返回None
+        """
+        self.stats['frames_received'] += 1
+        self.stats['wire_bytes_received'] += len(data)
+        frame = self.decode(data)
+        if frame.type in (FRAME_WINDOW, FRAME_RESET):
+            async with self._window_changed:
+                if frame.type == FRAME_WINDOW:
+                    if frame.stream_id in self.windows:
+                        self.windows[frame.stream_id] += struct.unpack('!I', frame.body)[0]
+                elif frame.stream_id in self.windows:
+                    self.cancelled.add(frame.stream_id)
+                self._window_changed.notify_all()
+            if frame.type == FRAME_WINDOW:
+                return None
+        return frame
+
+    async def close(self):
+        """连接断开，唤醒所有等待窗口的发送方"""
+        async with self._window_changed:
+            self.closed = True
+            self._window_changed.notify_all()
+
+
 class WebSocketReverseClient:
     """
     🔌 原生WebSocket反向代理客户端
     与云代理服务器建立WebSocket连接，处理飞书请求转发
     """
     
-    def __init__(self, cloud_server_ws='ws://175.178.183.96:8081/ws', local_server_url='http://192.168.0.105:5000'):
+    def __init__(self, cloud_server_ws='ws://175.178.183.96:8081/ws', local_server_url='http://192.168.0.105:5000',
+                 protocol='frames', max_concurrency=20, local_timeout=15):
         """
         初始化WebSocket反向代理客户端
         
         Args:
             cloud_server_ws: 云服务器WebSocket地址
             local_server_url: 本地服务器地址
+            protocol: 隧道协议，frames（服务器支持时使用二进制帧）或json
+            max_concurrency: 同时转发到本地服务器的最大请求数
+            local_timeout: 本地服务器请求超时时间（秒）
         """
         self.cloud_server_ws = cloud_server_ws
         self.local_server_url = local_server_url
         self.client_id = f"ws_client_{int(time.time())}"
+        self.protocol = protocol
+        self.max_concurrency = max_concurrency
+        self.local_timeout = local_timeout
         
         # 连接状态
         self.websocket = None
         self.connected = False
         self.running = False
         
-        # 创建HTTP会话
-        self.session = requests.Session()
-        self.session.timeout = 10
+        # 帧协议状态（注册确认后创建）
+        self.channel = None
+        self.request_streams = {}  # {stream_id: (元数据, 已收到的body)}
+        self.request_tasks = set()  # 处理中的请求任务
+        
+        # HTTP连接池和并发限制（在事件循环中创建，见start）
+        self.session = None
+        self.semaphore = None
         
         # 统计信息
         self.stats = {
             'connected': False,
             'requests_processed': 0,
             'connection_attempts': 0,
+            'active_requests': 0,
+            'peak_concurrency': 0,
             'start_time': time.time()
         }
         
@@ -78,6 +290,8 @@ class WebSocketReverseClient:
                 'timestamp': datetime.now().isoformat(),
                 'service': 'feishu-webhook-reverse-proxy'
             }
+            if self.protocol == 'frames':
+                registration_data.update(protocol=TUNNEL_PROTOCOL, compression=available_codecs())
             
             await self.websocket.send(json.dumps(registration_data))
             logger.info("✅ 客户端注册消息已发送")
@@ -86,6 +300,49 @@ class WebSocketReverseClient:
             logger.error(f"❌ 客户端注册失败: {str(e)}")
             return False
     
+    def spawn_request_task(self, coro):
+        """
+        在独立任务中处理请求，消息循环和心跳不会被慢请求阻塞
+        
+        Args:
+            coro: 请求处理协程
+        """
+        task = asyncio.create_task(coro)
+        self.request_tasks.add(task)
+        task.add_done_callback(self.request_tasks.discard)
+    
+    async def forward_to_local(self, method, endpoint, headers, query=None, body=None, payload=None):
+        """
+        转发请求到本地服务器，连接池复用连接，信号量限制同时转发的请求数
+        
+        Args:
+            method: 请求方法
+            endpoint: 请求路径
+            headers: 请求头
+            query: 查询参数（字典或查询字符串）
+            body: 原始请求体
+            payload: JSON请求体（与body二选一）
+        
+        Returns:
+            tuple: (状态码, 响应头, 响应体字节)
+        """
+        headers = {name: value for name, value in headers.items() if name.lower() not in SKIPPED_REQUEST_HEADERS}
+        async with self.semaphore:
+            self.stats['active_requests'] += 1
+            self.stats['peak_concurrency'] = max(self.stats['peak_concurrency'], self.stats['active_requests'])
+            try:
+                async with self.session.request(
+                    method,
+                    f"{self.local_server_url}{endpoint}",
+                    headers=headers,
+                    params=query or None,
+                    data=body,
+                    json=payload
+                ) as response:
+                    return response.status, response.headers, await response.read()
+            finally:
+                self.stats['active_requests'] -= 1
+    
     async def process_feishu_request(self, request_data):
         """
         处理飞书请求
@@ -93,8 +350,8 @@ class WebSocketReverseClient:
         Args:
             request_data: 飞书请求数据
         """
+        request_id = request_data.get('request_id')
         try:
-            request_id = request_data.get('request_id')
             endpoint = request_data.get('endpoint', '/feishu/webhook')
             method = request_data.get('method', 'POST')
             headers = request_data.get('headers', {})
@@ -103,34 +360,23 @@ class WebSocketReverseClient:
             
             logger.info(f"📥 处理飞书请求: {request_id} -> {endpoint}")
             
-            # 构建本地服务器URL
-            target_url = f"{self.local_server_url}{endpoint}"
-            
             # 转发请求到本地服务器
-            if method.upper() == 'POST':
-                response = self.session.post(
-                    target_url,
-                    json=payload,
-                    headers=headers,
-                    params=query_params,
-                    timeout=15
-                )
-            else:
-                response = self.session.get(
-                    target_url,
-                    headers=headers,
-                    params=query_params,
-                    timeout=15
-                )
+            status, response_headers, content = await self.forward_to_local(
+                method,
+                endpoint,
+                headers,
+                query=query_params,
+                payload=payload if method.upper() == 'POST' else None
+            )
             
             # 准备响应数据
             response_data = {
                 'type': 'feishu_response',
                 'request_id': request_id,
                 'response': {
-                    'status_code': response.status_code,
-                    'headers': dict(response.headers),
-                    'data': response.json() if response.headers.get('content-type', '').startswith('application/json') else response.text
+                    'status_code': status,
+                    'headers': dict(response_headers),
+                    'data': json.loads(content) if response_headers.get('content-type', '').startswith('application/json') else content.decode('utf-8', errors='replace')
                 },
                 'timestamp': datetime.now().isoformat()
             }
@@ -139,20 +385,87 @@ class WebSocketReverseClient:
             await self.websocket.send(json.dumps(response_data))
             
             self.stats['requests_processed'] += 1
-            logger.info(f"✅ 飞书请求处理完成: {request_id} - {response.status_code}")
+            logger.info(f"✅ 飞书请求处理完成: {request_id} - {status}")
             
-        except requests.exceptions.ConnectionError:
-            logger.error(f"❌ 无法连接到本地服务器: {self.local_server_url}")
-            await self.send_error_response(request_id, "本地服务器连接失败")
-            
-        except requests.exceptions.Timeout:
+        except asyncio.TimeoutError:
             logger.error(f"❌ 本地服务器请求超时: {request_id}")
             await self.send_error_response(request_id, "本地服务器请求超时")
             
+        except aiohttp.ClientConnectionError:
+            logger.error(f"❌ 无法连接到本地服务器: {self.local_server_url}")
+            await self.send_error_response(request_id, "本地服务器连接失败")
+            
         except Exception as e:
             logger.error(f"❌ 处理飞书请求失败: {request_id} - {str(e)}")
             await self.send_error_response(request_id, f"处理请求失败: {str(e)}")
     
+    async def handle_frame(self, data):
+        """
+        处理帧协议消息：按流ID拼接请求body，请求完整后在独立任务中处理
+
+        Args:
+            data: 二进制消息
+        """
+        frame = await self.channel.receive(data)
+        if frame is None:
+            return
+        if frame.type == FRAME_RESET:
+            self.request_streams.pop(frame.stream_id, None)
+            return
+        if frame.type == FRAME_REQUEST:
+            self.request_streams[frame.stream_id] = (frame.meta, bytearray())
+        entry = self.request_streams.get(frame.stream_id)
+        if entry is None:
+            return
+        entry[1].extend(frame.body)
+        if not frame.end:
+            await self.channel.grant(frame.stream_id, len(frame.body))
+            return
+        del self.request_streams[frame.stream_id]
+        self.spawn_request_task(self.process_framed_request(self.channel, frame.stream_id, entry[0], bytes(entry[1])))
+    
+    async def process_framed_request(self, channel, stream_id, meta, body):
+        """
+        处理帧协议请求：原始body转发到本地服务器，响应头和body原样回传
+        
+        Args:
+            channel: 收到请求的帧通道
+            stream_id: 流ID
+            meta: 请求元数据（方法、路径、查询字符串、头部）
+            body: 原始请求体
+        """
+        fields = unpack_fields(meta)
+        method, endpoint, query = fields[:3]
+        headers = dict(zip(fields[3::2], fields[4::2]))
+        logger.info(f"📥 处理飞书请求: #{stream_id} -> {endpoint}")
+        
+        try:
+            status, local_headers, content = await self.forward_to_local(method, endpoint, headers, query=query, body=body)
+            response_headers = [(name, value) for name, value in local_headers.items()
+                                if name.lower() not in SKIPPED_RESPONSE_HEADERS]
+        except asyncio.TimeoutError:
+            logger.error(f"❌ 本地服务器请求超时: #{stream_id}")
+            status, response_headers, content = 504, [('Content-Type', 'application/json')], \
+                json.dumps({'error': '本地服务器请求超时'}, ensure_ascii=False).encode()
+        except aiohttp.ClientConnectionError:
+            logger.error(f"❌ 无法连接到本地服务器: {self.local_server_url}")
+            status, response_headers, content = 502, [('Content-Type', 'application/json')], \
+                json.dumps({'error': '本地服务器连接失败'}, ensure_ascii=False).encode()
+        except Exception as e:
+            logger.error(f"❌ 处理飞书请求失败: #{stream_id} - {str(e)}")
+            status, response_headers, content = 500, [('Content-Type', 'application/json')], \
+                json.dumps({'error': f'处理请求失败: {str(e)}'}, ensure_ascii=False).encode()
+        
+        try:
+            meta = pack_fields([status] + [item for header in response_headers for item in header])
+            await channel.send_stream(FRAME_RESPONSE, stream_id, meta, content)
+            self.stats['requests_processed'] += 1
+            logger.info(f"✅ 飞书请求处理完成: #{stream_id} - {status}")
+        except ConnectionResetError:
+            logger.warning(f"⚠️ 请求已被服务器放弃: #{stream_id}")
+        except websockets.exceptions.ConnectionClosed:
+            logger.warning(f"⚠️ 连接已断开，响应未送达: #{stream_id}")
+    
     async def send_error_response(self, request_id, error_message):
         """
         发送错误响应
@@ -220,20 +533,31 @@ class WebSocketReverseClient:
         try:
             async for message in self.websocket:
                 try:
+                    if isinstance(message, bytes):
+                        if self.channel:
+                            await self.handle_frame(message)
+                        continue
+                    
                     data = json.loads(message)
                     message_type = data.get('type')
                     
                     if message_type == 'feishu_request':
-                        # 处理飞书请求
-                        await self.process_feishu_request(data)
+                        # 处理飞书请求（独立任务，不阻塞消息循环）
+                        self.spawn_request_task(self.process_feishu_request(data))
                     elif message_type == 'ping':
                         # 响应ping消息
                         pong_data = {'type': 'pong', 'timestamp': datetime.now().isoformat()}
                         await self.websocket.send(json.dumps(pong_data))
                         logger.debug("🏓 响应ping消息")
                     elif message_type == 'registration_ack':
-                        # 注册确认
-                        logger.info("✅ 客户端注册确认收到")
+                        # 注册确认，服务器同意时切换到帧协议
+                        if data.get('protocol') == TUNNEL_PROTOCOL:
+                            self.channel = FrameChannel(self.websocket.send, data.get('compression', 'zlib'))
+                            logger.info(f"✅ 客户端注册确认收到，使用帧协议 ({self.channel.codec})")
+                        else:
+                            if self.protocol == 'frames':
+                                logger.info("ℹ️ 服务器不支持帧协议，使用JSON消息")
+                            logger.info("✅ 客户端注册确认收到")
                     else:
                         logger.debug(f"📨 收到未知消息类型: {message_type}")
                         
@@ -261,11 +585,13 @@ class WebSocketReverseClient:
                 self.stats['connection_attempts'] += 1
                 logger.info(f"🔗 尝试连接到云服务器 (尝试 {attempt}/{max_retries}): {self.cloud_server_ws}")
                 
-                # 建立WebSocket连接
+                # 建立WebSocket连接（帧协议自行压缩，不再协商permessage-deflate）
                 self.websocket = await websockets.connect(
                     self.cloud_server_ws,
                     ping_interval=20,
-                    ping_timeout=10
+                    ping_timeout=10,
+                    compression=None if self.protocol == 'frames' else 'deflate',
+                    max_size=None
                 )
                 
                 self.connected = True
@@ -288,6 +614,11 @@ class WebSocketReverseClient:
                         await heartbeat_task
                     except asyncio.CancelledError:
                         pass
+                    # 帧协议状态随连接失效
+                    if self.channel:
+                        await self.channel.close()
+                        self.channel = None
+                    self.request_streams.clear()
                 
                 # 如果到达这里，说明连接正常断开
                 break
@@ -317,6 +648,13 @@ class WebSocketReverseClient:
         logger.info("🚀 启动WebSocket反向代理客户端")
         self.running = True
         
+        # 到本地服务器的连接池，连接数与并发上限一致
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.local_timeout)
+        )
+        
         try:
             while self.running:
                 success = await self.connect_and_run()
@@ -347,6 +685,10 @@ class WebSocketReverseClient:
                 logger.info("✅ WebSocket连接已关闭")
             except Exception as e:
                 logger.error(f"❌ 关闭WebSocket连接失败: {str(e)}")
+        
+        if self.session:
+            await self.session.close()
+            self.session = None
     
     def get_stats(self):
         """
@@ -359,7 +701,8 @@ class WebSocketReverseClient:
         return {
             **self.stats,
             'uptime_seconds': uptime,
-            'uptime_hours': uptime / 3600
+            'uptime_hours': uptime / 3600,
+            'tunnel': self.channel.stats if self.channel else None
         }
 
 async def main():
@@ -369,13 +712,30 @@ async def main():
     parser = argparse.ArgumentParser(description='🔌 原生WebSocket反向代理客户端')
     parser.add_argument('--cloud-ws', default='ws://175.178.183.96:8081/ws', help='云服务器WebSocket地址')
     parser.add_argument('--local-server', default='http://192.168.0.105:5000', help='本地服务器地址')
+    parser.add_argument('--protocol', choices=['frames', 'json'], default='frames',
+                        help='隧道协议：frames（服务器支持时使用二进制帧）或json')
+    parser.add_argument('--max-concurrency', type=int, default=20, help='同时转发到本地服务器的最大请求数')
+    parser.add_argument('--local-timeout', type=float, default=15, help='本地服务器请求超时时间（秒）')
     
     args = parser.parse_args()
     
+    # 配置日志
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('websocket_reverse_client.log', encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+    
     # 创建客户端
     client = WebSocketReverseClient(
         cloud_server_ws=args.cloud_ws,
-        local_server_url=args.local_server
+        local_server_url=args.local_server,
+        protocol=args.protocol,
+        max_concurrency=args.max_concurrency,
+        local_timeout=args.local_timeout
     )
     
     # 设置信号处理
@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+"""
+命令准入控制模块
+对会调用领星接口的重型命令按用户和群聊限流，并限制同时执行的数量；
+超出并发上限的请求进入等待队列，执行名额释放后按顺序接着执行，
+轻量命令（帮助、状态等）不经过准入控制，不会排在重型命令之后
+"""
+
+import os
+import math
+import time
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Any, Callable, Iterable, Optional
+
+from config.config import FeishuBotConfig
+from utils.rate_limiter import TokenBucket
+from utils.logger import api_logger
+
+# 准入结果
+ADMITTED = 'admitted'
+QUEUED = 'queued'
+LIMITED = 'limited'
+REJECTED = 'rejected'
+
+# 默认的重型命令（会调用领星接口或生成Excel）；补货、紧急和查基于内存快照应答，不在此列
+HEAVY_COMMANDS = ('刷新', 'refresh', '导出', 'export', '店铺', 'sellers', '测试', 'test')
+
+class Admission:
+    """一次准入判断的结果"""
+
+    def __init__(self, status: str, position: int = 0, retry_after: float = 0.0, scope: str = ''):
+        """
+        初始化准入结果
+
+        Args:
+            status: 准入结果（admitted/queued/limited/rejected）
+            position: 排队位置（从1开始，仅queued有效）
+            retry_after: 建议的重试等待时间（秒，仅limited有效）
+            scope: 触发限流的范围（'user' 或 'chat'，仅limited有效）
+        """
+        self.status = status
+        self.position = position
+        self.retry_after = retry_after
+        self.scope = scope
+
+    def reply_text(self) -> str:
+        """未立即执行时回复给用户的提示"""
+        if self.status == QUEUED:
+            return f"⏳ 已排队，当前第 {self.position} 位，完成后会自动回复结果。"
+        if self.status == LIMITED:
+            who = '本群' if self.scope == 'chat' else '您的'
+            return f"⏳ {who}查询过于频繁，请 {max(1, math.ceil(self.retry_after))} 秒后再试。"
+        if self.status == REJECTED:
+            return "⏳ 当前排队的查询较多，请稍后再试。"
+        return ''
+
+class AdmissionController:
+    """
+    重型命令准入控制器（线程安全）
+
+    每个用户和每个群聊各有一个令牌桶；通过限流的请求在并发未满时直接执行，
+    否则进入有界等待队列。release() 把名额直接交给队首请求（在独立线程中执行），
+    因此同时执行的重型命令不超过 max_concurrent 个，排队请求也不占用工作线程
+    """
+
+    def __init__(self, heavy_commands: Iterable[str] = HEAVY_COMMANDS, max_concurrent: int = None,
+                 max_pending: int = None, user_burst: int = None, user_interval: float = None,
+                 chat_burst: int = None, chat_interval: float = None, max_tracked: int = 1000):
+        """
+        初始化准入控制器
+
+        Args:
+            heavy_commands: 需要准入控制的命令
+            max_concurrent: 重型命令最大并发数
+            max_pending: 等待队列上限
+            user_burst: 每个用户的突发次数
+            user_interval: 每个用户恢复一次额度的间隔（秒）
+            chat_burst: 每个群聊的突发次数
+            chat_interval: 每个群聊恢复一次额度的间隔（秒）
+            max_tracked: 最多保留的用户/群聊令牌桶数量
+        """
+        self.heavy_commands = {command.lower() for command in heavy_commands}
+        self.max_concurrent = max(1, max_concurrent or FeishuBotConfig.HEAVY_MAX_CONCURRENT)
+        self.max_pending = max(0, max_pending if max_pending is not None else FeishuBotConfig.HEAVY_MAX_PENDING)
+        self.user_burst = user_burst or FeishuBotConfig.USER_BURST
+        self.user_interval = user_interval or FeishuBotConfig.USER_REFILL_INTERVAL
+        self.chat_burst = chat_burst or FeishuBotConfig.CHAT_BURST
+        self.chat_interval = chat_interval or FeishuBotConfig.CHAT_REFILL_INTERVAL
+        self.max_tracked = max(1, max_tracked)
+
+        self._user_buckets = OrderedDict()
+        self._chat_buckets = OrderedDict()
+        self._pending = deque()
+        self._active = 0
+        self._lock = threading.Lock()
+        self._stats = {'admitted': 0, 'queued': 0, 'limited': 0, 'rejected': 0, 'max_pending_seen': 0}
+
+        if self.max_concurrent >= FeishuBotConfig.WORKER_COUNT:
+            api_logger.log_warning(
+                f"重型命令并发上限({self.max_concurrent})不小于工作线程数({FeishuBotConfig.WORKER_COUNT})，"
+                f"轻量命令可能被重型命令阻塞"
+            )
+
+    def is_heavy(self, command: str) -> bool:
+        """判断命令是否需要准入控制"""
+        return command.lower() in self.heavy_commands
+
+    def _bucket(self, buckets: OrderedDict, key: str, burst: int, interval: float) -> TokenBucket:
+        """获取（或创建）令牌桶，超出数量上限时淘汰最久未使用的（调用方需持有锁）"""
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(1.0 / interval, burst)
+            while len(buckets) > self.max_tracked:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+    def acquire(self, sender_id: str, chat_id: Optional[str],
+                deferred: Optional[Callable[[], None]] = None) -> Admission:
+        """
+        申请执行一次重型命令
+
+        Args:
+            sender_id: 发送者ID
+            chat_id: 群聊ID（为空时只按用户限流）
+            deferred: 排队后由其他线程执行的任务（为空时不排队，并发已满直接拒绝）
+
+        Returns:
+            Admission: 准入结果；admitted 时调用方执行完毕后必须调用 release()
+        """
+        with self._lock:
+            can_queue = deferred is not None and len(self._pending) < self.max_pending
+            admission = self._admit(sender_id or 'anonymous', chat_id, can_queue)
+            self._stats[admission.status] += 1
+            if admission.status == ADMITTED:
+                self._active += 1
+            elif admission.status == QUEUED:
+                self._pending.append(deferred)
+                admission.position = len(self._pending)
+                self._stats['max_pending_seen'] = max(self._stats['max_pending_seen'], len(self._pending))
+            return admission
+
+    def _admit(self, user_key: str, chat_key: Optional[str], can_queue: bool) -> Admission:
+        """
+        检查令牌和并发名额并扣减令牌（调用方需持有锁）
+
+        Args:
+            user_key: 用户令牌桶的键
+            chat_key: 群聊令牌桶的键（为空时不按群聊限流）
+            can_queue: 并发已满时能否排队
+
+        Returns:
+            Admission: 准入结果（排队位置由调用方填写）
+        """
+        user_bucket = self._bucket(self._user_buckets, user_key, self.user_burst, self.user_interval)
+        chat_bucket = self._bucket(self._chat_buckets, chat_key, self.chat_burst,
+                                   self.chat_interval) if chat_key else None
+
+        # 先检查两个桶再扣减，避免一个桶被扣而另一个桶拒绝
+        for scope, bucket in (('user', user_bucket), ('chat', chat_bucket)):
+            wait = bucket.wait_time() if bucket else 0.0
+            if wait > 0:
+                return Admission(LIMITED, retry_after=wait, scope=scope)
+
+        if self._active < self.max_concurrent:
+            self._consume(user_bucket, chat_bucket)
+            return Admission(ADMITTED)
+        if not can_queue:
+            return Admission(REJECTED)
+        self._consume(user_bucket, chat_bucket)
+        return Admission(QUEUED)
+
+    @staticmethod
+    def _consume(user_bucket: TokenBucket, chat_bucket: Optional[TokenBucket]):
+        """扣减令牌（调用方需持有锁，且已确认令牌充足）"""
+        user_bucket.try_acquire()
+        if chat_bucket:
+            chat_bucket.try_acquire()
+
+    def release(self):
+        """
+        释放执行名额；等待队列不为空时名额直接交给队首任务，不会被新到的请求插队
+        """
+        with self._lock:
+            if not self._pending:
+                self._active -= 1
+                self._release_slot()
+                return
+            task = self._pending.popleft()
+
+        threading.Thread(target=self._run_deferred, args=(task,), name='feishu-heavy-queued', daemon=True).start()
+
+    def _release_slot(self):
+        """归还一个执行名额（调用方需持有锁；进程内计数已由 _active 维护）"""
+
+    def _run_deferred(self, task: Callable[[], None]):
+        """执行排队任务，完成后继续释放名额"""
+        try:
+            task()
+        except Exception as e:
+            api_logger.log_error(e, "执行排队命令失败")
+        finally:
+            self.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取准入统计信息
+
+        Returns:
+            Dict: 执行中/排队数量、并发上限和各类准入结果计数
+        """
+        with self._lock:
+            return {
+                **self._stats,
+                'active': self._active,
+                'pending': len(self._pending),
+                'max_concurrent': self.max_concurrent,
+                'max_pending': self.max_pending,
+                'tracked_users': len(self._user_buckets),
+                'tracked_chats': len(self._chat_buckets)
+            }
+
+
+class SharedAdmissionController(AdmissionController):
+    """
+    多进程共享的重型命令准入控制器
+
+    令牌桶和执行名额保存在SQLite中，多个工作进程合计不超过同一组限额；
+    等待队列仍在各进程内，并发已满时由后台线程轮询空出的名额。
+    数据库不可用时退回进程内的准入控制
+    """
+
+    def __init__(self, db_path: str, poll_interval: float = 0.2, **kwargs):
+        """
+        初始化共享准入控制器
+
+        Args:
+            db_path: SQLite数据库路径（各工作进程使用同一个文件）
+            poll_interval: 排队任务轮询空闲名额的间隔（秒）
+            **kwargs: 传给 AdmissionController 的限额参数
+        """
+        super().__init__(**kwargs)
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self._conn = None
+        self._poller = None
+        self._last_purge = 0.0
+        self._open_db()
+
+    def _open_db(self):
+        """打开SQLite数据库（失败时退回进程内准入控制）"""
+        try:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False,
+                                         isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS admission_buckets '
+                               '(bucket_key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS admission_slots '
+                               '(slot_id INTEGER PRIMARY KEY AUTOINCREMENT, pid INTEGER NOT NULL, '
+                               'started_at REAL NOT NULL)')
+        except sqlite3.Error as e:
+            api_logger.log_error(e, f"打开准入控制数据库失败，改用进程内限额: {self.db_path}")
+            self._conn = None
+
+    @staticmethod
+    def _pid_alive(pid: int) -> bool:
+        """检查进程是否存在"""
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def _count_slots(self) -> int:
+        """统计所有进程占用的名额，顺带清理已退出进程遗留的名额（需在事务中调用）"""
+        pids = [row[0] for row in self._conn.execute('SELECT DISTINCT pid FROM admission_slots')]
+        for pid in pids:
+            if not self._pid_alive(pid):
+                self._conn.execute('DELETE FROM admission_slots WHERE pid = ?', (pid,))
+        return self._conn.execute('SELECT COUNT(*) FROM admission_slots').fetchone()[0]
+
+    def _take_slot(self):
+        """登记本进程占用一个名额（需在事务中调用）"""
+        self._conn.execute('INSERT INTO admission_slots (pid, started_at) VALUES (?, ?)',
+                           (os.getpid(), time.time()))
+
+    def _refill(self, key: str, burst: int, interval: float, now: float) -> float:
+        """读取令牌桶当前令牌数（按经过时间补充，需在事务中调用）"""
+        row = self._conn.execute('SELECT tokens, updated_at FROM admission_buckets WHERE bucket_key = ?',
+                                 (key,)).fetchone()
+        if row is None:
+            return float(burst)
+        tokens, updated_at = row
+        return min(float(burst), tokens + max(0.0, now - updated_at) / interval)
+
+    def _admit(self, user_key: str, chat_key: Optional[str], can_queue: bool) -> Admission:
+        """在一个写事务中完成检查、扣减令牌和占用名额（调用方需持有锁）"""
+        if self._conn is None:
+            return super()._admit(user_key, chat_key, can_queue)
+
+        now = time.time()
+        buckets = [('user', f"user:{user_key}", self.user_burst, self.user_interval)]
+        if chat_key:
+            buckets.append(('chat', f"chat:{chat_key}", self.chat_burst, self.chat_interval))
+        try:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                tokens = {}
+                for scope, key, burst, interval in buckets:
+                    tokens[key] = self._refill(key, burst, interval, now)
+                    if tokens[key] < 1:
+                        self._conn.execute('ROLLBACK')
+                        return Admission(LIMITED, retry_after=(1 - tokens[key]) * interval, scope=scope)
+
+                if self._count_slots() < self.max_concurrent:
+                    self._take_slot()
+                    admission = Admission(ADMITTED)
+                elif can_queue:
+                    admission = Admission(QUEUED)
+                else:
+                    self._conn.execute('ROLLBACK')
+                    return Admission(REJECTED)
+
+                for key, value in tokens.items():
+                    self._conn.execute(
+                        'INSERT INTO admission_buckets (bucket_key, tokens, updated_at) VALUES (?, ?, ?) '
+                        'ON CONFLICT(bucket_key) DO UPDATE SET tokens = excluded.tokens, '
+                        'updated_at = excluded.updated_at', (key, value - 1, now))
+                self._purge_buckets(now)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            api_logger.log_error(e, "准入控制数据库读写失败，本次按进程内限额处理")
+            return super()._admit(user_key, chat_key, can_queue)
+
+        if admission.status == QUEUED:
+            self._start_poller()
+        return admission
+
+    def _purge_buckets(self, now: float):
+        """定期删除已恢复满额的令牌桶（与不存在等价，需在事务中调用）"""
+        full_after = max(self.user_burst * self.user_interval, self.chat_burst * self.chat_interval)
+        if now - self._last_purge > full_after:
+            self._conn.execute('DELETE FROM admission_buckets WHERE updated_at < ?', (now - full_after,))
+            self._last_purge = now
+
+    def _release_slot(self):
+        """删除本进程占用的一个名额（调用方需持有锁）"""
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute('DELETE FROM admission_slots WHERE slot_id = '
+                               '(SELECT slot_id FROM admission_slots WHERE pid = ? LIMIT 1)', (os.getpid(),))
+        except sqlite3.Error as e:
+            api_logger.log_error(e, "释放准入名额失败")
+
+    def _claim_for_pending(self) -> bool:
+        """为排队任务占用一个名额（调用方需持有锁）"""
+        try:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                claimed = self._count_slots() < self.max_concurrent
+                if claimed:
+                    self._take_slot()
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            return claimed
+        except sqlite3.Error as e:
+            api_logger.log_error(e, "准入控制数据库读写失败")
+            return False
+
+    def _start_poller(self):
+        """启动排队任务的名额轮询线程（调用方需持有锁）"""
+        if self._poller is None:
+            self._poller = threading.Thread(target=self._poll_slots, name='feishu-admission-poller',
+                                            daemon=True)
+            self._poller.start()
+
+    def _poll_slots(self):
+        """其他进程释放名额后，把名额交给本进程的队首任务"""
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                if not self._pending:
+                    self._poller = None
+                    return
+                if not self._claim_for_pending():
+                    continue
+                self._active += 1
+                task = self._pending.popleft()
+            threading.Thread(target=self._run_deferred, args=(task,), name='feishu-heavy-queued',
+                             daemon=True).start()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取准入统计信息
+
+        Returns:
+            Dict: 本进程的统计，另含所有进程合计执行中的数量和存储方式
+        """
+        stats = super().get_stats()
+        stats['backend'] = 'sqlite' if self._conn is not None else 'memory'
+        if self._conn is not None:
+            with self._lock:
+                try:
+                    stats['shared_active'] = self._conn.execute(
+                        'SELECT COUNT(*) FROM admission_slots').fetchone()[0]
+                except sqlite3.Error:
+                    pass
+        return stats
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+飞书消息卡片模块
+将缓存的查询结果渲染为可翻页、可排序的交互式卡片
+"""
+
+import math
+from typing import Dict, Any, List, Optional, Tuple, Callable
+
+from feishu.query_cache import QueryResult
+
+# 紧急补货排序方式: 名称 -> (按钮文字, 排序函数, 是否降序)；None表示默认的紧急程度顺序
+URGENT_SORTS: Dict[str, Tuple[str, Optional[Callable[[Any], Any]], bool]] = {
+    'days': ('按可售天数', None, False),
+    'purchase': ('按建议采购', lambda item: item.suggested_purchase, True),
+    'sales': ('按日均销量', lambda item: item.sales_avg_30, True),
+}
+
+def _button(text: str, value: Dict[str, Any], primary: bool = False) -> Dict[str, Any]:
+    """构建卡片按钮（value会在回调中原样带回）"""
+    return {
+        'tag': 'button',
+        'text': {'tag': 'plain_text', 'content': text},
+        'type': 'primary' if primary else 'default',
+        'value': value
+    }
+
+def _urgent_row(index: int, item) -> str:
+    """紧急补货商品的一行markdown"""
+    days = item.available_sale_days if item.available_sale_days > 0 else '断货'
+    out_date = item.out_stock_date[:10] if item.out_stock_date else '-'
+    return (f"{index}. **{item.asin}** · 店铺 {item.sid} · 可售天数 {days} · 断货日期 {out_date} · "
+            f"建议采购 {item.suggested_purchase} · 日均 {round(item.sales_avg_30, 1)}")
+
+def _query_value(result: QueryResult, page: int, sort: str) -> Dict[str, Any]:
+    """
+    按钮回调值：查询ID、页码和排序，并带上快照版本和店铺筛选，
+    回调落到没有该查询缓存的进程时可从共享快照重建结果
+    """
+    value = {'query_id': result.query_id, 'page': page, 'sort': sort}
+    if result.context.get('snapshot_version'):
+        value['snapshot'] = result.context['snapshot_version']
+        value['sellers'] = result.context.get('seller_ids') or []
+    return value
+
+def build_urgent_card(result: QueryResult, page: int = 1, sort: str = 'days',
+                      page_size: int = 10) -> Dict[str, Any]:
+    """
+    渲染紧急补货卡片
+
+    Args:
+        result: 缓存的查询结果
+        page: 页码（从1开始，超出范围自动修正）
+        sort: 排序方式（URGENT_SORTS的键）
+        page_size: 每页行数
+
+    Returns:
+        Dict[str, Any]: 飞书消息卡片JSON
+    """
+    if sort not in URGENT_SORTS:
+        sort = 'days'
+    sort_label, key_func, reverse = URGENT_SORTS[sort]
+    items = result.sorted_items(sort, key_func, reverse)
+
+    total_pages = max(1, math.ceil(len(items) / page_size))
+    page = min(max(1, page), total_pages)
+    start = (page - 1) * page_size
+    rows = [_urgent_row(start + offset + 1, item)
+            for offset, item in enumerate(items[start:start + page_size])]
+
+    scope = f"店铺 {', '.join(result.context['seller_ids'])} · " if result.context.get('seller_ids') else ''
+    elements: List[Dict[str, Any]] = [
+        {'tag': 'markdown',
+         'content': f"{scope}共 **{len(items)}** 个紧急补货商品 · 第 {page}/{total_pages} 页 · {sort_label}"},
+        {'tag': 'hr'},
+        {'tag': 'markdown', 'content': '\n'.join(rows) if rows else '✅ 暂无紧急补货商品'},
+        {'tag': 'action', 'actions': [
+            _button(label, _query_value(result, 1, key), primary=(key == sort))
+            for key, (label, _, _) in URGENT_SORTS.items()
+        ]}
+    ]
+
+    paging = []
+    if page > 1:
+        paging.append(_button('上一页', _query_value(result, page - 1, sort)))
+    if page < total_pages:
+        paging.append(_button('下一页', _query_value(result, page + 1, sort), primary=True))
+    if paging:
+        elements.append({'tag': 'action', 'actions': paging})
+
+    note = f"数据快照: {result.context['snapshot_time']}" if result.context.get('snapshot_time') else ''
+    elements.append({'tag': 'note', 'elements': [
+        {'tag': 'plain_text', 'content': f"{note} · 翻页基于缓存结果，不会重新查询".strip(' ·')}
+    ]})
+
+    return {
+        'config': {'wide_screen_mode': True, 'update_multi': True},
+        'header': {'title': {'tag': 'plain_text', 'content': '🚨 紧急补货提醒'}, 'template': 'red'},
+        'elements': elements
+    }
+
+def build_expired_card(command: str) -> Dict[str, Any]:
+    """
+    查询结果已过期时的提示卡片
+
+    Args:
+        command: 重新查询的命令
+
+    Returns:
+        Dict[str, Any]: 飞书消息卡片JSON
+    """
+    return {
+        'config': {'wide_screen_mode': True, 'update_multi': True},
+        'header': {'title': {'tag': 'plain_text', 'content': '⌛ 查询结果已过期'}, 'template': 'grey'},
+        'elements': [
+            {'tag': 'markdown', 'content': f"翻页数据已过期，请重新发送 \"{command}\" 查询。"}
+        ]
+    }
+
+def _progress_bar(done: int, total: int, width: int = 20) -> str:
+    """文本进度条"""
+    ratio = done / total if total else 0
+    filled = int(round(ratio * width))
+    return f"{'█' * filled}{'░' * (width - filled)} {int(ratio * 100)}%"
+
+def build_loading_card(progress: Dict[str, Any], title: str = '⏳ 正在拉取补货数据') -> Dict[str, Any]:
+    """
+    渲染数据加载中的卡片（部分统计随页面到达增量更新）
+
+    Args:
+        progress: 刷新进度（RefreshProgress.to_dict()）
+        title: 卡片标题
+
+    Returns:
+        Dict[str, Any]: 飞书消息卡片JSON
+    """
+    return {
+        'config': {'wide_screen_mode': True, 'update_multi': True},
+        'header': {'title': {'tag': 'plain_text', 'content': title}, 'template': 'blue'},
+        'elements': [
+            {'tag': 'markdown',
+             'content': f"已加载 **{progress['pages_done']}/{progress['total_pages']}** 页\n"
+                        f"{_progress_bar(progress['pages_done'], progress['total_pages'])}"},
+            {'tag': 'hr'},
+            {'tag': 'markdown',
+             'content': f"• 已统计商品: {progress['items']}\n"
+                        f"• 紧急补货: {progress['urgent_items']}\n"
+                        f"• 断货商品: {progress['out_of_stock_items']}\n"
+                        f"• 建议采购总量: {progress['total_suggested_purchase']}"},
+            {'tag': 'note', 'elements': [
+                {'tag': 'plain_text', 'content': f"部分结果，随数据到达持续更新 · 已用时 {progress['elapsed']}秒"}
+            ]}
+        ]
+    }
+
+def build_summary_card(summary: Dict[str, Any], urgent_items: List[Any], snapshot_time: str,
+                       seller_ids: Optional[List[str]] = None, extra_text: str = '',
+                       title: str = '📊 补货数据汇总报告') -> Dict[str, Any]:
+    """
+    渲染补货数据汇总卡片
+
+    Args:
+        summary: 汇总报告（generate_summary_report的结果）
+        urgent_items: 紧急补货项目（按紧急程度排序）
+        snapshot_time: 快照时间描述
+        seller_ids: 店铺筛选
+        extra_text: 附加说明（导出任务、拉取耗时等）
+        title: 卡片标题
+
+    Returns:
+        Dict[str, Any]: 飞书消息卡片JSON
+    """
+    scope = f"店铺 {', '.join(seller_ids)}\n" if seller_ids else ''
+    stats = (f"{scope}• 总计商品: {summary['total_items']}\n"
+             f"• 紧急补货: {summary['urgent_items']}\n"
+             f"• 断货商品: {summary['out_of_stock_items']}\n"
+             f"• 高销量商品: {summary['high_sales_items']}\n"
+             f"• 建议采购总量: {summary['total_suggested_purchase']}\n"
+             f"• 平均可售天数: {summary['avg_available_days']}")
+    top = [_urgent_row(index + 1, item) for index, item in enumerate(urgent_items[:5])]
+
+    elements: List[Dict[str, Any]] = [
+        {'tag': 'markdown', 'content': stats},
+        {'tag': 'hr'},
+        {'tag': 'markdown', 'content': '🔥 **前5个紧急补货商品**\n' + '\n'.join(top) if top else '✅ 暂无紧急补货商品'},
+    ]
+    if extra_text:
+        elements.append({'tag': 'markdown', 'content': extra_text})
+    elements.append({'tag': 'note', 'elements': [
+        {'tag': 'plain_text', 'content': f"数据快照: {snapshot_time}（发送 \"刷新\" 获取最新数据）"}
+    ]})
+
+    return {
+        'config': {'wide_screen_mode': True, 'update_multi': True},
+        'header': {'title': {'tag': 'plain_text', 'content': title}, 'template': 'green'},
+        'elements': elements
+    }
+
+def build_text_card(title: str, text: str, template: str = 'grey') -> Dict[str, Any]:
+    """
+    纯文本卡片（用于把进度卡片替换为提示或错误信息）
+
+    Args:
+        title: 卡片标题
+        text: 正文
+        template: 标题颜色
+
+    Returns:
+        Dict[str, Any]: 飞书消息卡片JSON
+    """
+    return {
+        'config': {'wide_screen_mode': True, 'update_multi': True},
+        'header': {'title': {'tag': 'plain_text', 'content': title}, 'template': template},
+        'elements': [{'tag': 'markdown', 'content': text.strip()}]
+    }
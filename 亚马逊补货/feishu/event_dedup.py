@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+飞书事件去重模块
+飞书在应答超时或失败时会重推同一事件，按事件ID记录已处理的事件，
+重复事件直接跳过，不再重新拉取补货数据和重复回复
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from config.config import FeishuBotConfig
+from utils.logger import api_logger
+
+def extract_event_key(event_data: Dict[str, Any]) -> Optional[str]:
+    """
+    提取事件去重键
+
+    schema 2.0 事件使用 header.event_id，旧版事件使用消息ID
+
+    Args:
+        event_data: 飞书事件数据
+
+    Returns:
+        Optional[str]: 去重键，无法识别时返回None
+    """
+    if event_data.get('schema') == '2.0':
+        event_id = event_data.get('header', {}).get('event_id')
+        if event_id:
+            return f"event:{event_id}"
+
+    event = event_data.get('event', {})
+    message_id = (event.get('message', {}).get('message_id')
+                  or event.get('open_message_id')
+                  or event.get('message_id'))
+    if message_id:
+        return f"message:{message_id}"
+
+    # 旧版事件回调的外层uuid同样在重推时保持不变
+    if event_data.get('uuid'):
+        return f"uuid:{event_data['uuid']}"
+    return None
+
+class EventDedupCache:
+    """
+    有界的LRU+TTL事件去重缓存
+
+    内存中使用OrderedDict维护最近的事件，查询和记录都是O(1)；
+    配置SQLite文件后同时写入数据库，多个进程共享去重记录
+    """
+
+    def __init__(self, max_entries: int = None, ttl: float = None, db_path: str = None):
+        """
+        初始化去重缓存
+
+        Args:
+            max_entries: 内存中保留的最大事件数
+            ttl: 事件记录有效期（秒）
+            db_path: SQLite数据库路径，为空则只使用内存
+        """
+        self.max_entries = max(1, max_entries or FeishuBotConfig.DEDUP_MAX_ENTRIES)
+        self.ttl = ttl or FeishuBotConfig.DEDUP_TTL
+        self.db_path = db_path if db_path is not None else FeishuBotConfig.DEDUP_DB_PATH
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._last_purge = 0.0
+        self._stats = {'lookups': 0, 'memory_hits': 0, 'db_hits': 0, 'misses': 0,
+                       'evictions': 0, 'db_errors': 0}
+
+        if self.db_path:
+            self._open_db()
+
+    def _open_db(self):
+        """打开SQLite数据库（失败时退回纯内存模式）"""
+        try:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False,
+                                         isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS feishu_events '
+                               '(event_key TEXT PRIMARY KEY, seen_at REAL NOT NULL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_feishu_events_seen_at '
+                               'ON feishu_events (seen_at)')
+        except sqlite3.Error as e:
+            api_logger.log_error(e, f"打开事件去重数据库失败，改用内存去重: {self.db_path}")
+            self._conn = None
+
+    def _remember(self, key: str, now: float):
+        """记录到内存LRU（调用方需持有锁）"""
+        self._entries[key] = now
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def _claim_in_db(self, key: str, now: float) -> bool:
+        """
+        在数据库中登记事件（调用方需持有锁）
+
+        Returns:
+            bool: 是否为首次登记（已存在且未过期则返回False）
+        """
+        cursor = self._conn.execute(
+            'INSERT INTO feishu_events (event_key, seen_at) VALUES (?, ?) '
+            'ON CONFLICT(event_key) DO UPDATE SET seen_at = excluded.seen_at '
+            'WHERE feishu_events.seen_at < ?',
+            (key, now, now - self.ttl))
+
+        # 定期清理过期记录
+        if now - self._last_purge > self.ttl:
+            self._conn.execute('DELETE FROM feishu_events WHERE seen_at < ?', (now - self.ttl,))
+            self._last_purge = now
+        return cursor.rowcount > 0
+
+    def check_and_mark(self, key: Optional[str]) -> bool:
+        """
+        检查事件是否重复，未见过的事件同时登记为已处理
+
+        Args:
+            key: 事件去重键（None表示无法去重，总是按新事件处理）
+
+        Returns:
+            bool: 是否为重复事件
+        """
+        if not key:
+            return False
+
+        now = time.time()
+        with self._lock:
+            self._stats['lookups'] += 1
+
+            seen_at = self._entries.get(key)
+            if seen_at is not None and now - seen_at < self.ttl:
+                self._entries.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return True
+
+            if self._conn is not None:
+                try:
+                    if not self._claim_in_db(key, now):
+                        self._remember(key, now)
+                        self._stats['db_hits'] += 1
+                        return True
+                except sqlite3.Error as e:
+                    self._stats['db_errors'] += 1
+                    api_logger.log_error(e, "事件去重数据库读写失败")
+
+            self._remember(key, now)
+            self._stats['misses'] += 1
+            return False
+
+    def forget(self, key: Optional[str]):
+        """
+        撤销事件登记（事件未能入队处理时调用，飞书重推时按新事件处理）
+
+        Args:
+            key: 事件去重键
+        """
+        if not key:
+            return
+
+        with self._lock:
+            self._entries.pop(key, None)
+            if self._conn is not None:
+                try:
+                    self._conn.execute('DELETE FROM feishu_events WHERE event_key = ?', (key,))
+                except sqlite3.Error as e:
+                    self._stats['db_errors'] += 1
+                    api_logger.log_error(e, "事件去重数据库读写失败")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取去重统计信息
+
+        Returns:
+            Dict: 查询次数、命中次数、命中率和缓存大小
+        """
+        with self._lock:
+            hits = self._stats['memory_hits'] + self._stats['db_hits']
+            lookups = self._stats['lookups']
+            return {
+                **self._stats,
+                'hits': hits,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'backend': 'sqlite' if self._conn is not None else 'memory'
+            }
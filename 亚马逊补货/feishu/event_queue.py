@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+飞书事件队列模块
+Webhook收到消息事件后先入队并立即应答，由有界的工作线程池执行命令，
+回复通过 send_text_message 异步发送，避免飞书因超时重推导致命令重复执行
+"""
+
+import time
+import queue
+import threading
+from collections import deque
+from typing import Dict, Any, Optional
+
+from config.config import FeishuBotConfig
+from utils.ttl_cache import TTLCache
+from utils.logger import api_logger
+
+BUSY_REPLY = "⏳ 当前处理的命令较多，请稍后再试。"
+
+class FeishuEventQueue:
+    """
+    飞书事件工作队列
+
+    submit() 只负责去重和入队，事件由 worker_count 个后台线程调用
+    bot.process_message 处理（命令执行和回复发送都在工作线程中完成）；
+    队列满时的繁忙提示由单独的发送线程从有界队列中取出发送，
+    同一事件只提示一次，同一群聊在 BUSY_REPLY_WINDOW 内只提示一次
+    """
+
+    def __init__(self, bot, worker_count: int = None, max_queue_size: int = None,
+                 latency_window: int = 200):
+        """
+        初始化事件队列
+
+        Args:
+            bot: 飞书机器人实例
+            worker_count: 工作线程数
+            max_queue_size: 等待处理的事件上限
+            latency_window: 统计延迟时保留的最近事件数
+        """
+        self.bot = bot
+        self.worker_count = max(1, worker_count or FeishuBotConfig.WORKER_COUNT)
+        self.max_queue_size = max(1, max_queue_size or FeishuBotConfig.EVENT_QUEUE_SIZE)
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._workers = []
+        self._busy_sender = None
+        self._lock = threading.Lock()
+        self._busy_replies = queue.Queue(maxsize=max(1, FeishuBotConfig.BUSY_REPLY_QUEUE_SIZE))
+        self._busy_chats = TTLCache(max_entries=1000, ttl=FeishuBotConfig.BUSY_REPLY_WINDOW)
+
+        # 统计信息
+        self._active = 0
+        self._counters = {'accepted': 0, 'duplicates': 0, 'rejected': 0, 'processed': 0, 'failed': 0,
+                          'busy_replies': 0, 'busy_suppressed': 0}
+        self._wait_times = deque(maxlen=latency_window)
+        self._process_times = deque(maxlen=latency_window)
+
+    def start(self):
+        """启动工作线程（重复调用无副作用）"""
+        with self._lock:
+            if self._workers:
+                return
+            for index in range(self.worker_count):
+                worker = threading.Thread(target=self._worker_loop, name=f"feishu-worker-{index}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            self._busy_sender = threading.Thread(target=self._busy_reply_loop, name='feishu-busy-reply',
+                                                 daemon=True)
+            self._busy_sender.start()
+        api_logger.log_info(f"飞书事件队列已启动: {self.worker_count}个工作线程，队列上限{self.max_queue_size}")
+
+    def stop(self, timeout: float = 5.0):
+        """
+        停止工作线程（已入队的事件会先处理完）
+
+        Args:
+            timeout: 每个线程的等待时间（秒）
+        """
+        with self._lock:
+            workers, self._workers = self._workers, []
+            sender, self._busy_sender = self._busy_sender, None
+        for _ in workers:
+            self._queue.put(None)
+        if sender:
+            self._busy_replies.put(None)
+            workers.append(sender)
+        for worker in workers:
+            worker.join(timeout)
+
+    def submit(self, event_data: Dict[str, Any]) -> str:
+        """
+        提交消息事件
+
+        Args:
+            event_data: 飞书事件数据
+
+        Returns:
+            str: 'accepted' 已入队，'duplicate' 重复事件已忽略，
+                 'busy' 队列已满（同时回复繁忙提示）
+        """
+        if self.bot.is_duplicate_event(event_data):
+            with self._lock:
+                self._counters['duplicates'] += 1
+            return 'duplicate'
+
+        if not self._workers:
+            self.start()
+
+        try:
+            self._queue.put_nowait((time.time(), event_data))
+        except queue.Full:
+            # 撤销去重登记，飞书重推同一事件时还能重新入队
+            self.bot.forget_event(event_data)
+            with self._lock:
+                self._counters['rejected'] += 1
+            api_logger.log_warning(f"飞书事件队列已满（{self.max_queue_size}），拒绝处理新事件")
+            self._notify_busy(event_data)
+            return 'busy'
+
+        with self._lock:
+            self._counters['accepted'] += 1
+        return 'accepted'
+
+    def _notify_busy(self, event_data: Dict[str, Any]):
+        """
+        把繁忙提示交给发送线程；同一事件的重推、窗口内同一群聊的后续事件
+        以及发送队列已满时不再提示
+
+        Args:
+            event_data: 被拒绝的事件数据
+        """
+        chat_id = event_data.get('event', {}).get('message', {}).get('chat_id')
+        if not chat_id:
+            return
+        with self._lock:
+            recently_notified = self._busy_chats.get(chat_id) is not None
+            if not recently_notified:
+                self._busy_chats.put(chat_id, True)
+        if recently_notified or not self.bot.mark_busy_replied(event_data):
+            with self._lock:
+                self._counters['busy_suppressed'] += 1
+            return
+        try:
+            self._busy_replies.put_nowait(chat_id)
+        except queue.Full:
+            with self._lock:
+                self._counters['busy_suppressed'] += 1
+
+    def _busy_reply_loop(self):
+        """繁忙提示发送线程"""
+        while True:
+            chat_id = self._busy_replies.get()
+            if chat_id is None:
+                return
+            try:
+                self.bot.send_text_message(chat_id, BUSY_REPLY)
+                with self._lock:
+                    self._counters['busy_replies'] += 1
+            except Exception as e:
+                api_logger.log_error(e, "发送繁忙提示失败")
+
+    def _worker_loop(self):
+        """工作线程：逐个取出事件并处理"""
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                self._queue.task_done()
+                return
+
+            enqueued_at, event_data = entry
+            started_at = time.time()
+            with self._lock:
+                self._active += 1
+
+            failed = False
+            try:
+                result = self.bot.process_message(event_data, skip_dedup=True)
+                failed = result.get('status') == 'error'
+            except Exception as e:
+                failed = True
+                api_logger.log_error(e, "工作线程处理飞书事件异常")
+            finally:
+                finished_at = time.time()
+                with self._lock:
+                    self._active -= 1
+                    self._counters['failed' if failed else 'processed'] += 1
+                    self._wait_times.append(started_at - enqueued_at)
+                    self._process_times.append(finished_at - started_at)
+                self._queue.task_done()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待队列中的事件全部处理完成
+
+        Args:
+            timeout: 最长等待时间（秒），None表示一直等待
+
+        Returns:
+            bool: 是否在超时前处理完成
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    @staticmethod
+    def _summarize(samples) -> Dict[str, float]:
+        """计算延迟样本的平均值和最大值（毫秒）"""
+        if not samples:
+            return {'avg_ms': 0.0, 'max_ms': 0.0}
+        return {
+            'avg_ms': round(sum(samples) / len(samples) * 1000, 1),
+            'max_ms': round(max(samples) * 1000, 1)
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取队列统计信息
+
+        Returns:
+            Dict: 队列深度、处理中数量、计数和延迟统计
+        """
+        with self._lock:
+            return {
+                'workers': len(self._workers),
+                'queue_depth': self._queue.qsize(),
+                'queue_capacity': self.max_queue_size,
+                'active': self._active,
+                **self._counters,
+                'queue_wait': self._summarize(self._wait_times),
+                'processing': self._summarize(self._process_times)
+            }
@@ -8,19 +8,26 @@ import json
 import hashlib
 import hmac
 import base64
-import time
 from datetime import datetime
 from typing import Dict, List, Optional, Any
 import os
 import sys
-import requests
+import threading
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from business.restock_analyzer import RestockAnalyzer
+from business.export_jobs import get_export_job_manager, ExportJobError, JOB_STATUS_DISPLAY
+from business.restock_snapshot import RestockSnapshotStore
+from feishu.event_dedup import EventDedupCache, extract_event_key
+from feishu.feishu_client import FeishuClient, MESSAGE_PATH
+from feishu.query_cache import QueryResultCache, QueryResult
+from feishu.admission import AdmissionController, ADMITTED
+from feishu.cards import build_urgent_card, build_expired_card, build_summary_card, build_text_card
+from feishu.progressive_reply import ProgressiveReply
 from utils.logger import api_logger
-from config.config import ServerConfig
+from config.config import ServerConfig, SnapshotConfig, FeishuBotConfig
 
 class FeishuBot:
     """
@@ -38,18 +45,30 @@ class FeishuBot:
         self.verification_token = os.getenv('FEISHU_VERIFICATION_TOKEN', '')
         self.encrypt_key = os.getenv('FEISHU_ENCRYPT_KEY', '')
         
-        # 飞书API地址
-        self.base_url = "https://open.feishu.cn"
-        self.token_url = f"{self.base_url}/open-apis/auth/v3/tenant_access_token/internal"
-        self.message_url = f"{self.base_url}/open-apis/im/v1/messages"
-        
-        # 访问令牌
-        self.access_token = None
-        self.token_expire_time = 0
+        # 飞书开放平台客户端（连接池、令牌缓存、失败重试和待发队列）
+        self.client = FeishuClient(self.app_id, self.app_secret)
         
         # 业务分析器
         self.analyzer = RestockAnalyzer()
         
+        # 补货数据快照（后台定时刷新，命令直接基于快照应答）
+        self.snapshot_store = RestockSnapshotStore(self.analyzer)
+        
+        # 冷启动时只允许一个命令等待首个快照
+        self._first_load_lock = threading.Lock()
+        
+        # 事件去重缓存（飞书重推的事件不再重复执行）
+        self.event_dedup = EventDedupCache()
+        
+        # 查询结果缓存（卡片翻页/排序回调直接读取）
+        self.query_cache = QueryResultCache()
+        
+        # 重型命令准入控制（按用户/群聊限流、限制并发，超出时排队）
+        self.admission = AdmissionController()
+        
+        # 当前线程正在处理的命令所在会话（渐进式回复使用）
+        self._command_context = threading.local()
+        
         # 命令处理器映射
         self.command_handlers = {
             '帮助': self._handle_help,
@@ -64,45 +83,57 @@ class FeishuBot:
             'urgent': self._handle_urgent_restock,
             '状态': self._handle_server_status,
             'status': self._handle_server_status,
+            '导出': self._handle_export,
+            'export': self._handle_export,
+            '导出状态': self._handle_export_status,
+            'export_status': self._handle_export_status,
+            '刷新': self._handle_refresh_snapshot,
+            'refresh': self._handle_refresh_snapshot,
+            '查': self._handle_lookup,
+            'lookup': self._handle_lookup,
         }
     
+    @property
+    def base_url(self) -> str:
+        """飞书开放平台地址"""
+        return self.client.base_url
+    
+    @base_url.setter
+    def base_url(self, value: str):
+        self.client.base_url = value.rstrip('/')
+    
+    @property
+    def token_url(self) -> str:
+        """租户令牌接口地址"""
+        return self.client.token_url
+    
+    @token_url.setter
+    def token_url(self, value: str):
+        self.client.token_url = value
+    
+    @property
+    def message_url(self) -> str:
+        """发送消息接口地址"""
+        return f"{self.client.base_url}{MESSAGE_PATH}"
+    
+    @property
+    def access_token(self) -> Optional[str]:
+        """当前缓存的访问令牌"""
+        return self.client.access_token
+    
+    @property
+    def token_expire_time(self) -> float:
+        """访问令牌过期时间戳"""
+        return self.client.token_expire_time
+    
     def get_access_token(self) -> str:
         """
-        获取飞书访问令牌
+        获取飞书访问令牌（线程安全，即将过期时自动续期）
         
         Returns:
             str: 访问令牌
         """
-        # 检查令牌是否过期
-        if self.access_token and time.time() < self.token_expire_time:
-            return self.access_token
-        
-        # 获取新令牌
-        headers = {
-            'Content-Type': 'application/json'
-        }
-        
-        data = {
-            'app_id': self.app_id,
-            'app_secret': self.app_secret
-        }
-        
-        try:
-            response = requests.post(self.token_url, headers=headers, json=data)
-            result = response.json()
-            
-            if result.get('code') == 0:
-                self.access_token = result['tenant_access_token']
-                self.token_expire_time = time.time() + result['expire'] - 300  # 提前5分钟过期
-                api_logger.log_info(f"飞书访问令牌获取成功，过期时间: {datetime.fromtimestamp(self.token_expire_time)}")
-                return self.access_token
-            else:
-                api_logger.log_error(f"获取飞书访问令牌失败: {result}")
-                return None
-                
-        except Exception as e:
-            api_logger.log_error(e, "获取飞书访问令牌异常")
-            return None
+        return self.client.get_tenant_access_token()
     
     def verify_signature(self, timestamp: str, nonce: str, encrypt: str, signature: str) -> bool:
         """
@@ -172,55 +203,9 @@ class FeishuBot:
             content: 消息内容
             
         Returns:
-            bool: 发送结果
+            bool: 发送结果（可重试的失败会写入待发队列稍后补发）
         """
-        access_token = self.get_access_token()
-        if not access_token:
-            return False
-        
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json; charset=utf-8'
-        }
-        
-        # 根据receive_id格式自动判断类型
-        if receive_id.startswith('oc_'):
-            id_type = 'chat_id'
-        elif receive_id.startswith('ou_'):
-            id_type = 'open_id'
-        elif receive_id.startswith('om_'):
-            id_type = 'user_id'
-        else:
-            # 默认使用chat_id，这是最常见的情况
-            id_type = 'chat_id'
-        
-        # 根据receive_id格式构建URL，将receive_id_type作为查询参数
-        message_url_with_params = f"{self.message_url}?receive_id_type={id_type}"
-        
-        data = {
-            'receive_id': receive_id,
-            'msg_type': msg_type,
-            'content': content  # content可能是字符串或对象，直接使用
-        }
-        
-        # 调试：记录发送的数据
-        api_logger.log_info(f"发送消息API URL: {message_url_with_params}")
-        api_logger.log_info(f"发送消息Headers: {headers}")
-        api_logger.log_info(f"发送消息数据: {json.dumps(data, ensure_ascii=False)}")
-        
-        try:
-            response = requests.post(message_url_with_params, headers=headers, json=data)
-            result = response.json()
-            
-            if result.get('code') == 0:
-                return True
-            else:
-                api_logger.log_error(f"发送飞书消息失败: {result}")
-                return False
-                
-        except Exception as e:
-            api_logger.log_error(e, "发送飞书消息异常")
-            return False
+        return self.client.send_message(receive_id, msg_type, content)
     
     def send_text_message(self, receive_id: str, text: str) -> bool:
         """
@@ -256,16 +241,115 @@ class FeishuBot:
         }
         return self.send_message(receive_id, 'post', rich_content)
     
-    def process_message(self, event_data: Dict) -> Dict:
+    def send_card_message(self, receive_id: str, card: Dict) -> bool:
+        """
+        发送交互式卡片消息
+        
+        Args:
+            receive_id: 接收者ID
+            card: 卡片JSON
+            
+        Returns:
+            bool: 发送结果
+        """
+        api_logger.log_info(f"发送卡片消息: receive_id={receive_id}")
+        return self.send_message(receive_id, 'interactive', json.dumps(card, ensure_ascii=False))
+    
+    def post_card(self, receive_id: str, card: Dict) -> Optional[str]:
+        """
+        发送卡片消息并返回消息ID（之后可原地更新）
+        
+        Args:
+            receive_id: 接收者ID
+            card: 卡片JSON
+            
+        Returns:
+            Optional[str]: 消息ID，发送失败返回None
+        """
+        return self.client.post_message(receive_id, 'interactive', json.dumps(card, ensure_ascii=False))
+    
+    def update_card(self, message_id: str, card: Dict) -> bool:
+        """
+        原地更新卡片消息
+        
+        Args:
+            message_id: 消息ID
+            card: 新的卡片JSON
+            
+        Returns:
+            bool: 更新结果
+        """
+        return self.client.update_message(message_id, json.dumps(card, ensure_ascii=False))
+    
+    def send_reply(self, receive_id: str, response: Any) -> bool:
+        """
+        发送命令回复（字典为卡片，其余按文本发送；空回复表示处理器已自行回复）
+        
+        Args:
+            receive_id: 接收者ID
+            response: 命令处理结果
+            
+        Returns:
+            bool: 发送结果
+        """
+        if not response:
+            return True
+        if isinstance(response, dict):
+            return self.send_card_message(receive_id, response)
+        return self.send_text_message(receive_id, response)
+    
+    def is_duplicate_event(self, event_data: Dict) -> bool:
+        """
+        检查事件是否为飞书重推的重复事件（首次出现的事件会被登记）
+        
+        Args:
+            event_data: 事件数据
+            
+        Returns:
+            bool: 是否重复
+        """
+        key = extract_event_key(event_data)
+        if self.event_dedup.check_and_mark(key):
+            api_logger.log_info(f"跳过重复的飞书事件: {key}")
+            return True
+        return False
+    
+    def forget_event(self, event_data: Dict):
+        """
+        撤销事件的去重登记（事件被拒绝处理时调用，飞书重推时可以重新处理）
+        
+        Args:
+            event_data: 事件数据
+        """
+        self.event_dedup.forget(extract_event_key(event_data))
+    
+    def mark_busy_replied(self, event_data: Dict) -> bool:
+        """
+        登记已为事件回复过繁忙提示（与事件去重共用存储，多进程部署时同样共享）
+        
+        Args:
+            event_data: 事件数据
+            
+        Returns:
+            bool: 是否首次登记（飞书重推同一事件时返回False，不再重复提示）
+        """
+        key = extract_event_key(event_data)
+        return bool(key) and not self.event_dedup.check_and_mark(f"busy:{key}")
+    
+    def process_message(self, event_data: Dict, skip_dedup: bool = False) -> Dict:
         """
         处理接收到的消息
         
         Args:
             event_data: 事件数据
+            skip_dedup: 是否跳过去重检查（调用方已检查过时使用）
             
         Returns:
             Dict: 处理结果
         """
+        if not skip_dedup and self.is_duplicate_event(event_data):
+            return {'status': 'duplicate', 'message': 'Event already processed', 'message_type': ''}
+        
         try:
             # 调试：记录完整事件数据
             api_logger.log_info(f"处理消息事件: {json.dumps(event_data, ensure_ascii=False)}")
@@ -303,11 +387,11 @@ class FeishuBot:
                 
                 # 处理命令
                 if text:
-                    response = self._process_command(text, sender_id or 'anonymous')
+                    response = self._process_command(text, sender_id or 'anonymous', chat_id)
                     
                     # 发送回复
                     if response and chat_id:
-                        success = self.send_text_message(chat_id, response)
+                        success = self.send_reply(chat_id, response)
                         api_logger.log_info(f"发送回复结果: {success}")
                     
                     return {'status': 'success', 'message': 'Message processed', 'message_type': msg_type}
@@ -325,16 +409,17 @@ class FeishuBot:
             api_logger.log_error(e, "处理飞书消息异常")
             return {'status': 'error', 'message': str(e), 'message_type': ''}
     
-    def _process_command(self, text: str, sender_id: str) -> str:
+    def _process_command(self, text: str, sender_id: str, chat_id: str = None) -> Any:
         """
         处理用户命令
         
         Args:
             text: 用户输入文本
             sender_id: 发送者ID
+            chat_id: 群聊ID（重型命令排队后结果发送到该会话）
             
         Returns:
-            str: 回复内容
+            str/Dict: 回复内容（文本，或交互式卡片JSON）
         """
         # 记录用户命令
         api_logger.log_info(f"收到用户命令: {text} (用户ID: {sender_id})")
@@ -349,14 +434,116 @@ class FeishuBot:
         
         # 查找命令处理器
         handler = self.command_handlers.get(command)
-        if handler:
+        if not handler:
+            return self._handle_unknown_command(text)
+        
+        # 轻量命令和快照索引查询直接执行，不与重型命令排队
+        if not self.admission.is_heavy(command) or self._is_snapshot_query(command, args):
+            return self._run_handler(command, handler, args, sender_id, chat_id)
+        
+        deferred = None
+        if chat_id:
+            deferred = lambda: self.send_reply(chat_id, self._run_handler(command, handler, args, sender_id, chat_id))
+        admission = self.admission.acquire(sender_id, chat_id, deferred)
+        if admission.status != ADMITTED:
+            api_logger.log_info(f"命令未立即执行: {command} ({admission.status}, 用户ID: {sender_id}, 群聊: {chat_id})")
+            return admission.reply_text()
+        
+        try:
+            return self._run_handler(command, handler, args, sender_id, chat_id)
+        finally:
+            self.admission.release()
+    
+    def _is_snapshot_query(self, command: str, args: List[str]) -> bool:
+        """是否为只读快照索引的查询（"店铺 <店铺ID> ..."），不调用领星接口"""
+        return command in ('店铺', 'sellers') and bool(args)
+    
+    def _run_handler(self, command: str, handler, args: List[str], sender_id: str,
+                     chat_id: str = None) -> Any:
+        """执行命令处理器，异常转换为错误提示"""
+        self._command_context.chat_id = chat_id
+        try:
+            return handler(args, sender_id)
+        except Exception as e:
+            api_logger.log_error(e, f"执行命令失败: {command}")
+            return f"执行命令失败: {str(e)}"
+        finally:
+            self._command_context.chat_id = None
+    
+    def _current_chat_id(self) -> Optional[str]:
+        """当前线程正在处理的命令所在会话（非消息触发时为None）"""
+        return getattr(self._command_context, 'chat_id', None)
+    
+    def _finish_reply(self, reply: Optional[ProgressiveReply], response: Any) -> Any:
+        """
+        用最终结果替换渐进式回复卡片
+        
+        Args:
+            reply: 渐进式回复（可为None）
+            response: 最终结果（卡片或文本）
+            
+        Returns:
+            Any: 已写入卡片时返回None，否则返回原结果交给普通回复流程
+        """
+        if reply is None or (not reply.message_id and not isinstance(response, dict)):
+            return response
+        card = response if isinstance(response, dict) else build_text_card('📦 补货数据', response)
+        return None if reply.finish(card) else response
+    
+    def handle_card_action(self, payload: Dict) -> Dict:
+        """
+        处理卡片按钮回调（翻页/排序），从查询结果缓存渲染新卡片
+        
+        Args:
+            payload: 卡片回调数据（兼容旧版卡片请求和 card.action.trigger 事件）
+            
+        Returns:
+            Dict: 卡片回调响应，/feishu/webhook 和 /feishu/card 两个入口原样返回；
+                  card.action.trigger 事件返回 {'card': {'type': 'raw', 'data': 新卡片JSON}}，
+                  旧版卡片请求（没有event、非schema 2.0）直接返回新卡片JSON
+        """
+        is_event = 'event' in payload or payload.get('schema') == '2.0'
+        action = payload.get('action') or payload.get('event', {}).get('action', {})
+        value = action.get('value') or {}
+        if isinstance(value, str):
             try:
-                return handler(args, sender_id)
-            except Exception as e:
-                api_logger.log_error(e, f"执行命令失败: {command}")
-                return f"执行命令失败: {str(e)}"
+                value = json.loads(value)
+            except ValueError:
+                value = {}
+        
+        result = self.query_cache.get(value.get('query_id', '')) or self._rebuild_query(value)
+        if result is None:
+            card = build_expired_card('紧急')
         else:
-            return self._handle_unknown_command(text)
+            try:
+                page = int(value.get('page', 1))
+            except (TypeError, ValueError):
+                page = 1
+            card = build_urgent_card(result, page=page, sort=value.get('sort', 'days'),
+                                     page_size=FeishuBotConfig.CARD_PAGE_SIZE)
+        return {'card': {'type': 'raw', 'data': card}} if is_event else card
+    
+    def _rebuild_query(self, value: Dict) -> Optional[QueryResult]:
+        """
+        本进程没有该查询的缓存时（如多进程部署中回调落到其他worker），
+        按按钮中的快照版本和店铺筛选从共享快照重建紧急补货结果
+
+        Args:
+            value: 按钮回调值
+
+        Returns:
+            Optional[QueryResult]: 重建的结果（沿用原查询ID），快照版本已变化时返回None
+        """
+        version = value.get('snapshot')
+        snapshot = self.snapshot_store.get_snapshot() if version else None
+        if snapshot is None or snapshot.version != version:
+            return None
+        seller_ids = value.get('sellers') or None
+        return self.query_cache.put('urgent', snapshot.urgent_for_sellers(seller_ids), {
+            'seller_ids': seller_ids,
+            'snapshot_time': snapshot.format_age(),
+            'snapshot_version': snapshot.version
+        }, query_id=value.get('query_id'))
     
     def _handle_help(self, args: List[str] = None, sender_id: str = None) -> str:
         """
@@ -369,15 +556,25 @@ class FeishuBot:
 • 帮助 / help - 显示此帮助信息
 • 测试 / test - 测试API连接状态
 • 店铺 / sellers - 获取店铺列表
+• 店铺 <店铺ID> [紧急] - 查看店铺补货概况/紧急补货商品
+• 查 <ASIN|MSKU|FNSKU> - 查询单个商品的库存、销量和补货建议
 • 补货 [店铺ID] - 获取补货数据
 • 紧急 [店铺ID] - 获取紧急补货商品
 • 状态 / status - 查看服务器状态
+• 导出 [店铺ID] - 基于快照生成Excel文件
+• 导出状态 [任务ID] - 查看导出任务进度
+• 刷新 / refresh - 立即刷新补货数据快照
 
 💡 使用示例：
 • 补货 - 获取所有店铺补货数据
 • 补货 12345 - 获取指定店铺补货数据
 • 紧急 - 获取所有紧急补货商品
 • 紧急 12345 - 获取指定店铺紧急补货商品
+• 店铺 12345 紧急 - 获取指定店铺紧急补货商品
+• 查 B08XXXXXXX - 查询单个ASIN
+• 导出 12345 - 导出指定店铺补货数据
+
+📦 补货、紧急、查和店铺ID查询基于后台定时刷新的全量数据快照，回复中会注明快照时间
 
 🔗 服务器地址: http://192.168.0.99:8000
 ⏰ 当前时间: """ + datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -408,10 +605,13 @@ class FeishuBot:
         except Exception as e:
             return f"❌ 连接测试异常: {str(e)}"
     
-    def _handle_get_sellers(self, args: List[str], sender_id: str) -> str:
+    def _handle_get_sellers(self, args: List[str], sender_id: str) -> Any:
         """
-        处理获取店铺信息命令
+        处理获取店铺信息命令（带店铺ID时查询该店铺的快照数据）
         """
+        if args:
+            return self._handle_seller_snapshot(args, sender_id)
+        
         try:
             sellers = self.analyzer.get_sellers()
             
@@ -439,77 +639,232 @@ class FeishuBot:
         except Exception as e:
             return f"❌ 获取店铺信息失败: {str(e)}"
     
-    def _handle_get_restock_data(self, args: List[str], sender_id: str) -> str:
+    def _handle_seller_snapshot(self, args: List[str], sender_id: str) -> Any:
         """
-        处理获取补货数据命令
+        处理 "店铺 <店铺ID> [紧急]" 命令，基于快照店铺索引应答
+        """
+        sid = args[0].strip()
+        snapshot = self.snapshot_store.get_snapshot()
+        if snapshot is None:
+            self.snapshot_store.start()
+            return "⏳ 补货数据快照正在加载，请稍后再试"
+        if not snapshot.has_seller(sid):
+            return f"❌ 快照中没有店铺 {sid} 的补货数据\n📦 数据快照: {snapshot.format_age()}"
+        
+        if len(args) > 1 and args[1].lower() in ('紧急', 'urgent'):
+            urgent_items = snapshot.urgent_for_sellers([sid])
+            if not urgent_items:
+                return f"✅ 店铺 {sid} 暂无紧急补货商品！\n📦 数据快照: {snapshot.format_age()}"
+            result = self.query_cache.put('urgent', urgent_items, {
+                'seller_ids': [sid],
+                'snapshot_time': snapshot.format_age(),
+                'snapshot_version': snapshot.version
+            })
+            return build_urgent_card(result, page_size=FeishuBotConfig.CARD_PAGE_SIZE)
+        
+        summary = snapshot.summarize_sellers([sid])
+        return f"""
+🏪 店铺 {sid} 补货概况
+
+📦 补货商品: {summary['total_items']} 个
+🚨 紧急补货: {summary['urgent_items']} 个
+🛒 建议采购总量: {summary['total_suggested_purchase']}
+
+💡 发送 "店铺 {sid} 紧急" 查看紧急补货明细
+📦 数据快照: {snapshot.format_age()}
+"""
+    
+    def _handle_lookup(self, args: List[str], sender_id: str) -> str:
+        """
+        处理 "查 <ASIN|MSKU|FNSKU>" 命令，基于快照单品索引返回库存、销量和建议明细
+        """
+        if not args:
+            return "❓ 请提供要查询的ASIN、MSKU或FNSKU，例如: 查 B08XXXXXXX"
+        
+        code = args[0].strip()
+        snapshot = self.snapshot_store.get_snapshot()
+        if snapshot is None:
+            self.snapshot_store.start()
+            return "⏳ 补货数据快照正在加载，请稍后再试"
+        
+        items = snapshot.lookup(code)
+        if not items:
+            return f"🔍 快照中未找到 {code}\n📦 数据快照: {snapshot.format_age()}"
+        
+        max_display = 5
+        sections = [self._format_item_detail(item) for item in items[:max_display]]
+        response = f"🔍 {code} 共找到 {len(items)} 条记录\n" + "\n".join(sections)
+        if len(items) > max_display:
+            response += f"\n... 还有 {len(items) - max_display} 条记录"
+        response += f"\n📦 数据快照: {snapshot.format_age()}"
+        return response
+    
+    def _format_item_detail(self, item) -> str:
+        """
+        格式化单个补货项目的库存、销量和建议明细（含已缓存的MSKU详细信息）
+        
+        Args:
+            item: 补货项目
+            
+        Returns:
+            str: 格式化文本
+        """
+        days = item.available_sale_days if item.available_sale_days > 0 else '断货'
+        lines = [
+            "━━━━━━━━━━━━━━━━",
+            f"📦 ASIN: {item.asin} · 店铺 {item.sid}",
+            f"🏷️ MSKU: {', '.join(item.msku_list or []) or '-'}",
+            f"🏷️ FNSKU: {', '.join(item.fnsku_list or []) or '-'}",
+            "",
+            "📊 库存：",
+            f"• FBA可售 {item.fba_available} · FBA在途 {item.fba_shipping} · 计划入库 {item.fba_shipping_plan}",
+            f"• 本地可用 {item.local_available} · 海外仓可用 {item.oversea_available} · "
+            f"海外仓在途 {item.oversea_shipping} · 采购计划 {item.purchase_plan}",
+            "",
+            "📈 销量：",
+            f"• 7天日均 {round(item.sales_avg_7, 2)} · 30天日均 {round(item.sales_avg_30, 2)}",
+            f"• 7天总量 {item.sales_total_7} · 30天总量 {item.sales_total_30}",
+            "",
+            "💡 建议：",
+            f"• 可售天数 {days} · 断货日期 {item.out_stock_date[:10] if item.out_stock_date else '-'}",
+            f"• 建议采购 {item.suggested_purchase} · 本地发FBA {item.suggested_local_to_fba} · "
+            f"海外仓发FBA {item.suggested_oversea_to_fba}",
+        ]
+        
+        # MSKU详细信息只在之前拉取过时展示，不为单品查询调用接口
+        detail = None
+        if item.primary_msku:
+            detail = self.analyzer.get_cached_msku_detail(item.sid, item.primary_msku)
+        detail = detail or getattr(item, 'msku_detail_data', None)
+        if detail:
+            lines += [
+                "",
+                "🔬 MSKU详细信息：",
+                f"• 日均销量 3天 {detail.get('sales_avg_3', 0)} · 14天 {detail.get('sales_avg_14', 0)} · "
+                f"60天 {detail.get('sales_avg_60', 0)} · 90天 {detail.get('sales_avg_90', 0)}",
+                f"• 建议补货 {detail.get('quantity_sug_replenishment', 0)} · 建议发货 {detail.get('quantity_sug_send', 0)} · "
+                f"本地发海外仓 {detail.get('quantity_sug_local_to_oversea', 0)} · "
+                f"海外仓发FBA {detail.get('quantity_sug_oversea_to_fba', 0)}",
+                f"• 建议采购日 {detail.get('sug_date_purchase') or '-'} · 本地发货日 {detail.get('sug_date_send_local') or '-'} · "
+                f"海外仓发货日 {detail.get('sug_date_send_oversea') or '-'}",
+                f"• FBA有效库存 {detail.get('quantity_fba_valid', 0)}",
+            ]
+        return "\n".join(lines)
+    
+    def _get_snapshot(self, on_progress=None):
+        """
+        获取补货数据快照（首次使用时启动后台刷新并等待首个快照）
+        
+        冷启动时只有一个命令等待首个快照，其他命令立即返回None，
+        由调用方回复"正在加载"，不会占满工作线程
+        
+        Args:
+            on_progress: 需要等待首个快照时的加载进度回调
+        
+        Returns:
+            RestockSnapshot: 补货数据快照，加载超时或已有命令在等待时返回None
+        """
+        snapshot = self.snapshot_store.get_snapshot()
+        if snapshot is None:
+            self.snapshot_store.start()
+            if not self._first_load_lock.acquire(blocking=False):
+                return None
+            try:
+                snapshot = self.snapshot_store.refresh(timeout=SnapshotConfig.FIRST_LOAD_TIMEOUT,
+                                                       on_progress=on_progress)
+            finally:
+                self._first_load_lock.release()
+        return snapshot
+    
+    def _handle_get_restock_data(self, args: List[str], sender_id: str) -> Any:
         """
+        处理获取补货数据命令（回复汇总卡片，不生成Excel；冷启动时先发出进度卡片并随页面到达原地更新）
+        """
+        chat_id = self._current_chat_id()
+        reply = ProgressiveReply(self, chat_id) if chat_id else None
         try:
             # 解析参数
             seller_ids = None
             if args:
                 seller_ids = [arg.strip() for arg in args]
             
-            # 获取补货数据（限制数量，避免消息过长）
-            restock_items = self.analyzer.get_restock_data(
-                seller_ids=seller_ids,
-                data_type=1,  # ASIN维度
-                max_pages=2,  # 限制页数
-                max_workers=3
-            )
-            
-            if not restock_items:
-                return "❌ 未找到补货数据"
-            
-            # 生成汇总报告
-            summary = self.analyzer.generate_summary_report(restock_items)
+            snapshot = self._get_snapshot(on_progress=reply.on_progress if reply else None)
+            if snapshot is None:
+                return self._finish_reply(reply, "⏳ 补货数据快照正在加载，请稍后再试")
             
-            response = f"""
-📊 补货数据汇总报告
-
-📈 统计数据：
-• 总计商品: {summary['total_items']}
-• 紧急补货: {summary['urgent_items']}
-• 断货商品: {summary['out_of_stock_items']}
-• 高销量商品: {summary['high_sales_items']}
-• 建议采购总量: {summary['total_suggested_purchase']}
-• 平均可售天数: {summary['avg_available_days']}
-
-🔥 前5个紧急补货商品：
-"""
+            # 全量查询直接使用快照中预先计算的结果；卡片只展示前5个紧急补货商品
+            summary = snapshot.summarize_sellers(seller_ids)
+            urgent_items = snapshot.urgent_for_sellers(seller_ids, limit=5)
             
-            # 分析紧急补货商品
-            urgent_items = self.analyzer.analyze_urgent_restock(restock_items)
-            if urgent_items:
-                response += "\nASIN | 可售天数 | 建议采购 | 日均销量\n"
-                response += "--- | --- | --- | ---\n"
-                
-                for item in urgent_items[:5]:
-                    asin = item.asin[:10]
-                    days = item.available_sale_days if item.available_sale_days > 0 else '断货'
-                    purchase = item.suggested_purchase
-                    sales = round(item.sales_avg_30, 1)
-                    
-                    response += f"{asin} | {days} | {purchase} | {sales}\n"
-            else:
-                response += "\n✅ 暂无紧急补货商品"
+            if not summary['total_items']:
+                return self._finish_reply(reply, f"❌ 未找到补货数据\n📦 数据快照: {snapshot.format_age()}")
             
-            # 导出Excel文件
-            try:
-                excel_file = self.analyzer.export_to_excel(restock_items)
-                response += f"\n📄 详细数据已导出: {excel_file}"
-            except Exception as e:
-                response += f"\n⚠️ 导出失败: {str(e)}"
+            export_command = ' '.join(['导出'] + (seller_ids or []))
+            return self._finish_reply(reply, build_summary_card(
+                summary, urgent_items, snapshot.format_age(), seller_ids,
+                f"📄 发送 \"{export_command}\" 生成Excel文件"
+            ))
             
-            response += f"\n⏰ 查询时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+        except Exception as e:
+            return self._finish_reply(reply, f"❌ 获取补货数据失败: {str(e)}")
+    
+    def _handle_export(self, args: List[str], sender_id: str) -> Any:
+        """
+        处理导出命令：基于快照提交后台Excel导出任务，完成后把结果写回回复卡片
+        """
+        chat_id = self._current_chat_id()
+        try:
+            seller_ids = [arg.strip() for arg in args] if args else None
+            snapshot = self._get_snapshot()
+            if snapshot is None:
+                return "⏳ 补货数据快照正在加载，请稍后再试"
             
-            return response
+            restock_items = snapshot.filter_by_sellers(seller_ids)
+            if not restock_items:
+                return f"❌ 未找到补货数据\n📦 数据快照: {snapshot.format_age()}"
             
+            job_id = get_export_job_manager().submit(restock_items, export_format='standard')
+        except ExportJobError as e:
+            return f"⚠️ 导出失败: {str(e)}"
         except Exception as e:
-            return f"❌ 获取补货数据失败: {str(e)}"
+            return f"❌ 提交导出任务失败: {str(e)}"
+        
+        scope = f"店铺 {', '.join(seller_ids)} " if seller_ids else ''
+        text = (f"📄 {scope}导出任务已提交: {job_id}（{len(restock_items)}条，发送 \"导出状态 {job_id}\" 查看进度）\n"
+                f"📦 数据快照: {snapshot.format_age()}")
+        
+        def render(status_text: str) -> Dict:
+            return build_text_card('📄 补货数据导出', status_text)
+        
+        reply = ProgressiveReply(self, chat_id) if chat_id else None
+        response = self._finish_reply(reply, render(text))
+        if response is None:
+            # 卡片已由机器人直接发出，导出任务结束时补充文件信息
+            get_export_job_manager().add_done_callback(
+                job_id, lambda job: self._on_export_done(reply, job_id, job, render))
+        return response
+    
+    def _on_export_done(self, reply: ProgressiveReply, job_id: str, job, render):
+        """
+        导出任务结束时把结果写回已发出的卡片
+        
+        Args:
+            reply: 已发出的卡片
+            job_id: 导出任务ID
+            job: 结束时的任务状态
+            render: 根据导出说明渲染卡片的函数
+        """
+        if job is None or not job.is_finished:
+            return
+        if job.error:
+            text = f"⚠️ 导出任务 {job_id} 失败: {job.error}"
+        else:
+            text = f"📄 导出完成: {job.output_path or job_id}（{job.item_count}条，耗时{job.duration}秒）"
+        reply.update(render(text))
     
-    def _handle_urgent_restock(self, args: List[str], sender_id: str) -> str:
+    def _handle_urgent_restock(self, args: List[str], sender_id: str) -> Any:
         """
-        处理紧急补货命令
+        处理紧急补货命令（回复可翻页、可排序的卡片）
         """
         try:
             # 解析参数
@@ -517,51 +872,48 @@ class FeishuBot:
             if args:
                 seller_ids = [arg.strip() for arg in args]
             
-            # 获取补货数据
-            restock_items = self.analyzer.get_restock_data(
-                seller_ids=seller_ids,
-                data_type=1,
-                max_pages=3,
-                max_workers=3
-            )
-            
-            if not restock_items:
-                return "❌ 未找到补货数据"
+            snapshot = self._get_snapshot()
+            if snapshot is None:
+                return "⏳ 补货数据快照正在加载，请稍后再试"
             
-            # 分析紧急补货商品
-            urgent_items = self.analyzer.analyze_urgent_restock(restock_items)
+            urgent_items = snapshot.urgent_for_sellers(seller_ids)
             
             if not urgent_items:
-                return "✅ 暂无紧急补货商品！"
-            
-            response = f"""
-🚨 紧急补货提醒！
-
-发现 {len(urgent_items)} 个紧急补货商品：
-
-ASIN | 店铺ID | 可售天数 | 断货日期 | 建议采购
---- | --- | --- | --- | ---
-"""
+                return f"✅ 暂无紧急补货商品！\n📦 数据快照: {snapshot.format_age()}"
             
-            for item in urgent_items[:10]:  # 限制显示前10个
-                asin = item.asin[:10]
-                sid = item.sid
-                days = item.available_sale_days if item.available_sale_days > 0 else '断货'
-                out_date = item.out_stock_date[:10] if item.out_stock_date else '-'
-                purchase = item.suggested_purchase
-                
-                response += f"{asin} | {sid} | {days} | {out_date} | {purchase}\n"
+            # 完整结果进入缓存，翻页和排序回调直接从缓存渲染
+            result = self.query_cache.put('urgent', urgent_items, {
+                'seller_ids': seller_ids,
+                'snapshot_time': snapshot.format_age(),
+                'snapshot_version': snapshot.version
+            })
+            return build_urgent_card(result, page_size=FeishuBotConfig.CARD_PAGE_SIZE)
             
-            if len(urgent_items) > 10:
-                response += f"\n... 还有 {len(urgent_items) - 10} 个紧急补货商品"
+        except Exception as e:
+            return f"❌ 获取紧急补货数据失败: {str(e)}"
+    
+    def _handle_refresh_snapshot(self, args: List[str], sender_id: str) -> Any:
+        """
+        处理刷新快照命令（拉取过程中进度卡片随页面到达原地更新）
+        """
+        chat_id = self._current_chat_id()
+        reply = ProgressiveReply(self, chat_id, title='🔄 正在刷新补货数据快照') if chat_id else None
+        try:
+            snapshot = self.snapshot_store.refresh(on_progress=reply.on_progress if reply else None)
+            if snapshot is None:
+                return self._finish_reply(reply, "❌ 刷新补货数据快照失败，请稍后再试")
             
-            response += f"\n⏰ 查询时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-            response += "\n💡 建议立即处理这些商品的补货！"
+            # 确保之后由后台线程定时刷新
+            self.snapshot_store.start()
             
-            return response
+            return self._finish_reply(reply, build_summary_card(
+                snapshot.summary, snapshot.urgent_for_sellers(None, limit=5), snapshot.format_age(),
+                extra_text=f"⏱️ 拉取耗时: {snapshot.duration}秒",
+                title='🔄 补货数据快照已刷新'
+            ))
             
         except Exception as e:
-            return f"❌ 获取紧急补货数据失败: {str(e)}"
+            return self._finish_reply(reply, f"❌ 刷新补货数据快照失败: {str(e)}")
     
     def _handle_server_status(self, args: List[str], sender_id: str) -> str:
         """
@@ -606,6 +958,33 @@ ASIN | 店铺ID | 可售天数 | 断货日期 | 建议采购
         except Exception as e:
             return f"❌ 获取服务器状态失败: {str(e)}"
     
+    def _handle_export_status(self, args: List[str], sender_id: str) -> str:
+        """
+        处理导出状态查询命令
+        """
+        try:
+            manager = get_export_job_manager()
+            
+            if args:
+                job = manager.get_job(args[0].strip())
+                if not job:
+                    return f"❌ 未找到导出任务: {args[0]}"
+                return f"📄 导出任务状态\n\n{job.format_status()}"
+            
+            jobs = manager.list_jobs(limit=5)
+            if not jobs:
+                return "📄 暂无导出任务"
+            
+            response = "📄 最近的导出任务：\n\n任务ID | 状态 | 进度 | 耗时\n--- | --- | --- | ---\n"
+            for job in jobs:
+                status = JOB_STATUS_DISPLAY.get(job.status, job.status)
+                duration = f"{job.duration}秒" if job.duration is not None else '-'
+                response += f"{job.job_id} | {status} | {job.progress}% | {duration}\n"
+            return response
+            
+        except Exception as e:
+            return f"❌ 查询导出状态失败: {str(e)}"
+    
     def _handle_unknown_command(self, text: str) -> str:
         """
         处理未知命令
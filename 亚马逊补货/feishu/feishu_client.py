@@ -0,0 +1,517 @@
+# -*- coding: utf-8 -*-
+"""
+飞书开放平台客户端模块
+线程安全的出站请求客户端：连接池复用、租户令牌单飞刷新和提前续期、
+429/5xx退避重试，以及发送失败消息的持久化待发队列（后台定时补发）
+"""
+
+import os
+import json
+import time
+import uuid
+import random
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config.config import FeishuBotConfig
+from utils.logger import api_logger
+
+FEISHU_BASE_URL = "https://open.feishu.cn"
+TOKEN_PATH = "/open-apis/auth/v3/tenant_access_token/internal"
+MESSAGE_PATH = "/open-apis/im/v1/messages"
+
+# 需要重试的飞书业务错误码（请求频率超限）
+FEISHU_RATE_LIMIT_CODES = {99991400}
+
+# 令牌无效/过期的错误码（刷新令牌后重试）
+FEISHU_TOKEN_INVALID_CODES = {99991661, 99991663, 99991668}
+
+# 令牌剩余有效期低于该值时必须同步刷新（秒）
+TOKEN_HARD_MARGIN = 60
+
+class FeishuAPIError(Exception):
+    """飞书接口异常类"""
+
+    def __init__(self, message: str, code: Any = None, status: int = None, retryable: bool = False):
+        super().__init__(message)
+        self.code = code
+        self.status = status
+        self.retryable = retryable
+
+def _receive_id_type(receive_id: str) -> str:
+    """根据receive_id格式判断ID类型"""
+    if receive_id.startswith('oc_'):
+        return 'chat_id'
+    if receive_id.startswith('ou_'):
+        return 'open_id'
+    if receive_id.startswith('om_'):
+        return 'user_id'
+    # 默认使用chat_id，这是最常见的情况
+    return 'chat_id'
+
+class FeishuClient:
+    """
+    飞书开放平台客户端
+
+    所有请求共用一个keep-alive连接池；令牌在到期前由后台线程续期，
+    过期时只有一个线程刷新，其余线程等待同一结果
+    """
+
+    def __init__(self, app_id: str, app_secret: str, base_url: str = FEISHU_BASE_URL,
+                 timeout: float = None, max_retries: int = None, pool_size: int = None,
+                 outbox_file: str = None, pool_timeout: float = None, outbox_retry_interval: float = None):
+        """
+        初始化飞书客户端
+
+        Args:
+            app_id: 应用ID
+            app_secret: 应用密钥
+            base_url: 飞书开放平台地址
+            timeout: 单次请求超时（秒）
+            max_retries: 失败后的最大重试次数
+            pool_size: 连接池大小
+            outbox_file: 待发消息文件路径（为空字符串时不持久化）
+            pool_timeout: 等待空闲连接的最长时间（秒）
+            outbox_retry_interval: 待发队列后台补发间隔（秒）
+        """
+        self.app_id = app_id
+        self.app_secret = app_secret
+        self.base_url = base_url.rstrip('/')
+        self._token_url = None
+        self.timeout = timeout or FeishuBotConfig.HTTP_TIMEOUT
+        self.max_retries = max_retries if max_retries is not None else FeishuBotConfig.HTTP_MAX_RETRIES
+        self.renew_ahead = FeishuBotConfig.TOKEN_RENEW_AHEAD
+        self.outbox_file = outbox_file if outbox_file is not None else FeishuBotConfig.OUTBOX_FILE
+        self.pool_timeout = pool_timeout or FeishuBotConfig.HTTP_POOL_TIMEOUT
+        self.outbox_retry_interval = outbox_retry_interval or FeishuBotConfig.OUTBOX_RETRY_INTERVAL
+
+        pool_size = pool_size or FeishuBotConfig.HTTP_POOL_SIZE
+        self.session = requests.Session()
+        # 并发请求数由连接槽位限制在连接池大小以内：突发回复时最多等待pool_timeout秒，
+        # 而不是为每条消息新建连接，也不会在连接池上无限期阻塞
+        self._slots = threading.BoundedSemaphore(pool_size)
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Content-Type'] = 'application/json; charset=utf-8'
+
+        # 令牌状态
+        self.access_token = None
+        self.token_expire_time = 0
+        self._token_lock = threading.Lock()
+        self._renewing = False
+
+        # 待发队列
+        self._outbox_lock = threading.Lock()
+        self._flushing = False
+        self._outbox_timer = None
+        self._outbox_count = len(self._load_outbox())
+
+        self._stats_lock = threading.Lock()
+        self._stats = {'requests': 0, 'retries': 0, 'errors': 0, 'pool_timeouts': 0, 'token_refreshes': 0,
+                       'messages_sent': 0, 'messages_updated': 0, 'messages_queued': 0, 'outbox_delivered': 0}
+
+        # 上次运行遗留的待发消息由后台线程补发
+        if self._outbox_count:
+            with self._outbox_lock:
+                self._start_outbox_timer()
+
+    @property
+    def token_url(self) -> str:
+        """租户令牌接口地址"""
+        return self._token_url or f"{self.base_url}{TOKEN_PATH}"
+
+    @token_url.setter
+    def token_url(self, value: str):
+        self._token_url = value
+
+    def _count(self, name: str, value: int = 1):
+        with self._stats_lock:
+            self._stats[name] += value
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        """占用一个连接槽位发送请求，等待超过pool_timeout时按连接失败处理"""
+        if not self._slots.acquire(timeout=self.pool_timeout):
+            self._count('pool_timeouts')
+            raise requests.exceptions.ConnectionError(f"等待空闲连接超过{self.pool_timeout}秒")
+        try:
+            return self.session.request(method, url, timeout=self.timeout, **kwargs)
+        finally:
+            self._slots.release()
+
+    # ---------- 租户令牌 ----------
+
+    def _fetch_token(self) -> Optional[str]:
+        """请求新的租户令牌（调用方需持有令牌锁）"""
+        data = {'app_id': self.app_id, 'app_secret': self.app_secret}
+        try:
+            response = self._send('POST', self.token_url, json=data)
+            result = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            api_logger.log_error(e, "获取飞书访问令牌异常")
+            return None
+
+        if result.get('code') != 0:
+            api_logger.logger.error(f"获取飞书访问令牌失败: code={result.get('code')}, msg={result.get('msg')}")
+            return None
+
+        self.access_token = result['tenant_access_token']
+        self.token_expire_time = time.time() + result['expire']
+        self._count('token_refreshes')
+        api_logger.log_info(f"飞书访问令牌获取成功，有效期{result['expire']}秒")
+        return self.access_token
+
+    def get_tenant_access_token(self) -> Optional[str]:
+        """
+        获取租户访问令牌
+
+        令牌即将到期时在后台续期并继续使用当前令牌；
+        已过期或不存在时同步刷新，并发调用只会发出一次刷新请求
+
+        Returns:
+            Optional[str]: 访问令牌，获取失败返回None
+        """
+        token, expire_at = self.access_token, self.token_expire_time
+        remaining = expire_at - time.time()
+        if token and remaining > TOKEN_HARD_MARGIN:
+            if remaining < self.renew_ahead:
+                self._renew_in_background()
+            return token
+
+        with self._token_lock:
+            # 等待锁期间其他线程可能已完成刷新
+            if self.access_token and self.token_expire_time - time.time() > TOKEN_HARD_MARGIN:
+                return self.access_token
+            return self._fetch_token()
+
+    def _renew_in_background(self):
+        """在后台线程中提前续期令牌（同一时间只有一个续期线程）"""
+        with self._stats_lock:
+            if self._renewing:
+                return
+            self._renewing = True
+
+        def renew():
+            renewed = None
+            try:
+                with self._token_lock:
+                    if self.token_expire_time - time.time() < self.renew_ahead:
+                        renewed = self._fetch_token()
+            finally:
+                with self._stats_lock:
+                    self._renewing = False
+            # 续期成功说明飞书已恢复可用，顺带补发待发消息
+            if renewed and self.outbox_size():
+                self._flush_in_background()
+
+        threading.Thread(target=renew, name='feishu-token-renew', daemon=True).start()
+
+    def invalidate_token(self, token: str):
+        """
+        使令牌失效（只在当前令牌仍是该令牌时生效，避免覆盖其他线程刚刷新的令牌）
+
+        Args:
+            token: 被服务端判定无效的令牌
+        """
+        with self._token_lock:
+            if self.access_token == token:
+                self.access_token = None
+                self.token_expire_time = 0
+
+    # ---------- 请求 ----------
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """计算重试等待时间：优先使用服务端提示，否则指数退避加随机抖动"""
+        if retry_after:
+            try:
+                return min(float(retry_after), 30.0)
+            except ValueError:
+                pass
+        delay = FeishuBotConfig.HTTP_RETRY_BACKOFF * (2 ** attempt)
+        return min(delay, 10.0) * (0.5 + random.random() / 2)
+
+    def request(self, method: str, path: str, json_data: Dict[str, Any] = None,
+                params: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        发送带租户令牌的请求（429/5xx/限流错误码退避重试，令牌失效时刷新后重试）
+
+        Args:
+            method: HTTP方法
+            path: 接口路径（或完整URL）
+            json_data: 请求体
+            params: 查询参数
+
+        Returns:
+            Dict[str, Any]: 响应JSON（code为0）
+        """
+        url = path if path.startswith('http') else f"{self.base_url}{path}"
+
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            if attempt:
+                self._count('retries')
+
+            token = self.get_tenant_access_token()
+            if not token:
+                if last_attempt:
+                    self._count('errors')
+                    raise FeishuAPIError("获取飞书访问令牌失败", retryable=True)
+                time.sleep(self._backoff(attempt))
+                continue
+
+            self._count('requests')
+            try:
+                response = self._send(method, url, params=params, json=json_data,
+                                      headers={'Authorization': f'Bearer {token}'})
+            except requests.exceptions.RequestException as e:
+                if last_attempt:
+                    self._count('errors')
+                    raise FeishuAPIError(f"请求飞书接口失败: {e}", retryable=True)
+                time.sleep(self._backoff(attempt))
+                continue
+
+            try:
+                result = response.json()
+            except ValueError:
+                result = {'code': response.status_code, 'msg': response.text[:200]}
+
+            code = result.get('code')
+            if response.status_code == 200 and code == 0:
+                return result
+
+            if code in FEISHU_TOKEN_INVALID_CODES:
+                self.invalidate_token(token)
+                if not last_attempt:
+                    continue
+
+            retryable = (response.status_code == 429 or response.status_code >= 500
+                         or code in FEISHU_RATE_LIMIT_CODES or code in FEISHU_TOKEN_INVALID_CODES)
+            if retryable and not last_attempt:
+                retry_after = response.headers.get('x-ogw-ratelimit-reset') or response.headers.get('Retry-After')
+                delay = self._backoff(attempt, retry_after)
+                api_logger.log_warning(f"飞书接口返回{response.status_code}/{code}，{delay:.1f}秒后重试: {path}")
+                time.sleep(delay)
+                continue
+
+            self._count('errors')
+            raise FeishuAPIError(f"飞书接口返回错误: {result.get('msg', '')}", code,
+                                 response.status_code, retryable)
+
+        raise FeishuAPIError("飞书接口请求失败", retryable=True)
+
+    # ---------- 消息发送 ----------
+
+    def send_message(self, receive_id: str, msg_type: str, content: Any,
+                     queue_on_failure: bool = True) -> bool:
+        """
+        发送消息
+
+        Args:
+            receive_id: 接收者ID
+            msg_type: 消息类型
+            content: 消息内容（字符串或对象，直接使用）
+            queue_on_failure: 可重试的失败是否写入待发队列
+
+        Returns:
+            bool: 发送结果
+        """
+        id_type = _receive_id_type(receive_id)
+        data = {'receive_id': receive_id, 'msg_type': msg_type, 'content': content}
+        api_logger.log_debug(f"发送飞书消息: {id_type}={receive_id}, 类型={msg_type}")
+
+        try:
+            self.request('POST', MESSAGE_PATH, json_data=data, params={'receive_id_type': id_type})
+        except FeishuAPIError as e:
+            api_logger.logger.error(f"发送飞书消息失败: {e} (code={e.code}, status={e.status})")
+            if queue_on_failure and e.retryable:
+                self._outbox_append(receive_id, msg_type, content)
+            return False
+
+        self._count('messages_sent')
+        if queue_on_failure and self.outbox_size():
+            self._flush_in_background()
+        return True
+
+    def post_message(self, receive_id: str, msg_type: str, content: Any) -> Optional[str]:
+        """
+        发送消息并返回消息ID（用于之后原地更新；失败不写入待发队列）
+
+        Args:
+            receive_id: 接收者ID
+            msg_type: 消息类型
+            content: 消息内容
+
+        Returns:
+            Optional[str]: 消息ID，发送失败返回None
+        """
+        id_type = _receive_id_type(receive_id)
+        data = {'receive_id': receive_id, 'msg_type': msg_type, 'content': content}
+        try:
+            result = self.request('POST', MESSAGE_PATH, json_data=data, params={'receive_id_type': id_type})
+        except FeishuAPIError as e:
+            api_logger.logger.error(f"发送飞书消息失败: {e} (code={e.code}, status={e.status})")
+            return None
+
+        self._count('messages_sent')
+        return (result.get('data') or {}).get('message_id')
+
+    def update_message(self, message_id: str, content: Any) -> bool:
+        """
+        原地更新已发送的卡片消息（卡片需开启 update_multi）
+
+        Args:
+            message_id: 消息ID
+            content: 新的卡片内容
+
+        Returns:
+            bool: 更新结果
+        """
+        try:
+            self.request('PATCH', f"{MESSAGE_PATH}/{message_id}", json_data={'content': content})
+        except FeishuAPIError as e:
+            api_logger.logger.error(f"更新飞书消息失败: {e} (code={e.code}, status={e.status})")
+            return False
+
+        self._count('messages_updated')
+        return True
+
+    # ---------- 待发队列 ----------
+
+    def _load_outbox(self) -> List[Dict[str, Any]]:
+        """读取待发队列（调用方需持有队列锁）"""
+        if not self.outbox_file or not os.path.exists(self.outbox_file):
+            return []
+        try:
+            with open(self.outbox_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            api_logger.log_error(e, f"读取飞书待发消息失败: {self.outbox_file}")
+            return []
+
+    def _save_outbox(self, entries: List[Dict[str, Any]]):
+        """原子写入待发队列（调用方需持有队列锁）"""
+        outbox_dir = os.path.dirname(self.outbox_file)
+        if outbox_dir:
+            os.makedirs(outbox_dir, exist_ok=True)
+        tmp_path = f"{self.outbox_file}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.outbox_file)
+        self._outbox_count = len(entries)
+
+    def _outbox_append(self, receive_id: str, msg_type: str, content: Any):
+        """将发送失败的消息写入待发队列"""
+        if not self.outbox_file:
+            return
+        with self._outbox_lock:
+            entries = self._load_outbox()
+            entries.append({
+                'id': uuid.uuid4().hex,
+                'receive_id': receive_id,
+                'msg_type': msg_type,
+                'content': content,
+                'created_at': time.time(),
+                'attempts': 0
+            })
+            self._save_outbox(entries[-FeishuBotConfig.OUTBOX_MAX_SIZE:])
+            self._start_outbox_timer()
+        self._count('messages_queued')
+        api_logger.log_warning(f"飞书消息已写入待发队列: {receive_id}")
+
+    def outbox_size(self) -> int:
+        """待发消息数量"""
+        return self._outbox_count
+
+    def flush_outbox(self) -> Tuple[int, int]:
+        """
+        重新发送待发队列中的消息（超过保留期的消息直接丢弃）
+
+        Returns:
+            Tuple[int, int]: (本次送达数, 剩余数)
+        """
+        if not self.outbox_file:
+            return 0, 0
+
+        with self._outbox_lock:
+            if self._flushing:
+                return 0, self._outbox_count
+            self._flushing = True
+            entries = self._load_outbox()
+
+        delivered_ids = set()
+        expired_ids = set()
+        try:
+            now = time.time()
+            for entry in entries:
+                if now - entry['created_at'] > FeishuBotConfig.OUTBOX_MAX_AGE:
+                    expired_ids.add(entry['id'])
+                    continue
+                entry['attempts'] += 1
+                if self.send_message(entry['receive_id'], entry['msg_type'], entry['content'],
+                                     queue_on_failure=False):
+                    delivered_ids.add(entry['id'])
+                else:
+                    break  # 仍然发送失败，保留剩余消息等下次再发
+        finally:
+            with self._outbox_lock:
+                attempts = {entry['id']: entry['attempts'] for entry in entries}
+                # 重新读取，保留刷新期间新写入的消息
+                remaining = [entry for entry in self._load_outbox()
+                             if entry['id'] not in delivered_ids and entry['id'] not in expired_ids]
+                for entry in remaining:
+                    entry['attempts'] = attempts.get(entry['id'], entry['attempts'])
+                self._save_outbox(remaining)
+                self._flushing = False
+
+        if delivered_ids:
+            self._count('outbox_delivered', len(delivered_ids))
+            api_logger.log_info(f"飞书待发消息已补发{len(delivered_ids)}条，剩余{len(remaining)}条")
+        return len(delivered_ids), len(remaining)
+
+    def _flush_in_background(self):
+        """在后台线程中补发待发消息"""
+        threading.Thread(target=self.flush_outbox, name='feishu-outbox', daemon=True).start()
+
+    def _start_outbox_timer(self):
+        """启动待发队列的定时补发线程（调用方需持有队列锁，同一时间只有一个定时线程）"""
+        if self._outbox_timer is not None:
+            return
+        self._outbox_timer = threading.Thread(target=self._outbox_loop, name='feishu-outbox-timer', daemon=True)
+        self._outbox_timer.start()
+
+    def _outbox_loop(self):
+        """
+        定时补发待发消息，直到队列清空
+
+        即使之后没有新的消息发送成功也能补发；补发仍失败时间隔逐次加倍（最多8倍），
+        避免飞书长时间不可用时频繁重试
+        """
+        interval = self.outbox_retry_interval
+        while True:
+            time.sleep(interval)
+            delivered, _ = self.flush_outbox()
+            with self._outbox_lock:
+                # 在队列锁内判断并退出，保证之后写入的消息会重新启动定时线程
+                if not self._outbox_count:
+                    self._outbox_timer = None
+                    return
+            if delivered:
+                interval = self.outbox_retry_interval
+            else:
+                interval = min(interval * 2, self.outbox_retry_interval * 8)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取客户端统计信息
+
+        Returns:
+            Dict: 请求/重试/错误次数、令牌状态和待发消息数
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['token_valid_seconds'] = max(0, int(self.token_expire_time - time.time())) if self.access_token else 0
+        stats['outbox_size'] = self.outbox_size()
+        return stats
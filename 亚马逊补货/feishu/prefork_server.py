@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+飞书Webhook多进程服务（Linux）
+主进程创建监听端口后预先fork多个工作进程共同accept，另fork一个刷新进程负责拉取数据；
+工作进程通过内存映射读取共享快照文件，CPU密集的卡片渲染不会阻塞其他进程的请求。
+
+用法:
+    python feishu/prefork_server.py --workers 4 --port 5000
+"""
+
+import os
+import sys
+import time
+import socket
+import signal
+import argparse
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.config import SnapshotConfig, StorageConfig
+from utils.logger import api_logger
+
+# 多进程模式下默认的共享事件去重数据库（未配置 FEISHU_DEDUP_DB 时使用）
+PREFORK_DEDUP_DB = os.path.join(StorageConfig.DATA_DIR, 'feishu_events.db')
+# 多进程共享的准入控制数据库文件名（与事件去重数据库放在同一目录）
+PREFORK_ADMISSION_DB = 'feishu_admission.db'
+
+def run_worker(fd: int, host: str, port: int):
+    """
+    工作进程：加载Flask应用，改用共享快照，并在继承的监听端口上服务
+
+    Args:
+        fd: 监听socket的文件描述符
+        host: 监听地址（仅用于日志）
+        port: 监听端口（仅用于日志）
+    """
+    from werkzeug.serving import make_server
+    from business.snapshot_file import SharedSnapshotStore
+    from feishu.event_dedup import EventDedupCache
+    from feishu.admission import SharedAdmissionController
+    import feishu.start_feishu_server as server
+
+    if server.feishu_bot is None:
+        raise RuntimeError("飞书机器人初始化失败")
+
+    # 每个进程各自创建机器人，快照、事件去重和准入限额在进程间共享；
+    # 卡片按钮带有快照版本和筛选条件，回调落到其他进程时从共享快照重建结果
+    server.feishu_bot.snapshot_store = SharedSnapshotStore()
+    if not server.feishu_bot.event_dedup.db_path:
+        server.feishu_bot.event_dedup = EventDedupCache(db_path=PREFORK_DEDUP_DB)
+    admission_db = os.path.join(os.path.dirname(server.feishu_bot.event_dedup.db_path), PREFORK_ADMISSION_DB)
+    server.feishu_bot.admission = SharedAdmissionController(
+        db_path=admission_db, heavy_commands=server.feishu_bot.admission.heavy_commands)
+    server.event_queue.start()
+
+    httpd = make_server(host, port, server.app, threaded=True, fd=fd)
+    api_logger.log_info(f"工作进程 {os.getpid()} 开始服务 {host}:{port}")
+    httpd.serve_forever()
+
+def run_refresher():
+    """刷新进程：唯一调用领星接口的进程，定时把快照写入共享目录"""
+    from business.snapshot_file import SnapshotFileWriter
+    from business.restock_snapshot import RestockSnapshotStore
+
+    SnapshotFileWriter(RestockSnapshotStore()).run()
+
+class PreforkServer:
+    """预先fork的多进程服务主进程：创建监听端口、派生并看护子进程"""
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 5000, workers: int = None,
+                 refresher: bool = True):
+        """
+        初始化多进程服务
+
+        Args:
+            host: 监听地址
+            port: 监听端口
+            workers: 工作进程数
+            refresher: 是否启动刷新进程（已有外部刷新进程时关闭）
+        """
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers or SnapshotConfig.SERVER_WORKERS)
+        self.refresher = refresher
+        self.sock = None
+        self._children = {}
+        self._stopping = False
+
+    def _spawn(self, role: str):
+        """fork一个子进程（role: 'worker' 或 'refresher'）"""
+        pid = os.fork()
+        if pid:
+            self._children[pid] = role
+            return
+
+        # 子进程：终止信号使用默认行为，Ctrl+C由主进程统一处理
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        code = 0
+        try:
+            if role == 'worker':
+                run_worker(self.sock.fileno(), self.host, self.port)
+            else:
+                self.sock.close()
+                run_refresher()
+        except Exception as e:
+            api_logger.log_error(e, f"{role}进程异常退出")
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _shutdown(self, signum, frame):
+        """收到终止信号：通知所有子进程退出"""
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def serve(self):
+        """启动并看护子进程，直到收到终止信号"""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(128)
+        self.sock.set_inheritable(True)
+        self.port = self.sock.getsockname()[1]
+
+        if self.refresher:
+            self._spawn('refresher')
+        for _ in range(self.workers):
+            self._spawn('worker')
+        signal.signal(signal.SIGTERM, self._shutdown)
+        signal.signal(signal.SIGINT, self._shutdown)
+        api_logger.log_info(f"多进程服务已启动: {self.host}:{self.port}，{self.workers}个工作进程"
+                            f"{'，1个刷新进程' if self.refresher else ''}")
+
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            role = self._children.pop(pid, None)
+            if role and not self._stopping:
+                api_logger.log_warning(f"{role}进程 {pid} 已退出（状态{status}），1秒后重启")
+                time.sleep(1)
+                self._spawn(role)
+
+        self.sock.close()
+        api_logger.log_info("多进程服务已停止")
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='飞书Webhook多进程服务（Linux）')
+    parser.add_argument('--host', default='0.0.0.0', help='监听地址')
+    parser.add_argument('--port', type=int, default=5000, help='监听端口')
+    parser.add_argument('--workers', type=int, default=SnapshotConfig.SERVER_WORKERS, help='工作进程数')
+    parser.add_argument('--no-refresher', action='store_true', help='不启动刷新进程（由外部进程写入共享快照）')
+    args = parser.parse_args()
+
+    if not hasattr(os, 'fork'):
+        print("❌ 多进程服务模式仅支持Linux，请使用 start_feishu_server.py")
+        sys.exit(1)
+
+    print("🤖 飞书机器人Webhook服务器（多进程模式）")
+    print("=" * 50)
+    print(f"📍 服务地址: http://{args.host}:{args.port}")
+    print(f"👷 工作进程: {args.workers}")
+    print(f"📦 共享快照目录: {SnapshotConfig.SHARED_DIR}")
+    print()
+
+    PreforkServer(args.host, args.port, args.workers, refresher=not args.no_refresher).serve()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+渐进式回复模块
+冷启动拉取数据时，首批页面到达后立即发出进度卡片，
+之后随页面到达通过消息更新接口原地刷新，最后替换为完整结果
+"""
+
+import time
+import threading
+from typing import Dict, Any
+
+from config.config import FeishuBotConfig
+from feishu.cards import build_loading_card
+
+class ProgressiveReply:
+    """
+    原地更新的回复卡片（线程安全）
+
+    on_progress() 可直接作为快照刷新的进度回调；更新按最小间隔节流，
+    finish() 总会把最终卡片写入（尚未发出进度卡片时直接发送新消息）；
+    飞书接口调用都在状态锁之外进行
+    """
+
+    def __init__(self, bot, chat_id: str, title: str = '⏳ 正在拉取补货数据',
+                 min_interval: float = None):
+        """
+        初始化渐进式回复
+
+        Args:
+            bot: 飞书机器人实例
+            chat_id: 会话ID
+            title: 进度卡片标题
+            min_interval: 两次进度更新的最小间隔（秒）
+        """
+        self.bot = bot
+        self.chat_id = chat_id
+        self.title = title
+        self.min_interval = min_interval if min_interval is not None else FeishuBotConfig.PROGRESS_UPDATE_INTERVAL
+        self.message_id = None
+        self.updates = 0
+        self._last_update = 0.0
+        self._finished = False
+        # _lock 只保护状态；_send_lock 保证同一时间只有一个飞书请求，卡片按顺序写入
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+
+    def on_progress(self, progress: Dict[str, Any]):
+        """
+        进度回调：首次发出进度卡片，之后节流更新；上一次发送尚未返回时直接跳过，不阻塞拉取线程
+
+        Args:
+            progress: 刷新进度（RefreshProgress.to_dict()）
+        """
+        with self._lock:
+            if self._finished:
+                return
+            now = time.time()
+            if self.message_id and now - self._last_update < self.min_interval:
+                return
+            self._last_update = now
+
+        card = build_loading_card(progress, self.title)
+        if not self._send_lock.acquire(blocking=False):
+            return
+        try:
+            # 等待期间可能已写入最终卡片，不能再用进度卡片覆盖
+            if not self._finished:
+                self._show(card)
+        finally:
+            self._send_lock.release()
+
+    def finish(self, card: Dict[str, Any]) -> bool:
+        """
+        写入最终卡片（等待正在进行的进度更新返回后发送）
+
+        Args:
+            card: 最终结果卡片
+
+        Returns:
+            bool: 是否成功（失败时调用方可改为普通回复）
+        """
+        with self._lock:
+            self._finished = True
+        with self._send_lock:
+            return self._show(card)
+
+    def update(self, card: Dict[str, Any]) -> bool:
+        """
+        结束后再次更新卡片（如导出完成后补充文件信息）
+
+        Args:
+            card: 新卡片
+
+        Returns:
+            bool: 更新结果
+        """
+        with self._send_lock:
+            if not self.message_id:
+                return False
+            return self._show(card)
+
+    def _show(self, card: Dict[str, Any]) -> bool:
+        """发送或原地更新卡片（调用方需持有发送锁，飞书请求期间不持有状态锁）"""
+        if self.message_id:
+            success = self.bot.update_card(self.message_id, card)
+        else:
+            message_id = self.bot.post_card(self.chat_id, card)
+            with self._lock:
+                self.message_id = message_id
+            success = message_id is not None
+        if success:
+            with self._lock:
+                self.updates += 1
+        return success
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+查询结果缓存模块
+保存机器人查询的完整结果集，卡片翻页/排序回调按查询ID从缓存读取，
+不再重新拉取补货数据；超过有效期的结果自动淘汰
+"""
+
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Callable
+
+from config.config import FeishuBotConfig
+
+class QueryResult:
+    """一次查询的完整结果集（按排序方式缓存排序后的列表）"""
+
+    def __init__(self, query_id: str, kind: str, items: List[Any],
+                 context: Dict[str, Any] = None):
+        """
+        初始化查询结果
+
+        Args:
+            query_id: 查询ID
+            kind: 查询类型（如 'urgent'）
+            items: 结果项目（默认顺序）
+            context: 渲染所需的附加信息（快照时间、店铺筛选等）
+        """
+        self.query_id = query_id
+        self.kind = kind
+        self.items = items
+        self.context = context or {}
+        self.created_at = time.time()
+        self._sorted = {}
+        self._lock = threading.Lock()
+
+    def sorted_items(self, sort_key: str, key_func: Optional[Callable[[Any], Any]],
+                     reverse: bool = False) -> List[Any]:
+        """
+        获取按指定方式排序的结果（每种排序只计算一次）
+
+        Args:
+            sort_key: 排序方式名称
+            key_func: 排序函数，None表示保持默认顺序
+            reverse: 是否降序
+
+        Returns:
+            List[Any]: 排序后的结果
+        """
+        if key_func is None:
+            return self.items
+        with self._lock:
+            if sort_key not in self._sorted:
+                self._sorted[sort_key] = sorted(self.items, key=key_func, reverse=reverse)
+            return self._sorted[sort_key]
+
+class QueryResultCache:
+    """有界的TTL查询结果缓存（线程安全）"""
+
+    def __init__(self, ttl: int = None, max_entries: int = None):
+        """
+        初始化查询结果缓存
+
+        Args:
+            ttl: 结果有效期（秒）
+            max_entries: 最多保留的结果集数量
+        """
+        self.ttl = ttl or FeishuBotConfig.QUERY_CACHE_TTL
+        self.max_entries = max(1, max_entries or FeishuBotConfig.QUERY_CACHE_MAX_ENTRIES)
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'stored': 0, 'hits': 0, 'misses': 0, 'expired': 0}
+
+    def _evict_expired(self, now: float):
+        """淘汰过期结果（调用方需持有锁；按创建时间有序，只需检查队首）"""
+        while self._results:
+            query_id, result = next(iter(self._results.items()))
+            if now - result.created_at < self.ttl:
+                break
+            self._results.popitem(last=False)
+            self._stats['expired'] += 1
+
+    def put(self, kind: str, items: List[Any], context: Dict[str, Any] = None,
+            query_id: str = None) -> QueryResult:
+        """
+        保存查询结果
+
+        Args:
+            kind: 查询类型
+            items: 结果项目
+            context: 渲染所需的附加信息
+            query_id: 查询ID（按按钮中的信息重建结果时沿用原ID，默认新生成）
+
+        Returns:
+            QueryResult: 带查询ID的结果集
+        """
+        result = QueryResult(query_id or uuid.uuid4().hex[:12], kind, items, context)
+        with self._lock:
+            self._evict_expired(result.created_at)
+            self._results[result.query_id] = result
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+            self._stats['stored'] += 1
+        return result
+
+    def get(self, query_id: str) -> Optional[QueryResult]:
+        """
+        获取查询结果
+
+        Args:
+            query_id: 查询ID
+
+        Returns:
+            Optional[QueryResult]: 结果集，不存在或已过期返回None
+        """
+        with self._lock:
+            self._evict_expired(time.time())
+            result = self._results.get(query_id)
+            self._stats['hits' if result else 'misses'] += 1
+            return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            return {**self._stats, 'entries': len(self._results), 'ttl': self.ttl}
@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+"""
+飞书表格同步模块
+将补货快照同步到飞书电子表格或多维表格：
+只写入变化的行，按接口上限分批，在限流下并发提交
+"""
+
+import os
+import json
+import time
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Any, List, Optional, Tuple, Callable
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from business.restock_analyzer import RestockAnalyzer, RestockItem
+from business.incremental_export import build_row_snapshot
+from config.config import FeishuSyncConfig
+from feishu.feishu_client import FEISHU_RATE_LIMIT_CODES
+from utils.logger import api_logger
+from utils.rate_limiter import TokenBucket
+
+# 尾部清空失败的行在同步状态中的占位键，下次同步时作为删除行重新清空
+STALE_ROW_KEY = '__stale__|{}'
+
+class FeishuSyncError(Exception):
+    """飞书同步异常类"""
+
+    def __init__(self, message: str, code: Any = None):
+        super().__init__(message)
+        self.code = code
+
+@dataclass
+class SyncResult:
+    """同步结果数据类"""
+    target: str
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+    total_rows: int = 0
+    requests: int = 0
+    failed_batches: int = 0
+    failed_rows: int = 0
+    duration: float = 0.0
+
+    @property
+    def changed(self) -> int:
+        """写入的变更行总数"""
+        return self.inserted + self.updated + self.deleted
+
+    @property
+    def rows_per_second(self) -> float:
+        """变更行吞吐量"""
+        return round(self.changed / self.duration, 1) if self.duration else 0.0
+
+def _column_letter(index: int) -> str:
+    """列序号（从1开始）转换为列字母"""
+    letters = ''
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+class _FeishuTableSync(ABC):
+    """飞书表格同步基类：请求、限流、并发批次和同步状态管理"""
+
+    target = ''
+
+    def __init__(self, bot, state_file: str, batch_size: int,
+                 concurrency: int = None, qps: float = None, base_url: str = None):
+        """
+        初始化同步器
+
+        Args:
+            bot: 飞书机器人实例（复用其 get_access_token）
+            state_file: 同步状态文件路径
+            batch_size: 单次请求的最大行数
+            concurrency: 并发批次数
+            qps: 每秒请求数上限
+            base_url: 飞书开放平台地址（默认使用机器人配置，测试时可指向本地替身服务）
+        """
+        self.bot = bot
+        self.state_file = state_file
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency or FeishuSyncConfig.CONCURRENCY)
+        self.base_url = (base_url or bot.base_url).rstrip('/')
+        self.limiter = TokenBucket(qps or FeishuSyncConfig.QPS, capacity=self.concurrency)
+
+        self.columns = list(RestockAnalyzer.STANDARD_COLUMN_ORDER)
+        self.headers = [RestockAnalyzer.STANDARD_COLUMN_MAPPING.get(col, col) for col in self.columns]
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._request_count = 0
+        self._count_lock = threading.Lock()
+        # 表头写入失败时置位并保存在同步状态中，下次同步重写表头
+        self._header_pending = False
+
+    def _request(self, method: str, path: str, payload: Dict[str, Any],
+                 max_attempts: int = 3) -> Dict[str, Any]:
+        """
+        发送飞书开放平台请求（限流、429/5xx退避重试）
+
+        Args:
+            method: HTTP方法
+            path: 接口路径
+            payload: 请求体
+            max_attempts: 最大尝试次数
+
+        Returns:
+            Dict[str, Any]: 响应中的data字段
+        """
+        url = f"{self.base_url}{path}"
+        for attempt in range(1, max_attempts + 1):
+            self.limiter.acquire()
+            access_token = self.bot.get_access_token()
+            if not access_token:
+                raise FeishuSyncError("获取飞书访问令牌失败")
+
+            headers = {
+                'Authorization': f'Bearer {access_token}',
+                'Content-Type': 'application/json; charset=utf-8'
+            }
+            with self._count_lock:
+                self._request_count += 1
+            try:
+                response = self.session.request(method, url, headers=headers, json=payload, timeout=30)
+            except requests.exceptions.RequestException as e:
+                if attempt == max_attempts:
+                    raise FeishuSyncError(f"请求失败: {e}")
+                time.sleep(attempt)
+                continue
+
+            try:
+                result = response.json()
+            except ValueError:
+                result = {'code': response.status_code, 'msg': response.text[:200]}
+
+            code = result.get('code')
+            retryable = response.status_code == 429 or response.status_code >= 500 or code in FEISHU_RATE_LIMIT_CODES
+            if response.status_code == 200 and code == 0:
+                return result.get('data') or {}
+            if retryable and attempt < max_attempts:
+                retry_after = response.headers.get('x-ogw-ratelimit-reset') or response.headers.get('Retry-After')
+                delay = float(retry_after) if retry_after and retry_after.replace('.', '', 1).isdigit() else attempt
+                api_logger.logger.warning(f"飞书同步请求被限流或失败({response.status_code}/{code})，{delay}秒后重试")
+                time.sleep(delay)
+                continue
+            raise FeishuSyncError(f"飞书接口返回错误: {result.get('msg', '')}", code)
+
+        raise FeishuSyncError("飞书接口请求失败")
+
+    def _run_batches(self, batches: List[Tuple[Any, Callable[[], Any]]]) -> Tuple[Dict[Any, Any], List[Any]]:
+        """
+        并发执行批次
+
+        Args:
+            batches: (批次标识, 执行函数) 列表
+
+        Returns:
+            Tuple[Dict, List]: (成功批次的返回值, 失败的批次标识)
+        """
+        results, failed = {}, []
+        if not batches:
+            return results, failed
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            future_to_batch = {executor.submit(func): batch_id for batch_id, func in batches}
+            for future in as_completed(future_to_batch):
+                batch_id = future_to_batch[future]
+                try:
+                    results[batch_id] = future.result()
+                except Exception as e:
+                    api_logger.log_error(e, f"飞书同步批次失败: {self.target} {batch_id}")
+                    failed.append(batch_id)
+        return results, failed
+
+    def _load_state(self) -> Dict[str, List[Any]]:
+        """加载同步状态（行键 -> [位置, 摘要]）"""
+        self._header_pending = False
+        if not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            api_logger.log_error(e, "加载飞书同步状态失败")
+            return {}
+        if state.get('columns') != self.columns:
+            api_logger.logger.info("同步列定义已变化，将重新全量同步")
+            return {}
+        self._header_pending = bool(state.get('header_pending'))
+        return state.get('rows', {})
+
+    def _save_state(self, rows: Dict[str, List[Any]]):
+        """保存同步状态"""
+        state_dir = os.path.dirname(self.state_file)
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'columns': self.columns, 'rows': rows, 'header_pending': self._header_pending},
+                      f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_file)
+
+    @abstractmethod
+    def _apply(self, state: Dict[str, List[Any]], snapshot: Dict[str, Tuple[List[Any], str]],
+               inserted: List[str], updated: List[str], deleted: List[str],
+               result: SyncResult) -> Dict[str, List[Any]]:
+        """写入差异并返回新的同步状态（写入失败的行需保留在状态中，下次同步重试）"""
+
+    def sync(self, restock_items: List[RestockItem]) -> SyncResult:
+        """
+        同步补货快照（只写入变化的行）
+
+        Args:
+            restock_items: 补货项目列表
+
+        Returns:
+            SyncResult: 同步结果
+        """
+        start_time = time.time()
+        self._request_count = 0
+        snapshot = build_row_snapshot(restock_items, self.columns)
+        state = self._load_state()
+
+        inserted = [key for key in snapshot if key not in state]
+        deleted = [key for key in state if key not in snapshot]
+        updated = [key for key in snapshot if key in state and state[key][1] != snapshot[key][1]]
+
+        result = SyncResult(target=self.target, inserted=len(inserted), updated=len(updated),
+                            deleted=len(deleted), total_rows=len(snapshot))
+
+        if inserted or updated or deleted or self._header_pending or not os.path.exists(self.state_file):
+            new_state = self._apply(state, snapshot, inserted, updated, deleted, result)
+            self._save_state(new_state)
+
+        result.requests = self._request_count
+        result.duration = round(time.time() - start_time, 3)
+        api_logger.logger.info(
+            f"飞书{self.target}同步完成: 新增{result.inserted}、更新{result.updated}、删除{result.deleted}，"
+            f"{result.requests}次请求，失败批次{result.failed_batches}（{result.failed_rows}行），耗时{result.duration}秒"
+        )
+        return result
+
+class SpreadsheetSync(_FeishuTableSync):
+    """
+    飞书电子表格同步
+
+    行定位方式与增量Excel导出一致：变更行原地改写，新增行填补删除留下的空行，
+    多余空行用末尾行回填后清空尾部，连续的行合并为一个写入区域
+    """
+
+    target = 'sheet'
+
+    def __init__(self, bot, spreadsheet_token: str = None, sheet_id: str = None, **kwargs):
+        """
+        初始化电子表格同步
+
+        Args:
+            bot: 飞书机器人实例
+            spreadsheet_token: 电子表格token
+            sheet_id: 工作表ID
+        """
+        self.spreadsheet_token = spreadsheet_token or FeishuSyncConfig.SHEET_TOKEN
+        self.sheet_id = sheet_id or FeishuSyncConfig.SHEET_ID
+        if not self.spreadsheet_token or not self.sheet_id:
+            raise FeishuSyncError("未配置飞书电子表格 (FEISHU_SHEET_TOKEN / FEISHU_SHEET_ID)")
+
+        kwargs.setdefault('batch_size', FeishuSyncConfig.SHEET_BATCH_ROWS)
+        kwargs.setdefault('state_file', os.path.join(
+            FeishuSyncConfig.STATE_DIR, f"sheet_{self.spreadsheet_token}_{self.sheet_id}.json"))
+        super().__init__(bot, **kwargs)
+
+    @staticmethod
+    def _cell_value(value: Any) -> Any:
+        return '' if value is None else value
+
+    def _write_values(self, value_ranges: List[Dict[str, Any]]):
+        """批量写入多个区域"""
+        path = f"/open-apis/sheets/v2/spreadsheets/{self.spreadsheet_token}/values_batch_update"
+        return self._request('POST', path, {'valueRanges': value_ranges})
+
+    def _build_batches(self, writes: Dict[int, List[Any]]) -> List[Tuple[List[int], List[Dict[str, Any]]]]:
+        """把待写入的行合并为连续区域，并按单次请求行数上限分批，返回 (批次行号, 写入区域) 列表"""
+        last_column = _column_letter(len(self.columns))
+        runs, run = [], []
+        for row in sorted(writes):
+            if run and (row != run[-1] + 1 or len(run) >= self.batch_size):
+                runs.append(run)
+                run = []
+            run.append(row)
+        if run:
+            runs.append(run)
+
+        batches, batch_rows, ranges = [], [], []
+        for run in runs:
+            if ranges and len(batch_rows) + len(run) > self.batch_size:
+                batches.append((batch_rows, ranges))
+                batch_rows, ranges = [], []
+            ranges.append({
+                'range': f"{self.sheet_id}!A{run[0]}:{last_column}{run[-1]}",
+                'values': [[self._cell_value(value) for value in writes[row]] for row in run]
+            })
+            batch_rows.extend(run)
+        if ranges:
+            batches.append((batch_rows, ranges))
+        return batches
+
+    def _apply(self, state, snapshot, inserted, updated, deleted, result):
+        rows = {key: list(entry) for key, entry in state.items()}
+        row_to_key = {entry[0]: key for key, entry in rows.items()}
+        last_row = len(rows) + 1
+        writes = {}
+
+        if not state or self._header_pending:
+            writes[1] = list(self.headers)
+
+        for key in updated:
+            writes[rows[key][0]] = snapshot[key][0]
+            rows[key][1] = snapshot[key][1]
+
+        holes = []
+        for key in deleted:
+            row = rows.pop(key)[0]
+            row_to_key.pop(row, None)
+            holes.append(row)
+
+        holes.sort(reverse=True)
+        for key in inserted:
+            if holes:
+                row = holes.pop()
+            else:
+                last_row += 1
+                row = last_row
+            writes[row] = snapshot[key][0]
+            rows[key] = [row, snapshot[key][1]]
+            row_to_key[row] = key
+
+        tail_rows = last_row
+        for hole in sorted(holes, reverse=True):
+            if hole != last_row:
+                moved_key = row_to_key.pop(last_row)
+                writes[hole] = snapshot[moved_key][0]
+                rows[moved_key][0] = hole
+                row_to_key[hole] = moved_key
+            last_row -= 1
+        for row in range(last_row + 1, tail_rows + 1):
+            writes[row] = [None] * len(self.columns)
+
+        batches = self._build_batches(writes)
+        _, failed = self._run_batches([
+            (index, lambda ranges=ranges: self._write_values(ranges)) for index, (_, ranges) in enumerate(batches)
+        ])
+        result.failed_batches = len(failed)
+
+        # 写入失败的行清空摘要，下次同步时作为变更行重新写入；表头失败时记为待写入
+        failed_tail = 0
+        self._header_pending = False
+        for index in failed:
+            for row in batches[index][0]:
+                key = row_to_key.get(row)
+                if row == 1:
+                    self._header_pending = True
+                elif key in rows:
+                    rows[key][1] = ''
+                    result.failed_rows += 1
+                elif row > last_row:
+                    failed_tail = max(failed_tail, row)
+                    result.failed_rows += 1
+
+        # 尾部清空失败时保留占位行，状态中的行号保持连续，下次同步重新清空
+        for row in range(last_row + 1, failed_tail + 1):
+            rows[STALE_ROW_KEY.format(row)] = [row, '']
+        return rows
+
+class BitableSync(_FeishuTableSync):
+    """飞书多维表格同步（记录ID定位，按批量接口上限分批新增/更新/删除）"""
+
+    target = 'bitable'
+
+    def __init__(self, bot, app_token: str = None, table_id: str = None, **kwargs):
+        """
+        初始化多维表格同步
+
+        Args:
+            bot: 飞书机器人实例
+            app_token: 多维表格app_token
+            table_id: 数据表ID
+        """
+        self.app_token = app_token or FeishuSyncConfig.BITABLE_APP_TOKEN
+        self.table_id = table_id or FeishuSyncConfig.BITABLE_TABLE_ID
+        if not self.app_token or not self.table_id:
+            raise FeishuSyncError("未配置飞书多维表格 (FEISHU_BITABLE_APP_TOKEN / FEISHU_BITABLE_TABLE_ID)")
+
+        kwargs.setdefault('batch_size', FeishuSyncConfig.BITABLE_BATCH_RECORDS)
+        kwargs.setdefault('state_file', os.path.join(
+            FeishuSyncConfig.STATE_DIR, f"bitable_{self.app_token}_{self.table_id}.json"))
+        super().__init__(bot, **kwargs)
+
+    @property
+    def _records_path(self) -> str:
+        return f"/open-apis/bitable/v1/apps/{self.app_token}/tables/{self.table_id}/records"
+
+    def _fields(self, values: List[Any], clear_empty: bool = False) -> Dict[str, Any]:
+        """
+        构造记录字段
+
+        Args:
+            values: 行数据
+            clear_empty: 是否为空值字段显式传null（更新记录时使用，变为空的字段会被清空）
+        """
+        return {header: value for header, value in zip(self.headers, values)
+                if clear_empty or value is not None}
+
+    def _chunks(self, keys: List[str]) -> List[List[str]]:
+        return [keys[i:i + self.batch_size] for i in range(0, len(keys), self.batch_size)]
+
+    def _apply(self, state, snapshot, inserted, updated, deleted, result):
+        rows = {key: list(entry) for key, entry in state.items()}
+        batches = []
+
+        for chunk in self._chunks(inserted):
+            payload = {'records': [{'fields': self._fields(snapshot[key][0])} for key in chunk]}
+            batches.append((('create', tuple(chunk)),
+                            lambda payload=payload: self._request('POST', f"{self._records_path}/batch_create", payload)))
+
+        for chunk in self._chunks(updated):
+            payload = {'records': [{'record_id': rows[key][0],
+                                    'fields': self._fields(snapshot[key][0], clear_empty=True)}
+                                   for key in chunk]}
+            batches.append((('update', tuple(chunk)),
+                            lambda payload=payload: self._request('POST', f"{self._records_path}/batch_update", payload)))
+
+        for chunk in self._chunks(deleted):
+            payload = {'records': [rows[key][0] for key in chunk]}
+            batches.append((('delete', tuple(chunk)),
+                            lambda payload=payload: self._request('POST', f"{self._records_path}/batch_delete", payload)))
+
+        results, failed = self._run_batches(batches)
+        result.failed_batches = len(failed)
+        result.failed_rows = sum(len(keys) for _, keys in failed)
+
+        for (action, keys), data in results.items():
+            if action == 'create':
+                for key, record in zip(keys, data.get('records', [])):
+                    rows[key] = [record.get('record_id'), snapshot[key][1]]
+            elif action == 'update':
+                for key in keys:
+                    rows[key][1] = snapshot[key][1]
+            else:
+                for key in keys:
+                    rows.pop(key, None)
+        return rows
+
+def create_sync_target(bot, target: str = None, **kwargs) -> _FeishuTableSync:
+    """
+    按配置创建同步目标
+
+    Args:
+        bot: 飞书机器人实例
+        target: 'sheet' 或 'bitable'（默认读取 FEISHU_SYNC_TARGET）
+
+    Returns:
+        同步器实例
+    """
+    target = target or FeishuSyncConfig.TARGET
+    if target == 'bitable':
+        return BitableSync(bot, **kwargs)
+    return SpreadsheetSync(bot, **kwargs)
@@ -14,6 +14,8 @@ from datetime import datetime
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from feishu.feishu_bot import FeishuBot
+from business.restock_analyzer import RestockAnalyzer
+from feishu.event_queue import FeishuEventQueue
 from utils.logger import api_logger
 
 # 飞书机器人专用配置
@@ -27,10 +29,16 @@ app.config['JSON_AS_ASCII'] = False  # 支持中文JSON
 # 初始化飞书机器人
 try:
     feishu_bot = FeishuBot()
+    event_queue = FeishuEventQueue(feishu_bot)
     print(f"✅ 飞书机器人初始化成功")
 except Exception as e:
     print(f"❌ 飞书机器人初始化失败: {e}")
     feishu_bot = None
+    event_queue = None
+
+def enqueue_message_event(request_data):
+    """消息事件入队后立即应答，命令由工作线程执行并异步回复"""
+    return jsonify({'status': event_queue.submit(request_data)})
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -40,7 +48,13 @@ def health_check():
         'service': 'feishu-webhook',
         'timestamp': datetime.now().isoformat(),
         'server': f"{FEISHU_HOST}:{FEISHU_PORT}",
-        'feishu_bot_status': 'ready' if feishu_bot else 'error'
+        'feishu_bot_status': 'ready' if feishu_bot else 'error',
+        'event_queue': event_queue.get_stats() if event_queue else None,
+        'event_dedup': feishu_bot.event_dedup.get_stats() if feishu_bot else None,
+        'snapshot': feishu_bot.snapshot_store.get_stats() if feishu_bot else None,
+        'admission': feishu_bot.admission.get_stats() if feishu_bot else None,
+        'restock_fetch': RestockAnalyzer.get_fetch_stats(),
+        'msku_detail_cache': RestockAnalyzer.get_msku_detail_cache_stats()
     })
 
 @app.route('/feishu/webhook', methods=['POST'])
@@ -71,8 +85,10 @@ def feishu_webhook():
             
             if event_type == 'im.message.receive_v1':
                 # 处理接收消息事件
-                result = feishu_bot.process_message(request_data)
-                return jsonify(result)
+                return enqueue_message_event(request_data)
+            elif event_type == 'card.action.trigger':
+                # 卡片按钮回调：从查询结果缓存渲染新卡片
+                return jsonify(feishu_bot.handle_card_action(request_data))
             else:
                 api_logger.log_info(f"收到未处理的2.0事件类型: {event_type}")
                 return jsonify({'status': 'ignored', 'event_type': event_type})
@@ -93,8 +109,7 @@ def feishu_webhook():
                 
                 if event_type == 'message':
                     # 处理消息
-                    result = feishu_bot.process_message(request_data)
-                    return jsonify(result)
+                    return enqueue_message_event(request_data)
                 else:
                     api_logger.log_info(f"收到未处理的事件类型: {event_type}")
                     return jsonify({'status': 'ignored', 'event_type': event_type})
@@ -106,6 +121,28 @@ def feishu_webhook():
         api_logger.log_error(e, "处理飞书webhook请求异常")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/feishu/card', methods=['POST'])
+def feishu_card_action():
+    """飞书消息卡片回调接口（翻页/排序按钮），直接返回新卡片替换原卡片"""
+    if not feishu_bot:
+        return jsonify({'error': 'Feishu bot not initialized'}), 500
+        
+    try:
+        request_data = request.get_json()
+        
+        if not request_data:
+            return jsonify({'error': 'Empty request'}), 400
+        
+        # 卡片请求网址验证
+        if request_data.get('type') == 'url_verification':
+            return jsonify({'challenge': request_data.get('challenge', '')})
+        
+        return jsonify(feishu_bot.handle_card_action(request_data))
+        
+    except Exception as e:
+        api_logger.log_error(e, "处理飞书卡片回调异常")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/status', methods=['GET'])
 def api_status():
     """API状态接口"""
@@ -118,9 +155,16 @@ def api_status():
             'feishu_bot': {
                 'app_id': feishu_bot.app_id[:8] + '***' if feishu_bot and feishu_bot.app_id else 'Not configured',
                 'has_token': bool(feishu_bot.access_token) if feishu_bot else False,
-                'status': 'ready' if feishu_bot else 'error'
+                'status': 'ready' if feishu_bot else 'error',
+                'client': feishu_bot.client.get_stats() if feishu_bot else None
             },
             'api_connection': result,
+            'event_queue': event_queue.get_stats() if event_queue else None,
+            'event_dedup': feishu_bot.event_dedup.get_stats() if feishu_bot else None,
+            'snapshot': feishu_bot.snapshot_store.get_stats() if feishu_bot else None,
+            'admission': feishu_bot.admission.get_stats() if feishu_bot else None,
+            'restock_fetch': RestockAnalyzer.get_fetch_stats(),
+            'msku_detail_cache': RestockAnalyzer.get_msku_detail_cache_stats(),
             'server': {
                 'host': FEISHU_HOST,
                 'port': FEISHU_PORT,
@@ -176,6 +220,7 @@ def main():
     print(f"🚀 启动飞书Webhook服务器...")
     print(f"📍 服务地址: http://{FEISHU_HOST}:{FEISHU_PORT}")
     print(f"🔗 Webhook地址: http://{FEISHU_HOST}:{FEISHU_PORT}/feishu/webhook")
+    print(f"🃏 卡片回调地址: http://{FEISHU_HOST}:{FEISHU_PORT}/feishu/card")
     print(f"💊 健康检查: http://{FEISHU_HOST}:{FEISHU_PORT}/health")
     print(f"📊 状态接口: http://{FEISHU_HOST}:{FEISHU_PORT}/api/status")
     print()
@@ -193,6 +238,10 @@ def main():
     print(f"   http://你的公网IP:{FEISHU_PORT}/feishu/webhook")
     print()
     
+    if event_queue:
+        event_queue.start()
+        feishu_bot.snapshot_store.start()
+    
     try:
         # 运行服务器
         app.run(
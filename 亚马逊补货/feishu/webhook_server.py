@@ -14,6 +14,8 @@ from datetime import datetime
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from feishu.feishu_bot import FeishuBot
+from business.restock_analyzer import RestockAnalyzer
+from feishu.event_queue import FeishuEventQueue
 from utils.logger import api_logger
 from config.config import ServerConfig
 
@@ -23,6 +25,9 @@ app = Flask(__name__)
 # 初始化飞书机器人
 feishu_bot = FeishuBot()
 
+# 消息事件工作队列（Webhook先应答，命令在工作线程中执行）
+event_queue = FeishuEventQueue(feishu_bot)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """
@@ -31,7 +36,13 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'server': f"{ServerConfig.HOST}:{ServerConfig.PORT}"
+        'server': f"{ServerConfig.HOST}:{ServerConfig.PORT}",
+        'event_queue': event_queue.get_stats(),
+        'event_dedup': feishu_bot.event_dedup.get_stats(),
+        'snapshot': feishu_bot.snapshot_store.get_stats(),
+        'admission': feishu_bot.admission.get_stats(),
+        'restock_fetch': RestockAnalyzer.get_fetch_stats(),
+        'msku_detail_cache': RestockAnalyzer.get_msku_detail_cache_stats()
     })
 
 @app.route('/feishu/webhook', methods=['POST'])
@@ -79,9 +90,8 @@ def feishu_webhook():
             inner_event_type = event.get('type')
             
             if inner_event_type == 'message':
-                # 处理消息
-                result = feishu_bot.process_message(event_data)
-                return jsonify(result)
+                # 入队后立即应答，避免飞书因超时重推
+                return jsonify({'status': event_queue.submit(event_data)})
             else:
                 api_logger.log_info(f"收到未处理的事件类型: {inner_event_type}")
                 return jsonify({'status': 'ignored', 'event_type': inner_event_type})
@@ -93,6 +103,27 @@ def feishu_webhook():
         api_logger.log_error(e, "处理飞书webhook请求异常")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/feishu/card', methods=['POST'])
+def feishu_card_action():
+    """
+    飞书消息卡片回调接口（翻页/排序按钮），直接返回新卡片替换原卡片
+    """
+    try:
+        request_data = request.get_json()
+        
+        if not request_data:
+            return jsonify({'error': 'Empty request'}), 400
+        
+        # 卡片请求网址验证
+        if request_data.get('type') == 'url_verification':
+            return jsonify({'challenge': request_data.get('challenge', '')})
+        
+        return jsonify(feishu_bot.handle_card_action(request_data))
+        
+    except Exception as e:
+        api_logger.log_error(e, "处理飞书卡片回调异常")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/feishu/test', methods=['POST'])
 def test_feishu_message():
     """
@@ -136,7 +167,7 @@ def execute_command():
         
         # 如果提供了chat_id，发送消息
         if chat_id and response:
-            feishu_bot.send_text_message(chat_id, response)
+            feishu_bot.send_reply(chat_id, response)
         
         return jsonify({
             'status': 'success',
@@ -162,9 +193,16 @@ def api_status():
             'feishu_bot': {
                 'app_id': feishu_bot.app_id[:8] + '***' if feishu_bot.app_id else 'Not configured',
                 'has_token': bool(feishu_bot.access_token),
-                'token_expire': datetime.fromtimestamp(feishu_bot.token_expire_time).isoformat() if feishu_bot.token_expire_time else None
+                'token_expire': datetime.fromtimestamp(feishu_bot.token_expire_time).isoformat() if feishu_bot.token_expire_time else None,
+                'client': feishu_bot.client.get_stats()
             },
             'api_connection': result,
+            'event_queue': event_queue.get_stats(),
+            'event_dedup': feishu_bot.event_dedup.get_stats(),
+            'snapshot': feishu_bot.snapshot_store.get_stats(),
+            'admission': feishu_bot.admission.get_stats(),
+            'restock_fetch': RestockAnalyzer.get_fetch_stats(),
+            'msku_detail_cache': RestockAnalyzer.get_msku_detail_cache_stats(),
             'server': {
                 'host': ServerConfig.HOST,
                 'port': ServerConfig.PORT,
@@ -209,6 +247,7 @@ def run_server():
         print(f"🚀 启动飞书Webhook服务器...")
         print(f"📍 服务地址: http://{ServerConfig.HOST}:{ServerConfig.PORT}")
         print(f"🔗 Webhook地址: http://{ServerConfig.HOST}:{ServerConfig.PORT}/feishu/webhook")
+        print(f"🃏 卡片回调地址: http://{ServerConfig.HOST}:{ServerConfig.PORT}/feishu/card")
         print(f"💊 健康检查: http://{ServerConfig.HOST}:{ServerConfig.PORT}/health")
         print(f"📊 状态接口: http://{ServerConfig.HOST}:{ServerConfig.PORT}/api/status")
         print()
@@ -222,6 +261,10 @@ def run_server():
             print("  - FEISHU_ENCRYPT_KEY (可选)")
             print()
         
+        # 启动事件工作线程和补货数据快照刷新
+        event_queue.start()
+        feishu_bot.snapshot_store.start()
+        
         # 运行服务器
         app.run(
             host=ServerConfig.HOST,
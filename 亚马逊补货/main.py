@@ -185,7 +185,9 @@ def get_restock_data(seller_ids: List[str] = None,
                   export_excel: bool = True,
                   export_json: bool = False,
                   export_format: str = 'both',
-                  enhance_with_msku_details: bool = False):
+                  enhance_with_msku_details: bool = False,
+                  background_export: bool = False,
+                  sync_feishu: bool = False):
     """
     获取补货数据
     
@@ -199,8 +201,10 @@ def get_restock_data(seller_ids: List[str] = None,
         max_workers: 并发线程数
         export_excel: 是否导出Excel
         export_json: 是否导出JSON
-        export_format: 导出格式（'both': 两种格式都有, 'standard': 标准格式, 'detail': 明细格式）
+        export_format: 导出格式（'both': 两种格式都有, 'standard': 标准格式, 'detail': 明细格式, 'incremental': 增量更新当前工作簿）
         enhance_with_msku_details: 是否使用MSKU详细信息接口增强数据
+        background_export: 是否提交后台导出任务（不等待文件生成）
+        sync_feishu: 是否将补货数据差异同步到飞书电子表格/多维表格
     """
     print("正在获取补货数据...")
     
@@ -281,6 +285,16 @@ def get_restock_data(seller_ids: List[str] = None,
                 
                 print(f"{asin:<12} {sid:<10} {sales:<8} {fba:<8} {purchase:<8} {str(days):<8}")
         
+        if sync_feishu:
+            sync_restock_to_feishu(restock_items)
+        
+        # 后台导出：提交任务后立即返回，文件由导出进程生成
+        if background_export:
+            submit_background_exports(restock_items,
+                                      export_format if export_excel else None,
+                                      export_json)
+            return restock_items
+        
         # 导出数据
         exported_files = []
         
@@ -292,6 +306,13 @@ def get_restock_data(seller_ids: List[str] = None,
                 elif export_format == 'detail':
                     excel_file = analyzer.export_to_excel_detail(restock_items)
                     print(f"\n✓ Excel文件已导出（明细拆分格式）: {excel_file}")
+                elif export_format == 'incremental':
+                    from business.incremental_export import IncrementalExcelExporter
+                    result = IncrementalExcelExporter().export(restock_items)
+                    excel_file = result.filepath
+                    print(f"\n✓ 当前工作簿已更新（{result.mode}）: {excel_file}")
+                    print(f"  新增 {result.inserted} / 更新 {result.updated} / 删除 {result.deleted} 行，"
+                          f"变更占比 {result.change_ratio:.1%}")
                 else:  # 'standard'
                     excel_file = analyzer.export_to_excel(restock_items)
                     print(f"\n✓ Excel文件已导出（标准格式）: {excel_file}")
@@ -319,6 +340,90 @@ def get_restock_data(seller_ids: List[str] = None,
         api_logger.log_error(e, "获取补货数据失败")
         return None
 
+def submit_background_exports(restock_items, export_format: Optional[str], export_json: bool = False) -> List[str]:
+    """
+    提交后台导出任务
+    
+    Args:
+        restock_items: 补货项目列表
+        export_format: Excel导出格式，None表示不导出Excel
+        export_json: 是否导出JSON
+        
+    Returns:
+        List[str]: 已提交的任务ID列表
+    """
+    from business.export_jobs import get_export_job_manager, ExportJobError
+    
+    manager = get_export_job_manager()
+    formats = ([export_format] if export_format else []) + (['json'] if export_json else [])
+    job_ids = []
+    
+    for fmt in formats:
+        try:
+            job_id = manager.submit(restock_items, export_format=fmt)
+            job_ids.append(job_id)
+            print(f"\n✓ 导出任务已提交（{fmt}）: {job_id}")
+        except ExportJobError as e:
+            print(f"✗ 导出任务提交失败: {e}")
+    
+    if job_ids:
+        print(f"💡 查看进度: python main.py --export-status <任务ID>")
+    
+    return job_ids
+
+def sync_restock_to_feishu(restock_items):
+    """
+    将补货数据差异同步到飞书（目标由FeishuSyncConfig配置）
+    
+    Args:
+        restock_items: 补货项目列表
+    """
+    from feishu.feishu_bot import FeishuBot
+    from feishu.sheet_sync import create_sync_target, FeishuSyncError
+    
+    try:
+        result = create_sync_target(FeishuBot()).sync(restock_items)
+    except FeishuSyncError as e:
+        print(f"✗ 飞书同步失败: {e}")
+        return None
+    
+    print(f"\n✓ 飞书{result.target}同步完成: 新增 {result.inserted} / 更新 {result.updated} / 删除 {result.deleted} 行，"
+          f"{result.requests} 次请求，耗时 {result.duration} 秒")
+    if result.failed_batches:
+        print(f"⚠ {result.failed_batches} 个批次写入失败，下次同步时重试")
+    return result
+
+def show_export_status(job_id: str = None):
+    """
+    显示导出任务状态
+    
+    Args:
+        job_id: 任务ID，为空时列出最近的任务
+    """
+    from business.export_jobs import ExportJobStore, JOB_STATUS_DISPLAY
+    
+    store = ExportJobStore()
+    
+    if job_id:
+        job = store.load(job_id)
+        if not job:
+            print(f"✗ 未找到导出任务: {job_id}")
+            return
+        print(job.format_status())
+        return
+    
+    jobs = store.list_jobs(limit=10)
+    if not jobs:
+        print("暂无导出任务")
+        return
+    
+    print(f"{'任务ID':<16} {'状态':<8} {'进度':<6} {'耗时(秒)':<10} {'文件'}")
+    print("-" * 100)
+    for job in jobs:
+        status = JOB_STATUS_DISPLAY.get(job.status, job.status)
+        duration = job.duration if job.duration is not None else '-'
+        print(f"{job.job_id:<16} {status:<8} {str(job.progress) + '%':<6} {str(duration):<10} {job.output_path or '-'}")
+
 def interactive_mode():
     """
     交互式模式
@@ -544,9 +649,13 @@ def main():
     parser.add_argument('--max-workers', type=int, default=3, help='并发线程数（默认3，范围1-5）')
     parser.add_argument('--no-excel', action='store_true', help='不导出Excel文件')
     parser.add_argument('--json', action='store_true', help='导出JSON文件')
-    parser.add_argument('--export-format', type=str, choices=['standard', 'detail', 'both'], default='both',
-                       help='导出格式（standard: 标准格式, detail: 明细拆分格式, both: 两种格式都有）')
+    parser.add_argument('--export-format', type=str, choices=['standard', 'detail', 'both', 'incremental'], default='both',
+                       help='导出格式（standard: 标准格式, detail: 明细拆分格式, both: 两种格式都有, incremental: 增量更新当前工作簿）')
     parser.add_argument('--enhance-msku-details', action='store_true', help='使用MSKU详细信息接口增强数据（会增加API调用次数）')
+    parser.add_argument('--background-export', action='store_true', help='提交后台导出任务，不等待文件生成')
+    parser.add_argument('--sync-feishu', action='store_true', help='将补货数据差异同步到飞书电子表格/多维表格')
+    parser.add_argument('--export-status', type=str, nargs='?', const='', default=None,
+                       help='查看导出任务状态（不指定任务ID时列出最近任务）')
     parser.add_argument('--interactive', action='store_true', help='交互式模式')
     parser.add_argument('--server', action='store_true', help='以服务模式运行')
     parser.add_argument('--feishu', action='store_true', help='启动飞书Webhook服务器')
@@ -575,6 +684,8 @@ def main():
         elif args.server:
             check_server_environment()
             run_as_service()
+        elif args.export_status is not None:
+            show_export_status(args.export_status or None)
         elif args.interactive:
             interactive_mode()
         elif args.test:
@@ -607,7 +718,9 @@ def main():
                 export_excel=not args.no_excel,
                 export_json=args.json,
                 export_format=args.export_format,
-                enhance_with_msku_details=args.enhance_msku_details
+                enhance_with_msku_details=args.enhance_msku_details,
+                background_export=args.background_export,
+                sync_feishu=args.sync_feishu
             )
         else:
             # 默认进入交互式模式
@@ -27,12 +27,13 @@ load_env_file()
 from business.restock_analyzer import RestockAnalyzer
 from utils.logger import api_logger
 
-def quick_export_restock_data(seller_id: str = None):
+def quick_export_restock_data(seller_id: str = None, background_export: bool = False):
     """
     快速导出指定店铺的补货数据
     
     Args:
         seller_id: 店铺ID，如果不指定则获取所有店铺
+        background_export: 是否提交后台导出任务（不等待文件生成）
     """
     print("🚀 快速导出补货数据（不含MSKU详细信息增强）")
     print("=" * 60)
@@ -77,9 +78,15 @@ def quick_export_restock_data(seller_id: str = None):
         print(f"   - 平均可售天数: {summary['avg_available_days']}")
         
         # 导出Excel（标准格式和明细拆分格式）
-        print("\n📄 导出Excel文件...")
-        excel_file = analyzer.export_to_excel_both(restock_items)
-        print(f"✅ Excel文件已导出: {excel_file}")
+        if background_export:
+            from business.export_jobs import get_export_job_manager
+            job_id = get_export_job_manager().submit(restock_items, export_format='both')
+            print(f"\n📄 导出任务已提交: {job_id}")
+            print(f"💡 查看进度: python main.py --export-status {job_id}")
+        else:
+            print("\n📄 导出Excel文件...")
+            excel_file = analyzer.export_to_excel_both(restock_items)
+            print(f"✅ Excel文件已导出: {excel_file}")
         
         # 显示紧急补货商品
         urgent_items = analyzer.analyze_urgent_restock(restock_items)
@@ -0,0 +1,734 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步云代理测试脚本 🧪
+启动本地领星替身服务和隧道客户端替身，验证异步代理的流式转发、隧道并发和断线改派，
+以及二进制帧隧道协议（编解码、流量控制、与 websocket_reverse_client.py 的端到端转发）
+和反向客户端的并发本地转发、边缘缓存、全局配额调度和延迟指标，
+并与 Flask线程版（cloud_proxy_server_ws.py）对比并发连接承载能力和p99延迟
+"""
+
+import os
+import sys
+import json
+import gzip
+import time
+import zlib
+import socket
+import asyncio
+import tempfile
+import threading
+import subprocess
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web
+
+# 添加deploy目录到Python路径
+DEPLOY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'deploy')
+sys.path.append(DEPLOY_DIR)
+
+from cloud_proxy_server_async import (
+    AsyncCloudProxy, EdgeCache, CachedResponse, QuotaGovernor, Metrics, FrameChannel, pack_fields, unpack_fields,
+    FRAME_REQUEST, FRAME_DATA, FRAME_WINDOW, FRAME_MAX_BODY, INITIAL_WINDOW
+)
+from websocket_reverse_client import WebSocketReverseClient
+
+class UpstreamStandIn:
+    """本地领星API替身：延迟后返回gzip压缩的补货数据页"""
+
+    def __init__(self, latency: float = 0.0, rows: int = 2000):
+        self.latency = latency
+        self.requests = 0
+        self.arrivals = []  # [(到达时间, client查询参数, 是否带X-Proxy-Client头)]
+        self.body = gzip.compress(json.dumps({
+            'code': 0,
+            'data': [{'asin': f'B{i:09d}', 'suggested_purchase': i % 50} for i in range(rows)]
+        }).encode())
+        self.runner = None
+        self.base_url = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        self.arrivals.append((time.monotonic(), request.query.get('client'), 'X-Proxy-Client' in request.headers))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.Response(body=self.body, headers={
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'gzip'
+        })
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route('*', '/{path:.*}', self._handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, '127.0.0.1', 0).start()
+        self.base_url = f"http://127.0.0.1:{self.runner.addresses[0][1]}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+class TunnelStandIn:
+    """隧道客户端替身：注册后按 websocket_reverse_client.py 的格式回复飞书请求"""
+
+    def __init__(self, ws_url: str, name: str, delay: float = 0.0, drop: bool = False):
+        self.ws_url = ws_url
+        self.name = name
+        self.delay = delay
+        self.drop = drop  # 收到请求后直接断开
+        self.handled = 0
+        self._session = None
+        self._task = None
+
+    async def start(self):
+        self._session = aiohttp.ClientSession()
+        ws = await self._session.ws_connect(self.ws_url)
+        await ws.send_str(json.dumps({'type': 'register', 'client_id': self.name, 'local_url': 'stand-in'}))
+        ack = json.loads((await ws.receive()).data)
+        assert ack['type'] == 'registration_ack'
+        self._task = asyncio.create_task(self._serve(ws))
+
+    async def _serve(self, ws):
+        async for message in ws:
+            data = json.loads(message.data)
+            if data.get('type') != 'feishu_request':
+                continue
+            if self.drop:
+                await ws.close()
+                return
+            asyncio.create_task(self._reply(ws, data))
+
+    async def _reply(self, ws, data):
+        await asyncio.sleep(self.delay)
+        self.handled += 1
+        await ws.send_str(json.dumps({
+            'type': 'feishu_response',
+            'request_id': data['request_id'],
+            'response': {'status_code': 200, 'data': {'client': self.name, 'echo': data['data']}}
+        }))
+
+    async def stop(self):
+        self._task.cancel()
+        await self._session.close()
+
+async def _start_proxy(upstream_url: str = 'http://127.0.0.1:9', edge_cache: EdgeCache = None,
+                       quota: QuotaGovernor = None) -> tuple:
+    proxy = AsyncCloudProxy(host='127.0.0.1', port=0, upstream_base_url=upstream_url,
+                            edge_cache=edge_cache or EdgeCache({}), quota=quota or QuotaGovernor({}))
+    runner = await proxy.start()
+    return proxy, runner, f"http://127.0.0.1:{proxy.port}"
+
+def test_async_proxy_streams_upstream():
+    """领星响应原样（保持gzip）流式转发"""
+    async def scenario():
+        upstream = UpstreamStandIn()
+        await upstream.start()
+        proxy, runner, url = await _start_proxy(upstream.base_url)
+        try:
+            async with aiohttp.ClientSession(auto_decompress=False) as session:
+                async with session.get(f"{url}/api/proxy/erp/sc/routing/restock?page=1",
+                                       headers={'Accept-Encoding': 'gzip'}) as response:
+                    body = await response.read()
+                    assert response.status == 200
+                    assert response.headers['Content-Encoding'] == 'gzip'
+                    assert body == upstream.body
+            assert proxy.stats['success_requests'] == 1
+        finally:
+            await runner.cleanup()
+            await upstream.stop()
+
+    print("🔄 测试流式转发...")
+    asyncio.run(scenario())
+    print("✅ 流式转发正常")
+
+def test_async_proxy_edge_cache():
+    """开启缓存的端点：签名参数不同的相同查询合并为一次上游调用，TTL内命中缓存，其他端点不受影响"""
+    async def scenario():
+        upstream = UpstreamStandIn(latency=0.1)
+        await upstream.start()
+        cache = EdgeCache({'/erp/sc/data/seller/lists': 60})
+        proxy, runner, url = await _start_proxy(upstream.base_url, cache)
+        try:
+            async with aiohttp.ClientSession(auto_decompress=False) as session:
+                async def call(endpoint: str, index: int, body: dict):
+                    params = {'access_token': 'token', 'app_key': 'app', 'timestamp': str(1760000000 + index),
+                              'sign': f'sign{index}'}
+                    async with session.post(f"{url}/api/proxy/{endpoint}", params=params, json=body,
+                                            headers={'Accept-Encoding': 'gzip'}) as response:
+                        assert response.status == 200
+                        assert await response.read() == upstream.body
+                        return response.headers.get('X-Proxy-Cache')
+
+                sources = await asyncio.gather(*(
+                    call('erp/sc/data/seller/lists', i, {'offset': 0, 'length': 200}) for i in range(10)
+                ))
+                assert sorted(sources) == ['COALESCED'] * 9 + ['MISS']
+                assert upstream.requests == 1
+
+                # 键顺序不同的相同业务参数命中缓存
+                assert await call('erp/sc/data/seller/lists', 10, {'length': 200, 'offset': 0}) == 'HIT'
+                assert await call('erp/sc/data/seller/lists', 11, {'offset': 200, 'length': 200}) == 'MISS'
+                assert await call('erp/sc/routing/restock', 12, {'offset': 0}) is None
+                assert upstream.requests == 3
+
+                async with session.get(f"{url}/stats") as response:
+                    stats = (await response.json())['edge_cache']
+            assert (stats['hits'], stats['coalesced'], stats['misses'], stats['entries']) == (1, 9, 2, 2)
+        finally:
+            await runner.cleanup()
+            await upstream.stop()
+
+    print("🗄️ 测试边缘缓存和请求合并...")
+    asyncio.run(scenario())
+    print("✅ 相同查询合并为一次上游调用，缓存命中正常")
+
+def test_edge_cache_shares_leader_failure():
+    """首个请求失败时等待者收到同一异常；首个请求被取消时由等待者重新请求一次"""
+    async def scenario():
+        cache = EdgeCache({'/erp/*': 60})
+        calls = []
+
+        async def failing_loader():
+            calls.append('fail')
+            await asyncio.sleep(0.05)
+            raise ConnectionError('upstream down')
+
+        results = await asyncio.gather(*(cache.fetch('key', 60, failing_loader) for _ in range(8)),
+                                       return_exceptions=True)
+        assert all(isinstance(result, ConnectionError) for result in results)
+        assert calls == ['fail'] and not cache.get_stats()['inflight']
+
+        async def slow_loader():
+            calls.append('load')
+            await asyncio.sleep(0.05)
+            return CachedResponse(200, [], b'{"code": 0}')
+
+        leader = asyncio.ensure_future(cache.fetch('key', 60, slow_loader))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(cache.fetch('key', 60, slow_loader)) for _ in range(4)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        sources = [source for _, source in await asyncio.gather(*followers)]
+        assert calls.count('load') == 2
+        assert sorted(sources) == ['COALESCED'] * 3 + ['MISS']
+
+    print("🗄️ 测试边缘缓存失败传递...")
+    asyncio.run(scenario())
+    print("✅ 上游失败只请求一次，取消后重新选出一个请求")
+
+def test_async_proxy_quota_governor():
+    """全局配额：按端点限速，各客户端轮流放行，排队超限返回429和Retry-After，领星仍限流时暂停放行"""
+    async def scenario():
+        upstream = UpstreamStandIn(rows=10)
+        await upstream.start()
+        quota = QuotaGovernor({'/erp/sc/routing/*': (10, 1)}, max_wait=1.0, penalty=1.0)
+        proxy, runner, url = await _start_proxy(upstream.base_url, quota=quota)
+        try:
+            async with aiohttp.ClientSession() as session:
+                async def call(client: str, n: int) -> tuple:
+                    async with session.get(f"{url}/api/proxy/erp/sc/routing/restock?client={client}&n={n}",
+                                           headers={'X-Proxy-Client': client}) as response:
+                        await response.read()
+                        return response.status, response.headers.get('Retry-After')
+
+                # 导出任务一次发出6个请求，稍后机器人发出2个：机器人不用排在导出任务的全部请求之后
+                export = [asyncio.create_task(call('export', n)) for n in range(6)]
+                await asyncio.sleep(0.05)
+                bot = [asyncio.create_task(call('bot', n)) for n in range(2)]
+                assert all(status == 200 for status, _ in await asyncio.gather(*export, *bot))
+
+                order = [client for _, client, _ in upstream.arrivals]
+                assert order.index('bot') < 3 and order[:5].count('bot') == 2
+                gaps = [b[0] - a[0] for a, b in zip(upstream.arrivals, upstream.arrivals[1:])]
+                assert min(gaps) >= 0.08
+                assert not any(forwarded for _, _, forwarded in upstream.arrivals)
+
+                # 预计排队超过上限的请求直接返回429，不转发到上游
+                burst = await asyncio.gather(*(call('export', n) for n in range(20)))
+                rejected = [retry_after for status, retry_after in burst if status == 429]
+                assert rejected and all(int(retry_after) >= 1 for retry_after in rejected)
+                assert upstream.requests == 8 + len(burst) - len(rejected)
+
+                # 领星仍返回限流：带上Retry-After，该端点暂停放行
+                upstream.body = gzip.compress(json.dumps({'code': 3001008, 'message': '请求太频繁'}).encode())
+                await asyncio.sleep(0.2)
+                status, retry_after = await call('bot', 99)
+                assert status == 200 and retry_after == '1'
+                requests_before = upstream.requests
+                status, retry_after = await call('bot', 100)
+                assert status == 429 and int(retry_after) >= 1
+                assert upstream.requests == requests_before
+
+                async with session.get(f"{url}/stats") as response:
+                    stats = (await response.json())['quota']
+            lane = stats['endpoints']['/erp/sc/routing/*']
+            assert lane['throttled'] == 1 and lane['rejected'] == len(rejected) + 1
+            assert lane['avg_wait_ms'] > 0 and stats['clients']['bot']['granted'] == 3
+            assert proxy.stats['quota_rejected'] == len(rejected) + 1
+            return lane
+        finally:
+            await runner.cleanup()
+            await upstream.stop()
+
+    print("🚦 测试全局配额调度...")
+    lane = asyncio.run(scenario())
+    print(f"✅ 配额调度正常：放行 {lane['granted']}，拒绝 {lane['rejected']}，"
+          f"平均排队 {lane['avg_wait_ms']}ms，最长 {lane['max_wait_ms']}ms")
+
+def test_metrics_sharded_counters_and_quantiles():
+    """多线程并发计数不丢失，分位数按分桶插值，Prometheus文本包含直方图各桶"""
+    metrics = Metrics()
+
+    def work():
+        for i in range(10000):
+            metrics.inc('total_requests')
+            metrics.observe('route_latency', (i % 100) / 1000, route='/feishu/webhook')
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert metrics.counter_values() == {'total_requests': 80000}
+    summary = metrics.latency_summary('route_latency')['/feishu/webhook']
+    assert summary['count'] == 80000
+    assert 45 <= summary['p50_ms'] <= 55 and 90 <= summary['p99_ms'] <= 100
+
+    text = metrics.prometheus('lingxing_proxy')
+    assert 'lingxing_proxy_total_requests_total 80000' in text
+    assert 'lingxing_proxy_route_latency_seconds_bucket{route="/feishu/webhook",le="+Inf"} 80000' in text
+    print(f"✅ 分片计数器和延迟直方图正常：p50 {summary['p50_ms']}ms，p99 {summary['p99_ms']}ms")
+
+def test_async_proxy_latency_metrics():
+    """/stats 按路由、领星端点和隧道客户端给出延迟分位数，/metrics 输出Prometheus文本"""
+    async def scenario():
+        upstream = UpstreamStandIn(latency=0.05, rows=10)
+        await upstream.start()
+        proxy, runner, url = await _start_proxy(upstream.base_url)
+        client = TunnelStandIn(f"{url.replace('http', 'ws')}/ws", 'A', delay=0.02)
+        await client.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                for n in range(5):
+                    async with session.get(f"{url}/api/proxy/erp/sc/routing/restock?n={n}") as response:
+                        assert response.status == 200
+                    async with session.post(f"{url}/feishu/webhook", json={'n': n}) as response:
+                        assert response.status == 200
+                async with session.get(f"{url}/stats") as response:
+                    latency = (await response.json())['latency']
+                async with session.get(f"{url}/metrics") as response:
+                    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+                    text = await response.text()
+        finally:
+            await client.stop()
+            await runner.cleanup()
+            await upstream.stop()
+
+        assert latency['routes']['/api/proxy/{endpoint}']['count'] == 5
+        assert latency['routes']['/feishu/webhook']['count'] == 5
+        assert latency['upstream']['/erp/sc/routing/restock']['p50_ms'] >= 50
+        assert 10 <= latency['tunnel']['A']['p50_ms'] <= 25  # 20ms的本地处理落在10-25ms桶内
+        assert 'lingxing_proxy_total_requests_total 5' in text
+        assert 'lingxing_proxy_feishu_requests_total 5' in text
+        assert 'lingxing_proxy_tunnel_latency_seconds_count{client="A"} 5' in text
+        assert 'lingxing_proxy_tunnel_inflight{client="A"} 0' in text
+        return latency
+
+    print("📈 测试延迟指标...")
+    latency = asyncio.run(scenario())
+    print(f"✅ 延迟指标正常：领星p50 {latency['upstream']['/erp/sc/routing/restock']['p50_ms']}ms，"
+          f"隧道p50 {latency['tunnel']['A']['p50_ms']}ms")
+
+def test_async_proxy_tunnels_concurrently():
+    """多个飞书请求在隧道中并发处理，响应与请求正确对应，并分摊到多个客户端"""
+    async def scenario():
+        proxy, runner, url = await _start_proxy()
+        clients = [TunnelStandIn(f"{url.replace('http', 'ws')}/ws", name, delay=0.2) for name in ('A', 'B')]
+        for client in clients:
+            await client.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async def call(index: int):
+                    async with session.post(f"{url}/feishu/webhook", json={'n': index}) as response:
+                        assert response.status == 200
+                        return await response.json()
+
+                started = time.perf_counter()
+                results = await asyncio.gather(*(call(i) for i in range(20)))
+                elapsed = time.perf_counter() - started
+
+            assert [result['echo']['n'] for result in results] == list(range(20))
+            assert elapsed < 1.0, elapsed  # 串行需要4秒
+            assert all(client.handled > 0 for client in clients)
+            assert not proxy.pending
+        finally:
+            for client in clients:
+                await client.stop()
+            await runner.cleanup()
+
+    print("🤖 测试隧道并发...")
+    asyncio.run(scenario())
+    print("✅ 隧道请求并发处理，响应对应正确")
+
+def test_async_proxy_retries_on_disconnect():
+    """隧道连接在处理中断开时，请求改派给其他连接"""
+    async def scenario():
+        proxy, runner, url = await _start_proxy()
+        ws_url = f"{url.replace('http', 'ws')}/ws"
+        dropping = TunnelStandIn(ws_url, 'drop', drop=True)
+        healthy = TunnelStandIn(ws_url, 'ok', delay=0.05)
+        await dropping.start()
+        await healthy.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                results = []
+                for index in range(3):
+                    async with session.post(f"{url}/feishu/command", json={'n': index}) as response:
+                        assert response.status == 200
+                        results.append(await response.json())
+            assert all(result['client'] == 'ok' for result in results)
+            assert proxy.stats['tunnel_retries'] >= 1
+        finally:
+            await dropping.stop()
+            await healthy.stop()
+            await runner.cleanup()
+
+    print("🔁 测试断线改派...")
+    asyncio.run(scenario())
+    print("✅ 断线请求已改派")
+
+def _feishu_event(index: int) -> dict:
+    """一条典型的飞书消息事件"""
+    return {
+        'schema': '2.0',
+        'header': {'event_id': f'ev_{index:08d}', 'event_type': 'im.message.receive_v1',
+                   'create_time': '1760000000000', 'token': 'v_token', 'app_id': 'cli_a000000000000000'},
+        'event': {'message': {'message_id': f'om_{index:032d}', 'chat_type': 'group', 'message_type': 'text',
+                              'content': json.dumps({'text': f'@补货助手 查询 B{index:09d} 补货建议'},
+                                                    ensure_ascii=False)}}
+    }
+
+def test_frame_channel_roundtrip_and_window():
+    """帧编解码、压缩，以及超过窗口的body在归还额度前暂停发送"""
+    async def scenario():
+        sent = []
+
+        async def send(data):
+            sent.append(data)
+
+        channel = FrameChannel(send)
+        meta = pack_fields(['POST', '/feishu/webhook', 'a=1', 'Content-Type', 'application/json'])
+        assert unpack_fields(meta) == ['POST', '/feishu/webhook', 'a=1', 'Content-Type', 'application/json']
+
+        body = json.dumps([_feishu_event(i) for i in range(2000)]).encode()
+        assert len(body) > INITIAL_WINDOW
+        sender = asyncio.create_task(channel.send_stream(FRAME_REQUEST, 7, meta, body))
+        await asyncio.sleep(0.05)
+        assert not sender.done()  # 窗口用完，等待对端归还
+        assert len(sent) == INITIAL_WINDOW // FRAME_MAX_BODY
+
+        peer = FrameChannel(send)
+        await channel.receive(peer.encode(FRAME_WINDOW, 7, body=(INITIAL_WINDOW * 4).to_bytes(4, 'big')))
+        await asyncio.wait_for(sender, 1)
+
+        frames = [channel.decode(data) for data in sent]
+        assert frames[0].type == FRAME_REQUEST and unpack_fields(frames[0].meta)[1] == '/feishu/webhook'
+        assert all(frame.type == FRAME_DATA for frame in frames[1:])
+        assert [frame.end for frame in frames].count(True) == 1 and frames[-1].end
+        assert b''.join(frame.body for frame in frames) == body
+        assert channel.stats['wire_bytes_sent'] < channel.stats['payload_bytes_sent'] / 3
+
+    print("📦 测试帧编解码和流量控制...")
+    asyncio.run(scenario())
+    print("✅ 帧协议编解码和窗口正常")
+
+def test_async_proxy_framed_tunnel():
+    """websocket_reverse_client.py 使用帧协议：并发大响应原样到达，且实际传输字节被压缩"""
+    async def scenario():
+        large = json.dumps({'data': [_feishu_event(i) for i in range(3000)]}, ensure_ascii=False).encode()
+
+        async def local_handler(request: web.Request) -> web.Response:
+            payload = await request.json()
+            await asyncio.sleep(0.1)
+            body = large if payload.get('large') else json.dumps({'echo': payload}).encode()
+            return web.Response(body=body, content_type='application/json', headers={'X-Local': 'yes'})
+
+        local_app = web.Application()
+        local_app.router.add_post('/feishu/webhook', local_handler)
+        local_runner = web.AppRunner(local_app, access_log=None)
+        await local_runner.setup()
+        await web.TCPSite(local_runner, '127.0.0.1', 0).start()
+
+        proxy, runner, url = await _start_proxy()
+        client = WebSocketReverseClient(f"{url.replace('http', 'ws')}/ws",
+                                        f"http://127.0.0.1:{local_runner.addresses[0][1]}")
+        client_task = asyncio.create_task(client.start())
+        try:
+            for _ in range(100):
+                if client.channel:
+                    break
+                await asyncio.sleep(0.02)
+            assert client.channel, '客户端未切换到帧协议'
+
+            async with aiohttp.ClientSession() as session:
+                async def call(index: int):
+                    async with session.post(f"{url}/feishu/webhook",
+                                            json={'n': index, 'large': index % 2 == 0}) as response:
+                        assert response.status == 200
+                        assert response.headers['X-Local'] == 'yes'
+                        return index, await response.read()
+
+                started = time.perf_counter()
+                results = await asyncio.gather(*(call(i) for i in range(8)))
+                elapsed = time.perf_counter() - started
+
+            for index, body in results:
+                assert body == (large if index % 2 == 0 else json.dumps({'echo': {'n': index, 'large': False}}).encode())
+            assert elapsed < 0.8, elapsed  # 串行至少0.8秒
+            assert proxy.stats['framed_requests'] == 8
+            stats = client.channel.stats
+            assert stats['wire_bytes_sent'] < stats['payload_bytes_sent'] / 3
+        finally:
+            client.running = False
+            await client.stop()
+            await asyncio.wait_for(client_task, 5)
+            await runner.cleanup()
+            await local_runner.cleanup()
+
+    print("🔌 测试帧协议端到端转发...")
+    asyncio.run(scenario())
+    print("✅ 帧协议并发转发正常，响应原样到达")
+
+def test_reverse_client_forwards_concurrently():
+    """反向客户端并发转发到本地服务器：慢请求相互重叠，并发数受上限约束，事件循环不被阻塞"""
+    async def scenario():
+        active = peak = 0
+
+        async def slow_handler(request: web.Request) -> web.Response:
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.3)
+            active -= 1
+            return web.json_response({'echo': await request.json()})
+
+        local_app = web.Application()
+        local_app.router.add_post('/feishu/webhook', slow_handler)
+        local_runner = web.AppRunner(local_app, access_log=None)
+        await local_runner.setup()
+        await web.TCPSite(local_runner, '127.0.0.1', 0).start()
+
+        proxy, runner, url = await _start_proxy()
+        client = WebSocketReverseClient(f"{url.replace('http', 'ws')}/ws",
+                                        f"http://127.0.0.1:{local_runner.addresses[0][1]}",
+                                        protocol='json', max_concurrency=4)
+        client_task = asyncio.create_task(client.start())
+
+        # 记录事件循环的最大停顿，阻塞式转发会让停顿达到本地请求耗时
+        max_gap = 0.0
+
+        async def ticker():
+            nonlocal max_gap
+            last = time.perf_counter()
+            while True:
+                await asyncio.sleep(0.01)
+                now = time.perf_counter()
+                max_gap = max(max_gap, now - last)
+                last = now
+
+        try:
+            for _ in range(100):
+                if proxy.clients and client.connected:
+                    break
+                await asyncio.sleep(0.02)
+            tick_task = asyncio.create_task(ticker())
+
+            async with aiohttp.ClientSession() as session:
+                async def call(index: int):
+                    async with session.post(f"{url}/feishu/webhook", json={'n': index}) as response:
+                        assert response.status == 200
+                        return (await response.json())['echo']['n']
+
+                started = time.perf_counter()
+                results = await asyncio.gather(*(call(i) for i in range(12)))
+                elapsed = time.perf_counter() - started
+            tick_task.cancel()
+
+            assert results == list(range(12))
+            assert peak == 4 and client.stats['peak_concurrency'] == 4
+            assert elapsed < 1.5, elapsed  # 串行需要3.6秒，4路并发约0.9秒
+            assert max_gap < 0.1, max_gap
+        finally:
+            await client.stop()
+            await asyncio.wait_for(client_task, 5)
+            await runner.cleanup()
+            await local_runner.cleanup()
+
+    print("🔀 测试反向客户端并发转发...")
+    asyncio.run(scenario())
+    print("✅ 本地请求并发转发，事件循环未被阻塞")
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+THREADED_SERVER = """
+import sys
+sys.path.insert(0, {deploy!r})
+import cloud_proxy_server_ws as module
+server = module.CloudProxyServerWS(host='127.0.0.1', port={port}, ws_port={ws_port})
+server.lingxing_base_url = {upstream!r}
+server.run()
+"""
+
+async def _load(url: str, total: int, concurrency: int) -> dict:
+    """以固定并发发送请求，统计吞吐量、延迟和失败数"""
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency, force_close=True)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30)) as session:
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    async with session.get(url) as response:
+                        await response.read()
+                        if response.status != 200:
+                            errors += 1
+                            return
+                except Exception:
+                    errors += 1
+                    return
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    pick = lambda q: latencies[min(int(len(latencies) * q), len(latencies) - 1)] * 1000 if latencies else float('nan')
+    return {'rps': len(latencies) / elapsed, 'p50': pick(0.5), 'p99': pick(0.99), 'errors': errors}
+
+def benchmark_against_threaded_server(concurrency_levels=(50, 200, 500), upstream_latency: float = 0.1):
+    """
+    并发连接基准：相同的领星替身（每个请求延迟100ms）下，
+    对比Flask线程版与异步版代理在不同并发连接数下的吞吐量、p99延迟和失败数
+    """
+    print(f"\n⏱️ 代理并发基准（上游延迟{upstream_latency * 1000:.0f}ms）...")
+
+    async def run():
+        upstream = UpstreamStandIn(latency=upstream_latency)
+        await upstream.start()
+        work_dir = tempfile.mkdtemp()
+        servers = {}
+        port = _free_port()
+        servers['Flask线程版'] = (port, subprocess.Popen(
+            [sys.executable, '-c', THREADED_SERVER.format(deploy=DEPLOY_DIR, port=port, ws_port=_free_port(),
+                                                          upstream=upstream.base_url)],
+            cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        port = _free_port()
+        servers['异步版'] = (port, subprocess.Popen(
+            [sys.executable, os.path.join(DEPLOY_DIR, 'cloud_proxy_server_async.py'), '--host', '127.0.0.1',
+             '--port', str(port), '--upstream', upstream.base_url, '--log-file', os.path.join(work_dir, 'async.log')],
+            cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                for port, _ in servers.values():
+                    for _ in range(100):
+                        try:
+                            async with session.get(f"http://127.0.0.1:{port}/health") as response:
+                                if response.status == 200:
+                                    break
+                        except aiohttp.ClientError:
+                            await asyncio.sleep(0.1)
+
+            for concurrency in concurrency_levels:
+                for name, (port, _) in servers.items():
+                    result = await _load(f"http://127.0.0.1:{port}/api/proxy/erp/sc/routing/restock",
+                                         total=concurrency * 4, concurrency=concurrency)
+                    print(f"  并发{concurrency:>4} {name}: {result['rps']:.0f} 请求/秒, "
+                          f"p50 {result['p50']:.0f}ms, p99 {result['p99']:.0f}ms, 失败 {result['errors']}")
+        finally:
+            for _, process in servers.values():
+                process.terminate()
+                process.wait(10)
+            await upstream.stop()
+
+    asyncio.run(run())
+
+def benchmark_tunnel_encoding(messages: int = 2000):
+    """
+    隧道编码基准：同样的飞书事件和回复，
+    对比JSON消息（含permessage-deflate估算）与二进制帧的传输字节数和编解码CPU
+    """
+    print(f"\n⏱️ 隧道编码基准（{messages} 个请求/响应）...")
+    headers = {'Content-Type': 'application/json; charset=utf-8', 'User-Agent': 'Feishu-Webhook/1.0',
+               'X-Lark-Request-Timestamp': '1760000000', 'X-Lark-Request-Nonce': 'nonce-1234567890',
+               'X-Lark-Signature': 'f' * 64, 'Accept-Encoding': 'gzip'}
+    reply = {'code': 0, 'data': [{'asin': f'B{i:09d}', 'suggested_purchase': i % 50} for i in range(40)]}
+    events = [_feishu_event(i) for i in range(messages)]
+
+    # JSON协议：客户端和服务器都要先解析再重新编码body
+    started = time.perf_counter()
+    json_bytes = deflate_bytes = 0
+    for index, event in enumerate(events):
+        for message in (
+            {'type': 'feishu_request', 'request_id': f'{index:036d}', 'method': 'POST', 'endpoint': '/feishu/webhook',
+             'headers': headers, 'data': event, 'timestamp': '2026-10-19T10:00:00.000000'},
+            {'type': 'feishu_response', 'request_id': f'{index:036d}',
+             'response': {'status_code': 200, 'headers': headers, 'data': reply}, 'timestamp': '2026-10-19T10:00:00.100000'}
+        ):
+            encoded = json.dumps(message).encode()
+            json.loads(encoded)
+            json_bytes += len(encoded)
+            compressor = zlib.compressobj(wbits=-15)
+            deflate_bytes += len(compressor.compress(encoded) + compressor.flush(zlib.Z_SYNC_FLUSH))
+    json_seconds = time.perf_counter() - started
+
+    # 帧协议：body字节原样传递
+    channel = FrameChannel(None)
+    reply_body = json.dumps(reply).encode()
+    header_fields = [item for header in headers.items() for item in header]
+    bodies = [json.dumps(event).encode() for event in events]  # 飞书发来的原始字节
+    frame_bytes = 0
+    started = time.perf_counter()
+    for index, body in enumerate(bodies):
+        for frame in (
+            channel.encode(1, index, 1, pack_fields(['POST', '/feishu/webhook', ''] + header_fields), body),
+            channel.encode(2, index, 1, pack_fields([200] + header_fields), reply_body)
+        ):
+            frame_bytes += len(frame)
+            decoded = channel.decode(frame)
+            unpack_fields(decoded.meta)
+    frame_seconds = time.perf_counter() - started
+
+    print(f"  JSON消息:      {json_bytes / messages:.0f} 字节/往返，启用deflate约 {deflate_bytes / messages:.0f} 字节，"
+          f"{json_seconds / messages * 1e6:.0f}μs/往返")
+    print(f"  二进制帧(zlib): {frame_bytes / messages:.0f} 字节/往返，{frame_seconds / messages * 1e6:.0f}μs/往返")
+
+def main():
+    """主函数"""
+    print("🧪 异步云代理测试")
+    print("=" * 50)
+    test_async_proxy_streams_upstream()
+    test_async_proxy_edge_cache()
+    test_edge_cache_shares_leader_failure()
+    test_async_proxy_quota_governor()
+    test_metrics_sharded_counters_and_quantiles()
+    test_async_proxy_latency_metrics()
+    test_async_proxy_tunnels_concurrently()
+    test_async_proxy_retries_on_disconnect()
+    test_frame_channel_roundtrip_and_window()
+    test_async_proxy_framed_tunnel()
+    test_reverse_client_forwards_concurrently()
+    benchmark_tunnel_encoding()
+    benchmark_against_threaded_server()
+
+if __name__ == "__main__":
+    main()
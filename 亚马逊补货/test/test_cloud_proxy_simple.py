@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+轮询版云代理测试脚本 🧪
+不启动HTTP服务，直接验证 cloud_proxy_server_simple.py 中
+请求/响应关联、长轮询唤醒与超时、客户端过期堆的惰性顺延和分批清理，
+以及客户端失败或断开时的请求改派
+"""
+
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+pytest.importorskip('websockets')
+
+# 添加deploy目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'deploy'))
+
+import cloud_proxy_server_simple as simple
+
+def _request(request_id: str) -> dict:
+    return {'request_id': request_id, 'method': 'POST', 'path': '/feishu/webhook'}
+
+def _start(target, *args) -> threading.Thread:
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+def test_correlator_wakes_waiter_and_drops_late_responses():
+    """响应到达时直接唤醒等待者；超时后的迟到响应和重复响应被丢弃"""
+    print("🔗 测试请求/响应关联...")
+    correlator = simple.RequestCorrelator()
+
+    correlator.register('r1')
+    _start(lambda: (time.sleep(0.05), correlator.complete('r1', {'status_code': 200})))
+    started = time.time()
+    assert correlator.wait('r1', timeout=5) == {'status_code': 200}
+    assert time.time() - started < 1
+    assert not correlator.complete('r1', {'status_code': 200})
+
+    correlator.register('r2')
+    assert correlator.wait('r2', timeout=0.05) is None
+    assert not correlator.complete('r2', {'status_code': 200})
+    assert len(correlator) == 0
+    assert correlator.stats == {'completed': 1, 'timeouts': 1, 'late_responses': 2}
+    print("✅ 响应直接唤醒等待者，迟到响应被丢弃")
+
+def test_long_poll_wakes_on_request_and_times_out():
+    """挂起的长轮询在请求入队时立即返回；没有请求时等到超时返回空列表"""
+    print("⏳ 测试长轮询唤醒与超时...")
+    state = simple.ProxyState()
+    state.register_client('c1', {})
+    results = []
+    poller = _start(lambda: results.append(state.get_requests('c1', wait=5)))
+    time.sleep(0.05)
+
+    started = time.time()
+    assert state.add_request('c1', _request('r1'))
+    poller.join(5)
+    assert time.time() - started < 1
+    assert [request['request_id'] for request in results[0]] == ['r1']
+    assert len(state.request_expiry) == 0
+
+    started = time.time()
+    assert state.get_requests('c1', wait=0.2) == []
+    assert 0.15 < time.time() - started < 1
+    print("✅ 长轮询按请求唤醒，超时返回空列表")
+
+def test_client_expiry_reschedules_after_heartbeat():
+    """心跳只更新时间戳；堆顶到期时按最后心跳顺延，真正失联后才移除"""
+    print("💓 测试客户端过期惰性顺延...")
+    state = simple.ProxyState()
+    state.register_client('c1', {})
+    registered = state.clients['c1']['last_heartbeat']
+    assert state.client_expiry.next_expiry() == registered + simple.CLIENT_TTL
+
+    # 模拟200秒后的一次心跳：堆中仍是注册时的到期时间
+    assert state.update_heartbeat('c1')
+    state.clients['c1']['last_heartbeat'] = registered + 200
+    assert state.client_expiry.next_expiry() == registered + simple.CLIENT_TTL
+
+    assert state.cleanup_expired_data(now=registered + simple.CLIENT_TTL + 1) == (0, 0)
+    assert 'c1' in state.clients
+    assert state.client_expiry.next_expiry() == registered + 200 + simple.CLIENT_TTL
+
+    assert state.cleanup_expired_data(now=registered + 200 + simple.CLIENT_TTL + 1) == (1, 0)
+    assert 'c1' not in state.clients and len(state.client_expiry) == 0
+    print("✅ 心跳后顺延，失联后移除")
+
+def test_cleanup_expires_requests_in_batches():
+    """同时到期的大量请求分批清理，未到期的请求保留"""
+    print("🧹 测试过期请求分批清理...")
+    state = simple.ProxyState()
+    state.register_client('c1', {})
+    now = time.time()
+    expired = simple.EXPIRY_BATCH * 2 + 10
+    for index in range(expired):
+        state.add_request('c1', _request(f'old{index}'), expires_at=now - 1)
+    state.add_request('c1', _request('fresh'), expires_at=now + 60)
+
+    state.cleanup_expired_data(now=now)
+    # 后台清理线程可能先处理掉一部分，按累计计数检查
+    assert state.metrics.counter_values()['expired_requests'] == expired
+    assert list(state.pending_requests['c1']) == ['fresh']
+    assert len(state.request_expiry) == 1
+    print(f"✅ {expired}个过期请求全部清理，未到期请求保留")
+
+def test_remove_client_wakes_parked_long_poll():
+    """注销挂起长轮询的客户端时轮询立即返回，已分配的请求以CLIENT_LOST唤醒"""
+    print("🔌 测试注销客户端唤醒长轮询...")
+    state = simple.ProxyState()
+    state.register_client('c1', {})
+    results = []
+    poller = _start(lambda: results.append(state.get_requests('c1', wait=10)))
+    time.sleep(0.05)
+
+    assert state.get_available_client('r1') == 'c1'
+    state.responses.register('r1')
+    started = time.time()
+    state.unregister_client('c1')
+    poller.join(5)
+    assert time.time() - started < 1 and results == [[]]
+    assert state.get_response('r1', timeout=1) is simple.CLIENT_LOST
+    assert 'c1' not in state.request_conditions and len(state.client_expiry) == 0
+    print("✅ 长轮询立即返回，在途请求收到CLIENT_LOST")
+
+def _serve(state: simple.ProxyState, client_id: str, reply: dict, stop: threading.Event):
+    """模拟本地客户端：长轮询取请求并按固定内容回复"""
+    while not stop.is_set() and client_id in state.clients:
+        for request_data in state.get_requests(client_id, wait=0.2):
+            state.store_response(request_data['request_id'], reply)
+
+def test_dispatch_retries_on_failed_client():
+    """客户端回复503时改派给其他客户端，失败的客户端计入惩罚"""
+    print("🔀 测试失败改派...")
+    state = simple.ProxyState()
+    stop = threading.Event()
+    try:
+        state.register_client('bad', {})
+        state.register_client('good', {})
+        _start(_serve, state, 'bad', {'status_code': 503}, stop)
+        _start(_serve, state, 'good', {'status_code': 200}, stop)
+
+        # 在途数相同时先选中出错的客户端
+        state.client_pool._clients['good'].ewma_latency = 1.0
+        assert state.dispatch(_request('r1'), timeout=5) == {'status_code': 200}
+        clients = state.client_pool.get_stats()['clients']
+        assert clients['bad']['failures'] == 1 and clients['bad']['penalty_ms'] > 0
+        assert clients['good']['failures'] == 0 and state.client_pool.stats['retried'] == 1
+        assert clients['bad']['inflight'] == clients['good']['inflight'] == 0
+    finally:
+        stop.set()
+    print("✅ 503后改派给健康客户端")
+
+def test_dispatch_retries_when_client_disconnects():
+    """处理中的客户端注销时请求立即改派，不等到超时"""
+    print("🔀 测试断开改派...")
+    state = simple.ProxyState()
+    stop = threading.Event()
+    try:
+        state.register_client('leaving', {})
+        state.register_client('good', {})
+        state.client_pool._clients['good'].ewma_latency = 1.0
+
+        def leave():
+            # 取走请求后不回复，直接注销
+            while not state.get_requests('leaving', wait=0.2):
+                pass
+            state.unregister_client('leaving')
+            _start(_serve, state, 'good', {'status_code': 200}, stop)
+
+        _start(leave)
+        started = time.time()
+        assert state.dispatch(_request('r1'), timeout=5) == {'status_code': 200}
+        assert time.time() - started < 2
+    finally:
+        stop.set()
+    print("✅ 客户端断开后立即改派")
+
+def main():
+    """主函数"""
+    print("🧪 轮询版云代理测试")
+    print("=" * 50)
+    test_correlator_wakes_waiter_and_drops_late_responses()
+    test_long_poll_wakes_on_request_and_times_out()
+    test_client_expiry_reschedules_after_heartbeat()
+    test_cleanup_expires_requests_in_batches()
+    test_remove_client_wakes_parked_long_poll()
+    test_dispatch_retries_on_failed_client()
+    test_dispatch_retries_when_client_disconnects()
+
+if __name__ == "__main__":
+    main()
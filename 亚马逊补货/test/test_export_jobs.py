@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台导出任务测试脚本 🧪
+不调用领星接口，用构造的补货数据验证导出任务的提交、状态查询、等待和完成回调，
+渲染过程中的分步进度、已结束任务的清理，以及增量导出只改写变化的行
+"""
+
+import os
+import sys
+import time
+import tempfile
+import dataclasses
+
+import pytest
+
+pytest.importorskip('pandas')
+pytest.importorskip('openpyxl')
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openpyxl import load_workbook
+
+from business.restock_analyzer import RestockItem
+from business.export_jobs import (ExportJob, ExportJobManager, ExportJobStore, _run_export_job,
+                                  JOB_COMPLETED)
+from business.incremental_export import IncrementalExcelExporter, DATA_SHEET_NAME
+
+def _make_items(count: int):
+    """生成测试用补货数据"""
+    return [RestockItem(hash_id=str(i), asin=f"B0{i:08d}", sid=str(1001 + i % 3), data_type=1, node_type=0,
+                        msku_list=[f"MSKU-{i}"], fnsku_list=[f"X00{i}"], suggested_purchase=i % 7,
+                        available_sale_days=i % 30)
+            for i in range(count)]
+
+def test_submit_status_and_wait():
+    """提交后立即返回任务ID，可查询状态、等待结束，完成回调拿到最终状态"""
+    print("📄 测试导出任务提交/查询/等待...")
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as base_dir:
+        # 导出文件写到当前目录下的output，切换到临时目录避免污染仓库
+        os.chdir(base_dir)
+        manager = ExportJobManager(max_workers=1, max_pending=2, job_dir=os.path.join(base_dir, 'jobs'))
+        try:
+            job_id = manager.submit(_make_items(50), export_format='standard')
+            assert manager.get_job(job_id).item_count == 50
+
+            job = manager.wait(job_id, timeout=60, poll_interval=0.1)
+            assert job.status == JOB_COMPLETED and job.progress == 100
+            assert os.path.exists(job.output_path) and job.duration is not None
+            assert [listed.job_id for listed in manager.list_jobs()] == [job_id]
+
+            notified = []
+            manager.add_done_callback(job_id, notified.append)
+            assert notified and notified[0].status == JOB_COMPLETED
+        finally:
+            manager.shutdown()
+            os.chdir(cwd)
+    print("✅ 提交、查询、等待和完成回调正常")
+
+def test_progress_reported_between_steps():
+    """渲染过程中按步骤写回进度，不再从10%直接跳到100%"""
+    print("📊 测试导出分步进度...")
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as base_dir:
+        os.chdir(base_dir)
+        store = ExportJobStore(os.path.join(base_dir, 'jobs'))
+        store.save(ExportJob(job_id='j1', export_format='both', item_count=20, created_at=time.time()))
+        progress = []
+        original = ExportJobStore.update
+
+        def record(self, job_id, **changes):
+            if 'progress' in changes:
+                progress.append(changes['progress'])
+            return original(self, job_id, **changes)
+
+        # 在当前进程中直接执行渲染，记录每次写回的进度
+        ExportJobStore.update = record
+        try:
+            _run_export_job(store.job_dir, 'j1', _make_items(20), 'both', None)
+        finally:
+            ExportJobStore.update = original
+            os.chdir(cwd)
+        assert progress[0] == 10 and progress[-1] == 100
+        assert len([value for value in progress if 10 < value < 100]) >= 2
+        assert progress == sorted(progress)
+    print(f"✅ 进度依次为 {progress}")
+
+def test_prune_finished_jobs():
+    """超过保留时间或数量的已结束任务连同导出文件一起清理，增量工作簿保留"""
+    print("🧹 测试导出任务清理...")
+    with tempfile.TemporaryDirectory() as base_dir:
+        store = ExportJobStore(os.path.join(base_dir, 'jobs'))
+        now = time.time()
+
+        def add(job_id, finished_at, export_format='standard', status=JOB_COMPLETED):
+            output = os.path.join(base_dir, f"{job_id}.xlsx")
+            with open(output, 'w') as f:
+                f.write('x')
+            store.save(ExportJob(job_id=job_id, export_format=export_format, item_count=1, status=status,
+                                 output_path=output, created_at=finished_at, finished_at=finished_at))
+            return output
+
+        old_output = add('old', now - 10 * 86400)
+        rolling = add('rolling', now - 10 * 86400, export_format='incremental')
+        add('recent1', now - 30)
+        add('recent2', now - 20)
+        add('recent3', now - 10)
+        store.save(ExportJob(job_id='running', export_format='standard', item_count=1, status='running',
+                             created_at=now - 10 * 86400))
+
+        assert store.prune(max_age=86400, max_jobs=2) == 3
+        assert sorted(job.job_id for job in store.list_jobs(limit=0)) == ['recent2', 'recent3', 'running']
+        assert not os.path.exists(old_output) and os.path.exists(rolling)
+    print("✅ 旧任务和导出文件已清理")
+
+def test_incremental_export_rewrites_changed_row():
+    """增量导出时只改写变化的一行，其他行保持不动"""
+    print("🔁 测试增量导出...")
+    with tempfile.TemporaryDirectory() as base_dir:
+        exporter = IncrementalExcelExporter(workbook_path=os.path.join(base_dir, 'current.xlsx'),
+                                            index_file=os.path.join(base_dir, 'index.json'),
+                                            full_rewrite_ratio=0.5)
+        items = _make_items(20)
+        first = exporter.export(items)
+        assert first.mode == 'full' and first.total_rows == 20
+
+        items[7] = dataclasses.replace(items[7], suggested_purchase=999)
+        written = []
+        write_row = exporter._write_row
+        exporter._write_row = lambda worksheet, row, values: (written.append(row),
+                                                              write_row(worksheet, row, values))
+        progress = []
+        second = exporter.export(items, on_progress=lambda percent, message: progress.append(percent))
+        assert second.mode == 'incremental'
+        assert (second.updated, second.inserted, second.deleted) == (1, 0, 0)
+        assert len(written) == 1 and progress
+
+        worksheet = load_workbook(exporter.workbook_path)[DATA_SHEET_NAME]
+        column = exporter.columns.index('suggested_purchase') + 1
+        assert worksheet.cell(row=written[0], column=column).value == 999
+        assert exporter.export(items).mode == 'unchanged'
+    print("✅ 只改写了变化的一行")
+
+def main():
+    """主函数"""
+    print("🧪 后台导出任务测试")
+    print("=" * 50)
+    test_submit_status_and_wait()
+    test_progress_reported_between_steps()
+    test_prune_finished_jobs()
+    test_incremental_export_rewrites_changed_row()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+飞书卡片回调测试脚本 🧪
+不连接飞书，用Flask测试客户端分别请求 /feishu/webhook（card.action.trigger 事件）
+和 /feishu/card（卡片请求网址），验证 card.action.trigger 事件返回包装后的卡片，
+旧版卡片请求直接返回卡片
+"""
+
+import os
+import sys
+import json
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from business.restock_analyzer import RestockItem
+import feishu.start_feishu_server as server
+import feishu.webhook_server as webhook_server
+
+def _urgent_items(count: int):
+    """生成测试用紧急补货数据（按可售天数排序）"""
+    return [RestockItem(hash_id=str(i), asin=f"B0{i:08d}", sid='1001', data_type=1, node_type=0,
+                        msku_list=[f"MSKU-{i}"], suggested_purchase=i, available_sale_days=i % 7 + 1)
+            for i in range(count)]
+
+def _card_event(value) -> dict:
+    """schema 2.0 的 card.action.trigger 事件"""
+    return {'schema': '2.0', 'header': {'event_type': 'card.action.trigger'},
+            'event': {'action': {'value': value}}}
+
+def _assert_envelope(response) -> dict:
+    """检查卡片回调响应格式，返回其中的卡片"""
+    assert response.status_code == 200
+    body = response.get_json()
+    assert set(body) == {'card'} and body['card']['type'] == 'raw'
+    return body['card']['data']
+
+def _assert_bare_card(response) -> dict:
+    """检查旧版卡片请求的响应直接是卡片JSON"""
+    assert response.status_code == 200
+    body = response.get_json()
+    assert 'elements' in body and 'type' not in body
+    return body
+
+def test_card_action_routes_share_envelope():
+    """两个入口对card.action.trigger事件返回相同的包装响应；过期的查询同样包装为卡片"""
+    print("🃏 测试卡片回调响应格式...")
+    result = server.feishu_bot.query_cache.put('urgent', _urgent_items(25), {'seller_ids': None})
+    value = {'query_id': result.query_id, 'page': 2, 'sort': 'purchase'}
+    client = server.app.test_client()
+
+    from_webhook = _assert_envelope(client.post('/feishu/webhook', json=_card_event(value)))
+    from_card = _assert_envelope(client.post('/feishu/card', json=_card_event(value)))
+    assert from_webhook == from_card
+    assert '2/3' in json.dumps(from_card, ensure_ascii=False)
+
+    expired = _card_event({'query_id': 'missing'})
+    expired_card = _assert_envelope(client.post('/feishu/webhook', json=expired))
+    assert expired_card == _assert_envelope(client.post('/feishu/card', json=expired))
+    print("✅ 两个入口返回相同格式的卡片")
+
+def test_legacy_card_request_returns_bare_card():
+    """旧版卡片请求（value为顶层action中的JSON字符串）直接返回卡片，内容与事件回调一致"""
+    print("🃏 测试旧版卡片请求响应格式...")
+    result = server.feishu_bot.query_cache.put('urgent', _urgent_items(25), {'seller_ids': None})
+    value = {'query_id': result.query_id, 'page': 2, 'sort': 'purchase'}
+    client = server.app.test_client()
+
+    legacy = {'open_id': 'ou_test', 'action': {'value': json.dumps(value), 'tag': 'button'}}
+    card = _assert_bare_card(client.post('/feishu/card', json=legacy))
+    assert card == _assert_envelope(client.post('/feishu/card', json=_card_event(value)))
+
+    expired = _assert_bare_card(client.post('/feishu/card', json={'action': {'value': {'query_id': 'missing'}}}))
+    assert '已过期' in json.dumps(expired, ensure_ascii=False)
+    print("✅ 旧版卡片请求直接返回卡片")
+
+def test_webhook_server_card_route_uses_envelope():
+    """webhook_server.py 的卡片回调入口使用同一格式"""
+    print("🃏 测试webhook_server卡片回调...")
+    result = webhook_server.feishu_bot.query_cache.put('urgent', _urgent_items(5), {'seller_ids': None})
+    client = webhook_server.app.test_client()
+    card = _assert_envelope(client.post('/feishu/card', json=_card_event({'query_id': result.query_id})))
+    assert card['elements']
+    print("✅ webhook_server卡片回调格式一致")
+
+def main():
+    """主函数"""
+    print("🧪 飞书卡片回调测试")
+    print("=" * 50)
+    test_card_action_routes_share_envelope()
+    test_legacy_card_request_returns_bare_card()
+    test_webhook_server_card_route_uses_envelope()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+飞书客户端测试脚本 🧪
+启动本地飞书替身服务（令牌和消息接口），验证租户令牌单飞刷新、
+429/5xx和令牌失效的重试、待发队列的后台定时补发，以及等待空闲连接有上限
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from feishu.feishu_client import FeishuClient
+
+class FeishuStandIn:
+    """本地飞书开放平台替身：按预设的回复序列响应消息接口并统计请求"""
+
+    def __init__(self, token_latency: float = 0.0, message_latency: float = 0.0):
+        self.token_latency = token_latency
+        self.message_latency = message_latency
+        self.token_requests = 0
+        self.messages = []     # 成功发送的消息内容
+        self.replies = []      # 预设回复 (HTTP状态码, 业务码)，用完后返回成功
+        self.down = False      # 为True时消息接口一律返回503
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                status, data = stand_in.handle(self.path, body)
+                payload = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                if status == 429:
+                    self.send_header('Retry-After', '0')
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    def handle(self, path: str, body: dict):
+        if path.endswith('/tenant_access_token/internal'):
+            time.sleep(self.token_latency)
+            with self._lock:
+                self.token_requests += 1
+                token = f"t-{self.token_requests}"
+            return 200, {'code': 0, 'tenant_access_token': token, 'expire': 7200}
+
+        time.sleep(self.message_latency)
+        with self._lock:
+            if self.down:
+                return 503, {'code': 503, 'msg': 'stand-in unavailable'}
+            if self.replies:
+                status, code = self.replies.pop(0)
+                return status, {'code': code, 'msg': 'stand-in error'}
+            self.messages.append(body['content'])
+            return 200, {'code': 0, 'data': {'message_id': f"om_{len(self.messages)}"}}
+
+def _client(stand_in: FeishuStandIn, **kwargs) -> FeishuClient:
+    kwargs.setdefault('outbox_file', '')
+    return FeishuClient('cli_test', 'secret', base_url=stand_in.base_url, **kwargs)
+
+def test_token_refresh_single_flight():
+    """令牌不存在时并发调用只发出一次令牌请求，所有线程拿到同一令牌"""
+    print("🔑 测试租户令牌单飞刷新...")
+    stand_in = FeishuStandIn(token_latency=0.2)
+    try:
+        client = _client(stand_in)
+        barrier = threading.Barrier(16)
+        tokens = []
+
+        def worker():
+            barrier.wait()
+            tokens.append(client.get_tenant_access_token())
+
+        threads = [threading.Thread(target=worker) for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        assert len(tokens) == 16 and set(tokens) == {'t-1'}
+        assert stand_in.token_requests == 1 and client.get_stats()['token_refreshes'] == 1
+    finally:
+        stand_in.stop()
+    print("✅ 16个线程并发获取令牌，只请求一次")
+
+def test_request_retries_rate_limit_and_server_errors():
+    """429和5xx退避后重试成功；令牌失效时刷新令牌后重试"""
+    print("🔁 测试请求重试...")
+    stand_in = FeishuStandIn()
+    try:
+        client = _client(stand_in, max_retries=3)
+        stand_in.replies = [(429, 99991400), (500, 500), (200, 99991663)]
+        assert client.send_message('oc_test', 'text', '{"text": "hi"}')
+        assert stand_in.messages == ['{"text": "hi"}']
+        assert stand_in.token_requests == 2
+        stats = client.get_stats()
+        assert stats['retries'] == 3 and stats['errors'] == 0
+
+        # 重试次数用完仍失败时返回失败
+        client.max_retries = 1
+        stand_in.replies = [(503, 503)] * 2
+        assert not client.send_message('oc_test', 'text', '{"text": "lost"}')
+        assert client.get_stats()['errors'] == 1
+    finally:
+        stand_in.stop()
+    print("✅ 限流、服务端错误和令牌失效均重试成功")
+
+def test_outbox_flushed_by_timer():
+    """发送失败的消息写入待发队列，飞书恢复后由后台定时补发，不依赖之后有消息发送成功"""
+    print("📮 测试待发队列定时补发...")
+    stand_in = FeishuStandIn()
+    with tempfile.TemporaryDirectory() as base_dir:
+        outbox_file = os.path.join(base_dir, 'outbox.json')
+        client = _client(stand_in, max_retries=0, outbox_file=outbox_file, outbox_retry_interval=0.1)
+        try:
+            stand_in.down = True
+            assert not client.send_message('oc_test', 'text', '{"text": "queued"}')
+            assert client.outbox_size() == 1
+
+            stand_in.down = False
+            deadline = time.time() + 5
+            while client.outbox_size() and time.time() < deadline:
+                time.sleep(0.05)
+            assert client.outbox_size() == 0 and stand_in.messages == ['{"text": "queued"}']
+            assert client.get_stats()['outbox_delivered'] == 1
+
+            # 队列清空后定时线程退出，新的失败消息会重新启动它
+            deadline = time.time() + 1
+            while client._outbox_timer is not None and time.time() < deadline:
+                time.sleep(0.02)
+            assert client._outbox_timer is None
+            stand_in.down = True
+            assert not client.send_message('oc_test', 'text', '{"text": "again"}')
+            assert client._outbox_timer is not None
+            stand_in.down = False
+            deadline = time.time() + 5
+            while client.outbox_size() and time.time() < deadline:
+                time.sleep(0.05)
+            assert stand_in.messages == ['{"text": "queued"}', '{"text": "again"}']
+
+            # 重启后遗留的待发消息同样会被补发（写入方的补发间隔很长，只有新客户端会补发）
+            restart_file = os.path.join(base_dir, 'restart.json')
+            stand_in.down = True
+            previous = _client(stand_in, max_retries=0, outbox_file=restart_file, outbox_retry_interval=60)
+            assert not previous.send_message('oc_test', 'text', '{"text": "restart"}')
+            restarted = _client(stand_in, max_retries=0, outbox_file=restart_file, outbox_retry_interval=0.1)
+            assert restarted.outbox_size() == 1
+            stand_in.down = False
+            deadline = time.time() + 5
+            while restarted.outbox_size() and time.time() < deadline:
+                time.sleep(0.05)
+            assert restarted.outbox_size() == 0 and stand_in.messages[-1] == '{"text": "restart"}'
+        finally:
+            stand_in.stop()
+    print("✅ 待发消息由后台定时补发")
+
+def test_pool_wait_is_bounded():
+    """连接全部占用时等待空闲连接不超过pool_timeout，超时按可重试的连接失败处理"""
+    print("⏱️ 测试等待空闲连接的上限...")
+    stand_in = FeishuStandIn(message_latency=0.5)
+    try:
+        client = _client(stand_in, max_retries=0, pool_size=1, pool_timeout=0.1)
+        assert client.get_tenant_access_token()
+        slow = threading.Thread(target=client.send_message, args=('oc_test', 'text', '{"text": "slow"}'))
+        slow.start()
+        time.sleep(0.1)
+
+        started = time.time()
+        assert not client.send_message('oc_test', 'text', '{"text": "blocked"}')
+        assert time.time() - started < 0.4
+        slow.join(5)
+        assert client.get_stats()['pool_timeouts'] == 1
+        assert stand_in.messages == ['{"text": "slow"}']
+    finally:
+        stand_in.stop()
+    print("✅ 连接池占满时等待有上限")
+
+def main():
+    """主函数"""
+    print("🧪 飞书客户端测试")
+    print("=" * 50)
+    test_token_refresh_single_flight()
+    test_request_retries_rate_limit_and_server_errors()
+    test_outbox_flushed_by_timer()
+    test_pool_wait_is_bounded()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+飞书事件队列测试脚本 🧪
+不连接飞书，替换机器人的命令处理和消息发送，
+验证队列满时拒绝的事件不会被去重登记，飞书重推后可以重新入队处理，
+且同一事件和同一群聊在提示间隔内只回复一次繁忙提示
+"""
+
+import os
+import sys
+import time
+import threading
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from feishu.feishu_bot import FeishuBot
+from feishu.event_queue import FeishuEventQueue, BUSY_REPLY
+
+def _message_event(event_id: str, chat_id: str = 'oc_test') -> dict:
+    """构造schema 2.0消息事件"""
+    return {
+        'schema': '2.0',
+        'header': {'event_id': event_id, 'event_type': 'im.message.receive_v1'},
+        'event': {'message': {'chat_id': chat_id, 'message_id': f'om_{event_id}',
+                              'message_type': 'text', 'content': '{"text": "帮助"}'}}
+    }
+
+def _offline_bot():
+    """创建不发起网络请求的机器人：命令处理阻塞到放行为止，回复只记录"""
+    bot = FeishuBot()
+    release = threading.Event()
+    processed, replies = [], []
+    lock = threading.Lock()
+
+    def process_message(event_data, skip_dedup=False):
+        release.wait(10)
+        with lock:
+            processed.append(event_data['header']['event_id'])
+        return {'status': 'success'}
+
+    def send_text_message(chat_id, text):
+        with lock:
+            replies.append((chat_id, text))
+        return True
+
+    bot.process_message = process_message
+    bot.send_text_message = send_text_message
+    return bot, release, processed, replies
+
+def test_busy_event_retry_is_accepted():
+    """队列满时返回busy且撤销去重登记，飞书重推同一事件时重新入队；已入队的事件仍按重复处理"""
+    print("📥 测试队列满时的重推处理...")
+    bot, release, processed, replies = _offline_bot()
+    events = FeishuEventQueue(bot, worker_count=1, max_queue_size=1)
+    try:
+        assert events.submit(_message_event('e1')) == 'accepted'
+        # 等工作线程取走e1并阻塞，再占满队列
+        while events.get_stats()['active'] == 0:
+            time.sleep(0.01)
+        assert events.submit(_message_event('e2')) == 'accepted'
+        assert events.submit(_message_event('e3')) == 'busy'
+
+        # 已入队的事件重推仍按重复跳过，被拒绝的事件重推时按新事件处理
+        assert events.submit(_message_event('e2')) == 'duplicate'
+        assert events.submit(_message_event('e3')) == 'busy'
+        # 同一群聊的其他事件在提示间隔内不再提示，其他群聊照常提示
+        assert events.submit(_message_event('e4')) == 'busy'
+        assert events.submit(_message_event('e5', chat_id='oc_other')) == 'busy'
+
+        release.set()
+        assert events.join(10)
+        assert events.submit(_message_event('e3')) == 'accepted'
+        assert events.join(10)
+    finally:
+        release.set()
+        events.stop()
+
+    # 繁忙提示由发送线程发送：e3重推和e4不再重复提示
+    assert processed == ['e1', 'e2', 'e3']
+    assert replies == [('oc_test', BUSY_REPLY), ('oc_other', BUSY_REPLY)]
+    stats = events.get_stats()
+    assert stats['rejected'] == 4 and stats['duplicates'] == 1
+    assert stats['busy_replies'] == 2 and stats['busy_suppressed'] == 2
+    print("✅ 被拒绝的事件重推后重新入队处理，繁忙提示不重复发送")
+
+def main():
+    """主函数"""
+    print("🧪 飞书事件队列测试")
+    print("=" * 50)
+    test_busy_event_retry_is_accepted()
+
+if __name__ == "__main__":
+    main()
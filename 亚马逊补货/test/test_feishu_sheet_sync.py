@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+飞书表格同步测试脚本 🧪
+启动本地飞书替身服务（令牌、电子表格写入、多维表格批量接口），
+验证只写入变化的行，并测量同步吞吐量
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from business.restock_analyzer import RestockItem
+from feishu.feishu_bot import FeishuBot
+from feishu.sheet_sync import SpreadsheetSync, BitableSync
+
+class FeishuStandIn:
+    """本地飞书开放平台替身：在内存中保存表格内容并统计请求"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.cells = {}      # 行号 -> 行数据
+        self.records = {}    # record_id -> fields
+        self.requests = 0
+        self.max_batch = 0
+        self.fail_rows = set()  # 写入区域包含这些行时返回错误
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                data = stand_in.handle(self.path, body)
+                payload = json.dumps(data).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    def handle(self, path: str, body: dict) -> dict:
+        if path.endswith('/tenant_access_token/internal'):
+            return {'code': 0, 'tenant_access_token': 't-standin', 'expire': 7200}
+
+        time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            if path.endswith('/values_batch_update'):
+                if any(self._range_rows(value_range) & self.fail_rows for value_range in body['valueRanges']):
+                    return {'code': 90217, 'msg': 'stand-in write failure'}
+                rows = 0
+                for value_range in body['valueRanges']:
+                    span = value_range['range'].split('!')[1].split(':')[0]
+                    start = int(''.join(ch for ch in span if ch.isdigit()))
+                    for offset, values in enumerate(value_range['values']):
+                        self.cells[start + offset] = values
+                    rows += len(value_range['values'])
+                self.max_batch = max(self.max_batch, rows)
+                return {'code': 0, 'data': {}}
+
+            records = body.get('records', [])
+            self.max_batch = max(self.max_batch, len(records))
+            if path.endswith('/batch_create'):
+                created = []
+                for record in records:
+                    self._next_id += 1
+                    record_id = f"rec{self._next_id}"
+                    self.records[record_id] = record['fields']
+                    created.append({'record_id': record_id, 'fields': record['fields']})
+                return {'code': 0, 'data': {'records': created}}
+            if path.endswith('/batch_update'):
+                # 与开放平台一致：只改写传入的字段，传null的字段被清空
+                for record in records:
+                    fields = self.records.setdefault(record['record_id'], {})
+                    for name, value in record['fields'].items():
+                        if value is None:
+                            fields.pop(name, None)
+                        else:
+                            fields[name] = value
+                return {'code': 0, 'data': {'records': records}}
+            if path.endswith('/batch_delete'):
+                for record_id in records:
+                    self.records.pop(record_id, None)
+                return {'code': 0, 'data': {}}
+        return {'code': 404, 'msg': f'unknown path {path}'}
+
+    @staticmethod
+    def _range_rows(value_range: dict) -> set:
+        """写入区域覆盖的行号"""
+        span = value_range['range'].split('!')[1].split(':')[0]
+        start = int(''.join(ch for ch in span if ch.isdigit()))
+        return set(range(start, start + len(value_range['values'])))
+
+    def sheet_asins(self) -> set:
+        """电子表格中非空数据行的ASIN集合"""
+        return {values[0] for row, values in self.cells.items() if row > 1 and values[0]}
+
+def _make_items(count: int, start: int = 0, purchase: int = 0):
+    return [RestockItem(hash_id=str(i), asin=f"B0{i:08d}", sid='1001', data_type=1, node_type=0,
+                        msku_list=[f"MSKU-{i}"], fnsku_list=[f"X00{i}"], suggested_purchase=purchase)
+            for i in range(start, start + count)]
+
+def _make_bot(stand_in: FeishuStandIn) -> FeishuBot:
+    bot = FeishuBot()
+    bot.base_url = stand_in.base_url
+    bot.token_url = f"{stand_in.base_url}/open-apis/auth/v3/tenant_access_token/internal"
+    return bot
+
+def _changed_snapshot(items):
+    """删除前30行、修改每50行中的1行、新增10行"""
+    changed = items[30:]
+    for item in changed[::50]:
+        item.suggested_purchase += 7
+    return changed + _make_items(10, start=len(items) + 1000)
+
+def test_spreadsheet_sync_writes_only_changes():
+    """电子表格：首次全量，再次同步只写变化的行，结果与快照一致"""
+    print("📊 测试电子表格差异同步...")
+    stand_in = FeishuStandIn()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            sync = SpreadsheetSync(_make_bot(stand_in), spreadsheet_token='shtStandIn', sheet_id='s1',
+                                   state_file=os.path.join(tmp, 'state.json'), batch_size=500, qps=1000)
+            items = _make_items(2000)
+            first = sync.sync(items)
+            assert first.inserted == 2000 and first.failed_batches == 0
+            assert stand_in.max_batch <= 500
+
+            unchanged = sync.sync(items)
+            assert unchanged.requests == 0, "未变化的快照不应发出请求"
+
+            items = _changed_snapshot(items)
+            second = sync.sync(items)
+            print(f"   第二次同步: 新增{second.inserted} 更新{second.updated} 删除{second.deleted}，{second.requests}次请求")
+            assert (second.inserted, second.updated, second.deleted) == (10, 40, 30)
+            assert stand_in.sheet_asins() == {item.asin for item in items}
+            assert stand_in.cells[1][0] == 'ASIN'
+    finally:
+        stand_in.stop()
+    print("✅ 电子表格差异同步测试通过")
+
+def test_spreadsheet_sync_retries_failed_tail_clear():
+    """电子表格：尾部清空批次失败时记入结果并保留在状态中，下次同步重新清空"""
+    print("📊 测试电子表格尾部清空失败重试...")
+    stand_in = FeishuStandIn()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            sync = SpreadsheetSync(_make_bot(stand_in), spreadsheet_token='shtStandIn', sheet_id='s1',
+                                   state_file=os.path.join(tmp, 'state.json'), batch_size=10, qps=1000)
+            items = _make_items(100)
+            assert sync.sync(items).failed_batches == 0
+
+            # 删除末尾30行（第72-101行需要清空），包含第95行的批次写入失败
+            items = items[:70]
+            stand_in.fail_rows = {95}
+            failed = sync.sync(items)
+            assert failed.deleted == 30
+            assert failed.failed_batches == 1 and failed.failed_rows == 10
+            assert len(stand_in.sheet_asins()) == 80
+
+            stand_in.fail_rows = set()
+            retried = sync.sync(items)
+            assert retried.requests > 0 and retried.failed_batches == 0
+            assert stand_in.sheet_asins() == {item.asin for item in items}
+
+            assert sync.sync(items).requests == 0
+            items += _make_items(5, start=500)
+            sync.sync(items)
+            assert stand_in.sheet_asins() == {item.asin for item in items}
+            assert max(row for row, values in stand_in.cells.items() if values[0]) == 76
+    finally:
+        stand_in.stop()
+    print("✅ 尾部清空失败的行在下次同步时重新清空")
+
+def test_spreadsheet_sync_retries_failed_header():
+    """电子表格：首次同步的表头写入失败时保留为待写入，下次同步重写表头"""
+    print("📊 测试电子表格表头写入失败重试...")
+    stand_in = FeishuStandIn()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            sync = SpreadsheetSync(_make_bot(stand_in), spreadsheet_token='shtStandIn', sheet_id='s1',
+                                   state_file=os.path.join(tmp, 'state.json'), batch_size=10, qps=1000)
+            items = _make_items(30)
+            stand_in.fail_rows = {1}
+            failed = sync.sync(items)
+            assert failed.failed_batches == 1 and 1 not in stand_in.cells
+
+            stand_in.fail_rows = set()
+            retried = sync.sync(items)
+            assert retried.requests > 0 and retried.failed_batches == 0
+            assert stand_in.cells[1][0] == 'ASIN'
+            assert stand_in.sheet_asins() == {item.asin for item in items}
+            assert sync.sync(items).requests == 0
+    finally:
+        stand_in.stop()
+    print("✅ 表头在下次同步时重新写入")
+
+def test_bitable_sync_clears_emptied_fields():
+    """多维表格：更新记录时变为空的字段显式传null，原值被清空"""
+    print("📊 测试多维表格清空字段...")
+    stand_in = FeishuStandIn()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            sync = BitableSync(_make_bot(stand_in), app_token='bascnStandIn', table_id='tbl1',
+                               state_file=os.path.join(tmp, 'state.json'), qps=1000)
+            items = _make_items(3)
+            items[0].remark = '待确认'
+            sync.sync(items)
+            record_id = next(rid for rid, fields in stand_in.records.items() if fields.get('备注') == '待确认')
+
+            items[0].remark = None
+            assert sync.sync(items).updated == 1
+            assert '备注' not in stand_in.records[record_id]
+            assert stand_in.records[record_id]['ASIN'] == items[0].asin
+    finally:
+        stand_in.stop()
+    print("✅ 变为空的字段被清空")
+
+def test_bitable_sync_writes_only_changes():
+    """多维表格：新增/更新/删除按批量接口上限提交，结果与快照一致"""
+    print("📊 测试多维表格差异同步...")
+    stand_in = FeishuStandIn()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            sync = BitableSync(_make_bot(stand_in), app_token='bascnStandIn', table_id='tbl1',
+                               state_file=os.path.join(tmp, 'state.json'), qps=1000)
+            items = _make_items(1200)
+            first = sync.sync(items)
+            assert first.inserted == 1200 and first.requests == 3
+            assert stand_in.max_batch == 500
+
+            items = _changed_snapshot(items)
+            second = sync.sync(items)
+            print(f"   第二次同步: 新增{second.inserted} 更新{second.updated} 删除{second.deleted}，{second.requests}次请求")
+            assert (second.inserted, second.updated, second.deleted) == (10, 24, 30)
+            assert second.requests == 3
+            assert {fields['ASIN'] for fields in stand_in.records.values()} == {item.asin for item in items}
+    finally:
+        stand_in.stop()
+    print("✅ 多维表格差异同步测试通过")
+
+def benchmark_sync_throughput(rows: int = 20000, latency: float = 0.05):
+    """
+    同步吞吐量基准：替身服务每个请求固定延迟，比较并发批次数的影响
+    """
+    print(f"\n⏱️ 同步吞吐量基准（{rows}行，替身延迟{int(latency * 1000)}ms/请求）")
+    print(f"{'目标':<8} {'并发':<6} {'请求数':<8} {'耗时(秒)':<10} {'行/秒':<10}")
+    for target_cls, kwargs in ((SpreadsheetSync, {'spreadsheet_token': 'shtBench', 'sheet_id': 's1',
+                                                  'batch_size': 1000}),
+                               (BitableSync, {'app_token': 'bascnBench', 'table_id': 'tbl1'})):
+        for concurrency in (1, 4):
+            stand_in = FeishuStandIn(latency=latency)
+            try:
+                with tempfile.TemporaryDirectory() as tmp:
+                    sync = target_cls(_make_bot(stand_in), state_file=os.path.join(tmp, 'state.json'),
+                                      concurrency=concurrency, qps=50, **kwargs)
+                    result = sync.sync(_make_items(rows))
+                    print(f"{result.target:<8} {concurrency:<6} {result.requests:<8} "
+                          f"{result.duration:<10} {result.rows_per_second:<10}")
+            finally:
+                stand_in.stop()
+
+def main():
+    """主函数"""
+    print("🧪 飞书表格同步测试")
+    print("=" * 50)
+    test_spreadsheet_sync_writes_only_changes()
+    test_spreadsheet_sync_retries_failed_tail_clear()
+    test_spreadsheet_sync_retries_failed_header()
+    test_bitable_sync_clears_emptied_fields()
+    test_bitable_sync_writes_only_changes()
+    benchmark_sync_throughput()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP轮询客户端测试脚本 🧪
+用本地替身服务同时扮演云服务器和本地服务器，验证突发请求下
+工作线程数、本地并发和排队数量有界，队列满时暂停轮询并在心跳中上报饱和状态，
+入队等待有上限（放不下的请求回复503退回云服务器）
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# 添加deploy目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'deploy'))
+
+from http_polling_client import (
+    HTTPPollingClient, request_priority,
+    PRIORITY_VERIFICATION, PRIORITY_INTERACTIVE, PRIORITY_EVENT
+)
+
+class StandInServer:
+    """云服务器和本地服务器替身：积压一批请求供轮询，本地处理有固定延迟"""
+
+    def __init__(self, backlog: int, handler_delay: float = 0.05):
+        self.pending = deque(
+            {'request_id': f'req_{i}', 'data': {'method': 'POST', 'endpoint': '/feishu/webhook',
+                                               'json_data': {'n': i}}}
+            for i in range(backlog)
+        )
+        self.handler_delay = handler_delay
+        self.ignore_limit = False  # 模拟不支持 max 参数的旧服务器，一次返回全部积压
+        self.poll_limits = []
+        self.responses = []
+        self.heartbeats = []
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                limit = int(query['max'][0])
+                with server.lock:
+                    server.poll_limits.append(limit)
+                    if server.ignore_limit:
+                        limit = len(server.pending)
+                    batch = [server.pending.popleft() for _ in range(min(limit, len(server.pending)))]
+                if not batch:
+                    time.sleep(0.05)
+                self._reply({'requests': batch, 'wait': query['wait'][0]})
+
+            def do_POST(self):
+                data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                path = urlparse(self.path).path
+                if path == '/feishu/webhook':
+                    with server.lock:
+                        server.active += 1
+                        server.peak = max(server.peak, server.active)
+                    time.sleep(server.handler_delay)
+                    with server.lock:
+                        server.active -= 1
+                    self._reply({'echo': data})
+                    return
+                with server.lock:
+                    if path == '/submit_response':
+                        server.responses.append(data['request_id'])
+                    elif path == '/heartbeat':
+                        server.heartbeats.append(data['stats'])
+                self._reply({'status': 'success'})
+
+        return Handler
+
+    def stop(self):
+        self.httpd.shutdown()
+
+def test_request_priority_order():
+    """URL校验优先于命令和卡片回调，普通事件最后，同优先级先进先出；Webhook上的机器人命令按事件类型归为交互请求"""
+    client = HTTPPollingClient('http://127.0.0.1:9', 'http://127.0.0.1:9', queue_limit=10)
+    requests_data = [
+        {'request_id': 'event_1', 'data': {'endpoint': '/feishu/webhook',
+                                           'json_data': {'header': {'event_type': 'im.chat.member.bot.added_v1'}}}},
+        {'request_id': 'command', 'data': {'endpoint': '/feishu/command', 'json_data': {'text': '/补货'}}},
+        {'request_id': 'event_2', 'data': {'endpoint': '/feishu/webhook',
+                                           'json_data': {'header': {'event_type': 'im.chat.updated_v1'}}}},
+        {'request_id': 'message', 'data': {'endpoint': '/feishu/webhook',
+                                           'json_data': {'header': {'event_type': 'im.message.receive_v1'}}}},
+        {'request_id': 'verify', 'data': {'json_data': {'type': 'url_verification', 'challenge': 'x'}}},
+        {'request_id': 'card', 'data': {'json_data': {'action': {'value': {'asin': 'B000000001'}}}}},
+    ]
+    assert [request_priority(data) for data in requests_data] == [
+        PRIORITY_EVENT, PRIORITY_INTERACTIVE, PRIORITY_EVENT, PRIORITY_INTERACTIVE,
+        PRIORITY_VERIFICATION, PRIORITY_INTERACTIVE
+    ]
+
+    for data in requests_data:
+        client.enqueue_request(data)
+    order = [client.work_queue.get()[3]['request_id'] for _ in requests_data]
+    assert order == ['verify', 'command', 'message', 'card', 'event_1', 'event_2']
+    print("✅ 请求按优先级排序")
+
+def test_burst_stays_bounded():
+    """200个积压请求：工作线程和本地并发不超过上限，每次领取不超过队列容量，队列满时暂停轮询"""
+    server = StandInServer(backlog=200)
+    client = HTTPPollingClient(server.url, server.url, poll_wait=5, max_workers=4, queue_limit=8)
+    runner = threading.Thread(target=client.start, daemon=True)
+    runner.start()
+
+    peak_threads = 0
+    deadline = time.time() + 20
+    heartbeat_sent = False
+    try:
+        while len(server.responses) < 200 and time.time() < deadline:
+            peak_threads = max(peak_threads, len([t for t in threading.enumerate() if t.name.startswith('polling-worker')]))
+            if client.stats['saturated'] and not heartbeat_sent:
+                client.send_heartbeat()
+                heartbeat_sent = True
+            time.sleep(0.01)
+    finally:
+        client.running = False
+        runner.join(10)
+        server.stop()
+
+    assert sorted(server.responses) == sorted(f'req_{i}' for i in range(200))
+    assert peak_threads == 4
+    assert server.peak <= 4
+    assert max(server.poll_limits) <= 8
+    assert client.stats['backpressure_waits'] > 0
+    assert heartbeat_sent and server.heartbeats[0]['saturated'] is True
+    assert 0 < server.heartbeats[0]['queue_depth'] <= 8
+    print(f"✅ 突发请求处理完成：工作线程峰值 {peak_threads}，本地并发峰值 {server.peak}，"
+          f"轮询 {client.stats['polls']} 次，背压等待 {client.stats['backpressure_waits']} 次")
+
+def test_enqueue_wait_is_bounded():
+    """队列满时轮询线程等待不超过入队期限，放不下的请求回复503退回云服务器"""
+    server = StandInServer(backlog=5)
+    client = HTTPPollingClient(server.url, server.url, poll_wait=1, queue_limit=2, enqueue_timeout=0.2)
+    server.ignore_limit = True
+    try:
+        # 不启动工作线程：旧服务器忽略 max 参数一次返回5个请求
+        started = time.time()
+        assert client.poll_for_requests()
+        elapsed = time.time() - started
+    finally:
+        server.stop()
+
+    assert elapsed < 1
+    assert client.work_queue.qsize() == 2 and client.stats['rejected_full'] == 3
+    assert sorted(server.responses) == ['req_2', 'req_3', 'req_4']
+    print(f"✅ 队列满时入队等待 {elapsed:.2f} 秒后退回3个请求")
+
+def main():
+    """主函数"""
+    print("🧪 HTTP轮询客户端测试")
+    print("=" * 50)
+    test_request_priority_order()
+    test_burst_stays_bounded()
+    test_enqueue_wait_is_bounded()
+
+if __name__ == "__main__":
+    main()
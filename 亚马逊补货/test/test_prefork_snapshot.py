@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共享快照与多进程服务测试脚本 🧪
+验证内存映射快照与内存快照的查询结果一致、版本原子切换、
+卡片翻页跨工作进程可用、准入限额在进程间共享，
+并对多进程Webhook服务做延迟/吞吐量基准测试
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import requests
+
+# 添加项目根目录到Python路径
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_ROOT)
+
+from business.restock_analyzer import RestockItem, RestockAnalyzer
+from business.restock_snapshot import RestockSnapshot
+from business.snapshot_file import write_snapshot_files, MappedRestockSnapshot, SharedSnapshotStore
+from feishu.admission import SharedAdmissionController, ADMITTED, QUEUED, LIMITED
+
+def _make_items(count: int, sellers: int = 20):
+    """生成测试用补货数据"""
+    return [
+        RestockItem(
+            hash_id=str(i), asin=f"B{i:09d}", sid=str(i % sellers), data_type=1, node_type=1,
+            msku_list=[f"msku-{i}", f"msku-{i}-b"] if i % 5 == 0 else [f"msku-{i}"],
+            fnsku_list=[f"X{i:09d}"], fba_available=i % 30, sales_avg_30=(i % 17) / 2,
+            out_stock_flag=1 if i % 13 == 0 else 0, out_stock_date='2024-06-01' if i % 13 == 0 else '',
+            suggested_purchase=i % 50, available_sale_days=i % 40
+        )
+        for i in range(count)
+    ]
+
+def test_mapped_snapshot_matches_memory():
+    """内存映射快照的汇总、单品、店铺和紧急补货查询与内存快照一致"""
+    print("📦 测试共享快照查询一致性...")
+    snapshot = RestockSnapshot(_make_items(3000), RestockAnalyzer())
+    with tempfile.TemporaryDirectory() as base_dir:
+        mapped = MappedRestockSnapshot(write_snapshot_files(snapshot, base_dir))
+
+        assert mapped.item_count == len(snapshot.items)
+        assert mapped.summary == json.loads(json.dumps(snapshot.summary))
+        assert mapped.items == snapshot.items
+        assert mapped.urgent_items == snapshot.urgent_items
+        for code in ('B000000042', 'msku-10-b', 'x000000007', 'missing', 'B0000000420000'):
+            assert mapped.lookup(code) == snapshot.lookup(code), code
+        for sellers in (['3'], ['3', '7'], ['999'], None):
+            assert mapped.urgent_for_sellers(sellers) == snapshot.urgent_for_sellers(sellers)
+            assert mapped.urgent_for_sellers(sellers, limit=5) == snapshot.urgent_for_sellers(sellers, limit=5)
+            assert mapped.filter_by_sellers(sellers) == snapshot.filter_by_sellers(sellers)
+            # 映射快照直接在列上统计，结果与逐项汇总一致（生成时间除外）
+            expected = dict(snapshot.summarize_sellers(sellers), report_time=None)
+            actual = dict(mapped.summarize_sellers(sellers), report_time=None)
+            assert actual == json.loads(json.dumps(expected)), sellers
+        assert mapped.has_seller('3') and not mapped.has_seller('999')
+    print("✅ 共享快照查询结果一致")
+
+def test_shared_store_follows_atomic_swap():
+    """写入新版本后读取方自动切换，已映射的旧版本仍可读取"""
+    print("🔄 测试快照版本切换...")
+    analyzer = RestockAnalyzer()
+    with tempfile.TemporaryDirectory() as base_dir:
+        store = SharedSnapshotStore(base_dir)
+        assert store.get_snapshot() is None
+
+        write_snapshot_files(RestockSnapshot(_make_items(100), analyzer, created_at=time.time() - 10), base_dir)
+        old = store.get_snapshot()
+        assert old.item_count == 100
+
+        for count in (200, 300):
+            write_snapshot_files(RestockSnapshot(_make_items(count), analyzer), base_dir)
+            time.sleep(0.01)
+        new = store.get_snapshot()
+        assert new.item_count == 300 and new is not old
+        assert old.lookup('B000000042')[0].asin == 'B000000042'
+        assert len([name for name in os.listdir(base_dir) if name.startswith('v-')]) == 2
+        assert store.get_stats()['items'] == 300
+    print("✅ 版本切换正常")
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _start_prefork(port: int, workers: int, env: dict) -> subprocess.Popen:
+    """启动多进程服务（不启动刷新进程），等待健康检查通过"""
+    process = subprocess.Popen(
+        [sys.executable, 'feishu/prefork_server.py', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--no-refresher'],
+        cwd=PROJECT_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/health", timeout=1).ok:
+                break
+        except requests.RequestException:
+            time.sleep(0.2)
+    return process
+
+def _find_button(card: dict, text: str) -> dict:
+    """从卡片中找出指定文字的按钮"""
+    for element in card['elements']:
+        for action in element.get('actions', []):
+            if action['text']['content'] == text:
+                return action
+    raise AssertionError(f"卡片中没有按钮: {text}")
+
+def test_card_paging_across_workers():
+    """在一个工作进程查询、在另一个工作进程翻页：按钮带有快照版本，从共享快照重建结果"""
+    print("🃏 测试跨工作进程翻页...")
+    with tempfile.TemporaryDirectory() as base_dir:
+        write_snapshot_files(RestockSnapshot(_make_items(3000), RestockAnalyzer()), base_dir)
+        env = dict(os.environ, SNAPSHOT_SHARED_DIR=base_dir,
+                   FEISHU_DEDUP_DB=os.path.join(base_dir, 'events.db'))
+        # 两个各有一个工作进程的服务共享同一快照目录，相当于同一服务的两个工作进程
+        ports = [_free_port(), _free_port()]
+        processes = [_start_prefork(port, 1, env) for port in ports]
+        try:
+            response = requests.post(f"http://127.0.0.1:{ports[0]}/feishu/command",
+                                     json={'command': '店铺 3 紧急'}, timeout=30).json()
+            value = _find_button(response['response'], '下一页')['value']
+            assert value['page'] == 2 and value['sellers'] == ['3'] and value['snapshot']
+
+            event = {'schema': '2.0', 'header': {'event_type': 'card.action.trigger'},
+                     'event': {'action': {'value': value}}}
+            body = requests.post(f"http://127.0.0.1:{ports[1]}/feishu/card", json=event, timeout=30).json()
+            text = json.dumps(body, ensure_ascii=False)
+            assert '已过期' not in text and '第 2/' in text, text[:300]
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait(10)
+    print("✅ 其他工作进程可以继续翻页")
+
+def test_shared_admission_limits_across_processes():
+    """两个共享同一数据库的准入控制器合计不超过令牌和并发上限"""
+    print("🚦 测试共享准入限额...")
+    with tempfile.TemporaryDirectory() as base_dir:
+        db_path = os.path.join(base_dir, 'admission.db')
+        options = dict(max_concurrent=1, max_pending=5, user_burst=2, user_interval=60,
+                       chat_burst=10, chat_interval=1)
+        first = SharedAdmissionController(db_path, poll_interval=0.05, **options)
+        second = SharedAdmissionController(db_path, poll_interval=0.05, **options)
+
+        assert first.acquire('u1', None).status == ADMITTED
+        ran = []
+        queued = second.acquire('u1', None, deferred=lambda: ran.append(True))
+        assert queued.status == QUEUED and queued.position == 1
+        # 用户令牌已在两个控制器上合计用完
+        limited = second.acquire('u1', None)
+        assert limited.status == LIMITED and limited.scope == 'user' and limited.retry_after > 0
+
+        assert first.get_stats()['shared_active'] == 1
+        first.release()
+        deadline = time.time() + 5
+        while not ran and time.time() < deadline:
+            time.sleep(0.05)
+        assert ran == [True]
+        deadline = time.time() + 5
+        while second.get_stats()['active'] and time.time() < deadline:
+            time.sleep(0.05)
+        assert second.get_stats()['shared_active'] == 0
+    print("✅ 令牌和并发名额在进程间共享")
+
+def _load_client(url: str, commands, total_requests: int, concurrency: int):
+    """压测客户端进程：用concurrency个线程发送请求，返回各请求耗时（秒）"""
+    session = requests.Session()
+
+    def call(index: int) -> float:
+        started = time.perf_counter()
+        response = session.post(f"{url}/feishu/command",
+                                json={'command': commands[index % len(commands)]}, timeout=30)
+        response.raise_for_status()
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(call, range(total_requests)))
+
+def benchmark_webhook(items: int = 50000, workers_list=None, total_requests: int = 800,
+                      concurrency: int = 16, clients: int = 4):
+    """
+    多进程Webhook基准：相同共享快照下，比较不同工作进程数的延迟和吞吐量
+    （请求为"店铺 <ID> 紧急"卡片渲染、"店铺 <ID>"概况、"补货"汇总和"查"单品查询，不调用领星/飞书接口）
+
+    压测请求由clients个独立进程发出，避免客户端自身的GIL成为瓶颈；
+    吞吐量只能随CPU核数提升，工作进程数超过CPU核数时不会再增加
+    """
+    cpus = os.cpu_count() or 1
+    workers_list = workers_list or sorted({1, 2, min(4, max(cpus, 2))})
+    print(f"\n⏱️ 多进程Webhook基准（{items}条快照，{total_requests}个请求，"
+          f"{clients}个压测进程共{concurrency}并发，{cpus}个CPU）...")
+    if cpus < max(workers_list):
+        print(f"  ⚠️ 本机只有{cpus}个CPU，压测进程和工作进程争用同一CPU，无法体现多进程扩展，"
+              f"请在至少{max(workers_list) + 1}核的机器上运行")
+    commands = ['店铺 3 紧急', '查 B000000042', '店铺 11', '补货 7', '查 msku-1000']
+
+    with tempfile.TemporaryDirectory() as base_dir:
+        write_snapshot_files(RestockSnapshot(_make_items(items), RestockAnalyzer()), base_dir)
+        env = dict(os.environ, SNAPSHOT_SHARED_DIR=base_dir,
+                   FEISHU_DEDUP_DB=os.path.join(base_dir, 'events.db'))
+
+        throughput = {}
+        for workers in workers_list:
+            port = _free_port()
+            process = _start_prefork(port, workers, env)
+            url = f"http://127.0.0.1:{port}"
+            try:
+                # 预热：每个工作进程首次请求时映射快照
+                _load_client(url, commands, workers * 4, workers)
+                per_client = total_requests // clients
+                started = time.perf_counter()
+                with ProcessPoolExecutor(max_workers=clients) as executor:
+                    futures = [executor.submit(_load_client, url, commands, per_client, concurrency // clients)
+                               for _ in range(clients)]
+                    latencies = sorted(latency for future in futures for latency in future.result())
+                elapsed = time.perf_counter() - started
+                throughput[workers] = len(latencies) / elapsed
+                p50 = latencies[len(latencies) // 2] * 1000
+                p95 = latencies[int(len(latencies) * 0.95)] * 1000
+                print(f"  {workers}个工作进程: {throughput[workers]:.0f} 请求/秒"
+                      f"（{throughput[workers] / throughput[workers_list[0]]:.2f}x）, "
+                      f"p50 {p50:.1f}ms, p95 {p95:.1f}ms")
+            finally:
+                process.terminate()
+                process.wait(10)
+        return throughput
+
+def main():
+    """主函数"""
+    print("🧪 共享快照与多进程服务测试")
+    print("=" * 50)
+    test_mapped_snapshot_matches_memory()
+    test_shared_store_follows_atomic_swap()
+    test_card_paging_across_workers()
+    test_shared_admission_limits_across_processes()
+    benchmark_webhook()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+云代理副本一致性测试脚本 🧪
+各云代理按单文件上传到云服务器，共用的转发辅助函数、指标采集、边缘缓存和配额调度代码
+在每个文件中各有一份。本脚本只解析源码（不导入，无需安装Flask/aiohttp），
+检查这些副本逐字相同，异步版与线程版的对应类接口一致
+"""
+
+import os
+import ast
+
+DEPLOY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'deploy')
+
+# Flask版代理：转发辅助函数逐字相同
+FLASK_PROXIES = ['cloud_proxy_server.py', 'cloud_proxy_server_simple.py', 'cloud_proxy_server_ws.py',
+                 'unified_cloud_proxy.py']
+FORWARDING_NAMES = ['HOP_BY_HOP_HEADERS', 'STREAM_CHUNK_SIZE', 'strip_hop_by_hop', 'upstream_request_headers',
+                    'stream_upstream_response']
+
+# 带指标采集的代理
+METRICS_PROXIES = ['cloud_proxy_server_async.py', 'cloud_proxy_server_simple.py', 'unified_cloud_proxy.py']
+METRICS_NAMES = ['LATENCY_BUCKETS', 'METRIC_SERIES_LIMIT', 'Metrics']
+
+# 带边缘缓存和配额调度的代理（异步版和线程版）
+EDGE_PROXIES = ['cloud_proxy_server_async.py', 'unified_cloud_proxy.py']
+EDGE_NAMES = ['HOP_BY_HOP_HEADERS', 'STREAM_CHUNK_SIZE', 'VOLATILE_PARAMS', 'SUCCESS_CODES', 'parse_cache_ttls',
+              'cache_key', 'business_code', 'is_cacheable', 'CachedResponse', 'THROTTLE_CODE',
+              'THROTTLE_PROBE_SIZE', 'parse_quota_rates', 'retry_after_seconds', 'QuotaExceeded']
+# 按asyncio和线程分别实现的类，只要求公开接口一致
+COUNTERPART_CLASSES = ['EdgeCache', 'QuotaLane', 'QuotaGovernor']
+
+def _definitions(filename: str) -> dict:
+    """解析模块顶层的函数、类和常量，返回 {名称: AST节点}"""
+    path = os.path.join(DEPLOY_DIR, filename)
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=path)
+    definitions = {}
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            definitions[node.name] = node
+        elif isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    definitions[target.id] = node
+    return definitions
+
+def _assert_identical(filenames: list, names: list):
+    """检查各文件中的同名定义逐字相同（比较AST，忽略行号）"""
+    modules = {filename: _definitions(filename) for filename in filenames}
+    reference = filenames[0]
+    for name in names:
+        expected = ast.dump(modules[reference][name])
+        for filename in filenames[1:]:
+            assert name in modules[filename], f"{filename} 缺少 {name}"
+            assert ast.dump(modules[filename][name]) == expected, \
+                f"{filename} 中的 {name} 与 {reference} 不一致，修改时需同步所有副本"
+
+def _public_methods(node: ast.ClassDef) -> set:
+    return {item.name for item in node.body
+            if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)) and not item.name.startswith('_')}
+
+def test_forwarding_helpers_identical():
+    """Flask版代理的逐跳头部处理和流式转发逐字相同"""
+    print("🔍 检查转发辅助函数副本...")
+    _assert_identical(FLASK_PROXIES, FORWARDING_NAMES)
+    print(f"✅ {len(FLASK_PROXIES)} 个代理的转发辅助函数一致")
+
+def test_metrics_identical():
+    """各代理的指标采集逐字相同"""
+    print("🔍 检查指标采集副本...")
+    _assert_identical(METRICS_PROXIES, METRICS_NAMES)
+    print(f"✅ {len(METRICS_PROXIES)} 个代理的Metrics一致")
+
+def test_edge_cache_and_quota_consistent():
+    """异步版和线程版的缓存/配额辅助函数逐字相同，EdgeCache/QuotaLane/QuotaGovernor公开接口一致"""
+    print("🔍 检查边缘缓存和配额调度副本...")
+    _assert_identical(EDGE_PROXIES, EDGE_NAMES)
+    modules = [_definitions(filename) for filename in EDGE_PROXIES]
+    for name in COUNTERPART_CLASSES:
+        methods = [_public_methods(module[name]) for module in modules]
+        assert all(item == methods[0] for item in methods), f"{name} 的公开接口不一致: {methods}"
+    print("✅ 异步版和线程版的缓存/配额代码一致")
+
+def main():
+    """主函数"""
+    print("🧪 云代理副本一致性测试")
+    print("=" * 50)
+    test_forwarding_helpers_identical()
+    test_metrics_identical()
+    test_edge_cache_and_quota_consistent()
+
+if __name__ == "__main__":
+    main()
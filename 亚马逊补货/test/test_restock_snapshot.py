@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+补货数据快照测试脚本 🧪
+用分页延迟的替身分析器代替领星接口，验证刷新等待受超时限制、
+同一时间只拉取一次、失败传给所有等待方、冷启动只有一个命令等待、首次加载失败后尽快重试，
+补货命令不再生成Excel且不经过准入控制，
+进度卡片的飞书请求不阻塞拉取线程，以及MSKU详细信息缓存有界
+"""
+
+import os
+import sys
+import time
+import threading
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import business.restock_analyzer as restock_analyzer_module
+from business.restock_analyzer import RestockAnalyzer, RestockItem
+from business.restock_snapshot import RestockSnapshotStore, RestockSnapshot
+import feishu.feishu_bot as feishu_bot_module
+from feishu.feishu_bot import FeishuBot
+from feishu.progressive_reply import ProgressiveReply
+from utils.ttl_cache import TTLCache
+
+def _make_items(count: int, start: int = 0):
+    return [RestockItem(hash_id=str(i), asin=f"B0{i:08d}", sid=str(1001 + i % 3), data_type=1, node_type=0,
+                        msku_list=[f"MSKU-{i}"], fnsku_list=[f"X00{i}"], suggested_purchase=i % 7,
+                        out_stock_flag=1 if i % 5 == 0 else 0)
+            for i in range(start, start + count)]
+
+class SlowAnalyzer(RestockAnalyzer):
+    """按页延迟返回数据的替身分析器（不调用领星接口）"""
+
+    def __init__(self, pages: int = 5, page_delay: float = 0.1, error: Exception = None):
+        super().__init__()
+        self.pages = pages
+        self.page_delay = page_delay
+        self.error = error
+        self.fetches = 0
+
+    def get_restock_data(self, on_page=None, **kwargs):
+        self.fetches += 1
+        items = []
+        for page in range(1, self.pages + 1):
+            time.sleep(self.page_delay)
+            page_items = _make_items(20, start=len(items))
+            items.extend(page_items)
+            if on_page:
+                on_page(page_items, page, self.pages)
+        if self.error:
+            raise self.error
+        return items
+
+def test_refresh_wait_is_bounded():
+    """首次刷新的调用方也只等待timeout秒，拉取在后台继续并由之后的调用方取得结果"""
+    print("⏱️ 测试快照刷新等待超时...")
+    analyzer = SlowAnalyzer(pages=5, page_delay=0.1)
+    store = RestockSnapshotStore(analyzer, refresh_interval=3600)
+
+    started = time.time()
+    assert store.refresh(timeout=0.15) is None
+    assert time.time() - started < 0.3
+    assert store.get_stats()['refreshing']
+
+    progress = []
+    snapshot = store.refresh(on_progress=progress.append)
+    assert snapshot is not None and snapshot.item_count == 100
+    assert analyzer.fetches == 1
+    assert progress and progress[-1]['pages_done'] == 5
+    print("✅ 超时后返回，拉取在后台完成且只拉取一次")
+
+def test_refresh_failure_reaches_all_waiters():
+    """拉取失败时所有等待方都收到异常，旧快照保留"""
+    print("⏱️ 测试快照刷新失败传递...")
+    analyzer = SlowAnalyzer(pages=2, page_delay=0.05, error=RuntimeError('领星接口异常'))
+    store = RestockSnapshotStore(analyzer, refresh_interval=3600)
+    errors = []
+
+    def wait_refresh():
+        try:
+            store.refresh(timeout=5)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=wait_refresh) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(errors) == 3 and analyzer.fetches == 1
+    assert store.get_snapshot() is None
+    assert store.get_stats()['last_error'] == '领星接口异常'
+    print("✅ 拉取失败传给所有等待方")
+
+def test_cold_start_has_single_waiter():
+    """冷启动时第一个命令等待首个快照，其他命令立即回复正在加载"""
+    print("🧊 测试冷启动只有一个等待方...")
+    bot = FeishuBot()
+    analyzer = SlowAnalyzer(pages=5, page_delay=0.1)
+    bot.snapshot_store = RestockSnapshotStore(analyzer, refresh_interval=3600)
+    replies = []
+    first = threading.Thread(target=lambda: replies.append(bot._process_command('紧急', 'u1')))
+    first.start()
+    while not bot.snapshot_store.get_stats()['refreshing']:
+        time.sleep(0.01)
+
+    started = time.time()
+    reply = bot._process_command('补货', 'u2')
+    assert time.time() - started < 0.2 and '正在加载' in str(reply)
+    first.join(10)
+    assert '正在加载' not in str(replies[0]) and analyzer.fetches == 1
+    bot.snapshot_store.stop()
+    print("✅ 其他命令立即返回正在加载")
+
+def test_first_load_failure_retries_quickly():
+    """尚无快照时拉取失败按短间隔重试，不等满刷新间隔"""
+    print("🔁 测试首次加载失败重试...")
+    analyzer = SlowAnalyzer(pages=1, page_delay=0.01, error=RuntimeError('领星接口异常'))
+    store = RestockSnapshotStore(analyzer, refresh_interval=3600, retry_interval=1)
+    store.start()
+    try:
+        deadline = time.time() + 5
+        while analyzer.fetches < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        analyzer.error = None
+        while store.get_snapshot() is None and time.time() < deadline:
+            time.sleep(0.05)
+        assert analyzer.fetches >= 2 and store.get_snapshot() is not None
+    finally:
+        store.stop()
+    print("✅ 首次加载失败后按退避间隔重试")
+
+def test_restock_reply_skips_export():
+    """补货命令只回复汇总卡片，Excel由导出命令按需生成"""
+    print("📄 测试补货回复不触发导出...")
+    submitted = []
+
+    class StubExportManager:
+        def submit(self, items, export_format='standard'):
+            submitted.append(len(items))
+            return 'job-1'
+
+    bot = FeishuBot()
+    store = RestockSnapshotStore(bot.analyzer)
+    store._snapshot = RestockSnapshot(_make_items(30), bot.analyzer)
+    bot.snapshot_store = store
+
+    original = feishu_bot_module.get_export_job_manager
+    feishu_bot_module.get_export_job_manager = StubExportManager
+    try:
+        card = bot._process_command('补货', 'user')
+        assert isinstance(card, dict) and '导出' in str(card)
+        card = bot._process_command('补货 1001', 'user')
+        assert isinstance(card, dict) and '导出 1001' in str(card)
+        assert submitted == []
+
+        reply = bot._process_command('导出 1001', 'user')
+        assert submitted == [10] and 'job-1' in str(reply)
+    finally:
+        feishu_bot_module.get_export_job_manager = original
+    print("✅ 补货回复不再生成Excel，导出命令提交任务")
+
+def test_snapshot_queries_skip_admission():
+    """重型命令名额用尽时，补货/紧急/查/店铺ID查询照常应答，导出仍需排队"""
+    print("🚦 测试快照查询不经过准入控制...")
+    bot = FeishuBot()
+    store = RestockSnapshotStore(bot.analyzer)
+    store._snapshot = RestockSnapshot(_make_items(30), bot.analyzer)
+    bot.snapshot_store = store
+    bot.admission.max_pending = 0
+    bot.admission._active = bot.admission.max_concurrent
+
+    for command in ('补货', '紧急', '查 B000000003', '店铺 1001'):
+        reply = bot._process_command(command, 'user')
+        assert '排队' not in str(reply) and '频繁' not in str(reply), command
+    assert '排队的查询较多' in bot._process_command('导出', 'user')
+    assert bot.admission.get_stats()['rejected'] == 1
+    print("✅ 快照查询不占用重型命令名额")
+
+def test_progress_updates_skip_while_sending():
+    """飞书请求进行中时进度回调立即跳过，最终卡片在其返回后写入且不会被进度卡片覆盖"""
+    print("🃏 测试进度卡片发送不阻塞拉取线程...")
+    release = threading.Event()
+    sent = []
+
+    class SlowBot:
+        def post_card(self, chat_id, card):
+            release.wait(5)
+            sent.append(('post', card))
+            return 'om_1'
+
+        def update_card(self, message_id, card):
+            sent.append(('update', card))
+            return True
+
+    reply = ProgressiveReply(SlowBot(), 'oc_chat', min_interval=0)
+    progress = {'pages_done': 1, 'total_pages': 5, 'items': 20, 'urgent_items': 1,
+                'out_of_stock_items': 0, 'total_suggested_purchase': 10, 'elapsed': 0.1}
+    first = threading.Thread(target=reply.on_progress, args=(progress,))
+    first.start()
+    time.sleep(0.05)
+
+    # 首张进度卡片仍在发送：后续进度直接跳过，不等待飞书请求返回
+    started = time.time()
+    reply.on_progress(dict(progress, pages_done=2))
+    assert time.time() - started < 0.1 and reply.message_id is None
+
+    final = {'final': True}
+    finisher = threading.Thread(target=reply.finish, args=(final,))
+    finisher.start()
+    time.sleep(0.05)
+    release.set()
+    first.join(5)
+    finisher.join(5)
+    reply.on_progress(dict(progress, pages_done=3))
+
+    assert [kind for kind, _ in sent] == ['post', 'update']
+    assert sent[-1][1] is final and reply.updates == 2
+    print("✅ 进度回调不阻塞，最终卡片最后写入")
+
+def test_msku_detail_cache_is_bounded():
+    """MSKU详细信息缓存超过上限时淘汰最久未使用的条目，过期条目不再返回"""
+    print("🗂️ 测试MSKU详细信息缓存上限...")
+
+    class StubClient:
+        def get_msku_detail_info(self, sid, msku, mode):
+            return {'code': 0, 'data': {'msku': msku}}
+
+    analyzer = RestockAnalyzer(api_client=StubClient())
+    original = RestockAnalyzer._msku_detail_cache
+    RestockAnalyzer._msku_detail_cache = TTLCache(max_entries=3, ttl=0.2)
+    # 跳过接口调用前的限频等待（time是全局模块，测试自身的等待使用原函数）
+    original_sleep = restock_analyzer_module.time.sleep
+    restock_analyzer_module.time.sleep = lambda seconds: None
+    try:
+        for index in range(5):
+            analyzer.get_msku_detail_info('1001', f'MSKU-{index}')
+            RestockAnalyzer.get_cached_msku_detail('1001', 'MSKU-2')
+        stats = RestockAnalyzer.get_msku_detail_cache_stats()
+        assert stats['entries'] == 3 and stats['evictions'] == 2
+        assert RestockAnalyzer.get_cached_msku_detail('1001', 'MSKU-0') is None
+        assert RestockAnalyzer.get_cached_msku_detail('1001', 'MSKU-2') == {'msku': 'MSKU-2'}
+
+        original_sleep(0.25)
+        assert RestockAnalyzer.get_cached_msku_detail('1001', 'MSKU-4') is None
+        assert RestockAnalyzer.get_msku_detail_cache_stats()['expired'] == 1
+    finally:
+        restock_analyzer_module.time.sleep = original_sleep
+        RestockAnalyzer._msku_detail_cache = original
+    print("✅ 缓存条数受限，过期条目自动失效")
+
+def main():
+    """主函数"""
+    print("🧪 补货数据快照测试")
+    print("=" * 50)
+    test_refresh_wait_is_bounded()
+    test_refresh_failure_reaches_all_waiters()
+    test_cold_start_has_single_waiter()
+    test_first_load_failure_retries_quickly()
+    test_restock_reply_skips_export()
+    test_snapshot_queries_skip_admission()
+    test_progress_updates_skip_while_sending()
+    test_msku_detail_cache_is_bounded()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+线程版云代理测试脚本 🧪
+不连接领星和云服务器，直接验证 unified_cloud_proxy.py 中
+边缘缓存的相同请求合并和失败传递、隧道客户端池的失败惩罚衰减，
+以及飞书请求经隧道转发时的响应唤醒、超时和失败改派（含客户端刚被选中就断开的情况）
+"""
+
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+pytest.importorskip('flask_socketio')
+
+# 添加deploy目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'deploy'))
+
+import unified_cloud_proxy as unified
+
+SUCCESS_BODY = b'{"code": 0, "data": []}'
+
+def _run_concurrently(count: int, func):
+    """同时启动count个线程执行func，返回 (结果列表, 异常列表)"""
+    barrier = threading.Barrier(count)
+    results, errors = [], []
+    lock = threading.Lock()
+
+    def worker():
+        barrier.wait()
+        try:
+            value = func()
+        except Exception as e:
+            with lock:
+                errors.append(e)
+        else:
+            with lock:
+                results.append(value)
+
+    threads = [threading.Thread(target=worker) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results, errors
+
+def test_edge_cache_coalesces_without_gap():
+    """相同请求持续到达时只向上游请求一次：首个请求先写入缓存再结束在途状态"""
+    print("🗄️ 测试边缘缓存请求合并...")
+    cache = unified.EdgeCache({'/erp/*': 60})
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return unified.CachedResponse(200, [('Content-Type', 'application/json')], SUCCESS_BODY)
+
+    def keep_fetching():
+        sources = set()
+        deadline = time.time() + 0.3
+        while time.time() < deadline:
+            sources.add(cache.fetch('key', 60, loader)[1])
+        return sources
+
+    results, errors = _run_concurrently(16, keep_fetching)
+    assert not errors and len(calls) == 1
+    assert set().union(*results) <= {'MISS', 'COALESCED', 'HIT'}
+    assert cache.get_stats()['inflight'] == 0
+    print(f"✅ 16个线程持续请求，上游只调用 {len(calls)} 次")
+
+def test_edge_cache_shares_leader_failure():
+    """首个请求失败时等待者收到同一异常，不再各自请求上游；之后的请求重新向上游请求"""
+    print("🗄️ 测试边缘缓存失败传递...")
+    cache = unified.EdgeCache({'/erp/*': 60})
+    calls = []
+
+    def failing_loader():
+        calls.append(1)
+        time.sleep(0.1)
+        raise ConnectionError('upstream down')
+
+    results, errors = _run_concurrently(8, lambda: cache.fetch('key', 60, failing_loader))
+    assert not results and len(errors) == 8
+    assert all(isinstance(e, ConnectionError) for e in errors)
+    assert len(calls) == 1
+    assert cache.get_stats()['coalesced'] == 7 and cache.get_stats()['inflight'] == 0
+
+    entry, source = cache.fetch('key', 60, lambda: unified.CachedResponse(200, [], SUCCESS_BODY))
+    assert source == 'MISS' and entry.body == SUCCESS_BODY
+    print("✅ 上游失败只请求一次，8个请求都收到失败")
+
+def test_client_pool_failure_penalty_decays():
+    """失败一次的客户端暂时少分配，惩罚衰减后重新参与分配，重新注册时惩罚清零"""
+    print("🔀 测试客户端池失败惩罚...")
+    pool = unified.ClientPool()
+    pool.add('c1')
+    pool.add('c2')
+    for index in range(4):
+        client_id = pool.acquire(f'warm{index}')
+        pool.release(client_id, f'warm{index}', latency=0.05)
+
+    client_id = pool.acquire('failed')
+    pool.release(client_id, 'failed', success=False)
+    healthy = 'c2' if client_id == 'c1' else 'c1'
+
+    # 低负载下在途数相同，惩罚期间总是选择健康的客户端
+    chosen = []
+    for index in range(6):
+        chosen.append(pool.acquire(f'r{index}'))
+        pool.release(chosen[-1], f'r{index}', latency=0.05)
+    assert chosen == [healthy] * 6
+
+    # 惩罚随时间衰减到0：模拟衰减时间过去，失败过的客户端重新被选中
+    pool._clients[client_id].penalized_at -= unified.PENALTY_DECAY
+    assert pool.get_stats()['clients'][client_id]['penalty_ms'] == 0
+    chosen = []
+    for index in range(20):
+        chosen.append(pool.acquire(f'late{index}'))
+        pool.release(chosen[-1], f'late{index}', latency=0.05)
+    assert client_id in chosen
+
+    # 重新注册清除惩罚
+    pool.release(pool.acquire('again', exclude=(healthy,)), 'again', success=False)
+    assert pool.get_stats()['clients'][client_id]['penalty_ms'] > 1000
+    pool.add(client_id)
+    assert pool.get_stats()['clients'][client_id]['penalty_ms'] == 0
+    assert pool.get_stats()['clients'][client_id]['failures'] == 2
+    print("✅ 失败惩罚随时间衰减，重新注册后清零")
+
+def _unified_proxy(replies: dict):
+    """创建统一代理并替换WebSocket发送：各客户端按replies中的内容异步回复（None表示不回复）"""
+    proxy = unified.UnifiedCloudProxy()
+    sent = []
+
+    def emit(event, message, room=None):
+        sent.append(room)
+        reply = replies.get(room)
+        if reply is not None:
+            threading.Timer(0.02, proxy.pending_requests.complete, (message['request_id'], reply)).start()
+
+    proxy.socketio.emit = emit
+    for client_id in replies:
+        proxy.client_pool.add(client_id)
+    return proxy, sent
+
+def test_dispatch_retries_on_failed_client():
+    """隧道客户端回复503时改派给其他客户端，响应直接唤醒等待线程"""
+    print("🔀 测试隧道请求改派...")
+    proxy, sent = _unified_proxy({'bad': {'status_code': 503}, 'good': {'status_code': 200}})
+    # 在途数相同时先选中出错的客户端
+    proxy.client_pool._clients['good'].ewma_latency = 1.0
+
+    started = time.time()
+    assert proxy._dispatch('r1', {'request_id': 'r1'}, timeout=5) == {'status_code': 200}
+    assert time.time() - started < 1 and sent == ['bad', 'good']
+    clients = proxy.client_pool.get_stats()['clients']
+    assert clients['bad']['failures'] == 1 and clients['good']['completed'] == 1
+    assert len(proxy.pending_requests) == 0
+    assert proxy.pending_requests.stats['completed'] == 2
+    print("✅ 503后改派给健康客户端")
+
+def test_dispatch_times_out_without_retry():
+    """客户端不回复时等到总超时返回None，不再改派；迟到的响应被丢弃"""
+    print("⏱️ 测试隧道请求超时...")
+    proxy, sent = _unified_proxy({'silent': None, 'other': None})
+
+    started = time.time()
+    assert proxy._dispatch('r1', {'request_id': 'r1'}, timeout=0.2) is None
+    assert 0.15 < time.time() - started < 1 and len(sent) == 1
+    assert not proxy.pending_requests.complete('r1', {'status_code': 200})
+    assert proxy.pending_requests.stats == {'completed': 0, 'timeouts': 1, 'late_responses': 1}
+    print("✅ 超时返回None，迟到响应被丢弃")
+
+def test_dispatch_fails_over_when_client_disconnects():
+    """处理中的客户端断开时在途请求以CLIENT_LOST唤醒并立即改派"""
+    print("🔌 测试客户端断开改派...")
+    proxy, sent = _unified_proxy({'leaving': None, 'good': {'status_code': 200}})
+    proxy.client_pool._clients['good'].ewma_latency = 1.0
+
+    def disconnect():
+        # 与断开事件处理相同：移出客户端池并唤醒其在途请求
+        for request_id in proxy.client_pool.remove('leaving'):
+            proxy.pending_requests.complete(request_id, unified.CLIENT_LOST)
+
+    threading.Timer(0.1, disconnect).start()
+    started = time.time()
+    assert proxy._dispatch('r1', {'request_id': 'r1'}, timeout=5) == {'status_code': 200}
+    assert time.time() - started < 1 and sent == ['leaving', 'good']
+    print("✅ 断开后立即改派")
+
+def test_dispatch_fails_over_when_client_disconnects_after_acquire():
+    """客户端刚被选中、请求尚未发出时断开，等待线程同样以CLIENT_LOST唤醒并改派，不等到超时"""
+    print("🔌 测试选中后立即断开的改派...")
+    proxy, sent = _unified_proxy({'leaving': None, 'good': {'status_code': 200}})
+    proxy.client_pool._clients['good'].ewma_latency = 1.0
+    acquire = proxy.client_pool.acquire
+
+    def acquire_then_disconnect(request_id, exclude=()):
+        client_id = acquire(request_id, exclude=exclude)
+        if client_id == 'leaving':
+            for lost_id in proxy.client_pool.remove('leaving'):
+                proxy.pending_requests.complete(lost_id, unified.CLIENT_LOST)
+        return client_id
+
+    proxy.client_pool.acquire = acquire_then_disconnect
+    started = time.time()
+    assert proxy._dispatch('r1', {'request_id': 'r1'}, timeout=5) == {'status_code': 200}
+    assert time.time() - started < 1 and sent == ['leaving', 'good']
+    assert proxy.pending_requests.stats['late_responses'] == 0
+    print("✅ 选中后断开同样立即改派")
+
+def main():
+    """主函数"""
+    print("🧪 线程版云代理测试")
+    print("=" * 50)
+    test_edge_cache_coalesces_without_gap()
+    test_edge_cache_shares_leader_failure()
+    test_client_pool_failure_penalty_decays()
+    test_dispatch_retries_on_failed_client()
+    test_dispatch_times_out_without_retry()
+    test_dispatch_fails_over_when_client_disconnects()
+    test_dispatch_fails_over_when_client_disconnects_after_acquire()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+限流工具模块
+提供线程安全的令牌桶限流器
+"""
+
+import time
+import threading
+from typing import Optional
+
+class TokenBucket:
+    """
+    令牌桶限流器
+
+    以固定速率补充令牌，容量决定允许的突发量，线程安全
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        初始化令牌桶
+
+        Args:
+            rate: 每秒补充的令牌数
+            capacity: 桶容量（默认等于rate，至少为1）
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        """按流逝时间补充令牌（调用方需持有锁）"""
+        elapsed = now - self._updated_at
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated_at = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """
+        尝试立即获取令牌
+
+        Args:
+            tokens: 需要的令牌数
+
+        Returns:
+            bool: 是否获取成功
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """
+        获取令牌还需等待的时间
+
+        Args:
+            tokens: 需要的令牌数
+
+        Returns:
+            float: 需要等待的秒数（0表示可立即获取）
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                return 0.0
+            return (tokens - self._tokens) / self.rate if self.rate > 0 else float('inf')
+
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        """
+        阻塞获取令牌
+
+        Args:
+            tokens: 需要的令牌数
+            timeout: 最长等待时间（秒），None表示一直等待
+
+        Returns:
+            bool: 是否在超时前获取成功
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate if self.rate > 0 else 1.0
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
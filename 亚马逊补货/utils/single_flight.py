@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+请求合并工具模块
+相同键的并发调用只执行一次，其余调用等待并共享同一结果
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+class _Call:
+    """进行中的一次调用"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    单飞（single-flight）请求合并器
+
+    第一个调用者执行函数，执行期间到达的相同键调用阻塞等待，
+    结束后所有调用者得到同一个结果或同一个异常；结果不做缓存
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'executions': 0, 'coalesced': 0, 'max_waiters': 0}
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        执行或加入相同键的调用
+
+        Args:
+            key: 调用键（参数规范化后的可哈希值）
+            func: 无参执行函数
+
+        Returns:
+            Tuple[Any, bool]: (结果, 是否为合并得到的共享结果)
+        """
+        with self._lock:
+            self._stats['calls'] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._stats['coalesced'] += 1
+                self._stats['max_waiters'] = max(self._stats['max_waiters'], call.waiters)
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._stats['executions'] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        获取合并统计信息
+
+        Returns:
+            Dict: 总调用数、实际执行数、合并等待数、单次最大等待数和进行中调用数
+        """
+        with self._lock:
+            return {
+                **self._stats,
+                'in_flight': len(self._calls),
+                'waiting': sum(call.waiters for call in self._calls.values())
+            }
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+有界缓存工具模块
+按最近使用顺序淘汰（LRU）并带有效期（TTL）的线程安全缓存
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+class TTLCache:
+    """
+    有界的LRU+TTL缓存
+
+    条目数超过 max_entries 时淘汰最久未使用的条目，
+    写入超过 ttl 秒的条目在读取时视为不存在并删除
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        """
+        初始化缓存
+
+        Args:
+            max_entries: 最多保留的条目数
+            ttl: 条目有效期（秒）
+        """
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        读取条目
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            Optional[Any]: 缓存值，不存在或已过期返回None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            stored_at, value = entry
+            if time.time() - stored_at >= self.ttl:
+                del self._entries[key]
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        """
+        写入条目（超出上限时淘汰最久未使用的条目）
+
+        Args:
+            key: 缓存键
+            value: 缓存值
+        """
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计信息
+
+        Returns:
+            Dict: 条目数、上限、命中/未命中、过期和淘汰次数
+        """
+        with self._lock:
+            return {'entries': len(self._entries), 'max_entries': self.max_entries, **self._stats}